@@ -61,6 +61,48 @@ async def proxy_request(
             )
 
 
+async def proxy_stream(request: Request, service_url: str, path: str) -> Response:
+    """
+    Проксировать долгоживущий поток (Server-Sent Events) без буферизации ответа и таймаута чтения
+    """
+    url = f"{service_url}{path}"
+    headers = dict(request.headers)
+    headers.pop("host", None)
+    headers.pop("connection", None)
+    if "x-user-role" not in headers:
+        headers["X-User-Role"] = "viewer"
+    
+    client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+    try:
+        upstream = await client.send(
+            client.build_request("GET", url, headers=headers, params=request.query_params),
+            stream=True
+        )
+    except httpx.RequestError as e:
+        await client.aclose()
+        logger.error(f"Request error to {url}: {str(e)}")
+        return Response(
+            content=f'{{"error": "Service unavailable: {str(e)}"}}',
+            status_code=503,
+            media_type="application/json"
+        )
+    
+    async def body():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+    
+    return StreamingResponse(
+        body(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type"),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.api_route("/auth/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def auth_proxy(request: Request, path: str):
     """Проксировать запросы к Auth Service"""
@@ -91,6 +133,9 @@ async def inventory_proxy(request: Request, path: str):
     else:
         full_path = "/inventory/"
     logger.info(f"Proxying to: {settings.INVENTORY_SERVICE_URL}{full_path}")
+    if path == "stream" and request.method == "GET":
+        # Поток изменений остатков (SSE) держит соединение открытым - проксируем без буферизации
+        return await proxy_stream(request, settings.INVENTORY_SERVICE_URL, full_path)
     return await proxy_request(request, settings.INVENTORY_SERVICE_URL, full_path)
 
 
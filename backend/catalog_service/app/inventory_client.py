@@ -3,12 +3,14 @@
 """
 import httpx
 import logging
+import uuid
 from typing import Optional
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 INVENTORY_SERVICE_URL = "http://inventory_service:8000"
+INVENTORY_REQUEST_ATTEMPTS = 3  # Попыток создать операцию при таймауте/обрыве соединения
 
 
 async def get_sku_total_weight(sku_id: int) -> Optional[int]:
@@ -42,36 +44,51 @@ async def create_inventory_operation(
     weight_value: int,
     weight_unit: str,
     source_location: Optional[str] = None,
-    target_location: Optional[str] = None
+    target_location: Optional[str] = None,
+    idempotency_key: Optional[str] = None
 ) -> bool:
     """
     Создать операцию в Inventory Service
     
+    При таймауте или обрыве соединения запрос повторяется с тем же ключом идемпотентности,
+    поэтому операция не применится к остаткам дважды.
+    
     Returns:
         True если операция создана успешно, False в противном случае
     """
+    idempotency_key = idempotency_key or str(uuid.uuid4())
     try:
         async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{INVENTORY_SERVICE_URL}/inventory/operations",
-                json={
-                    "operation_type": operation_type,
-                    "sku_id": sku_id,
-                    "quantity_value": quantity_value,
-                    "quantity_unit": quantity_unit,
-                    "weight_value": weight_value,
-                    "weight_unit": weight_unit,
-                    "source_location": source_location,
-                    "target_location": target_location
-                }
-            )
-            if response.status_code in [200, 201]:
-                logger.info(f"Successfully created inventory operation: {operation_type} for SKU {sku_id}")
-                return True
-            else:
-                logger.error(f"Failed to create inventory operation: {response.status_code} - {response.text}")
-                return False
+            for attempt in range(1, INVENTORY_REQUEST_ATTEMPTS + 1):
+                try:
+                    response = await client.post(
+                        f"{INVENTORY_SERVICE_URL}/inventory/operations",
+                        json={
+                            "operation_type": operation_type,
+                            "sku_id": sku_id,
+                            "quantity_value": quantity_value,
+                            "quantity_unit": quantity_unit,
+                            "weight_value": weight_value,
+                            "weight_unit": weight_unit,
+                            "source_location": source_location,
+                            "target_location": target_location
+                        },
+                        headers={"Idempotency-Key": idempotency_key}
+                    )
+                except httpx.TransportError as e:
+                    logger.warning(
+                        f"Inventory Service request failed (attempt {attempt}/{INVENTORY_REQUEST_ATTEMPTS}, "
+                        f"key {idempotency_key}): {e}"
+                    )
+                    continue
+                if response.status_code in [200, 201]:
+                    logger.info(f"Successfully created inventory operation: {operation_type} for SKU {sku_id}")
+                    return True
+                else:
+                    logger.error(f"Failed to create inventory operation: {response.status_code} - {response.text}")
+                    return False
+        logger.error(f"Inventory Service unavailable, operation {operation_type} for SKU {sku_id} not created")
+        return False
     except Exception as e:
         logger.error(f"Error calling Inventory Service: {e}")
         return False
-
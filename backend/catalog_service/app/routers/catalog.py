@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, UploadFile, File
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
@@ -26,13 +26,20 @@ router = APIRouter(prefix="/catalog", tags=["catalog"])
 
 @router.get("/skus", response_model=List[SKUListResponse])
 async def get_skus(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = Query(None, description="Поиск по названию или артикулу"),
     status: Optional[SKUStatus] = Query(None, description="Фильтр по статусу"),
+    after_id: Optional[int] = Query(None, description="Товары с ID больше указанного (постраничный обход по ID)"),
     db: Session = Depends(get_db)
 ):
-    """Получить список товаров"""
+    """
+    Получить список товаров по возрастанию ID
+
+    Заголовок X-Total-Count - количество товаров по фильтрам (без after_id, skip и limit): по нему
+    клиент, выгружающий весь каталог, проверяет, что получил полный список.
+    """
     query = db.query(SKU)
     
     # Поиск
@@ -51,8 +58,12 @@ async def get_skus(
         status_str = status.value if isinstance(status, SKUStatus) else str(status).lower()
         query = query.filter(SKU.status == status_str)
     
-    # Пагинация
-    skus = query.offset(skip).limit(limit).all()
+    response.headers["X-Total-Count"] = str(query.count())
+    if after_id is not None:
+        query = query.filter(SKU.id > after_id)
+    
+    # Пагинация (без порядка страницы могут пересекаться и пропускать товары)
+    skus = query.order_by(SKU.id).offset(skip).limit(limit).all()
     return skus
 
 
@@ -112,7 +112,10 @@ class SKUListResponse(BaseModel):
     code: str
     name: str
     weight: str
+    weight_unit_id: Optional[int] = None
     quantity: str
+    price: Optional[str] = None
+    price_unit_id: Optional[int] = None
     status: Optional[SKUStatus]
     
     class Config:
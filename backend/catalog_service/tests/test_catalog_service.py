@@ -129,3 +129,9 @@ def test_create_units_and_sku_flow(client):
     assert len(items) == 1
     assert items[0]["id"] == sku_id
 
+    assert resp.headers["X-Total-Count"] == "1"
+
+    # Постраничный обход по ID: после последнего товара список пуст, общее количество прежнее
+    resp = client.get("/catalog/skus", params={"after_id": sku_id}, headers=_admin_headers())
+    assert resp.json() == []
+    assert resp.headers["X-Total-Count"] == "1"
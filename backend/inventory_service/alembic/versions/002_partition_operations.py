@@ -0,0 +1,119 @@
+"""Partition inventory_operations by created_at (monthly)
+
+Revision ID: 002_partition_operations
+Revises: 001_initial
+Create Date: 2024-12-10
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002_partition_operations'
+down_revision = '001_initial'
+branch_labels = None
+depends_on = None
+
+
+# Сколько месяцев вперед создаем партиции при миграции
+PREMAKE_MONTHS = 3
+
+
+def upgrade() -> None:
+    # Переименовываем существующую таблицу, данные перенесем в партиционированную
+    op.execute("ALTER TABLE inventory_operations RENAME TO inventory_operations_legacy")
+    op.execute("ALTER INDEX IF EXISTS ix_inventory_operations_id RENAME TO ix_inventory_operations_legacy_id")
+    op.execute("ALTER INDEX IF EXISTS ix_inventory_operations_operation_type RENAME TO ix_inventory_operations_legacy_operation_type")
+    op.execute("ALTER INDEX IF EXISTS ix_inventory_operations_sku_id RENAME TO ix_inventory_operations_legacy_sku_id")
+    op.execute("ALTER TABLE inventory_operations_legacy RENAME CONSTRAINT inventory_operations_pkey TO inventory_operations_legacy_pkey")
+
+    # Партиционированная таблица: ключ партиционирования должен входить в первичный ключ.
+    # Последовательность id переиспользуем, чтобы новые операции продолжили нумерацию.
+    op.execute("""
+        CREATE TABLE inventory_operations (
+            id INTEGER NOT NULL DEFAULT nextval('inventory_operations_id_seq'),
+            operation_type VARCHAR(20) NOT NULL,
+            sku_id INTEGER NOT NULL,
+            sku_name VARCHAR(15) NOT NULL,
+            quantity_value INTEGER NOT NULL,
+            quantity_unit VARCHAR(20) NOT NULL,
+            weight_value INTEGER NOT NULL,
+            weight_unit VARCHAR(20) NOT NULL,
+            delta_value INTEGER NOT NULL,
+            delta_unit VARCHAR(20) NOT NULL,
+            source_location VARCHAR(100),
+            target_location VARCHAR(100),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT inventory_operations_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE inventory_operations_id_seq OWNED BY inventory_operations.id")
+    op.create_index('ix_inventory_operations_operation_type', 'inventory_operations', ['operation_type'], unique=False)
+    op.create_index('ix_inventory_operations_sku_id', 'inventory_operations', ['sku_id'], unique=False)
+
+    # Партиция по умолчанию - страховка для строк вне созданных диапазонов
+    op.execute("CREATE TABLE inventory_operations_default PARTITION OF inventory_operations DEFAULT")
+
+    # Месячные партиции (границы в UTC): от самой старой операции до PREMAKE_MONTHS вперед
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month_start DATE;
+            last_month DATE := date_trunc('month', (now() AT TIME ZONE 'UTC') + interval '{PREMAKE_MONTHS} months')::date;
+        BEGIN
+            SELECT COALESCE(
+                       date_trunc('month', min(created_at) AT TIME ZONE 'UTC'),
+                       date_trunc('month', now() AT TIME ZONE 'UTC')
+                   )::date
+              INTO month_start
+              FROM inventory_operations_legacy;
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF inventory_operations FOR VALUES FROM (%L) TO (%L)',
+                    'inventory_operations_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM'),
+                    month_start::timestamp AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+                month_start := (month_start + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+
+    # Переносим историю и удаляем старую таблицу
+    op.execute("INSERT INTO inventory_operations SELECT * FROM inventory_operations_legacy")
+    op.drop_table('inventory_operations_legacy')
+
+
+def downgrade() -> None:
+    # Собираем все партиции обратно в обычную таблицу
+    op.execute("ALTER TABLE inventory_operations RENAME TO inventory_operations_partitioned")
+    op.execute("ALTER TABLE inventory_operations_partitioned RENAME CONSTRAINT inventory_operations_pkey TO inventory_operations_partitioned_pkey")
+    op.execute("ALTER INDEX ix_inventory_operations_operation_type RENAME TO ix_inventory_operations_partitioned_operation_type")
+    op.execute("ALTER INDEX ix_inventory_operations_sku_id RENAME TO ix_inventory_operations_partitioned_sku_id")
+    op.execute("ALTER SEQUENCE inventory_operations_id_seq OWNED BY NONE")
+
+    op.create_table(
+        'inventory_operations',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('inventory_operations_id_seq')"), nullable=False),
+        sa.Column('operation_type', sa.String(length=20), nullable=False),
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('sku_name', sa.String(length=15), nullable=False),
+        sa.Column('quantity_value', sa.Integer(), nullable=False),
+        sa.Column('quantity_unit', sa.String(length=20), nullable=False),
+        sa.Column('weight_value', sa.Integer(), nullable=False),
+        sa.Column('weight_unit', sa.String(length=20), nullable=False),
+        sa.Column('delta_value', sa.Integer(), nullable=False),
+        sa.Column('delta_unit', sa.String(length=20), nullable=False),
+        sa.Column('source_location', sa.String(length=100), nullable=True),
+        sa.Column('target_location', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE inventory_operations_id_seq OWNED BY inventory_operations.id")
+    op.execute("INSERT INTO inventory_operations SELECT * FROM inventory_operations_partitioned")
+    # Удаление родительской таблицы удаляет и все её партиции
+    op.drop_table('inventory_operations_partitioned')
+
+    op.create_index(op.f('ix_inventory_operations_id'), 'inventory_operations', ['id'], unique=False)
+    op.create_index(op.f('ix_inventory_operations_operation_type'), 'inventory_operations', ['operation_type'], unique=False)
+    op.create_index(op.f('ix_inventory_operations_sku_id'), 'inventory_operations', ['sku_id'], unique=False)
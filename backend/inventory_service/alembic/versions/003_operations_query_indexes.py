@@ -0,0 +1,40 @@
+"""Composite and BRIN indexes for ledger queries
+
+Revision ID: 003_operations_query_indexes
+Revises: 002_partition_operations
+Create Date: 2024-12-12
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '003_operations_query_indexes'
+down_revision = '002_partition_operations'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Составные индексы под фильтр + сортировку по created_at DESC (B-tree читается в обратном порядке)
+    op.create_index('ix_inventory_operations_sku_id_created_at', 'inventory_operations', ['sku_id', 'created_at'], unique=False)
+    op.create_index('ix_inventory_operations_operation_type_created_at', 'inventory_operations', ['operation_type', 'created_at'], unique=False)
+    # Отдельные индексы по локациям: фильтр source OR target выполняется как UNION двух индексных сканов
+    op.create_index('ix_inventory_operations_source_location_created_at', 'inventory_operations', ['source_location', 'created_at'], unique=False)
+    op.create_index('ix_inventory_operations_target_location_created_at', 'inventory_operations', ['target_location', 'created_at'], unique=False)
+    # BRIN по created_at: журнал пишется по возрастанию времени, индекс занимает единицы страниц
+    op.create_index('ix_inventory_operations_created_at_brin', 'inventory_operations', ['created_at'], unique=False, postgresql_using='brin')
+
+    # Одиночные индексы покрываются составными (ведущая колонка та же)
+    op.drop_index('ix_inventory_operations_sku_id', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_operation_type', table_name='inventory_operations')
+
+
+def downgrade() -> None:
+    op.create_index('ix_inventory_operations_operation_type', 'inventory_operations', ['operation_type'], unique=False)
+    op.create_index('ix_inventory_operations_sku_id', 'inventory_operations', ['sku_id'], unique=False)
+
+    op.drop_index('ix_inventory_operations_created_at_brin', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_target_location_created_at', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_source_location_created_at', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_operation_type_created_at', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_sku_id_created_at', table_name='inventory_operations')
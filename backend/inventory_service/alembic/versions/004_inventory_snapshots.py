@@ -0,0 +1,84 @@
+"""Inventory totals snapshots for point-in-time queries
+
+Revision ID: 004_inventory_snapshots
+Revises: 003_operations_query_indexes
+Create Date: 2024-12-14
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004_inventory_snapshots'
+down_revision = '003_operations_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_snapshots',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('taken_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('location_rows', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('sku_rows', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_inventory_snapshots_id'), 'inventory_snapshots', ['id'], unique=False)
+    op.create_index(op.f('ix_inventory_snapshots_taken_at'), 'inventory_snapshots', ['taken_at'], unique=True)
+
+    op.create_table(
+        'inventory_location_total_snapshots',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('snapshot_id', sa.Integer(), nullable=False),
+        sa.Column('total_id', sa.Integer(), nullable=True),
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('sku_name', sa.String(length=15), nullable=False),
+        sa.Column('location_name', sa.String(length=100), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('weight', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['snapshot_id'], ['inventory_snapshots.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_inventory_location_total_snapshots_id'), 'inventory_location_total_snapshots', ['id'], unique=False)
+    op.create_index('ix_inventory_location_total_snapshots_snapshot_location', 'inventory_location_total_snapshots', ['snapshot_id', 'location_name', 'sku_id'], unique=False)
+    op.create_index('ix_inventory_location_total_snapshots_snapshot_sku', 'inventory_location_total_snapshots', ['snapshot_id', 'sku_id'], unique=False)
+
+    op.create_table(
+        'inventory_sku_total_snapshots',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('snapshot_id', sa.Integer(), nullable=False),
+        sa.Column('total_id', sa.Integer(), nullable=True),
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('sku_name', sa.String(length=15), nullable=False),
+        sa.Column('total_quantity', sa.Integer(), nullable=False),
+        sa.Column('total_weight', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['snapshot_id'], ['inventory_snapshots.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_inventory_sku_total_snapshots_id'), 'inventory_sku_total_snapshots', ['id'], unique=False)
+    op.create_index('ix_inventory_sku_total_snapshots_snapshot_sku', 'inventory_sku_total_snapshots', ['snapshot_id', 'sku_id'], unique=False)
+
+    # Время операции = момент вставки строки, а не начала транзакции.
+    # Иначе транзакция, начатая до снимка и завершенная после, получила бы created_at раньше снимка
+    # и выпала бы из догоняющего прохода по журналу.
+    op.execute("ALTER TABLE inventory_operations ALTER COLUMN created_at SET DEFAULT clock_timestamp()")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE inventory_operations ALTER COLUMN created_at SET DEFAULT now()")
+
+    op.drop_index('ix_inventory_sku_total_snapshots_snapshot_sku', table_name='inventory_sku_total_snapshots')
+    op.drop_index(op.f('ix_inventory_sku_total_snapshots_id'), table_name='inventory_sku_total_snapshots')
+    op.drop_table('inventory_sku_total_snapshots')
+
+    op.drop_index('ix_inventory_location_total_snapshots_snapshot_sku', table_name='inventory_location_total_snapshots')
+    op.drop_index('ix_inventory_location_total_snapshots_snapshot_location', table_name='inventory_location_total_snapshots')
+    op.drop_index(op.f('ix_inventory_location_total_snapshots_id'), table_name='inventory_location_total_snapshots')
+    op.drop_table('inventory_location_total_snapshots')
+
+    op.drop_index(op.f('ix_inventory_snapshots_taken_at'), table_name='inventory_snapshots')
+    op.drop_index(op.f('ix_inventory_snapshots_id'), table_name='inventory_snapshots')
+    op.drop_table('inventory_snapshots')
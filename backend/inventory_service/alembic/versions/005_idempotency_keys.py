@@ -0,0 +1,34 @@
+"""Idempotency keys for inventory operations
+
+Revision ID: 005_idempotency_keys
+Revises: 004_inventory_snapshots
+Create Date: 2024-12-16
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005_idempotency_keys'
+down_revision = '004_inventory_snapshots'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_idempotency_keys',
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('operation_id', sa.Integer(), nullable=False),
+        sa.Column('response', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    # Индекс для удаления ключей с истекшим сроком хранения
+    op.create_index(op.f('ix_inventory_idempotency_keys_created_at'), 'inventory_idempotency_keys', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_inventory_idempotency_keys_created_at'), table_name='inventory_idempotency_keys')
+    op.drop_table('inventory_idempotency_keys')
@@ -0,0 +1,40 @@
+"""Incrementally maintained per-location rollups
+
+Revision ID: 006_location_rollups
+Revises: 005_idempotency_keys
+Create Date: 2024-12-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_location_rollups'
+down_revision = '005_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_location_rollups',
+        sa.Column('location_name', sa.String(length=100), nullable=False),
+        sa.Column('total_weight', sa.Integer(), nullable=False),
+        sa.Column('sku_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('location_name')
+    )
+    # Заполняем сводку по текущим остаткам
+    op.execute("""
+        INSERT INTO inventory_location_rollups (location_name, total_weight, sku_count, updated_at)
+        SELECT location_name,
+               COALESCE(SUM(weight), 0),
+               COUNT(*) FILTER (WHERE weight <> 0),
+               MAX(updated_at)
+        FROM inventory_location_totals
+        GROUP BY location_name
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_location_rollups')
@@ -0,0 +1,62 @@
+"""Daily stock movement rollups for movement reports
+
+Revision ID: 007_daily_movements
+Revises: 006_location_rollups
+Create Date: 2024-12-20
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007_daily_movements'
+down_revision = '006_location_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_daily_movements',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('location_name', sa.String(length=100), nullable=False),
+        sa.Column('operation_type', sa.String(length=20), nullable=False),
+        sa.Column('inbound_weight', sa.Integer(), nullable=False),
+        sa.Column('outbound_weight', sa.Integer(), nullable=False),
+        sa.Column('inbound_count', sa.Integer(), nullable=False),
+        sa.Column('outbound_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'sku_id', 'location_name', 'operation_type')
+    )
+    op.create_index('ix_inventory_daily_movements_sku_day', 'inventory_daily_movements', ['sku_id', 'day'], unique=False)
+
+    # Заполняем агрегат по журналу (то же, что MovementService.backfill за всю историю)
+    op.execute("""
+        INSERT INTO inventory_daily_movements (
+            day, sku_id, location_name, operation_type,
+            inbound_weight, outbound_weight, inbound_count, outbound_count
+        )
+        SELECT day, sku_id, location_name, operation_type,
+               SUM(GREATEST(weight_delta, 0)),
+               SUM(GREATEST(-weight_delta, 0)),
+               COUNT(*) FILTER (WHERE weight_delta > 0),
+               COUNT(*) FILTER (WHERE weight_delta < 0)
+        FROM (
+            SELECT created_at::date AS day, sku_id, source_location AS location_name, operation_type,
+                   CASE WHEN operation_type IN ('receipt', 'create') THEN ABS(delta_value)
+                        ELSE -ABS(delta_value) END AS weight_delta
+            FROM inventory_operations
+            WHERE operation_type IN ('receipt', 'create', 'write_off', 'delete', 'transfer')
+              AND source_location IS NOT NULL AND delta_value <> 0
+            UNION ALL
+            SELECT created_at::date, sku_id, target_location, operation_type, ABS(delta_value)
+            FROM inventory_operations
+            WHERE operation_type = 'transfer' AND target_location IS NOT NULL AND delta_value <> 0
+        ) AS legs
+        GROUP BY day, sku_id, location_name, operation_type
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inventory_daily_movements_sku_day', table_name='inventory_daily_movements')
+    op.drop_table('inventory_daily_movements')
@@ -0,0 +1,40 @@
+"""Stock thresholds for low-stock and over-capacity alerts
+
+Revision ID: 008_stock_thresholds
+Revises: 007_daily_movements
+Create Date: 2024-12-22
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_stock_thresholds'
+down_revision = '007_daily_movements'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_stock_thresholds',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sku_id', sa.Integer(), nullable=True),
+        sa.Column('location_name', sa.String(length=100), nullable=True),
+        sa.Column('min_weight', sa.Integer(), nullable=True),
+        sa.Column('max_weight', sa.Integer(), nullable=True),
+        sa.Column('state', sa.String(length=10), server_default='ok', nullable=False),
+        sa.Column('state_changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_inventory_stock_thresholds_id'), 'inventory_stock_thresholds', ['id'], unique=False)
+    op.create_index(
+        'ix_inventory_stock_thresholds_sku_location', 'inventory_stock_thresholds',
+        ['sku_id', 'location_name'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inventory_stock_thresholds_sku_location', table_name='inventory_stock_thresholds')
+    op.drop_index(op.f('ix_inventory_stock_thresholds_id'), table_name='inventory_stock_thresholds')
+    op.drop_table('inventory_stock_thresholds')
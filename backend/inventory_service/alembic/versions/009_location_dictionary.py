@@ -0,0 +1,97 @@
+"""Location dictionary: integer location ids in the inventory ledger
+
+Revision ID: 009_location_dictionary
+Revises: 008_stock_thresholds
+Create Date: 2024-12-24
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009_location_dictionary'
+down_revision = '008_stock_thresholds'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_locations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('warehouse_location_id', sa.Integer(), nullable=True),
+        sa.Column('synced_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+        sa.UniqueConstraint('warehouse_location_id')
+    )
+    # Словарь из всех локаций журнала и остатков; id склада заполнит синхронизация с Warehouse Service
+    op.execute("""
+        INSERT INTO inventory_locations (name)
+        SELECT name FROM (
+            SELECT source_location AS name FROM inventory_operations WHERE source_location IS NOT NULL
+            UNION
+            SELECT target_location FROM inventory_operations WHERE target_location IS NOT NULL
+            UNION
+            SELECT location_name FROM inventory_location_totals
+        ) AS names
+        ORDER BY name
+    """)
+
+    # Колонки и индексы партиционированной таблицы создаются во всех партициях
+    op.add_column('inventory_operations', sa.Column('source_location_id', sa.Integer(), nullable=True))
+    op.add_column('inventory_operations', sa.Column('target_location_id', sa.Integer(), nullable=True))
+    op.execute("""
+        UPDATE inventory_operations AS o
+           SET source_location_id = (SELECT id FROM inventory_locations WHERE name = o.source_location),
+               target_location_id = (SELECT id FROM inventory_locations WHERE name = o.target_location)
+    """)
+    op.create_foreign_key(
+        'fk_inventory_operations_source_location_id', 'inventory_operations', 'inventory_locations',
+        ['source_location_id'], ['id']
+    )
+    op.create_foreign_key(
+        'fk_inventory_operations_target_location_id', 'inventory_operations', 'inventory_locations',
+        ['target_location_id'], ['id']
+    )
+
+    op.drop_index('ix_inventory_operations_source_location_created_at', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_target_location_created_at', table_name='inventory_operations')
+    op.create_index(
+        'ix_inventory_operations_source_location_id_created_at', 'inventory_operations',
+        ['source_location_id', 'created_at'], unique=False
+    )
+    op.create_index(
+        'ix_inventory_operations_target_location_id_created_at', 'inventory_operations',
+        ['target_location_id', 'created_at'], unique=False
+    )
+    # Место старых строк освобождается при перезаписи партиций (VACUUM FULL / pg_repack по партициям)
+    op.drop_column('inventory_operations', 'source_location')
+    op.drop_column('inventory_operations', 'target_location')
+
+
+def downgrade() -> None:
+    op.add_column('inventory_operations', sa.Column('source_location', sa.String(length=100), nullable=True))
+    op.add_column('inventory_operations', sa.Column('target_location', sa.String(length=100), nullable=True))
+    op.execute("""
+        UPDATE inventory_operations AS o
+           SET source_location = (SELECT name FROM inventory_locations WHERE id = o.source_location_id),
+               target_location = (SELECT name FROM inventory_locations WHERE id = o.target_location_id)
+    """)
+    op.drop_index('ix_inventory_operations_target_location_id_created_at', table_name='inventory_operations')
+    op.drop_index('ix_inventory_operations_source_location_id_created_at', table_name='inventory_operations')
+    op.create_index(
+        'ix_inventory_operations_source_location_created_at', 'inventory_operations',
+        ['source_location', 'created_at'], unique=False
+    )
+    op.create_index(
+        'ix_inventory_operations_target_location_created_at', 'inventory_operations',
+        ['target_location', 'created_at'], unique=False
+    )
+    op.drop_constraint('fk_inventory_operations_target_location_id', 'inventory_operations', type_='foreignkey')
+    op.drop_constraint('fk_inventory_operations_source_location_id', 'inventory_operations', type_='foreignkey')
+    op.drop_column('inventory_operations', 'target_location_id')
+    op.drop_column('inventory_operations', 'source_location_id')
+    op.drop_table('inventory_locations')
@@ -0,0 +1,47 @@
+"""Operation intake table for asynchronous ingestion
+
+Revision ID: 010_operation_intake
+Revises: 009_location_dictionary
+Create Date: 2024-12-26
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_operation_intake'
+down_revision = '009_location_dictionary'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_operation_intake',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('operation_type', sa.String(length=50), nullable=False),
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('quantity_value', sa.Integer(), nullable=False),
+        sa.Column('quantity_unit', sa.String(length=50), nullable=False),
+        sa.Column('weight_value', sa.Integer(), nullable=False),
+        sa.Column('weight_unit', sa.String(length=50), nullable=False),
+        sa.Column('source_location', sa.String(length=100), nullable=True),
+        sa.Column('target_location', sa.String(length=100), nullable=True),
+        sa.Column('idempotency_key', sa.String(length=255), nullable=True),
+        sa.Column('request_hash', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+        sa.Column('operation_id', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(length=500), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key')
+    )
+    op.create_index(
+        'ix_inventory_operation_intake_status_id', 'inventory_operation_intake', ['status', 'id'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inventory_operation_intake_status_id', table_name='inventory_operation_intake')
+    op.drop_table('inventory_operation_intake')
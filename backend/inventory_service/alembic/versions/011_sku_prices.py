@@ -0,0 +1,32 @@
+"""Catalog price projection for inventory valuation
+
+Revision ID: 011_sku_prices
+Revises: 010_operation_intake
+Create Date: 2024-12-27
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011_sku_prices'
+down_revision = '010_operation_intake'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_sku_prices',
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('price', sa.Float(), nullable=True),
+        sa.Column('currency', sa.String(length=20), nullable=True),
+        sa.Column('unit_weight', sa.Float(), nullable=True),
+        sa.Column('price_per_kg', sa.Float(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('sku_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_sku_prices')
@@ -0,0 +1,55 @@
+"""ABC/XYZ classification and turnover analytics
+
+Revision ID: 012_sku_analytics
+Revises: 011_sku_prices
+Create Date: 2024-12-28
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012_sku_analytics'
+down_revision = '011_sku_prices'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_sku_analytics',
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('abc_class', sa.String(length=1), nullable=True),
+        sa.Column('xyz_class', sa.String(length=1), nullable=True),
+        sa.Column('abc_rank', sa.Integer(), nullable=True),
+        sa.Column('demand_weight', sa.Integer(), nullable=False),
+        sa.Column('demand_value', sa.Float(), nullable=True),
+        sa.Column('value_share', sa.Float(), nullable=True),
+        sa.Column('cumulative_share', sa.Float(), nullable=True),
+        sa.Column('demand_cv', sa.Float(), nullable=True),
+        sa.Column('average_stock', sa.Float(), nullable=False),
+        sa.Column('turnover', sa.Float(), nullable=True),
+        sa.Column('window_from', sa.Date(), nullable=False),
+        sa.Column('window_to', sa.Date(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('sku_id')
+    )
+    op.create_index('ix_inventory_sku_analytics_classes', 'inventory_sku_analytics', ['abc_class', 'xyz_class'])
+    op.create_table(
+        'inventory_location_turnover',
+        sa.Column('location_name', sa.String(length=100), nullable=False),
+        sa.Column('outbound_weight', sa.Integer(), nullable=False),
+        sa.Column('average_stock', sa.Float(), nullable=False),
+        sa.Column('turnover', sa.Float(), nullable=True),
+        sa.Column('days_of_supply', sa.Float(), nullable=True),
+        sa.Column('window_from', sa.Date(), nullable=False),
+        sa.Column('window_to', sa.Date(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('location_name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_location_turnover')
+    op.drop_index('ix_inventory_sku_analytics_classes', table_name='inventory_sku_analytics')
+    op.drop_table('inventory_sku_analytics')
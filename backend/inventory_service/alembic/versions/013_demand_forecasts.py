@@ -0,0 +1,35 @@
+"""Demand forecast cache for replenishment
+
+Revision ID: 013_demand_forecasts
+Revises: 012_sku_analytics
+Create Date: 2024-12-29
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013_demand_forecasts'
+down_revision = '012_sku_analytics'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_demand_forecasts',
+        sa.Column('sku_id', sa.Integer(), nullable=False),
+        sa.Column('location_name', sa.String(length=100), nullable=False),
+        sa.Column('moving_average', sa.Float(), nullable=False),
+        sa.Column('smoothed', sa.Float(), nullable=False),
+        sa.Column('history_from', sa.Date(), nullable=False),
+        sa.Column('history_to', sa.Date(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('sku_id', 'location_name')
+    )
+    op.create_index('ix_inventory_demand_forecasts_location', 'inventory_demand_forecasts', ['location_name'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inventory_demand_forecasts_location', table_name='inventory_demand_forecasts')
+    op.drop_table('inventory_demand_forecasts')
@@ -0,0 +1,29 @@
+"""Ledger high-water mark for inventory snapshots
+
+Revision ID: 014_snapshot_operation_mark
+Revises: 013_demand_forecasts
+Create Date: 2024-12-30
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '014_snapshot_operation_mark'
+down_revision = '013_demand_forecasts'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('inventory_snapshots', sa.Column('operation_id_mark', sa.Integer(), nullable=True))
+    # Для существующих снимков - лучшее приближение по времени создания операций
+    op.execute(
+        "UPDATE inventory_snapshots s SET operation_id_mark = COALESCE("
+        "(SELECT max(o.id) FROM inventory_operations o WHERE o.created_at <= s.taken_at), 0)"
+    )
+    op.alter_column('inventory_snapshots', 'operation_id_mark', nullable=False)
+
+
+def downgrade() -> None:
+    op.drop_column('inventory_snapshots', 'operation_id_mark')
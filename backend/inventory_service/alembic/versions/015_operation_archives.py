@@ -0,0 +1,32 @@
+"""Registry of archived ledger partitions
+
+Revision ID: 015_operation_archives
+Revises: 014_snapshot_operation_mark
+Create Date: 2024-12-30
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '015_operation_archives'
+down_revision = '014_snapshot_operation_mark'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_operation_archives',
+        sa.Column('partition_name', sa.String(length=63), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('archive_path', sa.String(length=500), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=False),
+        sa.Column('max_operation_id', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('partition_name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_operation_archives')
@@ -0,0 +1,37 @@
+"""Shared idempotency keys for synchronous operations and intake tickets
+
+Revision ID: 016_idempotency_intake_keys
+Revises: 015_operation_archives
+Create Date: 2024-12-31
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '016_idempotency_intake_keys'
+down_revision = '015_operation_archives'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Ключ асинхронного запроса резервируется в той же таблице, что и ключ синхронного:
+    # у него нет операции и ответа, пока квитанция не применена
+    op.add_column('inventory_idempotency_keys', sa.Column('intake_id', sa.Integer(), nullable=True))
+    op.alter_column('inventory_idempotency_keys', 'operation_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('inventory_idempotency_keys', 'response', existing_type=sa.JSON(), nullable=True)
+    op.execute("""
+        INSERT INTO inventory_idempotency_keys (key, request_hash, intake_id, created_at)
+        SELECT idempotency_key, request_hash, id, created_at
+        FROM inventory_operation_intake
+        WHERE idempotency_key IS NOT NULL
+        ON CONFLICT (key) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM inventory_idempotency_keys WHERE intake_id IS NOT NULL")
+    op.alter_column('inventory_idempotency_keys', 'response', existing_type=sa.JSON(), nullable=False)
+    op.alter_column('inventory_idempotency_keys', 'operation_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('inventory_idempotency_keys', 'intake_id')
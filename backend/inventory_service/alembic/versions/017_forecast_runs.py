@@ -0,0 +1,38 @@
+"""Forecast refresh runs recorded separately from forecast rows
+
+Revision ID: 017_forecast_runs
+Revises: 016_idempotency_intake_keys
+Create Date: 2024-12-31
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '017_forecast_runs'
+down_revision = '016_idempotency_intake_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'inventory_forecast_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('history_from', sa.Date(), nullable=False),
+        sa.Column('history_to', sa.Date(), nullable=False),
+        sa.Column('cells', sa.Integer(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # Уже посчитанный прогноз (если строки есть) считается последним пересчетом
+    op.execute("""
+        INSERT INTO inventory_forecast_runs (history_from, history_to, cells, computed_at)
+        SELECT min(history_from), max(history_to), count(*), max(computed_at)
+        FROM inventory_demand_forecasts
+        HAVING count(*) > 0
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('inventory_forecast_runs')
@@ -0,0 +1,337 @@
+"""
+ABC/XYZ-анализ товаров и оборачиваемость локаций (inventory_sku_analytics, inventory_location_turnover)
+
+Источник - дневной агрегат движения (inventory_daily_movements, app/movements.py), а не журнал:
+задача читает только дни окна анализа (ANALYTICS_PERIODS периодов по ANALYTICS_PERIOD_DAYS дней,
+заканчивается вчерашним днем) и дни после него, поэтому ее стоимость не растет с длиной журнала.
+Результат пересчитывается, когда закрывается новый день; повторный запуск в тот же день ничего не делает.
+
+Расход товара - списания (write_off). Все показатели считаются векторами NumPy по строкам агрегата:
+- ABC: расход в стоимости (цена кг из проекции цен каталога, app/sku_prices.py) или в кг
+  (ANALYTICS_ABC_BASIS), сортировка по убыванию, накопленная доля: A - товары, пока накопленная
+  доля до них меньше ANALYTICS_ABC_A_SHARE, B - меньше ANALYTICS_ABC_B_SHARE, остальные и товары
+  без расхода - C. При оценке по стоимости товары без цены класса не получают;
+- XYZ: коэффициент вариации расхода по периодам окна (стандартное отклонение / среднее);
+- оборачиваемость: расход за окно / средний остаток. Остаток на конец каждого дня окна
+  восстанавливается от текущего остатка вычитанием движений следующих дней, среднее - одной
+  взвешенной суммой без матрицы дней. Операции update движением не являются, поэтому при
+  инвентаризациях внутри окна средний остаток приближенный.
+
+Запуск пересчета вручную:
+    python -m app.analytics --force
+"""
+import sys
+import os
+import logging
+import argparse
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import numpy as np
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import (
+    InventoryDailyMovement, InventorySKUTotal, InventoryLocationRollup,
+    InventorySKUAnalytics, InventoryLocationTurnover
+)
+from app import sku_prices
+
+logger = logging.getLogger(__name__)
+
+DEMAND_TYPES = ('write_off',)  # Расход товара (спрос)
+LOCATION_OUTBOUND_TYPES = ('write_off', 'transfer')  # Убытие из локации для оборачиваемости
+INSERT_CHUNK = 10000
+
+
+def analysis_window(today: date) -> Tuple[date, date]:
+    """Окно анализа [window_from, window_to): целые периоды, последний заканчивается вчера"""
+    return today - timedelta(days=settings.ANALYTICS_PERIODS * settings.ANALYTICS_PERIOD_DAYS), today
+
+
+def _optional(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def _abc(measure: np.ndarray, sku_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ABC по мере расхода (NaN - товар не оценен)
+
+    Returns:
+        Класс (пустая строка - не оценен), ранг (0 - не оценен), доля и накопленная доля (NaN - не оценен)
+    """
+    classes = np.full(len(measure), "", dtype="<U1")
+    ranks = np.zeros(len(measure), dtype=np.int64)
+    shares = np.full(len(measure), np.nan)
+    cumulative = np.full(len(measure), np.nan)
+    rated = np.nonzero(~np.isnan(measure))[0]
+    if not len(rated):
+        return classes, ranks, shares, cumulative
+    order = rated[np.lexsort((sku_ids[rated], -measure[rated]))]
+    total = measure[order].sum()
+    order_shares = measure[order] / total if total > 0 else np.zeros(len(order))
+    order_cumulative = np.cumsum(order_shares)
+    before = order_cumulative - order_shares
+    classes[order] = np.where(
+        measure[order] <= 0, "C",
+        np.where(before < settings.ANALYTICS_ABC_A_SHARE, "A",
+                 np.where(before < settings.ANALYTICS_ABC_B_SHARE, "B", "C"))
+    )
+    ranks[order] = np.arange(1, len(order) + 1)
+    shares[order] = order_shares
+    cumulative[order] = order_cumulative
+    return classes, ranks, shares, cumulative
+
+
+def _xyz(demand: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """XYZ по матрице расхода (товар x период): класс (пустая строка - расхода не было) и коэффициент вариации"""
+    mean = demand.mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = np.where(mean > 0, demand.std(axis=1) / mean, np.nan)
+    classes = np.select(
+        [np.isnan(cv), cv <= settings.ANALYTICS_XYZ_X_CV, cv <= settings.ANALYTICS_XYZ_Y_CV],
+        ["", "X", "Y"],
+        "Z"
+    )
+    return classes, cv
+
+
+class AnalyticsService:
+    """Пересчет ABC/XYZ-анализа и оборачиваемости"""
+
+    @staticmethod
+    def _movements(db: Session, window_from: date) -> Dict[str, np.ndarray]:
+        """Строки дневного агрегата с первого дня окна (включая дни после окна) векторами"""
+        rows = db.execute(
+            select(
+                InventoryDailyMovement.day, InventoryDailyMovement.sku_id, InventoryDailyMovement.location_name,
+                InventoryDailyMovement.operation_type,
+                InventoryDailyMovement.inbound_weight, InventoryDailyMovement.outbound_weight
+            ).where(InventoryDailyMovement.day >= window_from)
+        ).all()
+        origin = window_from.toordinal()
+        count = len(rows)
+        return {
+            "day": np.fromiter((row[0].toordinal() - origin for row in rows), dtype=np.int64, count=count),
+            "sku_id": np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            "location": np.array([row[2] for row in rows], dtype=str),
+            "operation_type": np.array([row[3] for row in rows], dtype=str),
+            "inbound": np.fromiter((row[4] for row in rows), dtype=np.float64, count=count),
+            "outbound": np.fromiter((row[5] for row in rows), dtype=np.float64, count=count),
+        }
+
+    @staticmethod
+    def compute(db: Session, window_from: date, window_to: date) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Показатели товаров и локаций за окно [window_from, window_to)
+
+        Returns:
+            Строки inventory_sku_analytics и inventory_location_turnover
+        """
+        days = (window_to - window_from).days
+        periods = max(days // settings.ANALYTICS_PERIOD_DAYS, 1)
+        movements = AnalyticsService._movements(db, window_from)
+        day = movements["day"]
+        net = movements["inbound"] - movements["outbound"]
+        # Движение дня j учитывается в остатках на конец min(j, days) дней окна (дни 0..j-1)
+        stock_factor = np.minimum(day, days) / days
+        in_window = day < days
+
+        sku_totals = db.execute(
+            select(InventorySKUTotal.sku_id, InventorySKUTotal.total_weight).where(InventorySKUTotal.total_weight != 0)
+        ).all()
+        total_ids = np.fromiter((row[0] for row in sku_totals), dtype=np.int64, count=len(sku_totals))
+        # Товары с движением после окна тоже нужны: их остаток в окне восстанавливается по этому движению
+        skus = np.union1d(movements["sku_id"], total_ids)
+        sku_positions = np.searchsorted(skus, movements["sku_id"])
+        current = np.zeros(len(skus))
+        current[np.searchsorted(skus, total_ids)] = [row[1] for row in sku_totals]
+        average_stock = np.maximum(
+            current - np.bincount(sku_positions, weights=net * stock_factor, minlength=len(skus)), 0.0
+        )
+        demand_rows = in_window & np.isin(movements["operation_type"], DEMAND_TYPES)
+        demand = np.bincount(
+            sku_positions[demand_rows] * periods + day[demand_rows] * periods // days,
+            weights=movements["outbound"][demand_rows],
+            minlength=len(skus) * periods
+        ).reshape(len(skus), periods)
+        demand_weight = demand.sum(axis=1)
+
+        if settings.ANALYTICS_ABC_BASIS == "value":
+            demand_value = demand_weight * sku_prices.price_cache.lookup(db, skus, settings.ANALYTICS_CURRENCY)
+        else:
+            demand_value = demand_weight.copy()
+        abc_classes, abc_ranks, shares, cumulative = _abc(demand_value, skus)
+        xyz_classes, cv = _xyz(demand)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            turnover = np.where(average_stock > 0, demand_weight / average_stock, np.nan)
+
+        sku_rows = [
+            {
+                "sku_id": sku_id,
+                "abc_class": abc_class or None,
+                "xyz_class": xyz_class or None,
+                "abc_rank": rank or None,
+                "demand_weight": int(weight),
+                "demand_value": value,
+                "value_share": share,
+                "cumulative_share": cumulative_share,
+                "demand_cv": variation,
+                "average_stock": stock,
+                "turnover": sku_turnover,
+                "window_from": window_from,
+                "window_to": window_to,
+            }
+            for sku_id, abc_class, xyz_class, rank, weight, value, share, cumulative_share, variation, stock, sku_turnover
+            in zip(
+                skus.tolist(), abc_classes.tolist(), xyz_classes.tolist(), abc_ranks.tolist(), demand_weight.tolist(),
+                _optional(demand_value), _optional(shares), _optional(cumulative), _optional(cv),
+                average_stock.tolist(), _optional(turnover)
+            )
+        ]
+
+        rollups = db.execute(
+            select(InventoryLocationRollup.location_name, InventoryLocationRollup.total_weight)
+        ).all()
+        rollup_names = np.array([row[0] for row in rollups], dtype=str)
+        locations = np.union1d(movements["location"], rollup_names)
+        location_positions = np.searchsorted(locations, movements["location"])
+        location_current = np.zeros(len(locations))
+        location_current[np.searchsorted(locations, rollup_names)] = [row[1] for row in rollups]
+        location_average = np.maximum(
+            location_current - np.bincount(location_positions, weights=net * stock_factor, minlength=len(locations)),
+            0.0
+        )
+        outbound_rows = in_window & np.isin(movements["operation_type"], LOCATION_OUTBOUND_TYPES)
+        location_outbound = np.bincount(
+            location_positions[outbound_rows], weights=movements["outbound"][outbound_rows], minlength=len(locations)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            location_turnover = np.where(location_average > 0, location_outbound / location_average, np.nan)
+            days_of_supply = np.where(location_outbound > 0, location_average / (location_outbound / days), np.nan)
+
+        location_rows = [
+            {
+                "location_name": location_name,
+                "outbound_weight": int(outbound),
+                "average_stock": stock,
+                "turnover": location_turnover_value,
+                "days_of_supply": supply,
+                "window_from": window_from,
+                "window_to": window_to,
+            }
+            for location_name, outbound, stock, location_turnover_value, supply in zip(
+                locations.tolist(), location_outbound.tolist(), location_average.tolist(),
+                _optional(location_turnover), _optional(days_of_supply)
+            )
+        ]
+        return sku_rows, location_rows
+
+    @staticmethod
+    def recompute(db: Session, force: bool = False) -> Dict:
+        """
+        Пересчитать показатели за окно, заканчивающееся вчера, и заменить ими таблицы результатов
+
+        Args:
+            force: Пересчитать, даже если окно не сдвинулось (например, после пересборки агрегата движения)
+
+        Returns:
+            Окно, количество товаров и локаций, матрица ABC/XYZ (количество товаров по парам классов)
+        """
+        window_from, window_to = analysis_window(db.execute(select(func.current_date())).scalar())
+        latest = db.query(func.max(InventorySKUAnalytics.window_to)).scalar()
+        if not force and latest == window_to:
+            return {**AnalyticsService.summary(db), "recomputed": False}
+
+        sku_rows, location_rows = AnalyticsService.compute(db, window_from, window_to)
+        db.execute(delete(InventorySKUAnalytics))
+        db.execute(delete(InventoryLocationTurnover))
+        for start in range(0, len(sku_rows), INSERT_CHUNK):
+            db.execute(insert(InventorySKUAnalytics), sku_rows[start:start + INSERT_CHUNK])
+        if location_rows:
+            db.execute(insert(InventoryLocationTurnover), location_rows)
+        db.commit()
+        logger.info(
+            f"ABC/XYZ-анализ за [{window_from}, {window_to}) пересчитан: "
+            f"{len(sku_rows)} товаров, {len(location_rows)} локаций"
+        )
+        return {**AnalyticsService.summary(db), "recomputed": True}
+
+    @staticmethod
+    def summary(db: Session) -> Dict:
+        """Окно и матрица ABC/XYZ текущих результатов"""
+        window = db.query(
+            func.min(InventorySKUAnalytics.window_from), func.max(InventorySKUAnalytics.window_to)
+        ).one()
+        matrix = {
+            f"{abc_class or '-'}{xyz_class or '-'}": count
+            for abc_class, xyz_class, count in db.execute(
+                select(InventorySKUAnalytics.abc_class, InventorySKUAnalytics.xyz_class, func.count())
+                .group_by(InventorySKUAnalytics.abc_class, InventorySKUAnalytics.xyz_class)
+            ).all()
+        }
+        return {
+            "window_from": window[0],
+            "window_to": window[1],
+            "skus": sum(matrix.values()),
+            "locations": db.query(func.count(InventoryLocationTurnover.location_name)).scalar(),
+            "matrix": dict(sorted(matrix.items())),
+        }
+
+    @staticmethod
+    def skus(
+        db: Session,
+        abc_class: Optional[str] = None,
+        xyz_class: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[InventorySKUAnalytics]:
+        """Результаты по товарам в порядке ранга ABC (товары без класса - в конце)"""
+        query = db.query(InventorySKUAnalytics)
+        if abc_class:
+            query = query.filter(InventorySKUAnalytics.abc_class == abc_class)
+        if xyz_class:
+            query = query.filter(InventorySKUAnalytics.xyz_class == xyz_class)
+        return query.order_by(
+            InventorySKUAnalytics.abc_rank.is_(None), InventorySKUAnalytics.abc_rank, InventorySKUAnalytics.sku_id
+        ).offset(skip).limit(limit).all()
+
+    @staticmethod
+    def locations(db: Session) -> List[InventoryLocationTurnover]:
+        """Оборачиваемость локаций по убыванию (локации без остатка - в конце)"""
+        return db.query(InventoryLocationTurnover).order_by(
+            InventoryLocationTurnover.turnover.is_(None),
+            InventoryLocationTurnover.turnover.desc(),
+            InventoryLocationTurnover.location_name
+        ).all()
+
+
+def run_analytics(force: bool = False) -> Dict:
+    """Пересчитать показатели, если закрылся новый день (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        return AnalyticsService.recompute(db, force)
+    except Exception as e:
+        logger.error(f"Ошибка при пересчете ABC/XYZ-анализа: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет ABC/XYZ-анализа и оборачиваемости")
+    parser.add_argument("--force", action="store_true", help="Пересчитать, даже если окно не сдвинулось")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = run_analytics(args.force)
+    print(f"Окно: [{report['window_from']}, {report['window_to']}), товаров: {report['skus']}, "
+          f"локаций: {report['locations']}, матрица: {report['matrix']}")
+
+
+if __name__ == "__main__":
+    main()
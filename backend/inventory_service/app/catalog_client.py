@@ -3,7 +3,7 @@
 """
 import httpx
 import logging
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -28,6 +28,56 @@ class CatalogClient:
             logger.error(f"Error fetching SKU {sku_id} from Catalog Service: {e}")
             return None
     
+    async def list_sku_records(self, page_size: int = 1000) -> Optional[List[Dict]]:
+        """
+        Получить все товары каталога постранично (SKUListResponse: id, name, weight, weight_unit_id,
+        price, price_unit_id, ...). None - каталог недоступен, чтобы не принять частичный список за полный
+
+        Страницы выбираются по ID (after_id), а не по смещению: товар, удаленный во время обхода,
+        не сдвигает следующие страницы и не приводит к пропуску других товаров.
+        """
+        records: List[Dict] = []
+        params = {"limit": page_size}
+        try:
+            while True:
+                response = await self.client.get(f"{self.base_url}/catalog/skus", params=params)
+                response.raise_for_status()
+                page = response.json()
+                records.extend(page)
+                if len(page) < page_size:
+                    return records
+                params = {"limit": page_size, "after_id": page[-1]["id"]}
+        except Exception as e:
+            logger.error(f"Error listing SKUs from Catalog Service: {e}")
+            return None
+
+    async def count_skus(self) -> Optional[int]:
+        """Количество товаров каталога (заголовок X-Total-Count списка; None - каталог недоступен)"""
+        try:
+            response = await self.client.get(f"{self.base_url}/catalog/skus", params={"limit": 1})
+            response.raise_for_status()
+            return int(response.headers["X-Total-Count"])
+        except Exception as e:
+            logger.error(f"Error counting SKUs in Catalog Service: {e}")
+            return None
+
+    async def list_skus(self, page_size: int = 1000) -> Optional[Dict[int, str]]:
+        """Получить все товары каталога: {ID товара: название} (None - каталог недоступен)"""
+        records = await self.list_sku_records(page_size)
+        if records is None:
+            return None
+        return {item["id"]: item["name"] for item in records}
+
+    async def get_units(self) -> Optional[Dict[int, str]]:
+        """Получить все единицы измерения: {ID: название} (None - каталог недоступен)"""
+        try:
+            response = await self.client.get(f"{self.base_url}/catalog/units")
+            response.raise_for_status()
+            return {unit["id"]: unit["name"] for unit in response.json()}
+        except Exception as e:
+            logger.error(f"Error fetching units from Catalog Service: {e}")
+            return None
+
     async def get_quantity_unit_coefficient(self, quantity_unit_name: str) -> int:
         """
         Получить коэффициент для единицы количества по её названию.
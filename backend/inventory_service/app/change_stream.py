@@ -0,0 +1,261 @@
+"""
+Поток изменений остатков для подписчиков (GET /inventory/stream, Server-Sent Events)
+
+Изменения собираются хуками сессии SQLAlchemy: after_flush запоминает записанные операции
+и строки остатков, after_commit публикует их, after_rollback отбрасывает. Поэтому подписчики
+видят только закоммиченные изменения, с какого бы пути они ни пришли (HTTP, потребитель событий).
+Прямые UPDATE через Core (исправления сверки) в поток не попадают.
+
+Публикация идет в одном месте (ChangeStream.publish в event loop сервиса): событию присваивается
+возрастающий id, оно попадает в кольцевую историю для возобновления по Last-Event-ID и раскладывается
+по буферам подходящих подписчиков. Подписчики проиндексированы по SKU и локации, поэтому публикация
+стоит O(подходящих подписчиков), а простаивающее соединение - только ожидание своего asyncio.Event.
+Буфер подписчика ограничен: при переполнении отбрасываются самые старые события, а клиент получает
+событие overflow и должен перечитать списки.
+
+Поток охватывает изменения, закоммиченные этим процессом сервиса.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import InventoryOperation, InventorySKUTotal, InventoryLocationTotal
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "change_stream_events"
+
+# Типы событий потока
+EVENT_OPERATION = "operation"
+EVENT_LOCATION_TOTAL = "location_total"
+EVENT_SKU_TOTAL = "sku_total"
+EVENT_OVERFLOW = "overflow"  # Часть событий отброшена - клиенту нужно перечитать списки
+EVENT_RESET = "reset"  # Возобновление с Last-Event-ID невозможно - история уже вытеснена
+
+
+def _matches(data: Dict[str, Any], kind: str, sku_id: Optional[int], location: Optional[str]) -> bool:
+    """Подходит ли событие под фильтры подписчика"""
+    if sku_id is not None and data.get("sku_id") != sku_id:
+        return False
+    if location is None:
+        return True
+    if kind == EVENT_OPERATION:
+        return location in (data.get("source_location"), data.get("target_location"))
+    return data.get("location_name") == location
+
+
+class Subscriber:
+    """Подписчик потока: фильтры и ограниченный буфер событий"""
+
+    def __init__(self, sku_id: Optional[int], location: Optional[str], buffer_size: int):
+        self.sku_id = sku_id
+        self.location = location
+        self.buffer: Deque[Tuple[int, str, Dict[str, Any]]] = deque(maxlen=buffer_size)
+        self.dropped = 0  # Сколько событий отброшено с последнего чтения
+        self.wakeup = asyncio.Event()
+
+    def push(self, item: Tuple[int, str, Dict[str, Any]]):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1  # deque с maxlen сам вытеснит самое старое событие
+        self.buffer.append(item)
+        self.wakeup.set()
+
+    def drain(self) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], int]:
+        """Забрать накопленные события и количество отброшенных"""
+        items = list(self.buffer)
+        dropped = self.dropped
+        self.buffer.clear()
+        self.dropped = 0
+        self.wakeup.clear()
+        return items, dropped
+
+
+class ChangeStream:
+    """Раздача изменений остатков подписчикам"""
+
+    def __init__(self, history_size: Optional[int] = None, buffer_size: Optional[int] = None):
+        self.history: Deque[Tuple[int, str, Dict[str, Any]]] = deque(
+            maxlen=history_size or settings.STREAM_HISTORY_SIZE
+        )
+        self.buffer_size = buffer_size or settings.STREAM_CLIENT_BUFFER_SIZE
+        self.last_id = 0
+        self._all: Set[Subscriber] = set()
+        self._by_sku: Dict[int, Set[Subscriber]] = {}
+        self._by_location: Dict[str, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        indexes = [self._all, *self._by_sku.values(), *self._by_location.values()]
+        return sum(len(index) for index in indexes)
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Event loop, в котором живут подписчики (публикации из других потоков передаются в него)"""
+        self._loop = loop
+
+    def _index(self, subscriber: Subscriber) -> Set[Subscriber]:
+        # SKU - более избирательный фильтр, поэтому подписчик с обоими фильтрами индексируется по SKU
+        if subscriber.sku_id is not None:
+            return self._by_sku.setdefault(subscriber.sku_id, set())
+        if subscriber.location is not None:
+            return self._by_location.setdefault(subscriber.location, set())
+        return self._all
+
+    def subscribe(
+        self,
+        sku_id: Optional[int] = None,
+        location: Optional[str] = None,
+        last_event_id: Optional[int] = None
+    ) -> Subscriber:
+        """
+        Подписаться на изменения
+
+        Args:
+            last_event_id: id последнего полученного события - пропущенные события из истории
+                попадут в буфер сразу; если история их уже вытеснила, первым придет событие reset
+        """
+        subscriber = Subscriber(sku_id, location, self.buffer_size)
+        if last_event_id is not None and last_event_id < self.last_id:
+            oldest = self.history[0][0] if self.history else self.last_id + 1
+            if last_event_id + 1 < oldest:
+                subscriber.push((self.last_id, EVENT_RESET, {"last_event_id": last_event_id}))
+            else:
+                for item in self.history:
+                    if item[0] > last_event_id and _matches(item[2], item[1], sku_id, location):
+                        subscriber.push(item)
+        self._index(subscriber).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        index = self._index(subscriber)
+        index.discard(subscriber)
+        if not index and index is not self._all:
+            if subscriber.sku_id is not None:
+                self._by_sku.pop(subscriber.sku_id, None)
+            else:
+                self._by_location.pop(subscriber.location, None)
+
+    def publish(self, events: List[Tuple[str, Dict[str, Any]]]):
+        """Опубликовать закоммиченные изменения (можно вызывать из любого потока)"""
+        if not events:
+            return
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                loop.call_soon_threadsafe(self._dispatch, events)
+                return
+        self._dispatch(events)
+
+    def _dispatch(self, events: List[Tuple[str, Dict[str, Any]]]):
+        for kind, data in events:
+            self.last_id += 1
+            item = (self.last_id, kind, data)
+            self.history.append(item)
+
+            candidates = [self._all]
+            sku_id = data.get("sku_id")
+            if sku_id is not None and sku_id in self._by_sku:
+                candidates.append(self._by_sku[sku_id])
+            for location in {data.get("source_location"), data.get("target_location"), data.get("location_name")}:
+                if location is not None and location in self._by_location:
+                    candidates.append(self._by_location[location])
+            for subscribers in candidates:
+                for subscriber in subscribers:
+                    if _matches(data, kind, subscriber.sku_id, subscriber.location):
+                        subscriber.push(item)
+
+
+def format_sse(event_id: Optional[int], kind: str, data: Dict[str, Any]) -> str:
+    """Событие в формате Server-Sent Events (без id клиент сохраняет прежний Last-Event-ID)"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {kind}\ndata: {payload}\n\n"
+
+
+async def sse_events(stream: "ChangeStream", subscriber: Subscriber, heartbeat_seconds: Optional[float] = None):
+    """Генератор ответа GET /inventory/stream: события подписчика и комментарии keepalive в простое"""
+    heartbeat = heartbeat_seconds or settings.STREAM_HEARTBEAT_SECONDS
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.wakeup.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            items, dropped = subscriber.drain()
+            chunks = []
+            if dropped:
+                chunks.append(format_sse(None, EVENT_OVERFLOW, {"dropped": dropped}))
+            chunks.extend(format_sse(*item) for item in items)
+            yield "".join(chunks)
+    finally:
+        stream.unsubscribe(subscriber)
+
+
+# Глобальный поток изменений
+change_stream = ChangeStream()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session: Session, flush_context):
+    """Запомнить записанные операции и строки остатков до commit"""
+    pending = session.info.setdefault(SESSION_KEY, {"operations": [], "totals": {}})
+    for obj in list(session.new) + list(session.dirty):
+        is_new = obj in session.new
+        if not is_new and not session.is_modified(obj):
+            continue
+        if isinstance(obj, InventoryOperation) and is_new:
+            pending["operations"].append((EVENT_OPERATION, {
+                "operation_id": obj.id,
+                "operation_type": obj.operation_type,
+                "sku_id": obj.sku_id,
+                "sku_name": obj.sku_name,
+                "delta_value": obj.delta_value,
+                "delta_unit": obj.delta_unit,
+                "source_location": obj.source_location,
+                "target_location": obj.target_location,
+            }))
+        elif isinstance(obj, InventoryLocationTotal):
+            # Несколько изменений одной строки за транзакцию - одно событие с итоговым значением
+            pending["totals"][(EVENT_LOCATION_TOTAL, obj.sku_id, obj.location_name)] = {
+                "sku_id": obj.sku_id,
+                "sku_name": obj.sku_name,
+                "location_name": obj.location_name,
+                "weight": obj.weight,
+            }
+        elif isinstance(obj, InventorySKUTotal):
+            pending["totals"][(EVENT_SKU_TOTAL, obj.sku_id)] = {
+                "sku_id": obj.sku_id,
+                "sku_name": obj.sku_name,
+                "total_weight": obj.total_weight,
+            }
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session):
+    pending = session.info.pop(SESSION_KEY, None)
+    if not pending:
+        return
+    events = pending["operations"] + [
+        (key[0], data) for key, data in pending["totals"].items()
+    ]
+    try:
+        change_stream.publish(events)
+    except Exception as e:
+        logger.error(f"Failed to publish inventory changes to stream: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(SESSION_KEY, None)
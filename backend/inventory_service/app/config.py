@@ -11,10 +11,91 @@ class Settings(BaseSettings):
     RABBITMQ_USER: str = "rabbitmq"
     RABBITMQ_PASSWORD: str = "rabbitmq_password"
     
+    # Потребитель событий RabbitMQ (sku.created/updated/deleted от Catalog Service)
+    # По умолчанию выключен: Catalog Service пока записывает те же изменения прямыми HTTP-вызовами
+    EVENT_CONSUMER_ENABLED: bool = False
+    RABBITMQ_PREFETCH_COUNT: int = 1000  # Сколько неподтвержденных сообщений брокер выдает потребителю
+    EVENT_CONSUMER_MAX_CONCURRENCY: int = 8  # Сколько запросов в Catalog Service выполняется одновременно
+    EVENT_BATCH_WINDOW_MS: int = 200  # Сколько ждать сообщений в пачку после первого
+    EVENT_BATCH_MAX_SIZE: int = 500  # Максимальный размер пачки (не больше prefetch)
+    EVENT_RETRY_MAX_ATTEMPTS: int = 5  # Попыток обработки события до переноса в DLQ
+    EVENT_RETRY_BASE_DELAY_MS: int = 1000  # Задержка перед первым повтором (далее удваивается)
+    RABBITMQ_RECONNECT_DELAY_SECONDS: float = 1.0  # Начальная задержка переподключения
+    RABBITMQ_RECONNECT_MAX_DELAY_SECONDS: float = 60.0  # Максимальная задержка переподключения
+    
     # External Services URLs
     CATALOG_SERVICE_URL: str = "http://catalog_service:8000"
     WAREHOUSE_SERVICE_URL: str = "http://warehouse_service:8000"
     
+    # Словарь локаций журнала операций (inventory_locations)
+    LOCATION_SYNC_INTERVAL_SECONDS: int = 600  # Период синхронизации с Warehouse Service (0 - не синхронизировать)
+    
+    # Партиционирование журнала операций (inventory_operations)
+    OPERATIONS_PARTITIONS_PREMAKE_MONTHS: int = 3  # Сколько будущих месячных партиций держать созданными
+    OPERATIONS_RETENTION_MONTHS: int = 0  # Сколько месяцев истории хранить в БД (0 - хранить всё)
+    OPERATIONS_ARCHIVE_DIR: str = "/app/archive"  # Каталог для gzip-архивов отключенных партиций
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 86400  # Период обслуживания партиций (раз в сутки)
+    
+    # Снимки остатков для запросов остатков на дату (as_of)
+    SNAPSHOT_INTERVAL_SECONDS: int = 86400  # Период снятия снимков (0 - не снимать автоматически)
+    SNAPSHOT_RETENTION_COUNT: int = 30  # Сколько последних снимков хранить (0 - хранить все)
+    
+    # Сводка по локациям (inventory_location_rollups)
+    LOCATION_ROLLUP_VERIFY_INTERVAL_SECONDS: int = 3600  # Период сверки сводки с остатками (0 - не сверять)
+    
+    # Поток изменений остатков (GET /inventory/stream)
+    STREAM_HISTORY_SIZE: int = 10000  # Сколько последних событий хранить для возобновления по Last-Event-ID
+    STREAM_CLIENT_BUFFER_SIZE: int = 1000  # Буфер событий подписчика (при переполнении отбрасываются старые)
+    STREAM_HEARTBEAT_SECONDS: float = 15.0  # Период keepalive-комментариев в простое
+    
+    # Индекс остатков в памяти для GET /inventory/locations и /inventory/sku/totals (app/stock_index.py)
+    STOCK_INDEX_ENABLED: bool = False
+    STOCK_INDEX_REBUILD_INTERVAL_SECONDS: int = 3600  # Перестроение из БД (подхватывает изменения в обход сессии)
+    
+    # Оповещения о низком остатке и переполнении (inventory.alert.*)
+    STOCK_THRESHOLD_CACHE_SECONDS: float = 60.0  # Как долго пороги кэшируются в процессе
+    
+    # Асинхронный прием операций (POST /inventory/operations?async=true, app/intake.py)
+    INTAKE_BATCH_SIZE: int = 1000  # Сколько квитанций применяется одной транзакцией
+    INTAKE_IDLE_POLL_SECONDS: float = 5.0  # Проверка очереди без сигнала о новых квитанциях (в т.ч. после перезапуска)
+    INTAKE_FLUSH_TIMEOUT_SECONDS: float = 30.0  # Предельное ожидание в POST /inventory/intake/flush
+    
+    # Потоковая выгрузка журнала и остатков (GET /inventory/export/...)
+    EXPORT_CHUNK_ROWS: int = 5000  # Строк в порции курсора на стороне сервера
+    
+    # Оценка запасов по ценам каталога (GET /inventory/valuation, app/sku_prices.py)
+    SKU_PRICE_REFRESH_INTERVAL_SECONDS: int = 3600  # Полное обновление проекции цен из Catalog Service (0 - только по событиям)
+    SKU_PRICE_CACHE_SECONDS: float = 300.0  # Как долго цены кэшируются в процессе
+    
+    # ABC/XYZ-анализ и оборачиваемость (app/analytics.py, GET /inventory/analytics/...)
+    ANALYTICS_INTERVAL_SECONDS: int = 3600  # Проверка, закрылся ли новый день (0 - только вручную)
+    ANALYTICS_PERIODS: int = 13  # Сколько периодов в окне анализа
+    ANALYTICS_PERIOD_DAYS: int = 7  # Длина периода для вариации спроса (XYZ)
+    ANALYTICS_ABC_BASIS: str = "value"  # value - расход по ценам каталога, weight - расход в кг
+    ANALYTICS_CURRENCY: str = "руб"  # Валюта оценки расхода при ANALYTICS_ABC_BASIS=value
+    ANALYTICS_ABC_A_SHARE: float = 0.8  # Класс A - товары, дающие первые 80% расхода
+    ANALYTICS_ABC_B_SHARE: float = 0.95  # Класс B - до 95%, остальные - C
+    ANALYTICS_XYZ_X_CV: float = 0.25  # Класс X - коэффициент вариации не выше
+    ANALYTICS_XYZ_Y_CV: float = 0.5  # Класс Y - не выше, остальные - Z
+    
+    # Прогноз спроса для пополнения складов (app/forecasting.py, POST /inventory/forecasts/query)
+    FORECAST_REFRESH_INTERVAL_SECONDS: int = 3600  # Проверка, закрылся ли новый день (0 - только вручную)
+    FORECAST_HISTORY_DAYS: int = 56  # Сколько дней расхода берется в историю
+    FORECAST_MOVING_AVERAGE_DAYS: int = 28  # Окно скользящего среднего (последние дни истории)
+    FORECAST_SMOOTHING_ALPHA: float = 0.2  # Вес последнего дня в экспоненциальном сглаживании
+    FORECAST_METHOD: str = "smoothing"  # smoothing или moving_average - прогноз по умолчанию
+    
+    # Аналитическая выгрузка журнала, остатков и товаров каталога в Parquet (app/parquet_export.py)
+    PARQUET_EXPORT_DIR: str = "/app/analytics"  # Каталог набора данных (партиции и файл состояния)
+    PARQUET_EXPORT_INTERVAL_SECONDS: int = 0  # Период выгрузки (0 - только вручную: python -m app.parquet_export)
+    PARQUET_BATCH_ROWS: int = 50000  # Строк в порции курсора и в Arrow record batch
+    PARQUET_COMPRESSION: str = "zstd"
+    PARQUET_LEDGER_LAG_SECONDS: int = 300  # Операции моложе не выгружаются: ждем коммита транзакций с меньшим id
+    
+    # Ключи идемпотентности операций (Idempotency-Key)
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 86400  # Сколько хранить ключ и ответ на первый запрос (и обработанные квитанции)
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: int = 3600  # Период удаления ключей и квитанций с истекшим сроком
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
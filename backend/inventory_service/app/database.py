@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 from app.config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
@@ -18,3 +19,9 @@ def get_db():
         db.close()
 
 
+
+
+def upsert(db: Session, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта сессии (PostgreSQL, SQLite в тестах)"""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
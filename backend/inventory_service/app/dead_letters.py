@@ -0,0 +1,113 @@
+"""
+Администрирование очереди недоставленных событий (DLQ) потребителя Inventory Service
+
+Просмотр не изымает сообщения: они забираются без подтверждения и возвращаются в очередь
+при закрытии канала. Повтор переносит сообщения в основную очередь со сброшенным счетчиком попыток.
+"""
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Any
+
+import aio_pika
+from aio_pika.abc import AbstractConnection, AbstractIncomingMessage
+
+from app.event_consumer import (
+    QUEUE_NAME, DEAD_LETTER_QUEUE, HEADER_ATTEMPTS, HEADER_ERROR, HEADER_DEAD_LETTERED_AT,
+    HEADER_ROUTING_KEY, declare_dead_letter_topology, event_routing_key, message_header, _default_connect
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(message: AbstractIncomingMessage) -> Dict[str, Any]:
+    """Сообщение DLQ в формате DeadLetterMessage"""
+    try:
+        body = json.loads(message.body)
+    except ValueError:
+        body = message.body.decode("utf-8", errors="replace")
+
+    return {
+        "routing_key": event_routing_key(message),
+        "attempts": int(message_header(message, HEADER_ATTEMPTS, 0)),
+        "last_error": message_header(message, HEADER_ERROR),
+        "dead_lettered_at": message_header(message, HEADER_DEAD_LETTERED_AT),
+        "body": body,
+    }
+
+
+class DeadLetterQueue:
+    """Просмотр, повтор и очистка DLQ"""
+
+    def __init__(self, connect: Callable[[], Awaitable[AbstractConnection]] = _default_connect):
+        self._connect = connect
+
+    async def _open(self):
+        connection = await self._connect()
+        channel = await connection.channel()
+        queue = await declare_dead_letter_topology(channel)
+        return connection, channel, queue
+
+    async def inspect(self, limit: int = 100) -> Dict[str, Any]:
+        """Первые limit сообщений DLQ (без изъятия) и общее количество"""
+        connection, channel, queue = await self._open()
+        try:
+            messages = []
+            while len(messages) < limit:
+                message = await queue.get(no_ack=False, fail=False)
+                if message is None:
+                    break
+                messages.append(_describe(message))
+            return {"total": queue.declaration_result.message_count, "messages": messages}
+        finally:
+            # Неподтвержденные сообщения возвращаются в DLQ при закрытии соединения
+            await connection.close()
+
+    async def replay(self, limit: Optional[int] = None, routing_key: Optional[str] = None) -> int:
+        """
+        Вернуть сообщения DLQ в основную очередь
+
+        Args:
+            limit: Сколько сообщений вернуть (None - все)
+            routing_key: Возвращать только события с этим routing key, остальные остаются в DLQ
+
+        Returns:
+            Количество возвращенных сообщений
+        """
+        connection, channel, queue = await self._open()
+        replayed = 0
+        try:
+            while limit is None or replayed < limit:
+                message = await queue.get(no_ack=False, fail=False)
+                if message is None:
+                    break
+                if routing_key and event_routing_key(message) != routing_key:
+                    continue  # Останется неподтвержденным и вернется в DLQ при закрытии соединения
+                headers = {
+                    name: value for name, value in (message.headers or {}).items()
+                    if name not in (HEADER_ATTEMPTS, HEADER_ERROR, HEADER_DEAD_LETTERED_AT)
+                }
+                headers[HEADER_ROUTING_KEY] = event_routing_key(message)
+                await channel.default_exchange.publish(
+                    aio_pika.Message(message.body, headers=headers, delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                    routing_key=QUEUE_NAME
+                )
+                await message.ack()
+                replayed += 1
+        finally:
+            await connection.close()
+        logger.info(f"Replayed {replayed} messages from {DEAD_LETTER_QUEUE}")
+        return replayed
+
+    async def purge(self) -> int:
+        """Удалить все сообщения DLQ. Возвращает количество удаленных"""
+        connection, channel, queue = await self._open()
+        try:
+            result = await queue.purge()
+        finally:
+            await connection.close()
+        logger.info(f"Purged {result.message_count} messages from {DEAD_LETTER_QUEUE}")
+        return result.message_count
+
+
+# Глобальный экземпляр
+dead_letter_queue = DeadLetterQueue()
@@ -1,383 +1,570 @@
 """
 Потребитель событий RabbitMQ для Inventory Service
 Подписывается на события от других сервисов и создает операции
+
+Работает в event loop сервиса на асинхронном клиенте aio-pika:
+- prefetch (RABBITMQ_PREFETCH_COUNT) ограничивает число неподтвержденных сообщений у потребителя;
+- сообщения копятся в пачку в течение EVENT_BATCH_WINDOW_MS или до EVENT_BATCH_MAX_SIZE штук;
+- повторные события по одному SKU в пачке схлопываются в последнее: при импорте CSV
+  тысячи sku.updated по одним и тем же товарам превращаются в одно применение на товар;
+- товары пачки запрашиваются в Catalog Service параллельно (не больше EVENT_CONSUMER_MAX_CONCURRENCY
+  запросов одновременно), пачка применяется одной транзакцией и подтверждается одним multiple-ack;
+- событие, которое не удалось применить, уходит в очередь повтора с TTL (задержка растет вдвое
+  с каждой попыткой) и по истечении TTL возвращается в основную очередь; после
+  EVENT_RETRY_MAX_ATTEMPTS попыток сообщение попадает в очередь недоставленных (DLQ).
+  Основная очередь продолжает разбираться и во время недоступности Catalog Service;
+- при потере соединения переподключается с экспоненциальной задержкой;
+- при остановке отменяет подписку, дообрабатывает полученные сообщения и закрывает соединение.
+  Неподтвержденные сообщения брокер вернет в очередь.
+
+Пачки обрабатываются строго по очереди: multiple-ack подтверждает все сообщения канала
+с меньшим delivery tag, поэтому параллельная обработка пачек на одном канале недопустима.
 """
-import pika
+import asyncio
 import json
 import logging
-import asyncio
-from typing import Dict, Any
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, Awaitable, Optional, List
+
+import aio_pika
+from aio_pika.abc import AbstractConnection, AbstractIncomingMessage
+from sqlalchemy.orm import Session
+
 from app.config import settings
 from app.database import SessionLocal
 from app.inventory_service import InventoryService
+from app import sku_locks, sku_prices, stock_alerts
 from app.catalog_client import catalog_client
+from app.models import InventoryOperation, InventorySKUTotal, InventoryLocationTotal
 
 logger = logging.getLogger(__name__)
 
+EXCHANGE_NAME = 'erp_events'
+QUEUE_NAME = 'inventory_service_queue'
+ROUTING_KEYS = ('sku.created', 'sku.updated', 'sku.deleted')
+DEAD_LETTER_QUEUE = f'{QUEUE_NAME}.dlq'
+
+# Заголовки сообщений в очередях повтора и DLQ
+HEADER_ROUTING_KEY = 'x-original-routing-key'  # Исходный routing key (при возврате через exchange по умолчанию он теряется)
+HEADER_ATTEMPTS = 'x-attempts'  # Сколько попыток обработки уже не удалось
+HEADER_ERROR = 'x-last-error'
+HEADER_DEAD_LETTERED_AT = 'x-dead-lettered-at'
+MAX_ERROR_LENGTH = 500
+
+# События, для применения которых нужны актуальные данные товара из Catalog Service
+CATALOG_EVENTS = ('sku.created', 'sku.updated')
+
+
+def retry_delays_ms() -> List[int]:
+    """Задержки перед повторными попытками: EVENT_RETRY_BASE_DELAY_MS, x2, x4, ..."""
+    return [settings.EVENT_RETRY_BASE_DELAY_MS * 2 ** level for level in range(settings.EVENT_RETRY_MAX_ATTEMPTS - 1)]
+
+
+def retry_queue_name(delay_ms: int) -> str:
+    """Имя очереди повтора (задержка в имени: аргументы существующей очереди изменить нельзя)"""
+    return f'{QUEUE_NAME}.retry.{delay_ms}ms'
+
+
+async def declare_dead_letter_topology(channel):
+    """Объявить очереди повтора и DLQ основной очереди"""
+    for delay_ms in retry_delays_ms():
+        # По истечении TTL сообщение возвращается в основную очередь через exchange по умолчанию
+        await channel.declare_queue(retry_queue_name(delay_ms), durable=True, arguments={
+            'x-message-ttl': delay_ms,
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': QUEUE_NAME,
+        })
+    return await channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+
+
+def message_header(message: AbstractIncomingMessage, name: str, default=None):
+    """Значение заголовка сообщения (строки aio-pika может вернуть как bytes)"""
+    value = (message.headers or {}).get(name, default)
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def event_routing_key(message: AbstractIncomingMessage) -> str:
+    """Routing key события с учетом возвратов из очередей повтора и DLQ"""
+    return message_header(message, HEADER_ROUTING_KEY) or message.routing_key
+
+
+def _default_connect() -> Awaitable[AbstractConnection]:
+    """Открыть соединение с RabbitMQ по настройкам сервиса"""
+    return aio_pika.connect(
+        host=settings.RABBITMQ_HOST,
+        port=settings.RABBITMQ_PORT,
+        login=settings.RABBITMQ_USER,
+        password=settings.RABBITMQ_PASSWORD
+    )
+
 
 class EventConsumer:
     """Потребитель событий RabbitMQ"""
-    
-    def __init__(self):
-        self.connection = None
-        self.channel = None
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[AbstractConnection]] = _default_connect,
+        prefetch_count: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        reconnect_delay: Optional[float] = None,
+        max_reconnect_delay: Optional[float] = None,
+        batch_window_ms: Optional[int] = None,
+        batch_max_size: Optional[int] = None
+    ):
+        """
+        Args:
+            connect: Фабрика соединений (в тестах подменяется брокером в памяти)
+            prefetch_count: Сколько неподтвержденных сообщений брокер выдает потребителю
+            max_concurrency: Сколько запросов в Catalog Service выполняется одновременно
+            reconnect_delay: Начальная задержка переподключения (секунды)
+            max_reconnect_delay: Максимальная задержка переподключения (секунды)
+            batch_window_ms: Сколько ждать сообщений в пачку после первого (0 - без ожидания)
+            batch_max_size: Максимальный размер пачки (не больше prefetch_count)
+        """
+        self._connect = connect
+        self.prefetch_count = prefetch_count or settings.RABBITMQ_PREFETCH_COUNT
+        self.max_concurrency = max_concurrency or settings.EVENT_CONSUMER_MAX_CONCURRENCY
+        self.reconnect_delay = reconnect_delay or settings.RABBITMQ_RECONNECT_DELAY_SECONDS
+        self.max_reconnect_delay = max_reconnect_delay or settings.RABBITMQ_RECONNECT_MAX_DELAY_SECONDS
+        self.batch_window = (
+            settings.EVENT_BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms
+        ) / 1000
+        # Больше prefetch сообщений брокер не выдаст, пока пачка не подтверждена
+        self.batch_max_size = min(batch_max_size or settings.EVENT_BATCH_MAX_SIZE, self.prefetch_count)
+
+        # Применение события в текущей транзакции (без commit) по routing key
+        self.appliers: Dict[str, Callable[[Session, Dict[str, Any]], Awaitable[None]]] = {
+            'sku.created': self._apply_sku_created,
+            'sku.updated': self._apply_sku_updated,
+            'sku.deleted': self._apply_sku_deleted,
+        }
+
+        # Счетчики для оценки эффекта пачек
+        self.stats = {"messages": 0, "batches": 0, "events_applied": 0, "retried": 0, "dead_lettered": 0}
+
+        self._stopping = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._stopped.set()
+        self._buffer: Optional[asyncio.Queue] = None
+        self._channel = None
         self._running = False
-    
-    def _connect(self):
-        """Установить соединение с RabbitMQ"""
-        max_retries = 5
-        retry_delay = 5  # секунд
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Attempting to connect to RabbitMQ (attempt {attempt + 1}/{max_retries})...")
-                logger.info(f"RabbitMQ host: {settings.RABBITMQ_HOST}, port: {settings.RABBITMQ_PORT}")
-                
-                credentials = pika.PlainCredentials(
-                    settings.RABBITMQ_USER,
-                    settings.RABBITMQ_PASSWORD
-                )
-                parameters = pika.ConnectionParameters(
-                    host=settings.RABBITMQ_HOST,
-                    port=settings.RABBITMQ_PORT,
-                    credentials=credentials,
-                    connection_attempts=3,
-                    retry_delay=2
-                )
-                self.connection = pika.BlockingConnection(parameters)
-                self.channel = self.connection.channel()
-                
-                # Объявить exchange
-                self.channel.exchange_declare(
-                    exchange='erp_events',
-                    exchange_type='topic',
-                    durable=True
-                )
-                
-                # Создать очередь для Inventory Service
-                queue_result = self.channel.queue_declare(
-                    queue='inventory_service_queue',
-                    durable=True
-                )
-                queue_name = queue_result.method.queue
-                
-                # Подписаться на события от Catalog Service
-                self.channel.queue_bind(
-                    exchange='erp_events',
-                    queue=queue_name,
-                    routing_key='sku.created'
-                )
-                self.channel.queue_bind(
-                    exchange='erp_events',
-                    queue=queue_name,
-                    routing_key='sku.updated'
-                )
-                self.channel.queue_bind(
-                    exchange='erp_events',
-                    queue=queue_name,
-                    routing_key='sku.deleted'
-                )
-                
-                # Настроить обработчик сообщений
-                self.channel.basic_consume(
-                    queue=queue_name,
-                    on_message_callback=self._handle_message,
-                    auto_ack=False
-                )
-                
-                logger.info("Successfully connected to RabbitMQ and subscribed to events")
-                return True
-            except Exception as e:
-                import traceback
-                error_msg = str(e)
-                error_trace = traceback.format_exc()
-                logger.error(f"Failed to connect to RabbitMQ (attempt {attempt + 1}/{max_retries}): {error_msg}")
-                logger.debug(f"Full traceback: {error_trace}")
-                if attempt < max_retries - 1:
-                    logger.info(f"Retrying in {retry_delay} seconds...")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    logger.error("Max retries reached. Failed to connect to RabbitMQ.")
-                    logger.error(f"Final error: {error_msg}")
-                    logger.error(f"Final traceback: {error_trace}")
-                    return False
-        return False
-    
-    def _handle_message(self, ch, method, properties, body):
-        """Обработать сообщение из RabbitMQ"""
+
+    @property
+    def is_running(self) -> bool:
+        """Есть активная подписка на очередь"""
+        return self._running
+
+    async def run(self):
+        """Потреблять события до вызова stop(), переподключаясь при обрывах соединения"""
+        logger.info("Starting RabbitMQ event consumer...")
+        self._stopping.clear()
+        self._stopped.clear()
+        delay = self.reconnect_delay
+
         try:
-            message = json.loads(body)
-            routing_key = method.routing_key
-            
-            logger.info(f"Received event: {routing_key}, data: {message}")
-            
-            # Обрабатываем событие в зависимости от типа
-            if routing_key == 'sku.created':
-                self._handle_sku_created(message)
-            elif routing_key == 'sku.updated':
-                self._handle_sku_updated(message)
-            elif routing_key == 'sku.deleted':
-                self._handle_sku_deleted(message)
-            
-            # Подтверждаем обработку сообщения
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception as e:
-            logger.error(f"Error handling message: {e}")
-            # Отклоняем сообщение при ошибке
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-    
-    def _handle_sku_created(self, data: Dict[str, Any]):
-        """Обработать событие создания товара"""
+            while not self._stopping.is_set():
+                try:
+                    await self._consume()
+                    delay = self.reconnect_delay  # Соединение было установлено - сбрасываем задержку
+                except Exception as e:
+                    logger.error(f"RabbitMQ consumer connection failed: {e}")
+
+                if self._stopping.is_set():
+                    break
+                logger.info(f"Reconnecting to RabbitMQ in {delay:.1f} seconds...")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.max_reconnect_delay)
+        finally:
+            self._stopped.set()
+            logger.info("RabbitMQ event consumer stopped")
+
+    async def stop(self):
+        """Остановить потребитель и дождаться обработки полученных сообщений"""
+        self._stopping.set()
+        await self._stopped.wait()
+
+    async def _consume(self):
+        """Одна сессия: подключиться, подписаться и потреблять до остановки или обрыва соединения"""
+        connection = await self._connect()
+        connection_lost = asyncio.Event()
+        connection.close_callbacks.add(lambda *args: connection_lost.set())
+        batcher = None
         try:
-            sku_id = data.get('sku_id')
-            if not sku_id:
-                logger.error("sku_id not found in event data")
-                return
-            
-            # Получаем полную информацию о товаре из Catalog Service
-            # Используем синхронный вызов, так как мы в callback
-            import httpx
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(f"{settings.CATALOG_SERVICE_URL}/catalog/skus/{sku_id}")
-                if response.status_code != 200:
-                    logger.error(f"Failed to fetch SKU {sku_id} from Catalog Service")
-                    return
-                
-                sku_data = response.json()
-            
-            # Получаем информацию о единицах измерения
-            weight_unit_name = sku_data.get('weight_unit', {}).get('name', 'кг')
-            quantity_unit_name = sku_data.get('quantity_unit', {}).get('name', 'шт')
-            
-            # Создаем операцию в Inventory Service
-            db = SessionLocal()
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self.prefetch_count)
+
+            exchange = await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.TOPIC, durable=True)
+            queue = await channel.declare_queue(QUEUE_NAME, durable=True)
+            # Подписаться на события от Catalog Service
+            for routing_key in ROUTING_KEYS:
+                await queue.bind(exchange, routing_key=routing_key)
+            await declare_dead_letter_topology(channel)
+            self._channel = channel
+
+            self._buffer = asyncio.Queue()
+            batcher = asyncio.ensure_future(self._batch_loop(self._buffer))
+            consumer_tag = await queue.consume(self._on_message)
+            self._running = True
+            logger.info("Successfully connected to RabbitMQ and subscribed to events")
+
+            stop_wait = asyncio.ensure_future(self._stopping.wait())
+            lost_wait = asyncio.ensure_future(connection_lost.wait())
             try:
-                # Для создания товара используем локацию "хранилище" (по умолчанию)
-                # Количество и вес берем из товара
-                quantity_value = int(float(sku_data.get('quantity', '1')))
-                weight_value = float(sku_data.get('weight', '1'))
-                
-                # Рассчитываем delta_value используя InventoryService
-                delta_value = await InventoryService.calculate_delta_value(
-                    quantity_value,
-                    quantity_unit_name,
-                    weight_value,
-                    weight_unit_name
-                )
-                
-                # Создаем операцию и обновляем остатки
-                await InventoryService.create_operation(
-                    db,
-                    operation_type='create',
-                    sku_id=sku_id,
-                    quantity_value=quantity_value,
-                    quantity_unit=quantity_unit_name,
-                    weight_value=int(weight_value),
-                    weight_unit=weight_unit_name,
-                    source_location='хранилище'
-                )
-                logger.info(f"Created inventory operation for SKU {sku_id}")
-            except Exception as e:
-                logger.error(f"Error creating inventory operation for SKU {sku_id}: {e}")
-                db.rollback()
+                await asyncio.wait([stop_wait, lost_wait, batcher], return_when=asyncio.FIRST_COMPLETED)
             finally:
-                db.close()
-        except Exception as e:
-            logger.error(f"Error handling sku.created event: {e}")
-    
-    def _handle_sku_updated(self, data: Dict[str, Any]):
-        """Обработать событие обновления товара"""
-        try:
-            sku_id = data.get('sku_id')
-            if not sku_id:
-                logger.error("sku_id not found in event data")
+                stop_wait.cancel()
+                lost_wait.cancel()
+
+            if batcher.done():
+                batcher.result()  # Пробрасываем неожиданную ошибку цикла пачек
+            if connection_lost.is_set():
+                # Неподтвержденные сообщения брокер вернет в очередь и выдаст после переподключения
+                raise ConnectionError("RabbitMQ connection lost")
+
+            # Новых сообщений не берем, полученные дообрабатываем и подтверждаем
+            await queue.cancel(consumer_tag)
+            self._buffer.put_nowait(None)
+            await batcher
+        finally:
+            self._running = False
+            if batcher and not batcher.done():
+                batcher.cancel()
+                await asyncio.gather(batcher, return_exceptions=True)
+            if not connection.is_closed:
+                await connection.close()
+
+    async def _on_message(self, message: AbstractIncomingMessage):
+        """Колбэк подписки: сообщение попадает в буфер текущей пачки"""
+        self._buffer.put_nowait(message)
+
+    async def _batch_loop(self, buffer: asyncio.Queue):
+        """Собирать пачки из буфера и применять их по очереди. None в буфере - завершить работу"""
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await buffer.get()
+            if first is None:
                 return
-            
-            # Получаем полную информацию о товаре из Catalog Service
-            import httpx
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(f"{settings.CATALOG_SERVICE_URL}/catalog/skus/{sku_id}")
-                if response.status_code != 200:
-                    logger.error(f"Failed to fetch SKU {sku_id} from Catalog Service")
-                    return
-                
-                sku_data = response.json()
-            
-            # Получаем информацию о единицах измерения
-            weight_unit_name = sku_data.get('weight_unit', {}).get('name', 'кг')
-            quantity_unit_name = sku_data.get('quantity_unit', {}).get('name', 'шт')
-            
-            # Создаем операцию в Inventory Service
-            db = SessionLocal()
-            try:
-                quantity_value = int(float(sku_data.get('quantity', '1')))
-                weight_value = float(sku_data.get('weight', '1'))
-                
-                # Получаем старые значения из существующей записи остатков (если есть)
-                from app.models import InventorySKUTotal
-                old_sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
-                
-                if old_sku_total:
-                    # Если запись существует, нужно обновить остатки
-                    # Рассчитываем новое delta_value
-                    new_delta_value = await InventoryService.calculate_delta_value(
-                        quantity_value,
-                        quantity_unit_name,
-                        weight_value,
-                        weight_unit_name
-                    )
-                    
-                    # Обновляем остатки: вычитаем старое значение и добавляем новое
-                    old_delta_value = old_sku_total.total_weight
-                    delta_diff = new_delta_value - old_delta_value
-                    
-                    # Обновляем запись остатков
-                    old_sku_total.total_weight = new_delta_value
-                    old_sku_total.sku_name = sku_data.get('name', 'Unknown')
-                    
-                    # Обновляем остатки по локациям
-                    from app.models import InventoryLocationTotal
-                    location_totals = db.query(InventoryLocationTotal).filter(
-                        InventoryLocationTotal.sku_id == sku_id
-                    ).all()
-                    
-                    for location_total in location_totals:
-                        # Пересчитываем вес для каждой локации пропорционально
-                        if old_delta_value > 0:
-                            ratio = location_total.weight / old_delta_value
-                            location_total.weight = int(new_delta_value * ratio)
-                        else:
-                            location_total.weight = new_delta_value
-                        location_total.sku_name = sku_data.get('name', 'Unknown')
-                    
-                    # Создаем операцию
-                    from app.models import InventoryOperation
-                    operation = InventoryOperation(
-                        operation_type='update',
-                        sku_id=sku_id,
-                        sku_name=sku_data.get('name', 'Unknown'),
-                        quantity_value=quantity_value,
-                        quantity_unit=quantity_unit_name,
-                        weight_value=int(weight_value),
-                        weight_unit=weight_unit_name,
-                        delta_value=new_delta_value,
-                        delta_unit='кг',
-                        source_location='хранилище',
-                        target_location='хранилище'
-                    )
-                    db.add(operation)
-                    db.commit()
-                    logger.info(f"Updated inventory totals and created operation for SKU {sku_id}")
+            batch = [first]
+            finished = False
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_max_size:
+                if buffer.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        message = await asyncio.wait_for(buffer.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
                 else:
-                    # Если записи нет, создаем новую (как при create)
-                    await InventoryService.create_operation(
-                        db,
-                        operation_type='create',
-                        sku_id=sku_id,
-                        quantity_value=quantity_value,
-                        quantity_unit=quantity_unit_name,
-                        weight_value=int(weight_value),
-                        weight_unit=weight_unit_name,
-                        source_location='хранилище'
-                    )
-                    logger.info(f"Created inventory operation for updated SKU {sku_id} (new record)")
-            except Exception as e:
-                logger.error(f"Error creating inventory operation for updated SKU {sku_id}: {e}")
-                db.rollback()
-            finally:
-                db.close()
-        except Exception as e:
-            logger.error(f"Error handling sku.updated event: {e}")
-    
-    def _handle_sku_deleted(self, data: Dict[str, Any]):
-        """Обработать событие удаления товара"""
-        try:
-            sku_id = data.get('sku_id')
-            if not sku_id:
-                logger.error("sku_id not found in event data")
+                    message = buffer.get_nowait()
+                if message is None:
+                    finished = True
+                    break
+                batch.append(message)
+            await self._process_batch(batch)
+            if finished:
                 return
-            
-            # Получаем данные из остатков перед удалением
-            db = SessionLocal()
+
+    async def _process_batch(self, messages: List[AbstractIncomingMessage]):
+        """Схлопнуть события пачки по SKU, применить одной транзакцией и подтвердить одним ack"""
+        self.stats["messages"] += len(messages)
+        self.stats["batches"] += 1
+
+        # Последнее событие по каждому SKU; все сообщения SKU подтверждаются вместе с ним
+        events: Dict[int, Dict[str, Any]] = {}
+        for message in messages:
+            routing_key = event_routing_key(message)
             try:
-                from app.models import InventoryOperation, InventorySKUTotal
-                
-                # Получаем данные из остатков
-                sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
-                
-                if sku_total:
-                    # Используем данные из остатков
-                    quantity_value = sku_total.total_quantity if sku_total.total_quantity > 0 else 1
-                    weight_value = sku_total.total_weight
-                    sku_name = sku_total.sku_name
-                    delta_value = -sku_total.total_weight  # Отрицательное значение при удалении
-                else:
-                    # Если остатков нет, используем данные из события
-                    quantity_value = 0
-                    weight_value = 0
-                    sku_name = data.get('name', 'Unknown')
-                    delta_value = 0
-                
-                # Создаем операцию
-                operation = InventoryOperation(
-                    operation_type='delete',
-                    sku_id=sku_id,
-                    sku_name=sku_name,
-                    quantity_value=quantity_value,
-                    quantity_unit='шт',
-                    weight_value=weight_value,
-                    weight_unit='кг',
-                    delta_value=delta_value,
-                    delta_unit='кг',
-                    source_location='хранилище',
-                    target_location='хранилище'
-                )
-                db.add(operation)
-                
-                # Обновляем остатки (уменьшаем до нуля)
-                if sku_total:
-                    sku_total.total_weight = 0
-                    sku_total.total_quantity = 0
-                
-                db.commit()
-                logger.info(f"Created inventory operation for deleted SKU {sku_id}")
+                data = json.loads(message.body)
+                sku_id = int(data['sku_id'])
             except Exception as e:
-                logger.error(f"Error creating inventory operation for deleted SKU {sku_id}: {e}")
-                db.rollback()
-            finally:
-                db.close()
+                # Повтор не поможет - сразу в DLQ
+                logger.error(f"Invalid event {routing_key}: {e}")
+                await self._dead_letter(message, f"Invalid event: {e}")
+                continue
+            if routing_key not in self.appliers:
+                continue  # Неизвестные события подтверждаем без обработки
+            previous = events.pop(sku_id, None)
+            events[sku_id] = {
+                "routing_key": routing_key,
+                "sku_id": sku_id,
+                "data": data,
+                "sku_data": None,
+                "error": None,
+                "messages": (previous["messages"] if previous else []) + [message],
+            }
+
+        failed = await self._fetch_skus(list(events.values()))
+        failed_skus = {event["sku_id"] for event in failed}
+        failed.extend(await self._apply_events(
+            [event for event in events.values() if event["sku_id"] not in failed_skus]
+        ))
+        self.stats["events_applied"] += len(events) - len(failed)
+
+        # Неудачные события переносятся в очереди повтора/DLQ (публикация с подтверждением брокера),
+        # после чего вся пачка подтверждается одним multiple-ack по наибольшему delivery tag
+        for event in failed:
+            for message in event["messages"]:
+                await self._retry(message, event["error"])
+        if messages:
+            await max(messages, key=lambda message: message.delivery_tag).ack(multiple=True)
+
+    async def _retry(self, message: AbstractIncomingMessage, error: str):
+        """Отправить сообщение в очередь повтора со следующей задержкой или в DLQ после последней попытки"""
+        attempts = int(message_header(message, HEADER_ATTEMPTS, 0)) + 1
+        if attempts >= settings.EVENT_RETRY_MAX_ATTEMPTS:
+            await self._dead_letter(message, error)
+            return
+        delay_ms = retry_delays_ms()[attempts - 1]
+        await self._republish(message, retry_queue_name(delay_ms), {
+            HEADER_ATTEMPTS: attempts,
+            HEADER_ERROR: error[:MAX_ERROR_LENGTH],
+        })
+        self.stats["retried"] += 1
+        logger.warning(
+            f"Event {event_routing_key(message)} failed (attempt {attempts}), retry in {delay_ms} ms: {error}"
+        )
+
+    async def _dead_letter(self, message: AbstractIncomingMessage, error: str):
+        """Отправить сообщение в DLQ"""
+        await self._republish(message, DEAD_LETTER_QUEUE, {
+            HEADER_ATTEMPTS: int(message_header(message, HEADER_ATTEMPTS, 0)) + 1,
+            HEADER_ERROR: error[:MAX_ERROR_LENGTH],
+            HEADER_DEAD_LETTERED_AT: datetime.now(timezone.utc).isoformat(),
+        })
+        self.stats["dead_lettered"] += 1
+        logger.error(f"Event {event_routing_key(message)} moved to {DEAD_LETTER_QUEUE}: {error}")
+
+    async def _republish(self, message: AbstractIncomingMessage, queue_name: str, headers: Dict[str, Any]):
+        """Опубликовать копию сообщения в очередь через exchange по умолчанию"""
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                message.body,
+                headers={**(message.headers or {}), HEADER_ROUTING_KEY: event_routing_key(message), **headers},
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=queue_name
+        )
+
+    async def _fetch_skus(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Параллельно получить товары из Catalog Service для sku.created/sku.updated
+
+        Returns:
+            События, для которых товар получить не удалось
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        failed = []
+
+        async def fetch(event: Dict[str, Any]):
+            async with semaphore:
+                sku_data = await catalog_client.get_sku(event["sku_id"])
+            if sku_data:
+                event["sku_data"] = sku_data
+            else:
+                event["error"] = f"Failed to fetch SKU {event['sku_id']} from Catalog Service"
+                logger.error(event["error"])
+                failed.append(event)
+
+        await asyncio.gather(*(
+            fetch(event) for event in events if event["routing_key"] in CATALOG_EVENTS
+        ))
+        return failed
+
+    async def _apply_events(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Применить события одной транзакцией
+
+        Если транзакция пачки не прошла, события применяются по одному,
+        чтобы одно ошибочное событие не отклоняло всю пачку.
+
+        Returns:
+            События, которые применить не удалось
+        """
+        if not events:
+            return []
+        db = SessionLocal()
+        try:
+            # Все SKU пачки блокируются заранее в порядке sku_id
+            sku_locks.lock_skus(db, [event["sku_id"] for event in events])
+            for event in events:
+                await self.appliers[event["routing_key"]](db, event)
+            db.commit()
+            return []
         except Exception as e:
-            logger.error(f"Error handling sku.deleted event: {e}")
-    
-    def start(self):
-        """Запустить потребитель"""
-        logger.info("Starting RabbitMQ event consumer...")
-        if self._connect():
-            self._running = True
-            logger.info("RabbitMQ event consumer is running and waiting for messages...")
-            try:
-                self.channel.start_consuming()
-            except KeyboardInterrupt:
-                logger.info("Stopping RabbitMQ event consumer...")
-                self.stop()
-            except Exception as e:
-                logger.error(f"Error in RabbitMQ consumer: {e}")
-                self._running = False
+            db.rollback()
+            if len(events) == 1:
+                logger.error(f"Error applying {events[0]['routing_key']} for SKU {events[0]['sku_id']}: {e}")
+                events[0]["error"] = f"{type(e).__name__}: {e}"
+                return list(events)
+            logger.warning(f"Batch of {len(events)} events failed ({e}), applying events one by one")
+        finally:
+            db.close()
+
+        failed = []
+        for event in events:
+            failed.extend(await self._apply_events([event]))
+        return failed
+
+    async def _apply_sku_created(self, db: Session, event: Dict[str, Any]):
+        """Применить событие создания товара"""
+        sku_id = event["sku_id"]
+        sku_data = event["sku_data"]
+        await sku_prices.apply_catalog_sku(db, sku_data)
+
+        # Получаем информацию о единицах измерения
+        weight_unit_name = (sku_data.get('weight_unit') or {}).get('name', 'кг')
+        quantity_unit_name = (sku_data.get('quantity_unit') or {}).get('name', 'шт')
+        # Для создания товара используем локацию "хранилище" (по умолчанию)
+        # Количество и вес берем из товара
+        quantity_value = int(float(sku_data.get('quantity', '1')))
+        weight_value = int(float(sku_data.get('weight', '1')))
+
+        delta_value = await InventoryService.calculate_delta_value(
+            quantity_value,
+            quantity_unit_name,
+            float(weight_value),
+            weight_unit_name
+        )
+        await InventoryService.add_operation(
+            db,
+            operation_type='create',
+            sku_id=sku_id,
+            sku_name=sku_data.get('name', 'Unknown'),
+            quantity_value=quantity_value,
+            quantity_unit=quantity_unit_name,
+            weight_value=weight_value,
+            weight_unit=weight_unit_name,
+            delta_value=delta_value,
+            source_location='хранилище'
+        )
+        logger.info(f"Created inventory operation for SKU {sku_id}")
+
+    async def _apply_sku_updated(self, db: Session, event: Dict[str, Any]):
+        """Применить событие обновления товара"""
+        sku_id = event["sku_id"]
+        sku_data = event["sku_data"]
+
+        # Получаем старые значения из существующей записи остатков (если есть)
+        old_sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
+        if not old_sku_total:
+            # Если записи нет, создаем новую (как при create)
+            await self._apply_sku_created(db, event)
+            return
+        await sku_prices.apply_catalog_sku(db, sku_data)
+
+        # Получаем информацию о единицах измерения
+        weight_unit_name = (sku_data.get('weight_unit') or {}).get('name', 'кг')
+        quantity_unit_name = (sku_data.get('quantity_unit') or {}).get('name', 'шт')
+        quantity_value = int(float(sku_data.get('quantity', '1')))
+        weight_value = float(sku_data.get('weight', '1'))
+        sku_name = sku_data.get('name', 'Unknown')
+
+        # Рассчитываем новое delta_value
+        new_delta_value = await InventoryService.calculate_delta_value(
+            quantity_value,
+            quantity_unit_name,
+            weight_value,
+            weight_unit_name
+        )
+        old_delta_value = old_sku_total.total_weight
+
+        # Обновляем запись остатков
+        stock_alerts.check(db, sku_id, None, old_delta_value, new_delta_value)
+        old_sku_total.total_weight = new_delta_value
+        old_sku_total.sku_name = sku_name
+
+        # Обновляем остатки по локациям
+        location_totals = db.query(InventoryLocationTotal).filter(
+            InventoryLocationTotal.sku_id == sku_id
+        ).order_by(InventoryLocationTotal.location_name).all()
+
+        def ledger_update(location_name: Optional[str], value: int):
+            db.add(InventoryOperation(
+                operation_type='update',
+                sku_id=sku_id,
+                sku_name=sku_name,
+                quantity_value=quantity_value,
+                quantity_unit=quantity_unit_name,
+                weight_value=int(weight_value),
+                weight_unit=weight_unit_name,
+                delta_value=value,
+                delta_unit='кг',
+                source_location=location_name,
+                target_location=location_name
+            ))
+
+        for location_total in location_totals:
+            # Пересчитываем вес для каждой локации пропорционально
+            if old_delta_value > 0:
+                ratio = location_total.weight / old_delta_value
+                new_weight = int(new_delta_value * ratio)
+            else:
+                new_weight = new_delta_value
+            InventoryService.location_weight_changed(
+                db, sku_id, location_total.location_name, location_total.weight, new_weight
+            )
+            location_total.weight = new_weight
+            location_total.sku_name = sku_name
+            # Абсолютное значение локации в журнале - чтобы сверка и остатки на дату воспроизводили пересчет
+            ledger_update(location_total.location_name, new_weight)
+
+        # Последней - операция без локации: задает только абсолютный остаток по SKU
+        ledger_update(None, new_delta_value)
+        db.flush()
+        logger.info(f"Updated inventory totals and created operation for SKU {sku_id}")
+
+    async def _apply_sku_deleted(self, db: Session, event: Dict[str, Any]):
+        """Применить событие удаления товара"""
+        sku_id = event["sku_id"]
+        sku_prices.remove(db, sku_id)
+
+        # Получаем данные из остатков перед удалением
+        sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
+
+        if sku_total:
+            # Используем данные из остатков
+            quantity_value = sku_total.total_quantity if sku_total.total_quantity > 0 else 1
+            weight_value = sku_total.total_weight
+            sku_name = sku_total.sku_name
+            delta_value = -sku_total.total_weight  # Отрицательное значение при удалении
         else:
-            logger.error("Failed to start RabbitMQ event consumer - will retry on next message")
-            self._running = False
-    
-    def stop(self):
-        """Остановить потребитель"""
-        self._running = False
-        if self.channel and not self.channel.is_closed:
-            self.channel.stop_consuming()
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
-        logger.info("RabbitMQ event consumer stopped")
+            # Если остатков нет, используем данные из события
+            quantity_value = 0
+            weight_value = 0
+            sku_name = event["data"].get('name', 'Unknown')
+            delta_value = 0
+
+        # Создаем операцию
+        operation = InventoryOperation(
+            operation_type='delete',
+            sku_id=sku_id,
+            sku_name=sku_name,
+            quantity_value=quantity_value,
+            quantity_unit='шт',
+            weight_value=weight_value,
+            weight_unit='кг',
+            delta_value=delta_value,
+            delta_unit='кг',
+            source_location='хранилище',
+            target_location='хранилище'
+        )
+        db.add(operation)
+        InventoryService.record_movements(db, operation)
+
+        # Обновляем остатки (уменьшаем до нуля)
+        if sku_total:
+            stock_alerts.check(db, sku_id, None, sku_total.total_weight, 0)
+            sku_total.total_weight = 0
+            sku_total.total_quantity = 0
+
+        db.flush()
+        logger.info(f"Created inventory operation for deleted SKU {sku_id}")
 
 
 # Глобальный экземпляр потребителя
 event_consumer = EventConsumer()
-
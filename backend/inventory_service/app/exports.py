@@ -0,0 +1,164 @@
+"""
+Потоковая выгрузка журнала операций и остатков локаций (GET /inventory/export/...)
+
+Выгрузка не собирает результат в памяти: строки читаются курсором на стороне сервера
+(stream_results - именованный курсор psycopg2) порциями по EXPORT_CHUNK_ROWS, каждая порция
+сразу кодируется в NDJSON или CSV, при необходимости сжимается gzip и отдается клиенту.
+Память процесса ограничена одной порцией независимо от объема выгрузки.
+
+Журнал выгружается в порядке (created_at, id) без ORM-объектов: названия локаций
+подставляются по словарю локаций, загруженному один раз перед выгрузкой.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import or_, select, false
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.locations import location_dictionary
+from app.models import InventoryOperation, InventoryLocationTotal
+
+FORMATS = ("ndjson", "csv")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+GZIP_MEDIA_TYPE = "application/gzip"
+
+OPERATION_COLUMNS = (
+    "id", "operation_type", "sku_id", "sku_name", "quantity_value", "quantity_unit", "weight_value",
+    "weight_unit", "delta_value", "delta_unit", "source_location", "target_location", "created_at"
+)
+LOCATION_TOTAL_COLUMNS = ("id", "sku_id", "sku_name", "location_name", "quantity", "weight", "updated_at")
+
+
+def filename(name: str, export_format: str, compress: bool) -> str:
+    """Имя файла выгрузки для Content-Disposition"""
+    return f"{name}.{export_format}{'.gz' if compress else ''}"
+
+
+def media_type(export_format: str, compress: bool) -> str:
+    return GZIP_MEDIA_TYPE if compress else MEDIA_TYPES[export_format]
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _encode_ndjson(columns: Sequence[str], rows: List[Sequence]) -> str:
+    return "".join(
+        json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def _encode_csv(rows: List[Sequence]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows([[_value(value) for value in row] for row in rows])
+    return buffer.getvalue()
+
+
+def encode(
+    chunks: Iterator[List[Sequence]],
+    columns: Sequence[str],
+    export_format: str,
+    compress: bool = False
+) -> Iterator[bytes]:
+    """
+    Закодировать порции строк в NDJSON/CSV (с заголовком) и при необходимости сжать gzip
+
+    Сжатие потоковое: в памяти только текущая порция и окно zlib.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 - формат gzip
+
+    def output(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    if export_format == "csv":
+        yield output(_encode_csv([columns]))
+    for rows in chunks:
+        data = output(_encode_csv(rows) if export_format == "csv" else _encode_ndjson(columns, rows))
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def stream_chunks(db: Session, statement, chunk_rows: int) -> Iterator[List[Sequence]]:
+    """Строки запроса порциями курсором на стороне сервера; читающая транзакция завершается в конце"""
+    try:
+        result = db.execute(statement.execution_options(stream_results=True, yield_per=chunk_rows))
+        for rows in result.partitions(chunk_rows):
+            yield rows
+    finally:
+        db.rollback()
+
+
+def operation_chunks(
+    db: Session,
+    operation_type: Optional[str] = None,
+    sku_id: Optional[int] = None,
+    location: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    chunk_rows: Optional[int] = None
+) -> Iterator[List[Sequence]]:
+    """Порции строк журнала (OPERATION_COLUMNS) с теми же фильтрами, что GET /inventory/operations"""
+    chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+    names = location_dictionary.names(db)
+    filters = []
+    if operation_type:
+        filters.append(InventoryOperation.operation_type == operation_type)
+    if sku_id is not None:
+        filters.append(InventoryOperation.sku_id == sku_id)
+    if date_from:
+        filters.append(InventoryOperation.created_at >= date_from)
+    if date_to:
+        filters.append(InventoryOperation.created_at < date_to)
+    if location:
+        location_id = location_dictionary.id_of(db, location, create=False)
+        filters.append(false() if location_id is None else or_(
+            InventoryOperation.source_location_id == location_id,
+            InventoryOperation.target_location_id == location_id
+        ))
+
+    statement = select(
+        InventoryOperation.id,
+        InventoryOperation.operation_type,
+        InventoryOperation.sku_id,
+        InventoryOperation.sku_name,
+        InventoryOperation.quantity_value,
+        InventoryOperation.quantity_unit,
+        InventoryOperation.weight_value,
+        InventoryOperation.weight_unit,
+        InventoryOperation.delta_value,
+        InventoryOperation.delta_unit,
+        InventoryOperation.source_location_id,
+        InventoryOperation.target_location_id,
+        InventoryOperation.created_at
+    ).where(*filters).order_by(InventoryOperation.created_at, InventoryOperation.id)
+
+    for rows in stream_chunks(db, statement, chunk_rows):
+        yield [row[:10] + (names.get(row[10]), names.get(row[11]), row[12]) for row in rows]
+
+
+def location_total_chunks(
+    db: Session,
+    location_name: Optional[str] = None,
+    chunk_rows: Optional[int] = None
+) -> Iterator[List[Sequence]]:
+    """Порции строк остатков по локациям (LOCATION_TOTAL_COLUMNS) в порядке (локация, название товара)"""
+    statement = select(*(getattr(InventoryLocationTotal, column) for column in LOCATION_TOTAL_COLUMNS))
+    if location_name:
+        statement = statement.where(InventoryLocationTotal.location_name == location_name)
+    statement = statement.order_by(
+        InventoryLocationTotal.location_name, InventoryLocationTotal.sku_name, InventoryLocationTotal.id
+    )
+    return stream_chunks(db, statement, chunk_rows or settings.EXPORT_CHUNK_ROWS)
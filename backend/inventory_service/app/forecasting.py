@@ -0,0 +1,221 @@
+"""
+Прогноз спроса по товарам и локациям (inventory_demand_forecasts) для пополнения складов
+
+Спрос ячейки (товар, локация) - убытие из локации по дневному агрегату движения
+(inventory_daily_movements): списания и перемещения в другие локации, т.е. все, что склад отдает.
+История - FORECAST_HISTORY_DAYS закрытых дней до сегодняшнего. Прогноз расхода в день считается
+сразу для всех ячеек матрицей NumPy (ячейка x день):
+- скользящее среднее за последние FORECAST_MOVING_AVERAGE_DAYS дней;
+- простое экспоненциальное сглаживание с весом FORECAST_SMOOTHING_ALPHA: уровень после последнего
+  дня равен взвешенной сумме дней истории, поэтому считается одним умножением матрицы на вектор весов.
+
+Прогнозы кэшируются в таблице и пересчитываются по расписанию, когда закрывается новый день.
+Пересчет записывается в inventory_forecast_runs: по нему "посчитано, спроса нет" (строк прогноза нет)
+отличается от "еще не считалось".
+Warehouse Service запрашивает их через POST /inventory/forecasts/query и пополняет склад на спрос
+горизонта за вычетом остатка. Точность и скорость методов на истории - tests/benchmark_forecast.py.
+
+Пересчет вручную:
+    python -m app.forecasting --force
+"""
+import sys
+import os
+import logging
+import argparse
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import numpy as np
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import InventoryDailyMovement, InventoryDemandForecast, InventoryForecastRun
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('smoothing', 'moving_average')
+OUTBOUND_TYPES = ('write_off', 'transfer')  # Убытие из локации, которое должно покрываться пополнением
+INSERT_CHUNK = 10000
+
+
+def moving_average(history: np.ndarray, days: int) -> np.ndarray:
+    """Среднее за последние days дней по каждой строке матрицы (ячейка x день)"""
+    return history[:, -days:].mean(axis=1)
+
+
+def exponential_smoothing(history: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Уровень простого экспоненциального сглаживания после последнего дня по каждой строке
+
+    level_t = alpha * y_t + (1 - alpha) * level_(t-1), level_0 = y_0 - то же, что сумма дней
+    с весами alpha * (1 - alpha)^(n-1-t) и (1 - alpha)^(n-1) для первого дня.
+    """
+    days = history.shape[1]
+    if not days:
+        return np.zeros(history.shape[0])
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1 - alpha) ** (days - 1)
+    return history @ weights
+
+
+def load_history(db: Session, history_from: date, history_to: date) -> Tuple[np.ndarray, List[str], np.ndarray, np.ndarray]:
+    """
+    Расход по дням [history_from, history_to) для ячеек с расходом
+
+    Returns:
+        ID товаров и названия локаций ячеек (по ячейке на строку), коды локаций, матрица ячейка x день (кг)
+    """
+    movement = InventoryDailyMovement
+    rows = db.execute(
+        select(movement.day, movement.sku_id, movement.location_name, movement.outbound_weight).where(
+            movement.day >= history_from,
+            movement.day < history_to,
+            movement.operation_type.in_(OUTBOUND_TYPES),
+            movement.outbound_weight > 0
+        )
+    ).all()
+    days = (history_to - history_from).days
+    origin = history_from.toordinal()
+    count = len(rows)
+    names: Dict[str, int] = {}
+    day = np.fromiter((row[0].toordinal() - origin for row in rows), dtype=np.int64, count=count)
+    sku_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=count)
+    locations = np.fromiter((names.setdefault(row[2], len(names)) for row in rows), dtype=np.int64, count=count)
+    weights = np.fromiter((row[3] for row in rows), dtype=np.float64, count=count)
+
+    cells, cell_positions = np.unique(np.stack([sku_ids, locations], axis=1), axis=0, return_inverse=True)
+    cell_positions = cell_positions.reshape(-1)
+    history = np.bincount(
+        cell_positions * days + day, weights=weights, minlength=len(cells) * days
+    ).reshape(len(cells), days)
+    return cells[:, 0], list(names), cells[:, 1], history
+
+
+class ForecastService:
+    """Пересчет и выдача прогнозов спроса"""
+
+    @staticmethod
+    def history_window(today: date) -> Tuple[date, date]:
+        """История [history_from, history_to): закрытые дни до сегодняшнего"""
+        return today - timedelta(days=settings.FORECAST_HISTORY_DAYS), today
+
+    @staticmethod
+    def refresh(db: Session, force: bool = False) -> Dict:
+        """
+        Пересчитать прогнозы всех ячеек и заменить ими кэш
+
+        Args:
+            force: Пересчитать, даже если новый день еще не закрылся (например, после пересборки агрегата)
+
+        Returns:
+            История, количество ячеек и признак пересчета
+        """
+        history_from, history_to = ForecastService.history_window(db.execute(select(func.current_date())).scalar())
+        latest = ForecastService.latest_run(db)
+        if not force and latest is not None and latest.history_to == history_to:
+            return {"history_from": history_from, "history_to": history_to, "cells": latest.cells, "refreshed": False}
+
+        sku_ids, location_names, locations, history = load_history(db, history_from, history_to)
+        averages = moving_average(history, settings.FORECAST_MOVING_AVERAGE_DAYS)
+        smoothed = exponential_smoothing(history, settings.FORECAST_SMOOTHING_ALPHA)
+        rows = [
+            {
+                "sku_id": sku_id,
+                "location_name": location_names[location],
+                "moving_average": average,
+                "smoothed": level,
+                "history_from": history_from,
+                "history_to": history_to,
+            }
+            for sku_id, location, average, level in zip(
+                sku_ids.tolist(), locations.tolist(), averages.tolist(), smoothed.tolist()
+            )
+        ]
+        db.execute(delete(InventoryDemandForecast))
+        for start in range(0, len(rows), INSERT_CHUNK):
+            db.execute(insert(InventoryDemandForecast), rows[start:start + INSERT_CHUNK])
+        db.execute(delete(InventoryForecastRun))
+        db.add(InventoryForecastRun(history_from=history_from, history_to=history_to, cells=len(rows)))
+        db.commit()
+        logger.info(f"Прогноз спроса по истории [{history_from}, {history_to}) пересчитан: {len(rows)} ячеек")
+        return {"history_from": history_from, "history_to": history_to, "cells": len(rows), "refreshed": True}
+
+    @staticmethod
+    def latest_run(db: Session) -> Optional[InventoryForecastRun]:
+        """Последний пересчет прогноза (None - прогнозы еще не считались)"""
+        return db.query(InventoryForecastRun).order_by(InventoryForecastRun.id.desc()).first()
+
+    @staticmethod
+    def query(
+        db: Session,
+        sku_ids: Optional[List[int]] = None,
+        location_names: Optional[List[str]] = None,
+        horizon_days: int = 7,
+        method: Optional[str] = None
+    ) -> Dict:
+        """
+        Прогноз спроса на horizon_days дней для наборов товаров и/или локаций
+
+        Returns:
+            Ответ в формате ForecastQueryResponse; computed_at = None - прогнозы еще не считались,
+            пустой items при заданном computed_at - спроса нет
+        """
+        method = method or settings.FORECAST_METHOD
+        latest = ForecastService.latest_run(db)
+        history_from, history_to, computed_at = (
+            (latest.history_from, latest.history_to, latest.computed_at) if latest else (None, None, None)
+        )
+        forecasts = db.query(InventoryDemandForecast)
+        if sku_ids:
+            forecasts = forecasts.filter(InventoryDemandForecast.sku_id.in_(set(sku_ids)))
+        if location_names:
+            forecasts = forecasts.filter(InventoryDemandForecast.location_name.in_(set(location_names)))
+        items = []
+        for forecast in forecasts.order_by(InventoryDemandForecast.location_name, InventoryDemandForecast.sku_id):
+            daily = forecast.smoothed if method == 'smoothing' else forecast.moving_average
+            items.append({
+                "sku_id": forecast.sku_id,
+                "location_name": forecast.location_name,
+                "moving_average": forecast.moving_average,
+                "smoothed": forecast.smoothed,
+                "daily_demand": daily,
+                "forecast_weight": daily * horizon_days,
+            })
+        return {
+            "method": method,
+            "horizon_days": horizon_days,
+            "history_from": history_from,
+            "history_to": history_to,
+            "computed_at": computed_at,
+            "items": items,
+        }
+
+
+def run_refresh(force: bool = False) -> Dict:
+    """Пересчитать прогнозы, если закрылся новый день (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        return ForecastService.refresh(db, force)
+    except Exception as e:
+        logger.error(f"Ошибка при пересчете прогноза спроса: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет прогноза спроса по товарам и локациям")
+    parser.add_argument("--force", action="store_true", help="Пересчитать, даже если новый день не закрылся")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = run_refresh(args.force)
+    print(f"История: [{report['history_from']}, {report['history_to']}), ячеек: {report['cells']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Ключи идемпотентности для создания операций (заголовок Idempotency-Key)
+
+Warehouse и Catalog повторяют запрос на создание операции при таймауте. Если первый запрос
+успел закоммититься, повтор без ключа применил бы изменение остатков второй раз.
+Ключ сохраняется в той же транзакции, что и операция, вместе с ответом на первый запрос:
+повтор с тем же ключом получает сохраненный ответ одним запросом по первичному ключу.
+Асинхронный прием (intake) резервирует ключ в той же таблице вместе с квитанцией, поэтому
+повтор в другом режиме не применяет операцию второй раз: синхронный повтор ключа квитанции
+получает ответ операции, в которую квитанция применена, а асинхронный повтор синхронного ключа
+отклоняется (IdempotencyKeyInUseError).
+Ключи хранятся IDEMPOTENCY_KEY_TTL_SECONDS, затем удаляются периодической задачей.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import InventoryOperation, InventoryIdempotencyKey, InventoryOperationIntake
+from app.schemas import OperationResponse
+
+logger = logging.getLogger(__name__)
+
+HEADER_NAME = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflictError(ValueError):
+    """Ключ уже использован для запроса с другими параметрами"""
+
+
+class IdempotencyKeyInUseError(Exception):
+    """Ключ занят запросом другого режима (синхронным или асинхронным), ответ на который нельзя повторить"""
+
+
+def request_hash(payload: Dict) -> str:
+    """SHA-256 канонического JSON тела запроса (без самого ключа)"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_saved_response(db: Session, key: str, payload_hash: str) -> Optional[Dict]:
+    """
+    Найти ответ на первый запрос с этим ключом (один запрос по первичному ключу)
+
+    Если ключ зарезервирован асинхронной квитанцией, ответ - операция, в которую она применена.
+
+    Raises:
+        IdempotencyConflictError: ключ использован с другим телом запроса
+        IdempotencyKeyInUseError: квитанция с этим ключом еще не применена или отклонена
+    """
+    saved = find_key(db, key, payload_hash)
+    if saved is None:
+        return None
+    if saved.response is not None:
+        return saved.response
+    ticket = db.get(InventoryOperationIntake, saved.intake_id) if saved.intake_id is not None else None
+    operation = db.get(InventoryOperation, ticket.operation_id) if ticket and ticket.operation_id else None
+    if operation is None:
+        state = f"квитанция {saved.intake_id}, статус {ticket.status}" if ticket else f"квитанция {saved.intake_id}"
+        raise IdempotencyKeyInUseError(f"{HEADER_NAME} '{key}' использован для асинхронной операции ({state})")
+    return OperationResponse.model_validate(operation).model_dump(mode="json")
+
+
+def find_key(db: Session, key: str, payload_hash: str) -> Optional[InventoryIdempotencyKey]:
+    """
+    Сохраненный ключ любого режима (синхронного или асинхронного)
+
+    Raises:
+        IdempotencyConflictError: ключ использован с другим телом запроса
+    """
+    saved = db.get(InventoryIdempotencyKey, key)
+    if saved is not None and saved.request_hash != payload_hash:
+        raise IdempotencyConflictError(
+            f"{HEADER_NAME} '{key}' уже использован для запроса с другими параметрами"
+        )
+    return saved
+
+
+def remember(db: Session, key: str, payload_hash: str, operation: InventoryOperation) -> None:
+    """
+    Сохранить ключ и ответ в текущей транзакции (до commit операции)
+
+    Если параллельный запрос с тем же ключом успел закоммититься первым,
+    commit завершится IntegrityError и откатит операцию вместе с изменением остатков.
+    """
+    db.refresh(operation)  # created_at задается БД при вставке
+    db.add(InventoryIdempotencyKey(
+        key=key,
+        request_hash=payload_hash,
+        operation_id=operation.id,
+        response=OperationResponse.model_validate(operation).model_dump(mode="json")
+    ))
+
+
+def reserve_for_intake(db: Session, key: str, payload_hash: str, intake_id: int) -> None:
+    """
+    Зарезервировать ключ за асинхронной квитанцией в текущей транзакции (до commit квитанции)
+
+    Если ключ уже занят (в любом режиме), commit завершится IntegrityError и откатит квитанцию.
+    """
+    db.add(InventoryIdempotencyKey(key=key, request_hash=payload_hash, intake_id=intake_id))
+
+
+def cleanup_expired_keys(db: Session, ttl_seconds: Optional[int] = None) -> int:
+    """Удалить ключи старше TTL. Возвращает количество удаленных ключей"""
+    ttl_seconds = settings.IDEMPOTENCY_KEY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    expired_before = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    result = db.execute(
+        delete(InventoryIdempotencyKey).where(InventoryIdempotencyKey.created_at < expired_before)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def run_cleanup() -> int:
+    """Удаление ключей с истекшим сроком хранения (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        removed = cleanup_expired_keys(db)
+        if removed:
+            logger.info(f"Удалено ключей идемпотентности с истекшим сроком: {removed}")
+        return removed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
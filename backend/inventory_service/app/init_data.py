@@ -9,6 +9,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app.database import SessionLocal
 from app.models import InventoryLocationTotal, InventorySKUTotal
+from app import location_rollups
 
 logger = logging.getLogger(__name__)
 
@@ -105,6 +106,7 @@ def init_location_items():
                     weight=weights[i],
                 )
                 db.add(location_total)
+                location_rollups.apply_weight_change(db, location_name, 0, weights[i])
                 
                 # Обновляем или создаем SKU total
                 sku_total = db.query(InventorySKUTotal).filter(
@@ -0,0 +1,394 @@
+"""
+Асинхронный прием операций (POST /inventory/operations?async=true)
+
+Синхронный путь на каждую операцию выполняет отдельную транзакцию: блокировка SKU, чтение
+и запись строк остатков, сводки по локации, дневного агрегата и commit. При всплеске мелких
+приемов и списаний по одним и тем же товарам это упирается в commit и в очередь на блокировку SKU.
+В асинхронном режиме запрос только сохраняет квитанцию в inventory_operation_intake
+(один INSERT и commit) и сразу получает 202 Accepted с ее номером.
+
+Фоновый применитель забирает квитанции пачками до INTAKE_BATCH_SIZE в порядке номеров:
+- каждая квитанция становится отдельной операцией журнала (история не схлопывается);
+- приращения остатков пачки суммируются по ключу (SKU, локация) и по SKU, поэтому каждая строка
+  остатков и сводки обновляется один раз на пачку, а все SKU пачки блокируются заранее;
+- пачка записывается одной транзакцией вместе со статусами квитанций (групповой commit).
+  Пока применяется пачка, новые квитанции копятся в следующую.
+Квитанция с товаром, неизвестным и Catalog Service, и остаткам, отклоняется (статус failed)
+в той же транзакции. Если пачка все же не применилась, квитанции применяются по одной,
+и отклоняется только квитанция с ошибкой.
+
+Состояние квитанции - GET /inventory/intake/{ticket}. Клиенту, которому нужно прочитать
+свою запись, POST /inventory/intake/flush дожидается применения всех квитанций до указанной
+(по умолчанию - последней принятой) и сам применяет еще не взятые фоновым применителем.
+В PostgreSQL квитанции выбираются с FOR UPDATE SKIP LOCKED: несколько экземпляров сервиса
+и flush применяют разные квитанции, не дожидаясь друг друга.
+
+Примененные и отклоненные квитанции хранятся IDEMPOTENCY_KEY_TTL_SECONDS (как и ключи идемпотентности)
+и затем удаляются периодической задачей; ожидающие применения не удаляются.
+
+Асинхронно принимаются только приращения (receipt/write_off/transfer): create/update/delete
+задают или читают абсолютные значения остатков и выполняются синхронно.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.inventory_service import InventoryService
+from app import idempotency
+from app.idempotency import IdempotencyKeyInUseError, HEADER_NAME
+from app.models import InventoryOperation, InventoryOperationIntake
+from app.rabbitmq_client import rabbitmq_client
+from app import sku_locks
+
+logger = logging.getLogger(__name__)
+
+ASYNC_OPERATION_TYPES = ("receipt", "write_off", "transfer")
+
+STATUS_PENDING = "pending"
+STATUS_APPLIED = "applied"
+STATUS_FAILED = "failed"
+
+MAX_ERROR_LENGTH = 500
+FLUSH_POLL_SECONDS = 0.05  # Как часто flush проверяет квитанции, которые применяет другой экземпляр
+
+
+def _find_by_key(db: Session, key: str, payload_hash: str) -> Optional[InventoryOperationIntake]:
+    """Квитанция по ключу идемпотентности (ключи общие с синхронными операциями)"""
+    saved = idempotency.find_key(db, key, payload_hash)
+    if saved is None:
+        return None
+    if saved.intake_id is None:
+        raise IdempotencyKeyInUseError(
+            f"{HEADER_NAME} '{key}' уже использован для синхронной операции {saved.operation_id}"
+        )
+    ticket = db.get(InventoryOperationIntake, saved.intake_id)
+    if ticket is None:
+        raise IdempotencyKeyInUseError(f"{HEADER_NAME} '{key}' использован для удаленной квитанции {saved.intake_id}")
+    return ticket
+
+
+def submit(
+    db: Session,
+    operation_type: str,
+    sku_id: int,
+    quantity_value: int,
+    quantity_unit: str,
+    weight_value: int,
+    weight_unit: str,
+    source_location: Optional[str] = None,
+    target_location: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    request_hash: Optional[str] = None
+) -> InventoryOperationIntake:
+    """
+    Принять операцию к асинхронному применению (квитанция закоммичена до возврата)
+
+    Повтор с тем же ключом идемпотентности возвращает ту же квитанцию. Ключ резервируется
+    в inventory_idempotency_keys вместе с квитанцией, как и у синхронных операций.
+
+    Raises:
+        ValueError: операцию этого типа нельзя принять асинхронно
+        IdempotencyConflictError: ключ использован для запроса с другими параметрами
+        IdempotencyKeyInUseError: ключ уже использован синхронной операцией
+    """
+    if operation_type not in ASYNC_OPERATION_TYPES:
+        raise ValueError(
+            f"Асинхронно принимаются только операции {', '.join(ASYNC_OPERATION_TYPES)}, а не {operation_type}"
+        )
+    if operation_type == "transfer" and not (source_location and target_location):
+        raise ValueError("Для перемещения нужны начальная и конечная локации")
+    if idempotency_key:
+        existing = _find_by_key(db, idempotency_key, request_hash)
+        if existing is not None:
+            return existing
+
+    ticket = InventoryOperationIntake(
+        operation_type=operation_type,
+        sku_id=sku_id,
+        quantity_value=quantity_value,
+        quantity_unit=quantity_unit,
+        weight_value=weight_value,
+        weight_unit=weight_unit,
+        source_location=source_location,
+        target_location=target_location if operation_type == "transfer" else source_location,
+        idempotency_key=idempotency_key,
+        request_hash=request_hash,
+        status=STATUS_PENDING
+    )
+    db.add(ticket)
+    try:
+        if idempotency_key:
+            db.flush()
+            idempotency.reserve_for_intake(db, idempotency_key, request_hash, ticket.id)
+        db.commit()
+    except IntegrityError:
+        # Параллельный запрос с тем же ключом (в любом режиме) закоммитился первым
+        db.rollback()
+        existing = _find_by_key(db, idempotency_key, request_hash) if idempotency_key else None
+        if existing is None:
+            raise
+        return existing
+    db.refresh(ticket)
+    intake_applier.wake()
+    return ticket
+
+
+def purge_processed_tickets(db: Session, ttl_seconds: Optional[int] = None) -> int:
+    """Удалить примененные и отклоненные квитанции старше TTL. Возвращает количество удаленных"""
+    ttl_seconds = settings.IDEMPOTENCY_KEY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    expired_before = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    result = db.execute(delete(InventoryOperationIntake).where(
+        InventoryOperationIntake.status.in_((STATUS_APPLIED, STATUS_FAILED)),
+        InventoryOperationIntake.processed_at < expired_before
+    ))
+    db.commit()
+    return result.rowcount
+
+
+def run_purge() -> int:
+    """Удаление обработанных квитанций с истекшим сроком хранения (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        removed = purge_processed_tickets(db)
+        if removed:
+            logger.info(f"Удалено обработанных квитанций с истекшим сроком: {removed}")
+        return removed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class IntakeApplier:
+    """Применение принятых квитанций пачками"""
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def wake(self):
+        """Сигнал о новой квитанции (без запущенного применителя - ничего не делает)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Фоновое применение квитанций в event loop сервиса"""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.INTAKE_IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            db = SessionLocal()
+            try:
+                # Полная пачка - за ней, скорее всего, есть еще квитанции
+                while await self.apply_pending(db) >= settings.INTAKE_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error(f"Error applying operation intake: {e}")
+            finally:
+                db.close()
+
+    async def apply_pending(self, db: Session, through: Optional[int] = None) -> int:
+        """
+        Применить очередную пачку квитанций одной транзакцией
+
+        Args:
+            through: Применять только квитанции с номером не больше through
+
+        Returns:
+            Сколько квитанций обработано (применено или отклонено)
+        """
+        query = select(InventoryOperationIntake).where(InventoryOperationIntake.status == STATUS_PENDING)
+        if through is not None:
+            query = query.where(InventoryOperationIntake.id <= through)
+        query = query.order_by(InventoryOperationIntake.id).limit(settings.INTAKE_BATCH_SIZE)
+        if db.get_bind().dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        tickets = db.execute(query).scalars().all()
+        if not tickets:
+            db.rollback()
+            return 0
+
+        ticket_ids = [ticket.id for ticket in tickets]
+        sku_names = await InventoryService.sku_names(db, {ticket.sku_id for ticket in tickets})
+        try:
+            created = await self._apply(db, tickets, sku_names)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(ticket_ids) == 1:
+                self._fail(db, ticket_ids[0], e)
+                return 1
+            logger.warning(f"Intake batch of {len(ticket_ids)} tickets failed ({e}), applying tickets one by one")
+            created = []
+            for ticket_id in ticket_ids:
+                created.extend(await self._apply_one(db, ticket_id, sku_names))
+
+        for event in created:
+            rabbitmq_client.publish_event("operation.created", event)
+        logger.info(f"Applied {len(created)} of {len(ticket_ids)} intake tickets")
+        return len(ticket_ids)
+
+    async def flush(self, db: Session, through: Optional[int] = None, timeout: Optional[float] = None) -> Dict:
+        """
+        Барьер: дождаться применения всех квитанций с номером не больше through
+
+        Квитанции, которые еще никто не применяет, применяются в текущей сессии;
+        взятые другим применителем - ожидаются.
+
+        Raises:
+            TimeoutError: квитанции не применены за timeout секунд
+        """
+        if through is None:
+            through = db.query(func.max(InventoryOperationIntake.id)).scalar() or 0
+        timeout = settings.INTAKE_FLUSH_TIMEOUT_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            while await self.apply_pending(db, through=through):
+                pass
+            pending = self._count(db, STATUS_PENDING, through)
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Не применено {pending} квитанций до {through} за {timeout} с")
+            await asyncio.sleep(FLUSH_POLL_SECONDS)
+        return {"through": through, "failed": self._count(db, STATUS_FAILED, through)}
+
+    @staticmethod
+    def _count(db: Session, status: str, through: int) -> int:
+        count = db.query(func.count(InventoryOperationIntake.id)).filter(
+            InventoryOperationIntake.status == status,
+            InventoryOperationIntake.id <= through
+        ).scalar()
+        db.rollback()  # Следующая проверка должна видеть коммиты других применителей
+        return count
+
+    async def _apply(
+        self,
+        db: Session,
+        tickets: List[InventoryOperationIntake],
+        sku_names: Dict[int, str]
+    ) -> List[Dict]:
+        """
+        Записать операции квитанций и суммарные приращения остатков в текущей транзакции (без commit)
+
+        Returns:
+            Данные событий operation.created (отправляются после commit)
+        """
+        now = datetime.now(timezone.utc)
+        for ticket in tickets:
+            if ticket.sku_id not in sku_names:
+                # Неизвестный товар отклоняется в той же транзакции, остальная пачка применяется
+                logger.error(f"Intake ticket {ticket.id} failed: SKU {ticket.sku_id} not found")
+                ticket.status = STATUS_FAILED
+                ticket.error = f"SKU {ticket.sku_id} not found in Catalog Service"
+                ticket.processed_at = now
+        tickets = [ticket for ticket in tickets if ticket.status == STATUS_PENDING]
+        # Все SKU пачки блокируются заранее в порядке sku_id (app/sku_locks.py)
+        sku_locks.lock_skus(db, [ticket.sku_id for ticket in tickets])
+
+        operations: List[Tuple[InventoryOperationIntake, InventoryOperation]] = []
+        location_deltas: Dict[Tuple[str, int], int] = defaultdict(int)
+        sku_deltas: Dict[int, int] = defaultdict(int)
+        for ticket in tickets:
+            delta_value = await InventoryService.calculate_delta_value(
+                ticket.quantity_value, ticket.quantity_unit, float(ticket.weight_value), ticket.weight_unit
+            )
+            operation = InventoryOperation(
+                operation_type=ticket.operation_type,
+                sku_id=ticket.sku_id,
+                sku_name=sku_names[ticket.sku_id],
+                quantity_value=ticket.quantity_value,
+                quantity_unit=ticket.quantity_unit,
+                weight_value=ticket.weight_value,
+                weight_unit=ticket.weight_unit,
+                delta_value=delta_value,
+                delta_unit="кг",
+                source_location=ticket.source_location,
+                target_location=ticket.target_location
+            )
+            operations.append((ticket, operation))
+            for location_name, location_delta in InventoryService.location_deltas(
+                ticket.operation_type, delta_value, ticket.source_location, ticket.target_location
+            ):
+                if location_name:
+                    location_deltas[(location_name, ticket.sku_id)] += location_delta
+            sku_deltas[ticket.sku_id] += InventoryService.sku_delta(ticket.operation_type, delta_value)
+        db.add_all([operation for _, operation in operations])
+        db.flush()
+
+        # Строки сводки по локациям блокируются в порядке названий, как в InventoryService._update_totals
+        for (location_name, sku_id), delta in sorted(location_deltas.items()):
+            if delta:
+                InventoryService._update_location_total(db, sku_id, sku_names[sku_id], location_name, delta)
+        for sku_id, delta in sorted(sku_deltas.items()):
+            if delta:
+                InventoryService._update_sku_total(db, sku_id, sku_names[sku_id], delta)
+
+        events = []
+        for ticket, operation in operations:
+            InventoryService.record_movements(db, operation)
+            ticket.status = STATUS_APPLIED
+            ticket.operation_id = operation.id
+            ticket.processed_at = now
+            events.append({
+                "operation_id": operation.id,
+                "operation_type": operation.operation_type,
+                "sku_id": operation.sku_id,
+                "sku_name": operation.sku_name,
+                "delta_value": operation.delta_value,
+                "delta_unit": operation.delta_unit,
+                "source_location": operation.source_location,
+                "target_location": operation.target_location
+            })
+        db.flush()
+        return events
+
+    async def _apply_one(self, db: Session, ticket_id: int, sku_names: Dict[int, str]) -> List[Dict]:
+        """Применить одну квитанцию отдельной транзакцией; при ошибке - отклонить ее"""
+        query = select(InventoryOperationIntake).where(
+            InventoryOperationIntake.id == ticket_id,
+            InventoryOperationIntake.status == STATUS_PENDING
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        ticket = db.execute(query).scalars().first()
+        if ticket is None:
+            db.rollback()
+            return []  # Уже применена или ее применяет другой экземпляр
+        try:
+            events = await self._apply(db, [ticket], sku_names)
+            db.commit()
+            return events
+        except Exception as e:
+            db.rollback()
+            self._fail(db, ticket_id, e)
+            return []
+
+    @staticmethod
+    def _fail(db: Session, ticket_id: int, error: Exception):
+        logger.error(f"Intake ticket {ticket_id} failed: {error}")
+        db.execute(update(InventoryOperationIntake).where(
+            InventoryOperationIntake.id == ticket_id,
+            InventoryOperationIntake.status == STATUS_PENDING
+        ).values(
+            status=STATUS_FAILED,
+            error=f"{type(error).__name__}: {error}"[:MAX_ERROR_LENGTH],
+            processed_at=datetime.now(timezone.utc)
+        ))
+        db.commit()
+
+
+# Глобальный применитель квитанций
+intake_applier = IntakeApplier()
@@ -1,15 +1,21 @@
 """
 Сервисная логика для работы с остатками и операциями
 """
+import asyncio
 import logging
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import Optional
-from app.models import InventoryOperation, InventorySKUTotal, InventoryLocationTotal
+from datetime import datetime
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, select, union_all
+from typing import Dict, Iterable, Optional, List, Tuple
+from app.models import InventoryOperation, InventorySKUTotal, InventoryLocationTotal, InventoryLocationRollup
 from app.catalog_client import catalog_client
+from app import idempotency, location_rollups, movements, sku_locks, sku_prices, stock_alerts
+from app.locations import location_dictionary
 
 logger = logging.getLogger(__name__)
 
+CATALOG_MAX_CONCURRENCY = 8  # Сколько запросов товаров в Catalog Service выполняется одновременно
+
 
 class InventoryService:
     """Сервис для работы с остатками и операциями"""
@@ -42,6 +48,30 @@ class InventoryService:
         
         return delta_value
     
+    @staticmethod
+    async def sku_names(db: Session, sku_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Названия товаров: из Catalog Service (параллельно), для недоступных в каталоге - из остатков.
+        Товаров, неизвестных и каталогу, и остаткам, в результате нет
+        """
+        sku_ids = set(sku_ids)
+        semaphore = asyncio.Semaphore(CATALOG_MAX_CONCURRENCY)
+        names: Dict[int, str] = {}
+
+        async def fetch(sku_id: int):
+            async with semaphore:
+                sku_info = await catalog_client.get_sku(sku_id)
+            if sku_info:
+                names[sku_id] = sku_info.get("name", "Unknown")
+
+        await asyncio.gather(*(fetch(sku_id) for sku_id in sku_ids))
+        missing = sku_ids - names.keys()
+        if missing:
+            names.update(db.query(InventorySKUTotal.sku_id, InventorySKUTotal.sku_name).filter(
+                InventorySKUTotal.sku_id.in_(missing)
+            ).all())
+        return names
+    
     @staticmethod
     async def create_operation(
         db: Session,
@@ -52,7 +82,9 @@ class InventoryService:
         weight_value: int,
         weight_unit: str,
         source_location: Optional[str] = None,
-        target_location: Optional[str] = None
+        target_location: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        request_hash: Optional[str] = None
     ) -> InventoryOperation:
         """
         Создать операцию и обновить остатки
@@ -67,6 +99,8 @@ class InventoryService:
             weight_unit: Единица веса
             source_location: Начальная локация
             target_location: Конечная локация
+            idempotency_key: Ключ идемпотентности (сохраняется в одной транзакции с операцией)
+            request_hash: Хеш тела запроса для проверки повторов с тем же ключом
         
         Returns:
             Созданная операция
@@ -77,6 +111,9 @@ class InventoryService:
             raise ValueError(f"SKU {sku_id} not found in Catalog Service")
         
         sku_name = sku_info.get('name', 'Unknown')
+        if operation_type in ('create', 'update'):
+            # Catalog Service сообщает о создании и изменении товара этой операцией - обновляем и цену
+            await sku_prices.apply_catalog_sku(db, sku_info)
         
         # Рассчитываем итоговое значение используя названия единиц измерения
         # Конвертируем weight_value в float для точного расчета
@@ -87,12 +124,9 @@ class InventoryService:
             weight_unit
         )
         
-        # Если одна локация, то target = source
-        if operation_type != 'transfer':
-            target_location = source_location
-        
-        # Создаем операцию
-        operation = InventoryOperation(
+        # Записываем операцию и обновляем остатки тем же путем, что и операции с готовым delta_value
+        operation = await InventoryService.add_operation(
+            db,
             operation_type=operation_type,
             sku_id=sku_id,
             sku_name=sku_name,
@@ -100,25 +134,13 @@ class InventoryService:
             quantity_unit=quantity_unit,
             weight_value=weight_value,
             weight_unit=weight_unit,
-            delta_value=delta_value,  # Храним абсолютное значение, знак определяем при обновлении остатков
-            delta_unit="кг",
+            delta_value=delta_value,
             source_location=source_location,
             target_location=target_location
         )
         
-        db.add(operation)
-        db.flush()  # Получаем ID операции
-        
-        # Обновляем остатки
-        await InventoryService._update_totals(
-            db,
-            sku_id,
-            sku_name,
-            operation_type,
-            delta_value,
-            source_location,
-            target_location
-        )
+        if idempotency_key:
+            idempotency.remember(db, idempotency_key, request_hash, operation)
         
         db.commit()
         db.refresh(operation)
@@ -138,7 +160,9 @@ class InventoryService:
         weight_unit: str,
         delta_value: int,
         source_location: Optional[str] = None,
-        target_location: Optional[str] = None
+        target_location: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        request_hash: Optional[str] = None
     ) -> InventoryOperation:
         """
         Создать операцию с заданным delta_value (для операций delete)
@@ -154,11 +178,53 @@ class InventoryService:
             if sku_total:
                 sku_name = sku_total.sku_name
         
+        operation = await InventoryService.add_operation(
+            db,
+            operation_type=operation_type,
+            sku_id=sku_id,
+            sku_name=sku_name,
+            quantity_value=quantity_value,
+            quantity_unit=quantity_unit,
+            weight_value=weight_value,
+            weight_unit=weight_unit,
+            delta_value=delta_value,
+            source_location=source_location,
+            target_location=target_location
+        )
+        
+        if idempotency_key:
+            idempotency.remember(db, idempotency_key, request_hash, operation)
+        
+        db.commit()
+        db.refresh(operation)
+        
+        logger.info(f"Created operation {operation.id} of type {operation_type} for SKU {sku_id} with delta_value {delta_value}")
+        
+        return operation
+    
+    @staticmethod
+    async def add_operation(
+        db: Session,
+        operation_type: str,
+        sku_id: int,
+        sku_name: str,
+        quantity_value: int,
+        quantity_unit: str,
+        weight_value: int,
+        weight_unit: str,
+        delta_value: int,
+        source_location: Optional[str] = None,
+        target_location: Optional[str] = None
+    ) -> InventoryOperation:
+        """
+        Записать операцию с готовым delta_value и обновить остатки в текущей транзакции (без commit)
+        
+        Используется для применения пачки событий одной транзакцией.
+        """
         # Если одна локация, то target = source
         if operation_type != 'transfer':
             target_location = source_location
         
-        # Создаем операцию
         operation = InventoryOperation(
             operation_type=operation_type,
             sku_id=sku_id,
@@ -167,7 +233,7 @@ class InventoryService:
             quantity_unit=quantity_unit,
             weight_value=weight_value,
             weight_unit=weight_unit,
-            delta_value=delta_value,  # Используем переданное значение
+            delta_value=delta_value,
             delta_unit="кг",
             source_location=source_location,
             target_location=target_location
@@ -187,13 +253,107 @@ class InventoryService:
             source_location,
             target_location
         )
+        InventoryService.record_movements(db, operation)
+        db.flush()
         
-        db.commit()
-        db.refresh(operation)
+        return operation
+    
+    @staticmethod
+    def record_movements(db: Session, operation: InventoryOperation):
+        """Учесть операцию в дневном агрегате движения товара (app/movements.py) в текущей транзакции"""
+        if operation.operation_type == 'update':
+            return
+        for location_name, location_delta in InventoryService.location_deltas(
+            operation.operation_type,
+            abs(operation.delta_value),
+            operation.source_location,
+            operation.target_location
+        ):
+            movements.add_movement(db, operation.sku_id, location_name, operation.operation_type, location_delta)
+    
+    @staticmethod
+    def query_operations(
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        operation_type: Optional[str] = None,
+        sku_id: Optional[int] = None,
+        location: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> List[InventoryOperation]:
+        """
+        Получить операции журнала (новые сначала, при равном времени - по id) с фильтрами
         
-        logger.info(f"Created operation {operation.id} of type {operation_type} for SKU {sku_id} with delta_value {delta_value}")
+        Фильтр по локации (source OR target) выполняется как UNION ALL двух запросов,
+        каждый из которых использует свой индекс (location, created_at) и сразу ограничен skip + limit.
+        Фильтр по периоду [date_from, date_to) позволяет PostgreSQL отсечь лишние партиции.
         
-        return operation
+        Args:
+            db: Сессия БД
+            skip: Смещение
+            limit: Количество операций
+            operation_type: Тип операции
+            sku_id: ID товара
+            location: Локация (начальная или конечная)
+            date_from: Начало периода (включительно)
+            date_to: Конец периода (не включительно)
+        
+        Returns:
+            Список операций
+        """
+        filters = []
+        if operation_type:
+            filters.append(InventoryOperation.operation_type == operation_type)
+        if sku_id is not None:
+            filters.append(InventoryOperation.sku_id == sku_id)
+        if date_from:
+            filters.append(InventoryOperation.created_at >= date_from)
+        if date_to:
+            filters.append(InventoryOperation.created_at < date_to)
+        
+        if not location:
+            return db.query(InventoryOperation).filter(*filters).order_by(
+                InventoryOperation.created_at.desc(), InventoryOperation.id.desc()
+            ).offset(skip).limit(limit).all()
+        
+        # Журнал хранит id локаций: название переводится по словарю, неизвестная локация - операций нет
+        location_id = location_dictionary.id_of(db, location, create=False)
+        if location_id is None:
+            return []
+        
+        # Вторая ветка исключает строки первой, поэтому дубликатов нет и сортировка UNION не нужна
+        branches = [
+            and_(*filters, InventoryOperation.source_location_id == location_id),
+            and_(
+                *filters,
+                InventoryOperation.target_location_id == location_id,
+                or_(
+                    InventoryOperation.source_location_id.is_(None),
+                    InventoryOperation.source_location_id != location_id
+                )
+            )
+        ]
+        limited_branches = [
+            select(
+                select(InventoryOperation).where(condition).order_by(
+                    InventoryOperation.created_at.desc(), InventoryOperation.id.desc()
+                ).limit(skip + limit).subquery()
+            )
+            for condition in branches
+        ]
+        matched = aliased(InventoryOperation, union_all(*limited_branches).subquery())
+        return db.query(matched).order_by(
+            matched.created_at.desc(), matched.id.desc()
+        ).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def location_summary(db: Session) -> List[InventoryLocationRollup]:
+        """
+        Сводка по всем локациям: суммарный вес, число SKU с ненулевым весом
+        и время последнего изменения остатков (из inventory_location_rollups, O(локаций))
+        """
+        return location_rollups.get_rollups(db)
     
     @staticmethod
     async def _update_totals(
@@ -217,25 +377,27 @@ class InventoryService:
             source_location: Начальная локация
             target_location: Конечная локация
         """
-        if operation_type == 'transfer':
-            # Перемещение: уменьшаем в source, увеличиваем в target
-            InventoryService._update_location_total(db, sku_id, sku_name, source_location, -delta_value)
-            InventoryService._update_location_total(db, sku_id, sku_name, target_location, delta_value)
-            # Абсолютные остатки не меняются при перемещении
-        elif operation_type in ['receipt', 'create']:
-            # Прием/создание: увеличиваем остатки
-            InventoryService._update_location_total(db, sku_id, sku_name, source_location, delta_value)
-            InventoryService._update_sku_total(db, sku_id, sku_name, delta_value)
-        elif operation_type in ['write_off', 'delete']:
-            # Списание/удаление: уменьшаем остатки
-            InventoryService._update_location_total(db, sku_id, sku_name, source_location, -delta_value)
-            InventoryService._update_sku_total(db, sku_id, sku_name, -delta_value)
-        elif operation_type == 'update':
+        # Операции одного SKU меняют остатки по очереди (app/sku_locks.py)
+        sku_locks.lock_skus(db, [sku_id])
+        if operation_type != 'update':
+            # Перемещение/прием/создание/списание/удаление: приращения остатков.
+            # Локации - по порядку названий, чтобы строки сводки по локациям блокировались в одном порядке
+            for location_name, location_delta in sorted(
+                InventoryService.location_deltas(operation_type, delta_value, source_location, target_location),
+                key=lambda item: item[0] or ""
+            ):
+                InventoryService._update_location_total(db, sku_id, sku_name, location_name, location_delta)
+            sku_delta = InventoryService.sku_delta(operation_type, delta_value)
+            if sku_delta:
+                # Абсолютные остатки не меняются при перемещении
+                InventoryService._update_sku_total(db, sku_id, sku_name, sku_delta)
+        else:
             # Изменение товара: обновляем остатки на новое значение
             # Находим существующую запись и обновляем её
             sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
             if sku_total:
                 # Обновляем абсолютные остатки
+                stock_alerts.check(db, sku_id, None, sku_total.total_weight, delta_value)
                 sku_total.total_weight = delta_value
                 sku_total.sku_name = sku_name
             else:
@@ -252,21 +414,79 @@ class InventoryService:
                 ).first()
                 
                 if location_total:
+                    InventoryService.location_weight_changed(
+                        db, sku_id, source_location, location_total.weight, delta_value
+                    )
                     location_total.weight = delta_value
                     location_total.sku_name = sku_name
                 else:
                     # Если записи нет, создаем новую
                     InventoryService._update_location_total(db, sku_id, sku_name, source_location, delta_value)
     
+    @staticmethod
+    def location_deltas(
+        operation_type: str,
+        delta_value: int,
+        source_location: Optional[str],
+        target_location: Optional[str]
+    ) -> List[Tuple[Optional[str], int]]:
+        """
+        Приращения остатков по локациям для операции (кроме update, которая задает абсолютное значение)
+        
+        Returns:
+            Список (локация, изменение веса в кг)
+        """
+        if operation_type == 'transfer':
+            # Перемещение: уменьшаем в source, увеличиваем в target
+            return [(source_location, -delta_value), (target_location, delta_value)]
+        if operation_type in ['receipt', 'create']:
+            # Прием/создание: увеличиваем остатки
+            return [(source_location, delta_value)]
+        if operation_type in ['write_off', 'delete']:
+            # Списание/удаление: уменьшаем остатки
+            return [(source_location, -delta_value)]
+        return []
+    
+    @staticmethod
+    def sku_delta(operation_type: str, delta_value: int) -> int:
+        """Изменение абсолютного остатка по SKU для операции (кроме update)"""
+        if operation_type in ['receipt', 'create']:
+            return delta_value
+        if operation_type in ['write_off', 'delete']:
+            return -delta_value
+        return 0
+    
+    @staticmethod
+    def applied_delta(operation: InventoryOperation) -> int:
+        """
+        Значение, с которым операция журнала применялась к остаткам.
+        Для delete в журнале хранится отрицательное значение, а к остаткам применялся модуль.
+        """
+        if operation.operation_type == 'delete':
+            return abs(operation.delta_value)
+        return operation.delta_value
+    
+    @staticmethod
+    def location_weight_changed(db: Session, sku_id: int, location_name: Optional[str], old_weight: int, new_weight: int):
+        """
+        Учесть изменение веса строки остатков по локации (old_weight -> new_weight):
+        сводка по локации и пороги оповещений для товара в локации и для заполненности локации
+        """
+        location_rollups.apply_weight_change(db, location_name, old_weight, new_weight)
+        stock_alerts.check(db, sku_id, location_name, old_weight, new_weight)
+        stock_alerts.check_location(db, location_name, new_weight - old_weight)
+    
     @staticmethod
     def _update_sku_total(db: Session, sku_id: int, sku_name: str, delta_weight: int):
         """Обновить абсолютные остатки по SKU"""
         sku_total = db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id == sku_id).first()
         
         if sku_total:
+            stock_alerts.check(db, sku_id, None, sku_total.total_weight, sku_total.total_weight + delta_weight)
             sku_total.total_weight += delta_weight
             sku_total.sku_name = sku_name  # Обновляем название на случай изменения
         else:
+            stock_alerts.check(db, sku_id, None, 0, delta_weight)
             # Создаем новую запись
             sku_total = InventorySKUTotal(
                 sku_id=sku_id,
@@ -290,9 +510,13 @@ class InventoryService:
         ).first()
         
         if location_total:
+            InventoryService.location_weight_changed(
+                db, sku_id, location_name, location_total.weight, location_total.weight + delta_weight
+            )
             location_total.weight += delta_weight
             location_total.sku_name = sku_name  # Обновляем название на случай изменения
         else:
+            InventoryService.location_weight_changed(db, sku_id, location_name, 0, delta_weight)
             # Создаем новую запись
             location_total = InventoryLocationTotal(
                 sku_id=sku_id,
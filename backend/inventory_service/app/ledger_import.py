@@ -0,0 +1,507 @@
+"""
+Загрузка исторического журнала операций при переводе площадки на систему
+
+Файл журнала (CSV с заголовком в формате GET /inventory/export/operations?format=csv, можно .gz)
+читается потоком порциями по --chunk-rows строк. Каждая строка проверяется без обращений к сервисам:
+товар - по заранее загруженному списку каталога (Catalog Service или его выгрузка CSV), название
+товара берется из каталога. Проверенная порция записывается в inventory_operations одним COPY
+(в SQLite - одним INSERT с множеством параметров) и коммитится; месячные партиции журнала
+создаются до записи порции. Остатки при записи не трогаются.
+
+После загрузки остатки загруженных SKU пересобираются из журнала целиком множественным SQL:
+inventory_location_totals и inventory_sku_totals удаляются и вставляются одним INSERT ... SELECT
+на таблицу (для ячейки - последнее абсолютное значение update плюс приращения после него, как
+в app/reconciliation.py), затем сверяется сводка по локациям и пересобирается агрегат движения
+за дни загрузки. Индекс остатков сервиса подхватит изменения при периодическом перестроении.
+
+Если партиции журнала уже архивировались (app/partitioning.py), журнал в БД неполон и пересборка
+с нуля стерла бы остатки архивированных месяцев. Тогда база пересборки - снимок остатков, в котором
+учтены все выгруженные операции (SnapshotService.ledger_baseline): строки снимка идут первыми,
+поверх них - операции с ID больше границы снимка (в том числе только что загруженные). Снимок
+должен быть снят до загрузки: без него пересборка отказывается работать (LedgerBaselineError),
+а CLI проверяет это до записи первой порции.
+
+Порции коммитятся по отдельности: после сбоя загрузку можно продолжить с --skip-rows
+(число уже загруженных строк из отчета), пропущенные строки все равно читаются - их SKU
+тоже попадают в пересборку остатков.
+
+Запуск вручную:
+    python -m app.ledger_import history.csv.gz
+    python -m app.ledger_import history.csv --catalog-csv skus_export.csv --strict
+"""
+import sys
+import os
+import io
+import csv
+import gzip
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import (
+    Table, Column, Integer, String, MetaData, select, insert, delete, func, case, and_, literal, text, union_all
+)
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.catalog_client import catalog_client
+from app.locations import location_dictionary
+from app.models import (
+    InventoryOperation, InventorySKUTotal, InventoryLocationTotal, InventoryLocation,
+    InventoryLocationTotalSnapshot, InventorySKUTotalSnapshot
+)
+from app.movements import MovementService
+from app.partitioning import OperationsPartitionManager, _month_start
+from app.snapshots import SnapshotService, LedgerBaselineError
+from app import location_rollups
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 100000
+MAX_ERRORS = 100  # Сколько ошибок строк попадает в отчет
+SKU_CHUNK_SIZE = 10000  # Строк во вставке во временную таблицу SKU
+
+OPERATION_TYPES = ("create", "update", "delete", "receipt", "write_off", "transfer")
+
+# Колонки файла (как в выгрузке журнала); id и sku_name файла не используются
+REQUIRED_COLUMNS = (
+    "operation_type", "sku_id", "quantity_value", "quantity_unit", "weight_value", "weight_unit",
+    "delta_value", "source_location", "target_location", "created_at"
+)
+
+# Колонки inventory_operations в порядке COPY
+COPY_COLUMNS = (
+    "operation_type", "sku_id", "sku_name", "quantity_value", "quantity_unit", "weight_value", "weight_unit",
+    "delta_value", "delta_unit", "source_location_id", "target_location_id", "created_at"
+)
+
+# Строка порции: поля COPY_COLUMNS, но вместо id локаций - названия
+ImportRow = Tuple[str, int, str, int, str, int, str, int, str, Optional[str], Optional[str], datetime]
+
+
+class LedgerImportError(ValueError):
+    """Файл журнала не может быть загружен"""
+
+
+def _parse_timestamp(value: str) -> datetime:
+    created_at = datetime.fromisoformat(value.strip())
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)  # Время без пояса считается UTC
+    return created_at
+
+
+class LedgerImporter:
+    """Потоковая загрузка файла журнала порциями и пересборка остатков загруженных SKU"""
+
+    def __init__(
+        self,
+        db: Session,
+        skus: Dict[int, str],
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        skip_rows: int = 0,
+        strict: bool = False
+    ):
+        """
+        Args:
+            db: Сессия БД
+            skus: Товары каталога {ID: название} - допустимые SKU журнала
+            chunk_rows: Строк в порции (одна транзакция)
+            skip_rows: Сколько первых строк уже загружено (продолжение после сбоя)
+            strict: Остановить загрузку на первой порции с ошибками (иначе такие строки пропускаются)
+        """
+        self.db = db
+        self.skus = skus
+        self.chunk_rows = chunk_rows
+        self.skip_rows = skip_rows
+        self.strict = strict
+        self.partitioned = OperationsPartitionManager.is_partitioned(db)
+        self.is_postgresql = db.get_bind().dialect.name == "postgresql"
+        self._months = set()
+        self._location_ids: Dict[str, int] = {}
+        self.imported_skus: Dict[int, str] = {}
+        self.first_created: Optional[datetime] = None
+        self.last_created: Optional[datetime] = None
+        self.report = {
+            "rows_read": 0,
+            "rows_imported": 0,
+            "rows_skipped": 0,
+            "rows_rejected": 0,
+            "errors": [],
+            "import_seconds": 0.0,
+            "rows_per_second": 0.0,
+        }
+
+    def run(self, lines: Iterable[str]) -> Dict:
+        """Загрузить строки файла (текст CSV с заголовком); остатки не пересобираются - см. rebuild()"""
+        started = time.perf_counter()
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            raise LedgerImportError("Файл журнала пуст")
+        columns = {name.strip().lower(): index for index, name in enumerate(header)}
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+        if missing:
+            raise LedgerImportError(f"В заголовке нет колонок: {', '.join(missing)}")
+
+        # Позиции колонок файла в порядке разбора (delta_unit необязательна)
+        indexes = tuple(columns[name] for name in REQUIRED_COLUMNS) + (columns.get("delta_unit"),)
+        chunk: List[ImportRow] = []
+        chunk_errors = 0
+        for line_number, values in enumerate(reader, start=2):
+            if not values:
+                continue
+            self.report["rows_read"] += 1
+            row = self._parse(line_number, values, indexes)
+            if row is None:
+                chunk_errors += 1
+                continue
+            if self.report["rows_read"] <= self.skip_rows:
+                self.report["rows_skipped"] += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= self.chunk_rows:
+                self._write(chunk, chunk_errors)
+                chunk, chunk_errors = [], 0
+        self._write(chunk, chunk_errors)
+
+        self.report["import_seconds"] = round(time.perf_counter() - started, 3)
+        self.report["rows_per_second"] = round(
+            self.report["rows_imported"] / max(time.perf_counter() - started, 1e-9), 1
+        )
+        return self.report
+
+    def _parse(self, line_number: int, values: List[str], indexes: Tuple[int, ...]) -> Optional[ImportRow]:
+        try:
+            (
+                operation_type, sku_id, quantity_value, quantity_unit, weight_value, weight_unit,
+                delta_value, source_location, target_location, created_at
+            ) = [values[index] for index in indexes[:-1]]
+            delta_unit = values[indexes[-1]] if indexes[-1] is not None else ""
+        except IndexError:
+            return self._reject(line_number, "не хватает колонок")
+        operation_type = operation_type.strip()
+        if operation_type not in OPERATION_TYPES:
+            return self._reject(line_number, f"неизвестный тип операции {operation_type!r}")
+        try:
+            # int() допускает пробелы по краям
+            sku_id = int(sku_id)
+            quantity_value = int(quantity_value)
+            weight_value = int(weight_value)
+            delta_value = int(delta_value)
+        except ValueError:
+            return self._reject(line_number, "sku_id, quantity_value, weight_value и delta_value должны быть целыми")
+        sku_name = self.skus.get(sku_id)
+        if sku_name is None:
+            return self._reject(line_number, f"товара {sku_id} нет в каталоге")
+        try:
+            created_at = _parse_timestamp(created_at)
+        except ValueError:
+            return self._reject(line_number, f"некорректное время {created_at!r}")
+        if not quantity_unit or not weight_unit:
+            return self._reject(line_number, "не указаны единицы количества и веса")
+        source_location = source_location.strip() or None
+        target_location = target_location.strip() or None
+        if operation_type == "transfer" and (not source_location or not target_location):
+            return self._reject(line_number, "для перемещения нужны обе локации")
+
+        self.imported_skus[sku_id] = sku_name
+        if self.first_created is None or created_at < self.first_created:
+            self.first_created = created_at
+        if self.last_created is None or created_at > self.last_created:
+            self.last_created = created_at
+        return (
+            operation_type, sku_id, sku_name, quantity_value, quantity_unit.strip(), weight_value, weight_unit.strip(),
+            delta_value, delta_unit.strip() or "кг", source_location, target_location, created_at
+        )
+
+    def _reject(self, line_number: int, message: str) -> None:
+        self.report["rows_rejected"] += 1
+        errors = self.report["errors"]
+        if len(errors) < MAX_ERRORS:
+            errors.append(f"Строка {line_number}: {message}")
+        elif len(errors) == MAX_ERRORS:
+            errors.append("... остальные ошибки не показаны")
+        return None
+
+    def _write(self, chunk: List[ImportRow], chunk_errors: int):
+        """Записать порцию одной транзакцией: партиции месяцев порции, новые локации, COPY, commit"""
+        if chunk_errors and self.strict:
+            raise LedgerImportError(
+                f"Ошибки в строках файла, загрузка остановлена после {self.report['rows_imported']} строк "
+                f"(продолжить можно с --skip-rows {self.skip_rows + self.report['rows_imported']})"
+            )
+        if not chunk:
+            return
+
+        if self.partitioned:
+            # Партиции создаются отдельными транзакциями до записи, иначе строки попадут в DEFAULT
+            for month in sorted({_month_start(row[11].astimezone(timezone.utc).date()) for row in chunk} - self._months):
+                OperationsPartitionManager.create_month_partition(self.db, month)
+                self._months.add(month)
+
+        rows = [row[:9] + (self._location_id(row[9]), self._location_id(row[10]), row[11]) for row in chunk]
+        if self.is_postgresql:
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(
+                row[:11] + (row[11].isoformat(),) for row in rows
+            )
+            buffer.seek(0)
+            # COPY идет через соединение сессии, в ее транзакции (как выгрузка партиций в архив)
+            with self.db.connection().connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY inventory_operations ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+                )
+        else:
+            self.db.execute(insert(InventoryOperation.__table__), [dict(zip(COPY_COLUMNS, row)) for row in rows])
+        self.db.commit()
+        self.report["rows_imported"] += len(chunk)
+        logger.info(f"Загружено строк журнала: {self.report['rows_imported']}")
+
+    def _location_id(self, name: Optional[str]) -> Optional[int]:
+        if name is None:
+            return None
+        location_id = self._location_ids.get(name)
+        if location_id is None:
+            # Новая локация попадает в словарь в транзакции порции
+            location_id = self._location_ids[name] = location_dictionary.id_of(self.db, name)
+        return location_id
+
+    def rebuild(self) -> Dict:
+        """Пересобрать остатки загруженных SKU, сводку по локациям и агрегат движения за дни загрузки"""
+        started = time.perf_counter()
+        report = rebuild_totals(self.db, self.imported_skus)
+        report["rollups_repaired"] = location_rollups.verify_rollups(self.db)["repaired"]
+        report["movement_rows"] = 0
+        if self.first_created is not None:
+            movements = MovementService.backfill(
+                self.db,
+                self.first_created.astimezone(timezone.utc).date(),
+                self.last_created.astimezone(timezone.utc).date() + timedelta(days=1)
+            )
+            report["movement_rows"] = movements["rows"]
+        report["rebuild_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+
+def _cell_weights(effects, keys: List[str]):
+    """
+    Итог по ячейкам из эффектов операций (ключи, phase, created_at, id, value, is_set):
+    последнее абсолютное значение (is_set = 1) плюс сумма приращений после него,
+    без абсолютных значений - сумма всех приращений. Строки базового снимка (phase = 0) идут
+    раньше операций журнала (phase = 1)
+    """
+    partition = [effects.c[key] for key in keys]
+    numbered = select(
+        effects,
+        func.row_number().over(
+            partition_by=partition, order_by=(effects.c.phase, effects.c.created_at, effects.c.id)
+        ).label("seq")
+    ).subquery()
+    marked = select(
+        numbered,
+        func.max(case((numbered.c.is_set == 1, numbered.c.seq))).over(
+            partition_by=[numbered.c[key] for key in keys]
+        ).label("last_set")
+    ).subquery()
+    last_set = func.coalesce(marked.c.last_set, 0)
+    weight = func.sum(case(
+        (marked.c.seq == marked.c.last_set, marked.c.value),
+        (and_(marked.c.is_set == 0, marked.c.seq > last_set), marked.c.value),
+        else_=0
+    ))
+    group = [marked.c[key] for key in keys]
+    return select(*group, weight.label("weight")).group_by(*group).subquery()
+
+
+def rebuild_totals(db: Session, skus: Dict[int, str]) -> Dict:
+    """
+    Пересобрать inventory_location_totals и inventory_sku_totals для SKU из журнала одной транзакцией
+
+    SKU передаются во временную таблицу, строки остатков этих SKU удаляются и вставляются заново
+    INSERT ... SELECT с оконными функциями по журналу. В PostgreSQL таблицы остатков на время
+    транзакции блокируются в режиме EXCLUSIVE: операции ждут пересборку, чтение не блокируется.
+    После архивации партиций журнала пересборка начинается с базового снимка остатков.
+
+    Args:
+        skus: {ID товара: название} - название записывается в строки остатков
+
+    Returns:
+        Количество вставленных строк остатков по локациям и по SKU, ID базового снимка
+
+    Raises:
+        LedgerBaselineError: Партиции журнала архивированы, а снимка остатков после архивации нет
+    """
+    report = {"skus": len(skus), "location_totals": 0, "sku_totals": 0, "baseline_snapshot_id": None}
+    if not skus:
+        return report
+    baseline = SnapshotService.ledger_baseline(db)
+
+    rebuilt = Table(
+        "ledger_import_skus", MetaData(),
+        Column("sku_id", Integer, primary_key=True),
+        Column("sku_name", String(15), nullable=False),
+        prefixes=["TEMPORARY"]
+    )
+    rebuilt.create(db.connection())
+    items = sorted(skus.items())
+    for start in range(0, len(items), SKU_CHUNK_SIZE):
+        db.execute(insert(rebuilt), [
+            {"sku_id": sku_id, "sku_name": sku_name} for sku_id, sku_name in items[start:start + SKU_CHUNK_SIZE]
+        ])
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE inventory_sku_totals, inventory_location_totals IN EXCLUSIVE MODE"))
+
+    op = InventoryOperation
+    in_rebuild = and_(
+        op.sku_id.in_(select(rebuilt.c.sku_id)),
+        op.id > (baseline.operation_id_mark if baseline is not None else 0)
+    )
+    # Для delete в журнале хранится отрицательное значение; к остаткам применяется модуль
+    magnitude = case((op.operation_type == "delete", func.abs(op.delta_value)), else_=op.delta_value)
+    signed = case((op.operation_type.in_(("create", "receipt", "update")), magnitude), else_=-magnitude)
+    is_set = case((op.operation_type == "update", 1), else_=0)
+
+    location_selects = [
+        select(
+            op.sku_id.label("sku_id"),
+            op.source_location_id.label("location_id"),
+            literal(1).label("phase"),
+            op.created_at.label("created_at"),
+            op.id.label("id"),
+            signed.label("value"),
+            is_set.label("is_set")
+        ).where(in_rebuild, op.operation_type.in_(OPERATION_TYPES), op.source_location_id.isnot(None)),
+        # Перемещение: вторая ветка - поступление в конечную локацию
+        select(op.sku_id, op.target_location_id, literal(1), op.created_at, op.id, magnitude, literal(0))
+        .where(in_rebuild, op.operation_type == "transfer", op.target_location_id.isnot(None))
+    ]
+    # Абсолютные остатки по SKU перемещение не меняет
+    sku_selects = [
+        select(
+            op.sku_id.label("sku_id"),
+            literal(1).label("phase"),
+            op.created_at.label("created_at"),
+            op.id.label("id"),
+            signed.label("value"),
+            is_set.label("is_set")
+        ).where(in_rebuild, op.operation_type.in_(("create", "receipt", "update", "write_off", "delete")))
+    ]
+    if baseline is not None:
+        # Строки базового снимка - абсолютные значения ячеек перед операциями журнала
+        location_snapshot = InventoryLocationTotalSnapshot
+        location_selects.append(
+            select(
+                location_snapshot.sku_id, InventoryLocation.id, literal(0), location_snapshot.updated_at,
+                literal(0), location_snapshot.weight, literal(1)
+            ).join(InventoryLocation, InventoryLocation.name == location_snapshot.location_name).where(
+                location_snapshot.snapshot_id == baseline.id,
+                location_snapshot.sku_id.in_(select(rebuilt.c.sku_id))
+            )
+        )
+        sku_snapshot = InventorySKUTotalSnapshot
+        sku_selects.append(
+            select(
+                sku_snapshot.sku_id, literal(0), sku_snapshot.updated_at, literal(0), sku_snapshot.total_weight, literal(1)
+            ).where(sku_snapshot.snapshot_id == baseline.id, sku_snapshot.sku_id.in_(select(rebuilt.c.sku_id)))
+        )
+        report["baseline_snapshot_id"] = baseline.id
+    location_weights = _cell_weights(union_all(*location_selects).subquery(), ["sku_id", "location_id"])
+    sku_weights = _cell_weights(union_all(*sku_selects).subquery(), ["sku_id"])
+
+    db.execute(delete(InventoryLocationTotal).where(InventoryLocationTotal.sku_id.in_(select(rebuilt.c.sku_id))))
+    db.execute(delete(InventorySKUTotal).where(InventorySKUTotal.sku_id.in_(select(rebuilt.c.sku_id))))
+    report["location_totals"] = db.execute(insert(InventoryLocationTotal).from_select(
+        ["sku_id", "sku_name", "location_name", "weight", "quantity"],
+        select(
+            location_weights.c.sku_id, rebuilt.c.sku_name, InventoryLocation.name, location_weights.c.weight, literal(0)
+        ).join(rebuilt, rebuilt.c.sku_id == location_weights.c.sku_id).join(
+            InventoryLocation, InventoryLocation.id == location_weights.c.location_id
+        )
+    )).rowcount
+    report["sku_totals"] = db.execute(insert(InventorySKUTotal).from_select(
+        ["sku_id", "sku_name", "total_weight", "total_quantity"],
+        select(sku_weights.c.sku_id, rebuilt.c.sku_name, sku_weights.c.weight, literal(0)).join(
+            rebuilt, rebuilt.c.sku_id == sku_weights.c.sku_id
+        )
+    )).rowcount
+    rebuilt.drop(db.connection())
+    db.commit()
+    logger.info(
+        f"Остатки {len(skus)} SKU пересобраны из журнала: {report['location_totals']} строк по локациям, "
+        f"{report['sku_totals']} по SKU"
+    )
+    return report
+
+
+def load_catalog_csv(path: str) -> Dict[int, str]:
+    """Товары из выгрузки каталога (GET /catalog/skus/export/csv): {ID: название}"""
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        reader = csv.DictReader(file)
+        return {int(row["ID"]): row["Название"] for row in reader if row.get("ID")}
+
+
+def _open_lines(path: str) -> Iterator[str]:
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Загрузка исторического журнала операций")
+    parser.add_argument("path", help="Файл журнала CSV (.gz - сжатый, '-' - stdin)")
+    parser.add_argument("--catalog-csv", default=None, help="Выгрузка каталога вместо запроса к Catalog Service")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Строк в порции (транзакции)")
+    parser.add_argument("--skip-rows", type=int, default=0, help="Сколько первых строк уже загружено")
+    parser.add_argument("--strict", action="store_true", help="Остановиться на первой порции с ошибками")
+    parser.add_argument("--no-rebuild", action="store_true", help="Не пересобирать остатки после загрузки")
+    args = parser.parse_args(argv)
+
+    if args.catalog_csv:
+        skus = load_catalog_csv(args.catalog_csv)
+    else:
+        skus = asyncio.run(catalog_client.list_skus())
+        if skus is None:
+            raise SystemExit(f"Каталог недоступен ({settings.CATALOG_SERVICE_URL}), укажите --catalog-csv")
+    logger.info(f"Товаров в каталоге: {len(skus)}")
+
+    db = SessionLocal()
+    try:
+        if not args.no_rebuild:
+            try:
+                SnapshotService.ledger_baseline(db)  # Без базы пересборки не загружаем
+            except LedgerBaselineError as e:
+                raise SystemExit(str(e))
+        importer = LedgerImporter(db, skus, args.chunk_rows, args.skip_rows, args.strict)
+        lines = _open_lines(args.path)
+        try:
+            report = importer.run(lines)
+        finally:
+            lines.close()
+        print(
+            f"Строк: {report['rows_read']}, загружено: {report['rows_imported']}, "
+            f"пропущено: {report['rows_skipped']}, отклонено: {report['rows_rejected']}, "
+            f"{report['import_seconds']} с ({report['rows_per_second']:,.0f} строк/с)"
+        )
+        for error in report["errors"]:
+            print(error)
+        if not args.no_rebuild:
+            rebuild = importer.rebuild()
+            print(
+                f"Пересобраны остатки {rebuild['skus']} SKU: по локациям {rebuild['location_totals']}, "
+                f"по SKU {rebuild['sku_totals']}, сводок исправлено {rebuild['rollups_repaired']}, "
+                f"строк движения {rebuild['movement_rows']}, {rebuild['rebuild_seconds']} с"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
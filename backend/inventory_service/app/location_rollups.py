@@ -0,0 +1,151 @@
+"""
+Сводка остатков по локациям (inventory_location_rollups)
+
+Суммарный вес и количество SKU по локации ведутся инкрементально: каждое изменение веса строки
+inventory_location_totals в той же транзакции применяется к строке сводки одним атомарным
+INSERT ... ON CONFLICT DO UPDATE с приращениями. Чтение сводки стоит O(локаций), а не O(строк остатков).
+
+Строка сводки одна на локацию, поэтому транзакции, меняющие остатки одной локации,
+ждут друг друга на ее блокировке до commit.
+
+Периодическая проверка сравнивает сводку с GROUP BY по inventory_location_totals
+и исправляет расхождения (например, после ручных правок остатков).
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, case, text
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, upsert
+from app.models import InventoryLocationTotal, InventoryLocationRollup
+
+logger = logging.getLogger(__name__)
+
+
+def apply_weight_change(db: Session, location_name: Optional[str], old_weight: int, new_weight: int):
+    """
+    Учесть в сводке изменение веса строки остатков (old_weight -> new_weight) в текущей транзакции
+
+    Args:
+        db: Сессия БД
+        location_name: Локация (None - без локации, в сводку не попадает)
+        old_weight: Вес строки до изменения (0 для новой строки)
+        new_weight: Вес строки после изменения
+    """
+    apply_delta(db, location_name, new_weight - old_weight, int(new_weight != 0) - int(old_weight != 0))
+
+
+def apply_delta(db: Session, location_name: Optional[str], weight_delta: int, sku_count_delta: int):
+    """Применить к сводке локации суммарные приращения веса и количества SKU (для пачки строк одной локации)"""
+    if not location_name or (not weight_delta and not sku_count_delta):
+        return
+
+    statement = upsert(db, InventoryLocationRollup).values(
+        location_name=location_name,
+        total_weight=weight_delta,
+        sku_count=sku_count_delta
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[InventoryLocationRollup.location_name],
+        set_={
+            "total_weight": InventoryLocationRollup.total_weight + weight_delta,
+            "sku_count": InventoryLocationRollup.sku_count + sku_count_delta,
+            "updated_at": func.now(),
+        }
+    ))
+
+
+def get_rollups(db: Session) -> List[InventoryLocationRollup]:
+    """Сводка по всем локациям"""
+    return db.query(InventoryLocationRollup).order_by(InventoryLocationRollup.location_name).all()
+
+
+def _aggregate_details(db: Session) -> Dict[str, Tuple[int, int]]:
+    """Эталон сводки одним GROUP BY по inventory_location_totals: {локация: (вес, количество SKU)}"""
+    rows = db.execute(
+        select(
+            InventoryLocationTotal.location_name,
+            func.coalesce(func.sum(InventoryLocationTotal.weight), 0),
+            func.count(case((InventoryLocationTotal.weight != 0, InventoryLocationTotal.sku_id)))
+        ).group_by(InventoryLocationTotal.location_name)
+    ).all()
+    return {location_name: (int(total_weight), sku_count) for location_name, total_weight, sku_count in rows}
+
+
+def _find_mismatches(db: Session) -> List[Dict]:
+    expected = _aggregate_details(db)
+    actual = {
+        location_name: (total_weight, sku_count)
+        for location_name, total_weight, sku_count in db.execute(
+            select(
+                InventoryLocationRollup.location_name,
+                InventoryLocationRollup.total_weight,
+                InventoryLocationRollup.sku_count
+            )
+        ).all()
+    }
+    mismatches = []
+    for location_name in sorted(expected.keys() | actual.keys()):
+        # Нет строки - то же, что пустая локация
+        expected_values = expected.get(location_name, (0, 0))
+        actual_values = actual.get(location_name, (0, 0))
+        if expected_values != actual_values:
+            mismatches.append({
+                "location_name": location_name,
+                "expected": expected_values,
+                "actual": actual_values
+            })
+    return mismatches
+
+
+def verify_rollups(db: Session, repair: bool = True) -> Dict:
+    """
+    Сверить сводку с остатками по локациям и при repair исправить расхождения
+
+    Сначала сверка идет без блокировок. Если расхождения найдены, в PostgreSQL сводка блокируется
+    в режиме EXCLUSIVE (чтение не блокируется, изменения остатков ждут), сверка повторяется
+    и сводка перезаписывается значениями из остатков. Так расхождения от транзакций,
+    которые еще не закоммичены, не принимаются за ошибку и не затираются.
+
+    Returns:
+        Отчет: расхождения (expected/actual - пары (вес, количество SKU)) и количество исправленных
+    """
+    mismatches = _find_mismatches(db)
+    report = {"mismatch_count": len(mismatches), "repaired": 0, "mismatches": mismatches}
+    if not mismatches or not repair:
+        db.rollback()
+        return report
+
+    db.rollback()
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE inventory_location_rollups IN EXCLUSIVE MODE"))
+    mismatches = _find_mismatches(db)
+    for mismatch in mismatches:
+        total_weight, sku_count = mismatch["expected"]
+        statement = upsert(db, InventoryLocationRollup).values(
+            location_name=mismatch["location_name"], total_weight=total_weight, sku_count=sku_count
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[InventoryLocationRollup.location_name],
+            set_={"total_weight": total_weight, "sku_count": sku_count, "updated_at": func.now()}
+        ))
+    db.commit()
+
+    report.update(mismatch_count=len(mismatches), repaired=len(mismatches), mismatches=mismatches)
+    if mismatches:
+        logger.warning(f"Исправлено {len(mismatches)} расхождений сводки по локациям: {mismatches[:10]}")
+    return report
+
+
+def run_verification() -> Dict:
+    """Сверить и исправить сводку по локациям (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        return verify_rollups(db)
+    except Exception as e:
+        logger.error(f"Ошибка при сверке сводки по локациям: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,191 @@
+"""
+Словарь локаций (inventory_locations): название локации <-> компактный целочисленный id
+
+Журнал операций хранит source_location_id/target_location_id вместо повторяющегося в каждой строке
+и в каждом индексе названия String(100). На границе API по-прежнему принимаются и отдаются названия:
+InventoryOperation.source_location/target_location переводятся в id при flush и обратно при чтении
+через словарь в памяти процесса (локаций - десятки, словарь загружается целиком).
+
+Новая локация добавляется в словарь в той же транзакции, что и первая операция с ней
+(INSERT ... ON CONFLICT DO NOTHING), и попадает в кэш процесса только после commit.
+Периодическая синхронизация с Warehouse Service добавляет его локации и сохраняет их id
+(warehouse_location_id), чтобы журнал можно было сопоставлять с локациями склада по id.
+
+Остатки по локациям, сводки и отчеты по-прежнему ключуются названием: это одна строка на
+(SKU, локация) или на локацию, тогда как журнал растет с каждой операцией.
+"""
+import logging
+import threading
+import weakref
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal, upsert
+from app.models import InventoryLocation, InventoryOperation
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "new_locations"
+
+
+class LocationDictionary:
+    """Кэш словаря локаций в памяти процесса (отдельный для каждой БД)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _cache(self, db: Session) -> Tuple[Dict[str, int], Dict[int, str]]:
+        bind = db.get_bind()
+        with self._lock:
+            cache = self._caches.get(bind)
+            if cache is None:
+                cache = self._caches[bind] = ({}, {})
+            return cache
+
+    def _remember(self, db: Session, locations: Dict[str, int]):
+        ids, names = self._cache(db)
+        with self._lock:
+            for name, location_id in locations.items():
+                ids[name] = location_id
+                names[location_id] = name
+
+    def load(self, db: Session):
+        """Загрузить словарь целиком (кроме локаций, добавленных еще не закоммиченной транзакцией)"""
+        uncommitted = db.info.get(SESSION_KEY, {})
+        self._remember(db, {
+            name: location_id
+            for name, location_id in db.execute(select(InventoryLocation.name, InventoryLocation.id)).all()
+            if name not in uncommitted
+        })
+
+    def names(self, db: Session) -> Dict[int, str]:
+        """Все локации словаря: {id: название}"""
+        self.load(db)
+        names = self._cache(db)[1]
+        with self._lock:
+            return dict(names)
+
+    def name_of(self, db: Optional[Session], location_id: Optional[int]) -> Optional[str]:
+        """Название локации по id (неизвестный id - перезагрузка словаря)"""
+        if location_id is None or db is None:
+            return None
+        names = self._cache(db)[1]
+        name = names.get(location_id)
+        if name is None:
+            self.load(db)
+            name = names.get(location_id)
+        return name
+
+    def id_of(self, db: Session, name: Optional[str], create: bool = True) -> Optional[int]:
+        """
+        id локации по названию
+
+        Args:
+            create: Добавить отсутствующую локацию в словарь в текущей транзакции
+                (иначе для неизвестной локации возвращается None)
+        """
+        if not name:
+            return None
+        location_id = self._cache(db)[0].get(name)
+        if location_id is not None:
+            return location_id
+        new_locations: Dict[str, int] = db.info.get(SESSION_KEY, {})
+        if name in new_locations:
+            return new_locations[name]
+
+        if create:
+            db.execute(upsert(db, InventoryLocation).values(name=name).on_conflict_do_nothing(
+                index_elements=[InventoryLocation.name]
+            ))
+        location_id = db.execute(select(InventoryLocation.id).where(InventoryLocation.name == name)).scalar()
+        if location_id is not None:
+            # Строка словаря могла быть создана этой транзакцией - в кэш процесса только после commit
+            db.info.setdefault(SESSION_KEY, {})[name] = location_id
+        return location_id
+
+    def sync(self, db: Session, warehouse_locations: List[Dict]) -> Dict:
+        """
+        Синхронизировать словарь с локациями Warehouse Service
+
+        Локации добавляются по названию, для существующих сохраняется warehouse_location_id.
+        Локации, которых нет на складе, остаются в словаре: на них ссылается журнал.
+
+        Returns:
+            Количество локаций склада и добавленных в словарь
+        """
+        now = datetime.now(timezone.utc)
+        known = set(self.names(db).values())
+        added = 0
+        for location in warehouse_locations:
+            name, warehouse_id = location["name"], location["id"]
+            # id склада мог перейти к локации с другим названием (переименование на складе)
+            db.execute(update(InventoryLocation).where(
+                InventoryLocation.warehouse_location_id == warehouse_id,
+                InventoryLocation.name != name
+            ).values(warehouse_location_id=None))
+            statement = upsert(db, InventoryLocation).values(name=name, warehouse_location_id=warehouse_id, synced_at=now)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[InventoryLocation.name],
+                set_={"warehouse_location_id": warehouse_id, "synced_at": now}
+            ))
+            added += name not in known
+        db.commit()
+        self.load(db)
+        return {"warehouse_locations": len(warehouse_locations), "added": added}
+
+
+# Глобальный словарь локаций
+location_dictionary = LocationDictionary()
+
+
+def fetch_warehouse_locations() -> Optional[List[Dict]]:
+    """Локации Warehouse Service (None - сервис недоступен)"""
+    try:
+        response = httpx.get(f"{settings.WAREHOUSE_SERVICE_URL}/warehouse/locations", timeout=10.0)
+        if response.status_code == 200:
+            return response.json()
+        logger.error(f"Failed to fetch warehouse locations: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Error fetching locations from Warehouse Service: {e}")
+    return None
+
+
+def run_sync() -> Optional[Dict]:
+    """Синхронизировать словарь локаций с Warehouse Service (периодическая задача)"""
+    warehouse_locations = fetch_warehouse_locations()
+    if warehouse_locations is None:
+        return None
+    db = SessionLocal()
+    try:
+        return location_dictionary.sync(db, warehouse_locations)
+    finally:
+        db.close()
+
+
+@event.listens_for(Session, "before_flush")
+def _resolve_location_ids(session: Session, flush_context, instances):
+    """Перевести названия локаций записываемых операций в id словаря"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, InventoryOperation):
+            continue
+        for kind in obj.__dict__.pop("_pending_locations", ()):
+            name = obj.__dict__.get(f"_{kind}_location_name")
+            setattr(obj, f"{kind}_location_id", location_dictionary.id_of(session, name))
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_new_locations(session: Session):
+    new_locations = session.info.pop(SESSION_KEY, None)
+    if new_locations:
+        location_dictionary._remember(session, new_locations)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_new_locations(session: Session):
+    session.info.pop(SESSION_KEY, None)
@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.routers import inventory
 from app.database import engine, Base
 from app.config import settings
+import asyncio
 import logging
 import os
 from alembic.config import Config
@@ -44,22 +45,121 @@ def run_migrations():
         # Продолжаем работу даже если миграции не удались (для отладки)
 
 
+async def run_periodically(job, interval_seconds: int, name: str, run_first: bool = True):
+    """Периодически выполнять синхронную задачу в отдельном потоке"""
+    if not run_first:
+        await asyncio.sleep(interval_seconds)
+    while True:
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            logger.error(f"Ошибка в периодической задаче '{name}': {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+background_tasks = []
+
+
 @app.on_event("startup")
 async def startup_event():
     run_migrations()
+    # Поток изменений: коммиты из рабочих потоков публикуются через event loop сервиса
+    from app.change_stream import change_stream
+    change_stream.bind_loop(asyncio.get_running_loop())
     # Инициализация тестовых данных
     try:
         from app.init_data import init_location_items
         init_location_items()
     except Exception as e:
         logger.warning(f"Не удалось инициализировать тестовые данные: {e}")
-    # RabbitMQ consumer отключен - используем прямые HTTP вызовы из Catalog Service
-    # Это проще и надежнее для MVP
-    logger.info("Inventory Service started - using direct HTTP calls from Catalog Service")
+    # Индекс остатков в памяти: строится до приема запросов, затем периодически перестраивается
+    if settings.STOCK_INDEX_ENABLED:
+        from app.stock_index import run_rebuild
+        try:
+            await asyncio.to_thread(run_rebuild)
+        except Exception as e:
+            logger.error(f"Не удалось построить индекс остатков: {e}")
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_rebuild, settings.STOCK_INDEX_REBUILD_INTERVAL_SECONDS, "stock_index", run_first=False)
+        ))
+    # Потребитель событий RabbitMQ работает в event loop сервиса.
+    # Выключен по умолчанию: Catalog Service пока дублирует изменения прямыми HTTP вызовами
+    if settings.EVENT_CONSUMER_ENABLED:
+        from app.event_consumer import event_consumer
+        background_tasks.append(asyncio.create_task(event_consumer.run()))
+        logger.info("Inventory Service started - consuming catalog events from RabbitMQ")
+    else:
+        logger.info("Inventory Service started - using direct HTTP calls from Catalog Service")
+    # Применение асинхронно принятых операций (POST /inventory/operations?async=true)
+    from app.intake import intake_applier
+    background_tasks.append(asyncio.create_task(intake_applier.run()))
+    # Синхронизация словаря локаций журнала с Warehouse Service
+    if settings.LOCATION_SYNC_INTERVAL_SECONDS > 0:
+        from app.locations import run_sync
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_sync, settings.LOCATION_SYNC_INTERVAL_SECONDS, "locations")
+        ))
+    # Создание будущих партиций и архивация старых по политике хранения
+    from app.partitioning import run_maintenance
+    background_tasks.append(asyncio.create_task(
+        run_periodically(run_maintenance, settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS, "partitions")
+    ))
+    # Снимки остатков для запросов на дату: раз в час проверяем, не пора ли снять очередной снимок
+    if settings.SNAPSHOT_INTERVAL_SECONDS > 0:
+        from app.snapshots import run_snapshot
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_snapshot, min(settings.SNAPSHOT_INTERVAL_SECONDS, 3600), "snapshots")
+        ))
+    # Сверка сводки по локациям с остатками (при запуске исправляет и сводку после init_data)
+    if settings.LOCATION_ROLLUP_VERIFY_INTERVAL_SECONDS > 0:
+        from app.location_rollups import run_verification
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_verification, settings.LOCATION_ROLLUP_VERIFY_INTERVAL_SECONDS, "location_rollups")
+        ))
+    # Проекция цен каталога для оценки запасов: полное обновление при запуске и периодически
+    if settings.SKU_PRICE_REFRESH_INTERVAL_SECONDS > 0:
+        from app.sku_prices import run_refresh
+        background_tasks.append(asyncio.create_task(run_refresh()))
+    # ABC/XYZ-анализ и оборачиваемость: пересчет, когда закрывается новый день
+    if settings.ANALYTICS_INTERVAL_SECONDS > 0:
+        from app.analytics import run_analytics
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_analytics, settings.ANALYTICS_INTERVAL_SECONDS, "analytics")
+        ))
+    # Прогноз спроса для пополнения складов: пересчет, когда закрывается новый день
+    if settings.FORECAST_REFRESH_INTERVAL_SECONDS > 0:
+        from app.forecasting import run_refresh as run_forecast_refresh
+        background_tasks.append(asyncio.create_task(
+            run_periodically(run_forecast_refresh, settings.FORECAST_REFRESH_INTERVAL_SECONDS, "forecasts")
+        ))
+    # Аналитическая выгрузка в Parquet (pyarrow импортируется только при включенной выгрузке)
+    if settings.PARQUET_EXPORT_INTERVAL_SECONDS > 0:
+        from app.parquet_export import run_export
+        background_tasks.append(asyncio.create_task(run_export()))
+    # Удаление ключей идемпотентности с истекшим сроком хранения
+    from app.idempotency import run_cleanup
+    background_tasks.append(asyncio.create_task(
+        run_periodically(run_cleanup, settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS, "idempotency_keys")
+    ))
+    # Удаление обработанных квитанций асинхронного приема с тем же сроком хранения
+    from app.intake import run_purge
+    background_tasks.append(asyncio.create_task(
+        run_periodically(run_purge, settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS, "intake_tickets")
+    ))
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if settings.EVENT_CONSUMER_ENABLED:
+        from app.event_consumer import event_consumer
+        await event_consumer.stop()
+    for task in background_tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    background_tasks.clear()
     logger.info("Inventory Service shutting down")
 
 
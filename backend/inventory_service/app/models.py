@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, UniqueConstraint
+from sqlalchemy import Column, Integer, Float, String, Date, DateTime, Numeric, UniqueConstraint, Index, ForeignKey, JSON, select
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import object_session
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -13,13 +15,56 @@ class OperationType(str):
     TRANSFER = "transfer"  # Перемещение товара
 
 
+class InventoryLocation(Base):
+    """
+    Словарь локаций: компактный id для журнала операций (app/locations.py).
+    Пополняется при записи операций с новой локацией и синхронизацией с Warehouse Service
+    """
+    __tablename__ = "inventory_locations"
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, unique=True)  # Название локации
+    warehouse_location_id = Column(Integer, nullable=True, unique=True)  # ID локации в Warehouse Service
+    synced_at = Column(DateTime(timezone=True), nullable=True)  # Последняя синхронизация с Warehouse Service
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+def _get_location(operation, kind: str):
+    """Название локации операции: заданное в этом процессе или по id из словаря"""
+    name = operation.__dict__.get(f"_{kind}_location_name")
+    if name is None:
+        location_id = getattr(operation, f"{kind}_location_id")
+        if location_id is not None:
+            from app.locations import location_dictionary
+            name = location_dictionary.name_of(object_session(operation), location_id)
+            operation.__dict__[f"_{kind}_location_name"] = name
+    return name
+
+
+def _set_location(operation, kind: str, name):
+    # id подставляется при flush (app/locations.py), чтобы новая локация попала в словарь в той же транзакции
+    operation.__dict__[f"_{kind}_location_name"] = name or None
+    setattr(operation, f"{kind}_location_id", None)
+    if name:
+        operation.__dict__.setdefault("_pending_locations", set()).add(kind)
+
+
 class InventoryOperation(Base):
-    """Операция с товаром"""
+    """
+    Операция с товаром.
+    В PostgreSQL таблица партиционирована по месяцам по created_at (миграция 002),
+    первичный ключ физически (id, created_at); обслуживание партиций - app/partitioning.py.
+    Локации хранятся как id словаря inventory_locations (миграция 009); source_location и target_location -
+    названия: их можно задавать и читать как раньше, в SQL-выражениях это подзапрос к словарю
+    (в частых запросах фильтруйте по source_location_id/target_location_id)
+    """
     __tablename__ = "inventory_operations"
     
-    id = Column(Integer, primary_key=True, index=True)
-    operation_type = Column(String(20), nullable=False, index=True)  # create/update/delete/receipt/write_off/transfer
-    sku_id = Column(Integer, nullable=False, index=True)  # ID товара из Catalog Service
+    # В метаданных ключ - только id: составной (id, created_at) не дал бы SQLite (тесты) выдавать id автоматически.
+    # Отдельного индекса по id нет (миграция 002): поиск по id в PostgreSQL идет по первичному ключу
+    id = Column(Integer, primary_key=True)
+    operation_type = Column(String(20), nullable=False)  # create/update/delete/receipt/write_off/transfer
+    sku_id = Column(Integer, nullable=False)  # ID товара из Catalog Service
     sku_name = Column(String(15), nullable=False)  # Название товара
     quantity_value = Column(Integer, nullable=False)  # Значение количества (целое число)
     quantity_unit = Column(String(20), nullable=False)  # Единица количества (шт/уп/ящ/пал)
@@ -27,9 +72,46 @@ class InventoryOperation(Base):
     weight_unit = Column(String(20), nullable=False)  # Единица веса (кг/г/т)
     delta_value = Column(Integer, nullable=False)  # Итоговое значение = количество*вес (например: +15 или -290)
     delta_unit = Column(String(20), nullable=False, default="кг")  # Единица итогового значения (обычно кг)
-    source_location = Column(String(100), nullable=True)  # Начальная локация
-    target_location = Column(String(100), nullable=True)  # Конечная локация (если одна локация, то = source_location)
+    source_location_id = Column(Integer, ForeignKey("inventory_locations.id"), nullable=True)  # Начальная локация
+    target_location_id = Column(Integer, ForeignKey("inventory_locations.id"), nullable=True)  # Конечная локация (если одна локация, то = source)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    # Индексы под фильтры журнала с сортировкой по created_at (миграции 003, 009)
+    __table_args__ = (
+        Index('ix_inventory_operations_sku_id_created_at', 'sku_id', 'created_at'),
+        Index('ix_inventory_operations_operation_type_created_at', 'operation_type', 'created_at'),
+        Index('ix_inventory_operations_source_location_id_created_at', 'source_location_id', 'created_at'),
+        Index('ix_inventory_operations_target_location_id_created_at', 'target_location_id', 'created_at'),
+        Index('ix_inventory_operations_created_at_brin', 'created_at', postgresql_using='brin'),
+    )
+    
+    @hybrid_property
+    def source_location(self):
+        """Начальная локация (название)"""
+        return _get_location(self, "source")
+    
+    @source_location.inplace.setter
+    def _source_location_setter(self, name):
+        _set_location(self, "source", name)
+    
+    @source_location.inplace.expression
+    @classmethod
+    def _source_location_expression(cls):
+        return select(InventoryLocation.name).where(InventoryLocation.id == cls.source_location_id).scalar_subquery()
+    
+    @hybrid_property
+    def target_location(self):
+        """Конечная локация (название)"""
+        return _get_location(self, "target")
+    
+    @target_location.inplace.setter
+    def _target_location_setter(self, name):
+        _set_location(self, "target", name)
+    
+    @target_location.inplace.expression
+    @classmethod
+    def _target_location_expression(cls):
+        return select(InventoryLocation.name).where(InventoryLocation.id == cls.target_location_id).scalar_subquery()
 
 
 class InventorySKUTotal(Base):
@@ -61,3 +143,258 @@ class InventoryLocationTotal(Base):
         UniqueConstraint('sku_id', 'location_name', name='uq_inventory_location_sku_location'),
     )
 
+
+class InventoryLocationRollup(Base):
+    """
+    Сводка по локации: сумма и количество ненулевых строк inventory_location_totals.
+    Ведется инкрементально в той же транзакции, что и остатки (app/location_rollups.py)
+    """
+    __tablename__ = "inventory_location_rollups"
+    
+    location_name = Column(String(100), primary_key=True)  # Название локации из Warehouse Service
+    total_weight = Column(Integer, nullable=False, default=0)  # Суммарный вес в локации (в кг)
+    sku_count = Column(Integer, nullable=False, default=0)  # Количество SKU с ненулевым весом
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class InventoryStockThreshold(Base):
+    """
+    Порог остатка для оповещений (app/stock_alerts.py).
+    SKU + локация - остаток товара в локации, только SKU - абсолютный остаток товара,
+    только локация - суммарный вес в локации (заполненность)
+    """
+    __tablename__ = "inventory_stock_thresholds"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    sku_id = Column(Integer, nullable=True)  # ID товара из Catalog Service
+    location_name = Column(String(100), nullable=True)  # Локация
+    min_weight = Column(Integer, nullable=True)  # Ниже - low_stock (в кг)
+    max_weight = Column(Integer, nullable=True)  # Выше - over_capacity (в кг)
+    state = Column(String(10), nullable=False, default="ok")  # ok/low/high - последнее оповещенное состояние
+    state_changed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_inventory_stock_thresholds_sku_location', 'sku_id', 'location_name'),
+    )
+
+
+class InventorySKUPrice(Base):
+    """
+    Проекция цен каталога для оценки запасов (app/sku_prices.py).
+    Обновляется по sku.created/sku.updated и периодически целиком из Catalog Service
+    """
+    __tablename__ = "inventory_sku_prices"
+    
+    sku_id = Column(Integer, primary_key=True)  # ID товара из Catalog Service
+    price = Column(Float, nullable=True)  # Цена единицы товара (None - цена не задана)
+    currency = Column(String(20), nullable=True)  # Единица цены (руб/USD/EUR)
+    unit_weight = Column(Float, nullable=True)  # Вес единицы товара в кг
+    price_per_kg = Column(Float, nullable=True)  # Цена килограмма (None - оценить нельзя)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class InventorySKUAnalytics(Base):
+    """
+    ABC/XYZ-класс и оборачиваемость товара за окно анализа (app/analytics.py).
+    Пересчитывается целиком периодической задачей из дневного агрегата движения
+    """
+    __tablename__ = "inventory_sku_analytics"
+    
+    sku_id = Column(Integer, primary_key=True)  # ID товара из Catalog Service
+    abc_class = Column(String(1), nullable=True)  # A/B/C по вкладу в расход (None - нет цены при оценке по стоимости)
+    xyz_class = Column(String(1), nullable=True)  # X/Y/Z по вариации спроса (None - расхода не было)
+    abc_rank = Column(Integer, nullable=True)  # Место по вкладу в расход (1 - наибольший)
+    demand_weight = Column(Integer, nullable=False, default=0)  # Расход (списания) за окно (в кг)
+    demand_value = Column(Float, nullable=True)  # Расход в стоимостном выражении (None - нет цены)
+    value_share = Column(Float, nullable=True)  # Доля в суммарном расходе
+    cumulative_share = Column(Float, nullable=True)  # Накопленная доля с учетом товаров выше по рангу
+    demand_cv = Column(Float, nullable=True)  # Коэффициент вариации расхода по периодам окна
+    average_stock = Column(Float, nullable=False, default=0)  # Средний остаток за окно (в кг)
+    turnover = Column(Float, nullable=True)  # Оборачиваемость: расход / средний остаток
+    window_from = Column(Date, nullable=False)  # Первый день окна
+    window_to = Column(Date, nullable=False)  # День после последнего дня окна
+    computed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_inventory_sku_analytics_classes', 'abc_class', 'xyz_class'),
+    )
+
+
+class InventoryLocationTurnover(Base):
+    """Оборачиваемость локации за окно анализа (app/analytics.py)"""
+    __tablename__ = "inventory_location_turnover"
+    
+    location_name = Column(String(100), primary_key=True)  # Название локации из Warehouse Service
+    outbound_weight = Column(Integer, nullable=False, default=0)  # Убыло за окно: списания и перемещения (в кг)
+    average_stock = Column(Float, nullable=False, default=0)  # Средний остаток за окно (в кг)
+    turnover = Column(Float, nullable=True)  # Оборачиваемость: убыло / средний остаток
+    days_of_supply = Column(Float, nullable=True)  # На сколько дней хватит среднего остатка при среднем расходе
+    window_from = Column(Date, nullable=False)
+    window_to = Column(Date, nullable=False)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class InventoryDemandForecast(Base):
+    """
+    Прогноз спроса по товару в локации (app/forecasting.py): кэш, пересчитывается по расписанию
+    из дневного агрегата движения. Ячеек без расхода за историю в таблице нет (спрос 0)
+    """
+    __tablename__ = "inventory_demand_forecasts"
+    
+    sku_id = Column(Integer, primary_key=True)  # ID товара из Catalog Service
+    location_name = Column(String(100), primary_key=True)  # Локация
+    moving_average = Column(Float, nullable=False)  # Скользящее среднее расхода (кг в день)
+    smoothed = Column(Float, nullable=False)  # Экспоненциальное сглаживание расхода (кг в день)
+    history_from = Column(Date, nullable=False)  # Первый день истории
+    history_to = Column(Date, nullable=False)  # День после последнего дня истории
+    computed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('ix_inventory_demand_forecasts_location', 'location_name'),
+    )
+
+
+class InventoryForecastRun(Base):
+    """
+    Последний пересчет прогноза спроса (app/forecasting.py). Хранится отдельно от строк прогноза:
+    пересчет, не нашедший расхода, не оставляет строк, но прогноз при этом посчитан (спрос 0)
+    """
+    __tablename__ = "inventory_forecast_runs"
+    
+    id = Column(Integer, primary_key=True)
+    history_from = Column(Date, nullable=False)  # Первый день истории
+    history_to = Column(Date, nullable=False)  # День после последнего дня истории
+    cells = Column(Integer, nullable=False)  # Ячеек с расходом (строк прогноза)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class InventoryOperationIntake(Base):
+    """
+    Принятая к асинхронному применению операция (квитанция, app/intake.py).
+    Строка пишется до ответа 202 и переводится в applied в одной транзакции с записью операции в журнал
+    """
+    __tablename__ = "inventory_operation_intake"
+    
+    id = Column(Integer, primary_key=True)  # Номер квитанции
+    operation_type = Column(String(50), nullable=False)  # receipt/write_off/transfer
+    sku_id = Column(Integer, nullable=False)
+    quantity_value = Column(Integer, nullable=False)
+    quantity_unit = Column(String(50), nullable=False)
+    weight_value = Column(Integer, nullable=False)
+    weight_unit = Column(String(50), nullable=False)
+    source_location = Column(String(100), nullable=True)
+    target_location = Column(String(100), nullable=True)
+    idempotency_key = Column(String(255), nullable=True, unique=True)  # Повтор с тем же ключом - та же квитанция
+    request_hash = Column(String(64), nullable=True)  # SHA-256 тела запроса (для проверки повторов)
+    status = Column(String(20), nullable=False, default="pending")  # pending/applied/failed
+    operation_id = Column(Integer, nullable=True)  # ID операции журнала после применения
+    error = Column(String(500), nullable=True)  # Причина failed
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    processed_at = Column(DateTime(timezone=True), nullable=True)  # Применена или отклонена
+    
+    __table_args__ = (
+        Index('ix_inventory_operation_intake_status_id', 'status', 'id'),
+    )
+
+
+class InventoryDailyMovement(Base):
+    """
+    Движение товара за день по локации и типу операции (отчеты по движению, app/movements.py).
+    Ведется инкрементально при записи операций и может быть пересобрано из журнала
+    """
+    __tablename__ = "inventory_daily_movements"
+    
+    day = Column(Date, primary_key=True)  # День операции (по created_at)
+    sku_id = Column(Integer, primary_key=True)  # ID товара из Catalog Service
+    location_name = Column(String(100), primary_key=True)  # Локация
+    operation_type = Column(String(20), primary_key=True)  # Тип операции
+    inbound_weight = Column(Integer, nullable=False, default=0)  # Поступило в локацию (в кг)
+    outbound_weight = Column(Integer, nullable=False, default=0)  # Убыло из локации (в кг)
+    inbound_count = Column(Integer, nullable=False, default=0)  # Количество операций поступления
+    outbound_count = Column(Integer, nullable=False, default=0)  # Количество операций убытия
+    
+    __table_args__ = (
+        # Отчеты по товару за период без полного перебора дней
+        Index('ix_inventory_daily_movements_sku_day', 'sku_id', 'day'),
+    )
+
+
+class InventorySnapshot(Base):
+    """Снимок остатков на момент времени (для запросов остатков на дату)"""
+    __tablename__ = "inventory_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    taken_at = Column(DateTime(timezone=True), nullable=False, unique=True, index=True)  # Момент, на который сняты остатки
+    location_rows = Column(Integer, nullable=False, default=0)  # Количество строк остатков по локациям
+    sku_rows = Column(Integer, nullable=False, default=0)  # Количество строк остатков по SKU
+    operation_id_mark = Column(Integer, nullable=False, default=0)  # Максимальный ID операции журнала, учтенной в снимке
+
+
+class InventoryLocationTotalSnapshot(Base):
+    """Остатки по локациям в снимке"""
+    __tablename__ = "inventory_location_total_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    snapshot_id = Column(Integer, ForeignKey("inventory_snapshots.id", ondelete="CASCADE"), nullable=False)
+    total_id = Column(Integer, nullable=True)  # ID строки inventory_location_totals
+    sku_id = Column(Integer, nullable=False)
+    sku_name = Column(String(15), nullable=False)
+    location_name = Column(String(100), nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)
+    weight = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False)  # updated_at исходной строки
+    
+    __table_args__ = (
+        Index('ix_inventory_location_total_snapshots_snapshot_location', 'snapshot_id', 'location_name', 'sku_id'),
+        Index('ix_inventory_location_total_snapshots_snapshot_sku', 'snapshot_id', 'sku_id'),
+    )
+
+
+class InventorySKUTotalSnapshot(Base):
+    """Абсолютные остатки по SKU в снимке"""
+    __tablename__ = "inventory_sku_total_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    snapshot_id = Column(Integer, ForeignKey("inventory_snapshots.id", ondelete="CASCADE"), nullable=False)
+    total_id = Column(Integer, nullable=True)  # ID строки inventory_sku_totals
+    sku_id = Column(Integer, nullable=False)
+    sku_name = Column(String(15), nullable=False)
+    total_quantity = Column(Integer, nullable=False, default=0)
+    total_weight = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False)  # updated_at исходной строки
+    
+    __table_args__ = (
+        Index('ix_inventory_sku_total_snapshots_snapshot_sku', 'snapshot_id', 'sku_id'),
+    )
+
+
+class InventoryOperationArchive(Base):
+    """
+    Партиция журнала, выгруженная в архив и отключенная от inventory_operations (app/partitioning.py).
+    Пока такие записи есть, журнал в БД неполон: пересборка остатков начинается со снимка (app/snapshots.py)
+    """
+    __tablename__ = "inventory_operation_archives"
+    
+    partition_name = Column(String(63), primary_key=True)  # Имя партиции (inventory_operations_yYYYYmMM)
+    month = Column(Date, nullable=False)  # Первый день месяца партиции
+    archive_path = Column(String(500), nullable=False)  # Путь к gzip-архиву
+    rows = Column(Integer, nullable=False, default=0)  # Количество выгруженных операций
+    max_operation_id = Column(Integer, nullable=True)  # Максимальный ID выгруженной операции (None - партиция пуста)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class InventoryIdempotencyKey(Base):
+    """
+    Ключ идемпотентности операции (Idempotency-Key) и сохраненный ответ на первый запрос
+
+    Общий для синхронных операций и асинхронных квитанций: ключ, использованный в одном режиме,
+    не применит операцию повторно в другом.
+    """
+    __tablename__ = "inventory_idempotency_keys"
+    
+    key = Column(String(255), primary_key=True)  # Значение заголовка Idempotency-Key
+    request_hash = Column(String(64), nullable=False)  # SHA-256 тела запроса
+    operation_id = Column(Integer, nullable=True)  # ID созданной операции журнала (синхронный запрос)
+    response = Column(JSON, nullable=True)  # Ответ на первый запрос (OperationResponse, синхронный запрос)
+    intake_id = Column(Integer, nullable=True)  # Квитанция асинхронного запроса
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
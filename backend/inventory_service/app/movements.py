@@ -0,0 +1,295 @@
+"""
+Отчеты по движению товара (inventory_daily_movements)
+
+Журнал операций агрегируется по дням в разрезе (день, SKU, локация, тип операции):
+сколько килограммов поступило в локацию и убыло из нее и сколькими операциями.
+Перемещение дает две строки: убытие из начальной локации и поступление в конечную.
+Операции update задают абсолютное значение остатка, движением не являются и в отчет не попадают.
+
+Агрегат ведется инкрементально при записи операции (InventoryService.record_movements) и может быть
+пересобран из журнала за любой период (backfill). Отчет за произвольный период читает только агрегат;
+недели и месяцы собираются из дней в запросе.
+
+Запуск пересборки вручную:
+    python -m app.movements --from 2024-01-01 --to 2024-07-01
+"""
+import sys
+import os
+import logging
+import argparse
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import select, insert, delete, func, case, cast, text, union_all, Date
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, upsert
+from app.models import InventoryOperation, InventoryDailyMovement, InventoryLocation
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Типы операций, которые меняют остатки в локации приращением (см. InventoryService.location_deltas)
+INBOUND_TYPES = ('receipt', 'create')
+OUTBOUND_TYPES = ('write_off', 'delete')
+MOVEMENT_TYPES = INBOUND_TYPES + OUTBOUND_TYPES + ('transfer',)
+
+
+def add_movement(db: Session, sku_id: int, location_name: str, operation_type: str, weight_delta: int):
+    """
+    Учесть изменение остатка локации за текущий день в текущей транзакции
+
+    Args:
+        weight_delta: Приращение остатка (> 0 - поступление, < 0 - убытие)
+    """
+    add_movements(db, [(sku_id, location_name, operation_type, weight_delta)])
+
+
+def add_movements(db: Session, changes: List[Tuple[int, str, str, int]]):
+    """
+    Учесть пачку изменений остатков (sku_id, локация, тип операции, приращение) за текущий день
+    одним upsert с множеством параметров (executemany)
+    """
+    rows = []
+    for sku_id, location_name, operation_type, weight_delta in changes:
+        if not location_name or not weight_delta:
+            continue
+        inbound = max(weight_delta, 0)
+        outbound = max(-weight_delta, 0)
+        rows.append({
+            "sku_id": sku_id,
+            "location_name": location_name,
+            "operation_type": operation_type,
+            "inbound_weight": inbound,
+            "outbound_weight": outbound,
+            "inbound_count": int(inbound > 0),
+            "outbound_count": int(outbound > 0),
+        })
+    if not rows:
+        return
+    statement = upsert(db, InventoryDailyMovement).values(day=func.current_date())
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[
+            InventoryDailyMovement.day, InventoryDailyMovement.sku_id,
+            InventoryDailyMovement.location_name, InventoryDailyMovement.operation_type
+        ],
+        set_={
+            "inbound_weight": InventoryDailyMovement.inbound_weight + statement.excluded.inbound_weight,
+            "outbound_weight": InventoryDailyMovement.outbound_weight + statement.excluded.outbound_weight,
+            "inbound_count": InventoryDailyMovement.inbound_count + statement.excluded.inbound_count,
+            "outbound_count": InventoryDailyMovement.outbound_count + statement.excluded.outbound_count,
+        }
+    ), rows)
+
+
+def _ledger_movements(created_from: datetime, created_to: datetime):
+    """
+    Движения журнала за [created_from, created_to) по дням одним INSERT ... SELECT:
+    ветка начальной локации и ветка конечной локации перемещений, затем GROUP BY
+    (журнал хранит id локаций, названия подставляются из словаря после группировки)
+    """
+    op = InventoryOperation
+    # Для delete в журнале хранится отрицательное значение; к остаткам применяется модуль
+    weight = func.abs(op.delta_value)
+    period = [op.created_at >= created_from, op.created_at < created_to, op.delta_value != 0]
+    legs = union_all(
+        select(
+            func.date(op.created_at).label("day"),
+            op.sku_id.label("sku_id"),
+            op.source_location_id.label("location_id"),
+            op.operation_type.label("operation_type"),
+            case((op.operation_type.in_(INBOUND_TYPES), weight), else_=-weight).label("weight_delta")
+        ).where(*period, op.operation_type.in_(MOVEMENT_TYPES), op.source_location_id.isnot(None)),
+        select(
+            func.date(op.created_at),
+            op.sku_id,
+            op.target_location_id,
+            op.operation_type,
+            weight
+        ).where(*period, op.operation_type == 'transfer', op.target_location_id.isnot(None))
+    ).subquery()
+
+    inbound = legs.c.weight_delta > 0
+    grouped = select(
+        legs.c.day,
+        legs.c.sku_id,
+        legs.c.location_id,
+        legs.c.operation_type,
+        func.sum(case((inbound, legs.c.weight_delta), else_=0)).label("inbound_weight"),
+        func.sum(case((inbound, 0), else_=-legs.c.weight_delta)).label("outbound_weight"),
+        func.sum(case((inbound, 1), else_=0)).label("inbound_count"),
+        func.sum(case((inbound, 0), else_=1)).label("outbound_count")
+    ).group_by(legs.c.day, legs.c.sku_id, legs.c.location_id, legs.c.operation_type).subquery()
+
+    return select(
+        grouped.c.day,
+        grouped.c.sku_id,
+        InventoryLocation.name,
+        grouped.c.operation_type,
+        grouped.c.inbound_weight,
+        grouped.c.outbound_weight,
+        grouped.c.inbound_count,
+        grouped.c.outbound_count
+    ).join(InventoryLocation, InventoryLocation.id == grouped.c.location_id)
+
+
+def _month_windows(date_from: date, date_to: date) -> List[tuple]:
+    """Разбить [date_from, date_to) на окна по календарным месяцам (совпадают с партициями журнала)"""
+    windows = []
+    start = date_from
+    while start < date_to:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end = min(next_month, date_to)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+class MovementService:
+    """Сервис отчетов по движению товара"""
+
+    @staticmethod
+    def backfill(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None) -> Dict:
+        """
+        Пересобрать агрегат из журнала за дни [date_from, date_to)
+
+        Период обрабатывается по месяцам, каждый месяц - отдельной транзакцией: строки агрегата за месяц
+        удаляются и вставляются заново одним INSERT ... SELECT. В PostgreSQL на время транзакции
+        агрегат блокируется в режиме EXCLUSIVE: операции, записанные во время пересборки,
+        дождутся ее и добавят свои приращения к уже пересобранным строкам.
+
+        Args:
+            date_from: Первый день (по умолчанию - день первой операции журнала)
+            date_to: День после последнего (по умолчанию - завтра)
+
+        Returns:
+            Период, количество месяцев и вставленных строк агрегата
+        """
+        if date_from is None:
+            first = db.query(func.min(InventoryOperation.created_at)).scalar()
+            date_from = first.date() if first else db.execute(select(func.current_date())).scalar()
+        if date_to is None:
+            date_to = db.execute(select(func.current_date())).scalar() + timedelta(days=1)
+
+        report = {"date_from": date_from, "date_to": date_to, "months": 0, "rows": 0}
+        for start, end in _month_windows(date_from, date_to):
+            if db.get_bind().dialect.name == "postgresql":
+                db.execute(text("LOCK TABLE inventory_daily_movements IN EXCLUSIVE MODE"))
+            db.execute(delete(InventoryDailyMovement).where(
+                InventoryDailyMovement.day >= start,
+                InventoryDailyMovement.day < end
+            ))
+            result = db.execute(insert(InventoryDailyMovement).from_select(
+                [
+                    "day", "sku_id", "location_name", "operation_type",
+                    "inbound_weight", "outbound_weight", "inbound_count", "outbound_count"
+                ],
+                _ledger_movements(datetime.combine(start, time.min), datetime.combine(end, time.min))
+            ))
+            db.commit()
+            report["months"] += 1
+            report["rows"] += result.rowcount
+            logger.info(f"Движение товара за [{start}, {end}) пересобрано: {result.rowcount} строк")
+        return report
+
+    @staticmethod
+    def _period_start(db: Session, granularity: str):
+        """Начало периода (день, понедельник недели или первое число месяца) для строки агрегата"""
+        day = InventoryDailyMovement.day
+        if granularity == 'day':
+            return day
+        if db.get_bind().dialect.name == "postgresql":
+            return cast(func.date_trunc(granularity, day), Date)
+        if granularity == 'week':
+            return func.date(day, 'weekday 0', '-6 days')
+        return func.date(day, 'start of month')
+
+    @staticmethod
+    def report(
+        db: Session,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        granularity: str = 'day',
+        sku_id: Optional[int] = None,
+        location: Optional[str] = None,
+        operation_type: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[Dict]:
+        """
+        Движение товара за дни [date_from, date_to) с группировкой по дням, неделям или месяцам
+
+        Недели и месяцы, попавшие в период частично, содержат только дни периода.
+
+        Returns:
+            Строки в формате MovementReportRow (сортировка по периоду, SKU, локации, типу операции)
+        """
+        period = MovementService._period_start(db, granularity).label("period_start")
+        movement = InventoryDailyMovement
+        filters = []
+        if date_from:
+            filters.append(movement.day >= date_from)
+        if date_to:
+            filters.append(movement.day < date_to)
+        if sku_id is not None:
+            filters.append(movement.sku_id == sku_id)
+        if location:
+            filters.append(movement.location_name == location)
+        if operation_type:
+            filters.append(movement.operation_type == operation_type)
+
+        rows = db.execute(
+            select(
+                period,
+                movement.sku_id,
+                movement.location_name,
+                movement.operation_type,
+                func.sum(movement.inbound_weight),
+                func.sum(movement.outbound_weight),
+                func.sum(movement.inbound_count),
+                func.sum(movement.outbound_count)
+            ).where(*filters).group_by(
+                period, movement.sku_id, movement.location_name, movement.operation_type
+            ).order_by(
+                period, movement.sku_id, movement.location_name, movement.operation_type
+            ).offset(skip).limit(limit)
+        ).all()
+
+        return [
+            {
+                "period_start": period_start,
+                "sku_id": row_sku_id,
+                "location_name": location_name,
+                "operation_type": row_operation_type,
+                "inbound_weight": inbound_weight,
+                "outbound_weight": outbound_weight,
+                "net_weight": inbound_weight - outbound_weight,
+                "inbound_count": inbound_count,
+                "outbound_count": outbound_count
+            }
+            for (
+                period_start, row_sku_id, location_name, row_operation_type,
+                inbound_weight, outbound_weight, inbound_count, outbound_count
+            ) in rows
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересборка отчетов по движению товара из журнала операций")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="Первый день (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="День после последнего (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = SessionLocal()
+    try:
+        report = MovementService.backfill(db, args.date_from, args.date_to)
+    finally:
+        db.close()
+    print(f"Пересобрано месяцев: {report['months']}, строк агрегата: {report['rows']}")
+
+
+if __name__ == "__main__":
+    main()
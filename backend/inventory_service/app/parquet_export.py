@@ -0,0 +1,313 @@
+"""
+Аналитическая выгрузка в Parquet: журнал операций, остатки и товары каталога (PARQUET_EXPORT_DIR)
+
+Аналитики читают набор данных с диска (pandas.read_parquet, pyarrow.dataset, DuckDB) и не нагружают
+рабочую БД постраничными запросами к /inventory/operations. Структура каталога (партиции в стиле Hive):
+
+    operations/month=2024-12/part-000000123456.parquet   журнал, по месяцу created_at
+    location_totals/date=2024-12-29/part-0.parquet       снимок остатков по локациям за день
+    sku_totals/date=2024-12-29/part-0.parquet            снимок остатков по SKU за день
+    skus/date=2024-12-29/part-0.parquet                  товары каталога (из Catalog Service)
+    _state.json                                          водяные знаки последней выгрузки
+
+Строки читаются курсором на стороне сервера (app/exports.stream_chunks) порциями PARQUET_BATCH_ROWS,
+каждая порция превращается в Arrow record batch и сразу пишется в файл: память ограничена порцией.
+
+Журнал выгружается инкрементально: водяной знак - последний выгруженный id, каждый запуск пишет
+новые файлы part-<первый id>. Операции читаются по возрастанию id до первой операции моложе
+PARQUET_LEDGER_LAG_SECONDS: она и все следующие откладываются до следующего запуска, чтобы транзакция
+с меньшим id, закоммиченная позже, не оказалась за водяным знаком. Фильтр по created_at в запросе
+для этого не годится: операция с меньшим id, но более поздним created_at была бы пропущена,
+а водяной знак ушел бы дальше нее.
+Остатки - снимок текущего состояния; он пишется, только если с прошлой выгрузки изменились количество
+строк или последнее updated_at. Файлы пишутся под временным именем и переименовываются, состояние
+сохраняется последним: прерванная выгрузка повторяется с прежнего водяного знака и перезаписывает
+те же файлы.
+
+Запуск вручную:
+    python -m app.parquet_export --dir /data/inventory
+"""
+import sys
+import os
+import json
+import asyncio
+import logging
+import argparse
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Sequence
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.catalog_client import catalog_client
+from app.exports import stream_chunks, location_total_chunks
+from app.locations import location_dictionary
+from app.models import InventoryOperation, InventoryLocationTotal, InventorySKUTotal
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "_state.json"
+SKU_TOTAL_COLUMNS = ("id", "sku_id", "sku_name", "total_quantity", "total_weight", "updated_at")
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+OPERATION_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("operation_type", pa.string()),
+    ("sku_id", pa.int64()),
+    ("sku_name", pa.string()),
+    ("quantity_value", pa.int64()),
+    ("quantity_unit", pa.string()),
+    ("weight_value", pa.int64()),
+    ("weight_unit", pa.string()),
+    ("delta_value", pa.int64()),
+    ("delta_unit", pa.string()),
+    ("source_location", pa.string()),
+    ("target_location", pa.string()),
+    ("created_at", TIMESTAMP),
+])
+LOCATION_TOTAL_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("sku_id", pa.int64()),
+    ("sku_name", pa.string()),
+    ("location_name", pa.string()),
+    ("quantity", pa.int64()),
+    ("weight", pa.int64()),
+    ("updated_at", TIMESTAMP),
+])
+SKU_TOTAL_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("sku_id", pa.int64()),
+    ("sku_name", pa.string()),
+    ("total_quantity", pa.int64()),
+    ("total_weight", pa.int64()),
+    ("updated_at", TIMESTAMP),
+])
+
+
+def _batch(schema: pa.Schema, rows: Sequence[Sequence]) -> pa.RecordBatch:
+    """Строки результата запроса -> Arrow record batch (по колонкам, без промежуточных словарей)"""
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+class _PartFile:
+    """Файл партиции: пишется под временным именем, на место встает в commit()"""
+
+    def __init__(self, path: str, schema: pa.Schema):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+        self.writer = pq.ParquetWriter(self.temp_path, schema, compression=settings.PARQUET_COMPRESSION)
+        self.rows = 0
+
+    def write(self, batch: pa.RecordBatch):
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def commit(self):
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.writer.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ParquetExporter:
+    """Выгрузка набора данных для аналитики в каталог directory"""
+
+    def __init__(self, db: Session, directory: Optional[str] = None, batch_rows: Optional[int] = None):
+        self.db = db
+        self.directory = directory or settings.PARQUET_EXPORT_DIR
+        self.batch_rows = batch_rows or settings.PARQUET_BATCH_ROWS
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict:
+        path = os.path.join(self.directory, STATE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_state(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.state, file, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def _write_snapshot(self, name: str, day: str, schema: pa.Schema, chunks: Iterator[List[Sequence]]) -> int:
+        part = _PartFile(os.path.join(self.directory, name, f"date={day}", "part-0.parquet"), schema)
+        try:
+            for rows in chunks:
+                part.write(_batch(schema, rows))
+        except Exception:
+            part.discard()
+            raise
+        part.commit()
+        return part.rows
+
+    def export_operations(self) -> Dict:
+        """
+        Новые операции журнала (id больше водяного знака) в файлы месячных партиций
+
+        Выгрузка останавливается на первой по id операции, созданной позже cutoff: водяной знак -
+        id последней операции перед ней.
+
+        Returns:
+            Количество строк, записанные файлы и новый водяной знак
+        """
+        last_id = self.state.get("operations", {}).get("last_id", 0)
+        cutoff = self.db.execute(select(func.now())).scalar() - timedelta(seconds=settings.PARQUET_LEDGER_LAG_SECONDS)
+        names = location_dictionary.names(self.db)
+        op = InventoryOperation
+        statement = select(
+            op.id, op.operation_type, op.sku_id, op.sku_name, op.quantity_value, op.quantity_unit, op.weight_value,
+            op.weight_unit, op.delta_value, op.delta_unit, op.source_location_id, op.target_location_id, op.created_at
+        ).where(op.id > last_id).order_by(op.id)
+
+        parts: Dict[str, _PartFile] = {}
+        chunks = stream_chunks(self.db, statement, self.batch_rows)
+        try:
+            for rows in chunks:
+                young = next((number for number, row in enumerate(rows) if row[12] >= cutoff), None)
+                rows = rows[:young]
+                by_month: Dict[str, List[Sequence]] = {}
+                for row in rows:
+                    by_month.setdefault(row[12].strftime("%Y-%m"), []).append(
+                        row[:10] + (names.get(row[10]), names.get(row[11]), row[12])
+                    )
+                for month, month_rows in by_month.items():
+                    if month not in parts:
+                        parts[month] = _PartFile(os.path.join(
+                            self.directory, "operations", f"month={month}", f"part-{month_rows[0][0]:012d}.parquet"
+                        ), OPERATION_SCHEMA)
+                    parts[month].write(_batch(OPERATION_SCHEMA, month_rows))
+                if rows:
+                    last_id = rows[-1][0]
+                if young is not None:
+                    break
+        except Exception:
+            for part in parts.values():
+                part.discard()
+            raise
+        finally:
+            chunks.close()
+        for part in parts.values():
+            part.commit()
+        self.state["operations"] = {"last_id": last_id}
+        return {
+            "rows": sum(part.rows for part in parts.values()),
+            "files": sorted(os.path.relpath(part.path, self.directory) for part in parts.values()),
+            "last_id": last_id,
+        }
+
+    def _totals_watermark(self, model) -> Dict:
+        count, updated_at = self.db.query(func.count(model.id), func.max(model.updated_at)).one()
+        return {"rows": count, "updated_at": updated_at.isoformat() if updated_at else None}
+
+    def export_totals(self, day: str) -> Dict:
+        """Снимки остатков по локациям и по SKU за день day (таблицы без изменений пропускаются)"""
+        report = {}
+        snapshots = (
+            ("location_totals", InventoryLocationTotal, LOCATION_TOTAL_SCHEMA,
+             lambda: location_total_chunks(self.db, chunk_rows=self.batch_rows)),
+            ("sku_totals", InventorySKUTotal, SKU_TOTAL_SCHEMA,
+             lambda: stream_chunks(self.db, select(
+                 *(getattr(InventorySKUTotal, column) for column in SKU_TOTAL_COLUMNS)
+             ).order_by(InventorySKUTotal.sku_id), self.batch_rows)),
+        )
+        for name, model, schema, chunks in snapshots:
+            watermark = self._totals_watermark(model)
+            if self.state.get(name) == watermark:
+                report[name] = None
+                continue
+            report[name] = self._write_snapshot(name, day, schema, chunks())
+            self.state[name] = watermark
+        return report
+
+    def export_skus(self, records: List[Dict], day: str) -> int:
+        """Снимок товаров каталога за день (колонки - поля списка товаров Catalog Service)"""
+        if not records:
+            return 0
+        table = pa.Table.from_pylist(records)
+        part = _PartFile(os.path.join(self.directory, "skus", f"date={day}", "part-0.parquet"), table.schema)
+        try:
+            for batch in table.to_batches(max_chunksize=self.batch_rows):
+                part.write(batch)
+        except Exception:
+            part.discard()
+            raise
+        part.commit()
+        return part.rows
+
+    def run(self, sku_records: Optional[List[Dict]] = None) -> Dict:
+        """
+        Выгрузить журнал, остатки и (если переданы) товары каталога, затем сохранить водяные знаки
+
+        Returns:
+            Отчет по частям выгрузки; None у снимка - таблица не менялась, у skus - каталог недоступен
+        """
+        day = self.db.execute(select(func.current_date())).scalar().isoformat()
+        report = {
+            "operations": self.export_operations(),
+            **self.export_totals(day),
+            "skus": None if sku_records is None else self.export_skus(sku_records, day),
+        }
+        self._save_state()
+        return report
+
+
+def _export_in_session(sku_records: Optional[List[Dict]], directory: Optional[str], batch_rows: Optional[int]) -> Dict:
+    db = SessionLocal()
+    try:
+        return ParquetExporter(db, directory, batch_rows).run(sku_records)
+    finally:
+        db.close()
+
+
+async def run_export_once(directory: Optional[str] = None, batch_rows: Optional[int] = None) -> Dict:
+    """Выгрузка с товарами каталога: запрос в Catalog Service в event loop, чтение БД и запись - в потоке"""
+    sku_records = await catalog_client.list_sku_records()
+    if sku_records is None:
+        logger.warning("Товары каталога не выгружены: Catalog Service недоступен")
+    report = await asyncio.to_thread(_export_in_session, sku_records, directory, batch_rows)
+    logger.info(
+        f"Выгрузка в Parquet: операций {report['operations']['rows']} "
+        f"(до id {report['operations']['last_id']}), остатки {report['location_totals']}/{report['sku_totals']}, "
+        f"товаров {report['skus']}"
+    )
+    return report
+
+
+async def run_export():
+    """Периодически выгружать набор данных (PARQUET_EXPORT_INTERVAL_SECONDS)"""
+    while True:
+        try:
+            await run_export_once()
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке в Parquet: {e}", exc_info=True)
+        await asyncio.sleep(settings.PARQUET_EXPORT_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка журнала, остатков и товаров каталога в Parquet")
+    parser.add_argument("--dir", dest="directory", help="Каталог набора данных (по умолчанию PARQUET_EXPORT_DIR)")
+    parser.add_argument("--batch-rows", type=int, help="Строк в порции (по умолчанию PARQUET_BATCH_ROWS)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run_export_once(args.directory, args.batch_rows))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
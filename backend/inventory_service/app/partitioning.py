@@ -0,0 +1,309 @@
+"""
+Обслуживание партиций журнала операций (inventory_operations)
+
+Таблица inventory_operations партиционирована по месяцам по created_at (см. миграцию 002).
+Модуль создает будущие партиции заранее и применяет политику хранения:
+партиции старше OPERATIONS_RETENTION_MONTHS выгружаются в gzip-архив и отключаются от журнала.
+Архивированные партиции записываются в inventory_operation_archives: по ним сверка и пересборка
+остатков узнают, что журнал в БД неполон, и начинают со снимка остатков (app/snapshots.py).
+
+Запуск вручную:
+    python -m app.partitioning list
+    python -m app.partitioning maintain
+    python -m app.partitioning archive inventory_operations_y2024m01
+"""
+import sys
+import os
+import re
+import gzip
+import logging
+import argparse
+from datetime import date, datetime, timezone
+from typing import List, Dict, Optional
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models import InventoryOperationArchive
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "inventory_operations"
+DEFAULT_PARTITION = "inventory_operations_default"
+PARTITION_NAME_RE = re.compile(r"^inventory_operations_y(\d{4})m(\d{2})$")
+
+
+def _month_start(value: date) -> date:
+    """Первый день месяца"""
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value: date, months: int) -> date:
+    """Сдвинуть первый день месяца на months месяцев"""
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _utc_bound(value: date) -> str:
+    """Граница партиции в UTC (в том же виде, что и в миграции)"""
+    return f"{value.isoformat()} 00:00:00+00"
+
+
+def partition_name(month_start: date) -> str:
+    """Имя месячной партиции, например inventory_operations_y2024m12"""
+    return f"{PARENT_TABLE}_y{month_start.year:04d}m{month_start.month:02d}"
+
+
+class OperationsPartitionManager:
+    """Управление месячными партициями журнала операций"""
+
+    @staticmethod
+    def is_partitioned(db: Session) -> bool:
+        """Проверить, что журнал партиционирован (только PostgreSQL после миграции 002)"""
+        if db.get_bind().dialect.name != "postgresql":
+            return False
+        return db.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid "
+                "WHERE c.relname = :name AND c.relnamespace = 'public'::regnamespace"
+            ),
+            {"name": PARENT_TABLE}
+        ).first() is not None
+
+    @staticmethod
+    def list_partitions(db: Session) -> List[Dict]:
+        """
+        Получить месячные партиции журнала с количеством строк (по статистике планировщика)
+
+        Returns:
+            Список словарей {name, month, rows_estimate}, отсортированный по месяцу
+        """
+        rows = db.execute(
+            text(
+                "SELECT c.relname, c.reltuples::bigint "
+                "FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :parent"
+            ),
+            {"parent": PARENT_TABLE}
+        ).all()
+
+        partitions = []
+        for name, rows_estimate in rows:
+            match = PARTITION_NAME_RE.match(name)
+            if not match:
+                continue  # Партиция по умолчанию и посторонние таблицы
+            partitions.append({
+                "name": name,
+                "month": date(int(match.group(1)), int(match.group(2)), 1),
+                "rows_estimate": max(int(rows_estimate), 0)
+            })
+        return sorted(partitions, key=lambda item: item["month"])
+
+    @staticmethod
+    def create_month_partition(db: Session, month_start: date) -> bool:
+        """
+        Создать партицию за месяц, если её еще нет.
+        Строки этого месяца, попавшие в партицию по умолчанию, переносятся в новую партицию.
+
+        Returns:
+            True если партиция была создана
+        """
+        month_start = _month_start(month_start)
+        name = partition_name(month_start)
+        exists = db.execute(text("SELECT to_regclass(:name)"), {"name": f"public.{name}"}).scalar()
+        if exists:
+            return False
+
+        bounds = {"from": _utc_bound(month_start), "to": _utc_bound(_add_months(month_start, 1))}
+        create_sql = (
+            f'CREATE TABLE "{name}" PARTITION OF {PARENT_TABLE} '
+            f"FOR VALUES FROM ('{bounds['from']}') TO ('{bounds['to']}')"
+        )
+
+        stray_rows = db.execute(
+            text(
+                f"SELECT count(*) FROM {DEFAULT_PARTITION} "
+                "WHERE created_at >= CAST(:from AS timestamptz) AND created_at < CAST(:to AS timestamptz)"
+            ),
+            bounds
+        ).scalar()
+
+        if stray_rows:
+            # PostgreSQL не даст создать партицию, пока пересекающиеся строки лежат в DEFAULT
+            db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+            db.execute(text(create_sql))
+            db.execute(
+                text(
+                    f'INSERT INTO "{name}" SELECT * FROM {DEFAULT_PARTITION} '
+                    "WHERE created_at >= CAST(:from AS timestamptz) AND created_at < CAST(:to AS timestamptz)"
+                ),
+                bounds
+            )
+            db.execute(
+                text(
+                    f"DELETE FROM {DEFAULT_PARTITION} "
+                    "WHERE created_at >= CAST(:from AS timestamptz) AND created_at < CAST(:to AS timestamptz)"
+                ),
+                bounds
+            )
+            db.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+            logger.warning(f"Перенесено {stray_rows} операций из {DEFAULT_PARTITION} в {name}")
+        else:
+            db.execute(text(create_sql))
+
+        db.commit()
+        logger.info(f"Создана партиция {name}")
+        return True
+
+    @staticmethod
+    def ensure_future_partitions(db: Session, months_ahead: Optional[int] = None) -> List[str]:
+        """
+        Создать партиции текущего месяца и months_ahead месяцев вперед
+
+        Returns:
+            Имена созданных партиций
+        """
+        if months_ahead is None:
+            months_ahead = settings.OPERATIONS_PARTITIONS_PREMAKE_MONTHS
+
+        current = _month_start(datetime.now(timezone.utc).date())
+        created = []
+        for offset in range(months_ahead + 1):
+            month_start = _add_months(current, offset)
+            if OperationsPartitionManager.create_month_partition(db, month_start):
+                created.append(partition_name(month_start))
+        return created
+
+    @staticmethod
+    def archive_partition(db: Session, name: str, archive_dir: Optional[str] = None, drop: bool = True) -> str:
+        """
+        Выгрузить партицию в gzip-архив (CSV с заголовком) и отключить её от журнала
+
+        Архив пишется во временный файл и переименовывается только после успешной выгрузки,
+        поэтому при ошибке партиция остается подключенной и данные не теряются.
+        В той же транзакции, что и отключение, партиция записывается в inventory_operation_archives.
+
+        Args:
+            db: Сессия БД
+            name: Имя партиции (inventory_operations_yYYYYmMM)
+            archive_dir: Каталог архивов (по умолчанию OPERATIONS_ARCHIVE_DIR)
+            drop: Удалить таблицу после отключения (иначе она остается отдельной таблицей)
+
+        Returns:
+            Путь к файлу архива
+        """
+        match = PARTITION_NAME_RE.match(name)
+        if not match:
+            raise ValueError(f"Некорректное имя партиции: {name}")
+
+        archive_dir = archive_dir or settings.OPERATIONS_ARCHIVE_DIR
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = os.path.join(archive_dir, f"{name}.csv.gz")
+        tmp_path = f"{archive_path}.tmp"
+
+        rows, max_operation_id = db.execute(text(f'SELECT count(*), max(id) FROM "{name}"')).one()
+        # COPY идет через то же соединение, что и сессия, чтобы видеть согласованные данные
+        raw_connection = db.connection().connection
+        with gzip.open(tmp_path, "wb") as archive_file:
+            with raw_connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER true)', archive_file)
+        with open(tmp_path, "rb") as archive_file:
+            os.fsync(archive_file.fileno())
+        os.replace(tmp_path, archive_path)
+
+        db.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"'))
+        if drop:
+            db.execute(text(f'DROP TABLE "{name}"'))
+        db.merge(InventoryOperationArchive(
+            partition_name=name,
+            month=date(int(match.group(1)), int(match.group(2)), 1),
+            archive_path=archive_path,
+            rows=rows,
+            max_operation_id=max_operation_id
+        ))
+        db.commit()
+
+        logger.info(f"Партиция {name} выгружена в {archive_path} и отключена от журнала")
+        return archive_path
+
+    @staticmethod
+    def apply_retention(db: Session, retention_months: Optional[int] = None, archive_dir: Optional[str] = None) -> List[str]:
+        """
+        Архивировать партиции старше срока хранения
+
+        Хранится текущий месяц и retention_months полных месяцев до него.
+        retention_months = 0 отключает архивацию.
+
+        Returns:
+            Пути к созданным архивам
+        """
+        if retention_months is None:
+            retention_months = settings.OPERATIONS_RETENTION_MONTHS
+        if retention_months <= 0:
+            return []
+
+        cutoff = _add_months(_month_start(datetime.now(timezone.utc).date()), -retention_months)
+        archived = []
+        for partition in OperationsPartitionManager.list_partitions(db):
+            if partition["month"] < cutoff:
+                archived.append(OperationsPartitionManager.archive_partition(db, partition["name"], archive_dir))
+        return archived
+
+
+def run_maintenance() -> Dict:
+    """Создать будущие партиции и применить политику хранения (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        if not OperationsPartitionManager.is_partitioned(db):
+            logger.info("Журнал операций не партиционирован, обслуживание партиций пропущено")
+            return {"created": [], "archived": []}
+
+        created = OperationsPartitionManager.ensure_future_partitions(db)
+        archived = OperationsPartitionManager.apply_retention(db)
+        return {"created": created, "archived": archived}
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании партиций журнала операций: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Обслуживание партиций inventory_operations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Показать месячные партиции")
+    subparsers.add_parser("maintain", help="Создать будущие партиции и применить политику хранения")
+    archive_parser = subparsers.add_parser("archive", help="Выгрузить партицию в архив и отключить её")
+    archive_parser.add_argument("name", help="Имя партиции, например inventory_operations_y2024m01")
+    archive_parser.add_argument("--archive-dir", default=None, help="Каталог для архива")
+    archive_parser.add_argument("--keep-table", action="store_true", help="Не удалять таблицу после отключения")
+    args = parser.parse_args(argv)
+
+    if args.command == "maintain":
+        result = run_maintenance()
+        print(f"Создано партиций: {len(result['created'])}, архивировано: {len(result['archived'])}")
+        return
+
+    db = SessionLocal()
+    try:
+        if args.command == "list":
+            for partition in OperationsPartitionManager.list_partitions(db):
+                print(f"{partition['name']}\t{partition['month']:%Y-%m}\t~{partition['rows_estimate']} строк")
+        elif args.command == "archive":
+            path = OperationsPartitionManager.archive_partition(
+                db, args.name, archive_dir=args.archive_dir, drop=not args.keep_table
+            )
+            print(path)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
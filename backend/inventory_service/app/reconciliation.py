@@ -0,0 +1,509 @@
+"""
+Сверка остатков с журналом операций
+
+Остатки inventory_sku_totals и inventory_location_totals ведутся инкрементально
+(InventoryService._update_totals и пропорциональный пересчет в event_consumer) и могут разойтись с журналом.
+Сверка проходит журнал серверным курсором в порядке (sku_id, created_at, id), агрегирует эффекты операций
+по ячейкам (sku, локация) векторно порциями NumPy и сравнивает результат с таблицами остатков.
+
+Память ограничена: как только поток журнала уходит за SKU, его ячейки окончательно посчитаны,
+сверяются и освобождаются. Диапазоны SKU не пересекаются, поэтому сверку можно запускать параллельно.
+
+Пока партиции журнала не архивировались (app/partitioning.py), журнал воспроизводится с нуля. После
+архивации журнал в БД неполон: база - снимок остатков, в котором учтены все выгруженные операции
+(SnapshotService.ledger_baseline), поверх него воспроизводятся операции с ID больше границы снимка.
+Без такого снимка сверка отказывается работать (LedgerBaselineError), чтобы не "исправить"
+верные остатки по усеченному журналу.
+
+Запуск вручную:
+    python -m app.reconciliation --workers 4
+    python -m app.reconciliation --sku-from 1 --sku-to 5000 --repair
+"""
+import sys
+import os
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import numpy as np
+from sqlalchemy import select, func, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, engine
+from app.models import (
+    InventoryOperation, InventorySKUTotal, InventoryLocationTotal,
+    InventoryLocationTotalSnapshot, InventorySKUTotalSnapshot
+)
+from app.snapshots import SnapshotService, LedgerBaselineError
+from app import location_rollups
+from app.locations import location_dictionary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+MAX_REPORTED_MISMATCHES = 1000
+
+# Коды типов операций для векторной обработки
+OP_OTHER, OP_ADD, OP_SUB, OP_DELETE, OP_TRANSFER, OP_UPDATE = 0, 1, 2, 3, 4, 5
+OPERATION_CODES = {
+    'create': OP_ADD,
+    'receipt': OP_ADD,
+    'write_off': OP_SUB,
+    'delete': OP_DELETE,
+    'transfer': OP_TRANSFER,
+    'update': OP_UPDATE,
+}
+
+# Специальные коды локаций: абсолютный остаток по SKU и отсутствующая локация
+SKU_LEVEL = -1
+NO_LOCATION = -2
+
+
+class _LocationCodes:
+    """Словарь названий локаций в целочисленные коды (локаций мало, словарь растет по ходу потока)"""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.names: List[str] = []
+
+    def code(self, name: Optional[str]) -> int:
+        if not name:
+            return NO_LOCATION
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def name(self, code: int) -> Optional[str]:
+        return None if code == SKU_LEVEL else self.names[code]
+
+
+def _chunk_effects(
+    sku: np.ndarray,
+    op_code: np.ndarray,
+    delta: np.ndarray,
+    source: np.ndarray,
+    target: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Развернуть операции порции в эффекты (sku, локация, значение, абсолютное?, позиция).
+    Логика совпадает с InventoryService._update_totals: update задает остаток своей локации
+    и остаток по SKU, update без локации (последняя операция пересчета sku.updated) - только остаток по SKU.
+    """
+    position = np.arange(len(sku))
+    magnitude = np.where(op_code == OP_DELETE, np.abs(delta), delta)
+
+    parts = []
+
+    def add(mask, location, value, is_set):
+        parts.append((sku[mask], location[mask], value[mask], np.full(int(mask.sum()), is_set), position[mask]))
+
+    sku_level = np.full(len(sku), SKU_LEVEL)
+    adds = op_code == OP_ADD
+    subs = (op_code == OP_SUB) | (op_code == OP_DELETE)
+    transfers = op_code == OP_TRANSFER
+    updates = op_code == OP_UPDATE
+
+    # Остатки по локациям
+    add(adds, source, magnitude, False)
+    add(subs, source, -magnitude, False)
+    add(transfers, source, -magnitude, False)
+    add(transfers, target, magnitude, False)
+    add(updates, source, magnitude, True)
+    # Абсолютные остатки по SKU (перемещение их не меняет)
+    add(adds, sku_level, magnitude, False)
+    add(subs, sku_level, -magnitude, False)
+    add(updates, sku_level, magnitude, True)
+
+    eff_sku, eff_location, eff_value, eff_set, eff_position = (np.concatenate(items) for items in zip(*parts))
+    valid = eff_location != NO_LOCATION
+    return eff_sku[valid], eff_location[valid], eff_value[valid], eff_set[valid], eff_position[valid]
+
+
+def _aggregate_chunk(
+    state: Dict[int, Dict[int, int]],
+    sku: np.ndarray,
+    location: np.ndarray,
+    value: np.ndarray,
+    is_set: np.ndarray,
+    position: np.ndarray
+):
+    """
+    Применить эффекты порции к состоянию ячеек.
+    Для ячейки итог = последнее абсолютное значение (update) + сумма приращений после него,
+    а если абсолютных значений в порции нет - прежнее состояние + сумма приращений.
+    """
+    if len(sku) == 0:
+        return
+
+    keys = np.stack([sku, location], axis=1)
+    cells, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    count = len(cells)
+
+    last_set = np.full(count, -1, dtype=np.int64)
+    np.maximum.at(last_set, inverse[is_set], position[is_set])
+
+    set_value = np.zeros(count, dtype=np.int64)
+    is_last_set = is_set & (position == last_set[inverse])
+    set_value[inverse[is_last_set]] = value[is_last_set]
+
+    increments = ~is_set & (position > last_set[inverse])
+    sums = np.zeros(count, dtype=np.int64)
+    np.add.at(sums, inverse[increments], value[increments])
+
+    for (cell_sku, cell_location), has_set, base, increment in zip(
+        cells.tolist(), (last_set >= 0).tolist(), set_value.tolist(), sums.tolist()
+    ):
+        sku_state = state.setdefault(cell_sku, {})
+        if has_set:
+            sku_state[cell_location] = base + increment
+        else:
+            sku_state[cell_location] = sku_state.get(cell_location, 0) + increment
+
+
+class LedgerReconciler:
+    """Потоковая сверка остатков с журналом операций по диапазону SKU"""
+
+    def __init__(
+        self,
+        db: Session,
+        repair_db: Optional[Session] = None,
+        sku_from: Optional[int] = None,
+        sku_to: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        """
+        Args:
+            db: Сессия для чтения журнала и остатков
+            repair_db: Сессия для исправления остатков (None - только отчет)
+            sku_from: Начало диапазона SKU (включительно)
+            sku_to: Конец диапазона SKU (включительно)
+            chunk_size: Размер порции строк журнала
+        """
+        self.db = db
+        self.repair_db = repair_db
+        self.sku_from = sku_from
+        self.sku_to = sku_to
+        self.chunk_size = chunk_size
+        self.locations = _LocationCodes()
+        self.location_names: Dict[int, str] = {}  # Словарь локаций журнала: {id: название}
+        self.state: Dict[int, Dict[int, int]] = {}
+        self.sku_names: Dict[int, str] = {}
+        self.baseline = None  # Снимок остатков, с которого воспроизводится журнал (None - с нуля)
+        self._seed_from = sku_from  # Начало диапазона SKU, строки снимка которого еще не загружены
+        self.report = {
+            "sku_from": sku_from,
+            "sku_to": sku_to,
+            "baseline_snapshot_id": None,
+            "operations_scanned": 0,
+            "cells_checked": 0,
+            "mismatch_count": 0,
+            "repaired": 0,
+            "mismatches": []
+        }
+
+    def _sku_range(self, column, lower: Optional[int], upper: Optional[int], upper_inclusive: bool) -> list:
+        conditions = []
+        if lower is not None:
+            conditions.append(column >= lower)
+        if upper is not None:
+            conditions.append(column <= upper if upper_inclusive else column < upper)
+        return conditions
+
+    def run(self) -> Dict:
+        """
+        Выполнить сверку и вернуть отчет
+
+        Raises:
+            LedgerBaselineError: Партиции журнала архивированы, а снимка остатков после архивации нет
+        """
+        if self.db.get_bind().dialect.name == "postgresql":
+            # Журнал и остатки читаются из одного согласованного снимка данных
+            self.db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        self.baseline = SnapshotService.ledger_baseline(self.db)
+        if self.baseline is not None:
+            self.report["baseline_snapshot_id"] = self.baseline.id
+        self.location_names = location_dictionary.names(self.db)
+
+        statement = select(
+            InventoryOperation.sku_id,
+            InventoryOperation.operation_type,
+            InventoryOperation.delta_value,
+            InventoryOperation.source_location_id,
+            InventoryOperation.target_location_id,
+            InventoryOperation.sku_name
+        ).where(
+            *self._sku_range(InventoryOperation.sku_id, self.sku_from, self.sku_to, True),
+            *([InventoryOperation.id > self.baseline.operation_id_mark] if self.baseline is not None else [])
+        ).order_by(
+            InventoryOperation.sku_id, InventoryOperation.created_at, InventoryOperation.id
+        ).execution_options(stream_results=True, yield_per=self.chunk_size)
+
+        window_start = self.sku_from
+        for rows in self.db.execute(statement).partitions(self.chunk_size):
+            self._seed(rows[-1][0])
+            self._process_chunk(rows)
+            # SKU меньше последнего в порции в потоке больше не встретятся - их можно сверить и забыть
+            current_sku = rows[-1][0]
+            self._flush(window_start, current_sku)
+            window_start = current_sku
+
+        self._seed(None)
+        self._flush(window_start, None)
+        self.db.rollback()  # Завершаем читающую транзакцию
+        return self.report
+
+    def _seed(self, upper: Optional[int]):
+        """
+        Загрузить в состояние строки базового снимка для SKU до upper включительно (None - до конца диапазона).
+        Операции этих SKU в потоке журнала еще впереди, поэтому они применяются поверх снимка.
+        """
+        if self.baseline is None:
+            return
+        snapshot_id = self.baseline.id
+        location_rows = self.db.execute(
+            select(
+                InventoryLocationTotalSnapshot.sku_id, InventoryLocationTotalSnapshot.sku_name,
+                InventoryLocationTotalSnapshot.location_name, InventoryLocationTotalSnapshot.weight
+            ).where(
+                InventoryLocationTotalSnapshot.snapshot_id == snapshot_id,
+                *self._sku_range(InventoryLocationTotalSnapshot.sku_id, self._seed_from, upper, True)
+            )
+        ).all()
+        for sku_id, sku_name, location_name, weight in location_rows:
+            self.state.setdefault(sku_id, {})[self.locations.code(location_name)] = weight
+            self.sku_names.setdefault(sku_id, sku_name)
+        sku_rows = self.db.execute(
+            select(
+                InventorySKUTotalSnapshot.sku_id, InventorySKUTotalSnapshot.sku_name, InventorySKUTotalSnapshot.total_weight
+            ).where(
+                InventorySKUTotalSnapshot.snapshot_id == snapshot_id,
+                *self._sku_range(InventorySKUTotalSnapshot.sku_id, self._seed_from, upper, True)
+            )
+        ).all()
+        for sku_id, sku_name, total_weight in sku_rows:
+            self.state.setdefault(sku_id, {})[SKU_LEVEL] = total_weight
+            self.sku_names.setdefault(sku_id, sku_name)
+        if upper is not None:
+            self._seed_from = upper + 1
+
+    def _process_chunk(self, rows):
+        self.report["operations_scanned"] += len(rows)
+        sku = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        op_code = np.fromiter((OPERATION_CODES.get(row[1], OP_OTHER) for row in rows), dtype=np.int8, count=len(rows))
+        delta = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        names = self.location_names
+        source = np.fromiter((self.locations.code(names.get(row[3])) for row in rows), dtype=np.int64, count=len(rows))
+        target = np.fromiter((self.locations.code(names.get(row[4])) for row in rows), dtype=np.int64, count=len(rows))
+        for row in rows:
+            self.sku_names[row[0]] = row[5]
+
+        _aggregate_chunk(self.state, *_chunk_effects(sku, op_code, delta, source, target))
+
+    def _flush(self, lower: Optional[int], upper: Optional[int]):
+        """Сверить SKU из [lower, upper) (upper=None - до конца диапазона) и освободить их состояние"""
+        upper_inclusive = upper is None
+        if upper is None:
+            upper = self.sku_to
+
+        expected: Dict[Tuple[int, int], int] = {}
+        for sku_id in [sku_id for sku_id in self.state if upper_inclusive or sku_id < upper]:
+            for location_code, weight in self.state.pop(sku_id).items():
+                expected[(sku_id, location_code)] = weight
+
+        actual: Dict[Tuple[int, int], int] = {}
+        location_rows = self.db.execute(
+            select(InventoryLocationTotal.sku_id, InventoryLocationTotal.location_name, InventoryLocationTotal.weight).where(
+                *self._sku_range(InventoryLocationTotal.sku_id, lower, upper, upper_inclusive)
+            )
+        ).all()
+        for sku_id, location_name, weight in location_rows:
+            actual[(sku_id, self.locations.code(location_name))] = weight
+        sku_rows = self.db.execute(
+            select(InventorySKUTotal.sku_id, InventorySKUTotal.sku_name, InventorySKUTotal.total_weight).where(
+                *self._sku_range(InventorySKUTotal.sku_id, lower, upper, upper_inclusive)
+            )
+        ).all()
+        for sku_id, sku_name, total_weight in sku_rows:
+            actual[(sku_id, SKU_LEVEL)] = total_weight
+            self.sku_names.setdefault(sku_id, sku_name)
+
+        mismatches = []
+        for key in expected.keys() | actual.keys():
+            expected_weight = expected.get(key, 0)
+            actual_weight = actual.get(key)
+            self.report["cells_checked"] += 1
+            if expected_weight != (actual_weight or 0):
+                sku_id, location_code = key
+                mismatches.append({
+                    "sku_id": sku_id,
+                    "location_name": self.locations.name(location_code),
+                    "ledger_weight": expected_weight,
+                    "totals_weight": actual_weight
+                })
+
+        mismatches.sort(key=lambda item: (item["sku_id"], item["location_name"] or ""))
+        self.report["mismatch_count"] += len(mismatches)
+        free_slots = MAX_REPORTED_MISMATCHES - len(self.report["mismatches"])
+        self.report["mismatches"].extend(mismatches[:max(free_slots, 0)])
+
+        if self.repair_db is not None and mismatches:
+            self._repair(mismatches)
+
+        for sku_id in list(self.sku_names):
+            if upper_inclusive or sku_id < upper:
+                del self.sku_names[sku_id]
+
+    def _repair(self, mismatches: List[Dict]):
+        """
+        Привести остатки к журналу.
+        Исправление применяется приращением (weight + разница), поэтому изменения,
+        закоммиченные после снимка сверки, не теряются.
+        """
+        for mismatch in mismatches:
+            sku_id = mismatch["sku_id"]
+            location_name = mismatch["location_name"]
+            difference = mismatch["ledger_weight"] - (mismatch["totals_weight"] or 0)
+            sku_name = self.sku_names.get(sku_id, "Unknown")
+
+            if location_name is None:
+                if mismatch["totals_weight"] is None:
+                    self.repair_db.add(InventorySKUTotal(
+                        sku_id=sku_id, sku_name=sku_name, total_weight=mismatch["ledger_weight"], total_quantity=0
+                    ))
+                else:
+                    self.repair_db.execute(
+                        update(InventorySKUTotal).where(InventorySKUTotal.sku_id == sku_id).values(
+                            total_weight=InventorySKUTotal.total_weight + difference
+                        )
+                    )
+            else:
+                # Сводка по локации получает то же приращение; количество SKU - по весу на момент сверки
+                location_rollups.apply_weight_change(
+                    self.repair_db, location_name, mismatch["totals_weight"] or 0, mismatch["ledger_weight"]
+                )
+                if mismatch["totals_weight"] is None:
+                    self.repair_db.add(InventoryLocationTotal(
+                        sku_id=sku_id, sku_name=sku_name, location_name=location_name,
+                        weight=mismatch["ledger_weight"], quantity=0
+                    ))
+                else:
+                    self.repair_db.execute(
+                        update(InventoryLocationTotal).where(
+                            InventoryLocationTotal.sku_id == sku_id,
+                            InventoryLocationTotal.location_name == location_name
+                        ).values(weight=InventoryLocationTotal.weight + difference)
+                    )
+        self.repair_db.commit()
+        self.report["repaired"] += len(mismatches)
+        logger.info(f"Исправлено {len(mismatches)} расхождений остатков с журналом")
+
+
+def run_reconciliation(
+    sku_from: Optional[int] = None,
+    sku_to: Optional[int] = None,
+    repair: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Dict:
+    """Сверить диапазон SKU в собственных сессиях (для CLI и параллельных воркеров)"""
+    db = SessionLocal()
+    repair_db = SessionLocal() if repair else None
+    try:
+        return LedgerReconciler(db, repair_db, sku_from, sku_to, chunk_size).run()
+    finally:
+        db.close()
+        if repair_db is not None:
+            repair_db.close()
+
+
+def split_sku_range(db: Session, workers: int) -> List[Tuple[int, int]]:
+    """Разбить диапазон SKU (по журналу и остаткам) на workers непересекающихся диапазонов"""
+    bounds = [
+        db.execute(select(func.min(model.sku_id), func.max(model.sku_id))).one()
+        for model in (InventoryOperation, InventorySKUTotal, InventoryLocationTotal)
+    ]
+    lows = [low for low, _ in bounds if low is not None]
+    highs = [high for _, high in bounds if high is not None]
+    if not lows:
+        return []
+    low, high = min(lows), max(highs)
+    step = max((high - low + 1 + workers - 1) // workers, 1)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def _init_worker():
+    # Соединения пула родительского процесса нельзя использовать после fork
+    engine.dispose(close=False)
+
+
+def _merge_reports(reports: List[Dict]) -> Dict:
+    merged = {
+        "sku_from": None,
+        "sku_to": None,
+        "baseline_snapshot_id": None,
+        "operations_scanned": 0,
+        "cells_checked": 0,
+        "mismatch_count": 0,
+        "repaired": 0,
+        "mismatches": []
+    }
+    for report in reports:
+        for key in ("operations_scanned", "cells_checked", "mismatch_count", "repaired"):
+            merged[key] += report[key]
+        merged["mismatches"].extend(report["mismatches"])
+    if reports:
+        merged["sku_from"] = reports[0]["sku_from"]
+        merged["sku_to"] = reports[-1]["sku_to"]
+        merged["baseline_snapshot_id"] = reports[0]["baseline_snapshot_id"]
+    merged["mismatches"] = merged["mismatches"][:MAX_REPORTED_MISMATCHES]
+    return merged
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Сверка остатков с журналом операций")
+    parser.add_argument("--sku-from", type=int, default=None, help="Начало диапазона SKU (включительно)")
+    parser.add_argument("--sku-to", type=int, default=None, help="Конец диапазона SKU (включительно)")
+    parser.add_argument("--repair", action="store_true", help="Исправить остатки по журналу")
+    parser.add_argument("--workers", type=int, default=1, help="Количество параллельных процессов")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Размер порции строк журнала")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.workers > 1 and args.sku_from is None and args.sku_to is None:
+            db = SessionLocal()
+            try:
+                SnapshotService.ledger_baseline(db)  # Проверить базу до запуска воркеров
+                ranges = split_sku_range(db, args.workers)
+            finally:
+                db.close()
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+                futures = [
+                    executor.submit(run_reconciliation, low, high, args.repair, args.chunk_size)
+                    for low, high in ranges
+                ]
+                report = _merge_reports([future.result() for future in futures])
+        else:
+            report = run_reconciliation(args.sku_from, args.sku_to, args.repair, args.chunk_size)
+    except LedgerBaselineError as e:
+        raise SystemExit(str(e))
+
+    if report["baseline_snapshot_id"] is not None:
+        print(f"Журнал воспроизведен от снимка остатков {report['baseline_snapshot_id']}")
+    print(
+        f"Операций: {report['operations_scanned']}, ячеек: {report['cells_checked']}, "
+        f"расхождений: {report['mismatch_count']}, исправлено: {report['repaired']}"
+    )
+    for mismatch in report["mismatches"]:
+        print(
+            f"SKU {mismatch['sku_id']}\t{mismatch['location_name'] or '<всего>'}\t"
+            f"журнал={mismatch['ledger_weight']}\tостатки={mismatch['totals_weight']}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,13 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
 from typing import List, Optional
+from datetime import date, datetime
+import asyncio
 import logging
 
 from app.database import get_db
-from app.models import InventoryOperation, InventorySKUTotal, InventoryLocationTotal
-from app.schemas import OperationCreate, OperationResponse, SKUTotalResponse, LocationTotalResponse
+from app.models import (
+    InventorySKUTotal, InventoryLocationTotal, InventorySnapshot, InventoryStockThreshold,
+    InventoryLocation, InventoryOperationIntake
+)
+from app.schemas import (
+    OperationCreate, OperationResponse, SKUTotalResponse, LocationTotalResponse, LocationSummaryResponse,
+    StockIndexStatsResponse, SKULockStatsResponse, LocationDictionaryEntry, LocationSyncResponse, SnapshotResponse,
+    ReconciliationResponse, MovementReportRow, MovementBackfillResponse, StockThresholdCreate, StockThresholdResponse,
+    DeadLetterListResponse, DeadLetterReplayResponse, DeadLetterPurgeResponse, IntakeTicketResponse, IntakeFlushResponse,
+    TotalsQuery, StockCountResponse, ValuationResponse, SKUAnalyticsResponse, LocationTurnoverResponse,
+    AnalyticsSummaryResponse, ForecastQuery, ForecastQueryResponse, ForecastRefreshResponse
+)
 from app.inventory_service import InventoryService
+from app import exports, idempotency, intake, stock_alerts, valuation
+from app.snapshots import SnapshotService, LedgerBaselineError
+from app.stock_counts import CountParser, StockCount, StockCountError, FORMATS as COUNT_FORMATS
+from app.reconciliation import LedgerReconciler, DEFAULT_CHUNK_SIZE
+from app.movements import MovementService, GRANULARITIES
+from app.analytics import AnalyticsService
+from app.forecasting import ForecastService, METHODS as FORECAST_METHODS
+from app.dead_letters import dead_letter_queue
+from app.intake import intake_applier
+from app.change_stream import change_stream, sse_events
+from app.stock_index import stock_index
+from app.sku_locks import lock_metrics
+from app.locations import location_dictionary, fetch_warehouse_locations
+from app.config import settings
 from app.rabbitmq_client import rabbitmq_client
 
 logger = logging.getLogger(__name__)
@@ -23,12 +50,61 @@ async def inventory_root():
         "available_endpoints": {
             "operations": {
                 "list": "GET /inventory/operations",
-                "create": "POST /inventory/operations"
+                "create": "POST /inventory/operations",
+                "create_async": "POST /inventory/operations?async=true"
+            },
+            "intake": {
+                "ticket": "GET /inventory/intake/{ticket_id}",
+                "flush": "POST /inventory/intake/flush"
             },
             "sku_totals": "GET /inventory/sku/totals",
             "location_totals": "GET /inventory/locations",
+            "location_summary": "GET /inventory/locations/summary",
+            "valuation": "GET /inventory/valuation",
+            "totals_query": "POST /inventory/totals/query",
             "location_details": "GET /inventory/locations/{location_name}",
-            "sku_history": "GET /inventory/sku/{sku_id}/history"
+            "stock_index": "GET /inventory/stock-index",
+            "lock_stats": "GET /inventory/locks/stats",
+            "location_dictionary": {
+                "list": "GET /inventory/location-dictionary",
+                "sync": "POST /inventory/location-dictionary/sync"
+            },
+            "sku_history": "GET /inventory/sku/{sku_id}/history",
+            "export": {
+                "operations": "GET /inventory/export/operations",
+                "locations": "GET /inventory/export/locations"
+            },
+            "stream": "GET /inventory/stream (Server-Sent Events)",
+            "snapshots": {
+                "list": "GET /inventory/snapshots",
+                "create": "POST /inventory/snapshots"
+            },
+            "reconciliation": "POST /inventory/reconciliation",
+            "stock_count": "POST /inventory/counts (CSV, NDJSON или JSON)",
+            "movement_reports": {
+                "report": "GET /inventory/reports/movements",
+                "backfill": "POST /inventory/reports/movements/backfill"
+            },
+            "analytics": {
+                "summary": "GET /inventory/analytics",
+                "skus": "GET /inventory/analytics/skus",
+                "locations": "GET /inventory/analytics/locations",
+                "recompute": "POST /inventory/analytics/recompute"
+            },
+            "forecasts": {
+                "query": "POST /inventory/forecasts/query",
+                "refresh": "POST /inventory/forecasts/refresh"
+            },
+            "thresholds": {
+                "list": "GET /inventory/thresholds",
+                "set": "POST /inventory/thresholds",
+                "delete": "DELETE /inventory/thresholds/{threshold_id}"
+            },
+            "dead_letters": {
+                "list": "GET /inventory/events/dead-letters",
+                "replay": "POST /inventory/events/dead-letters/replay",
+                "purge": "DELETE /inventory/events/dead-letters"
+            }
         }
     }
 
@@ -36,12 +112,38 @@ async def inventory_root():
 @router.post("/operations", response_model=OperationResponse, status_code=201)
 async def create_operation(
     operation: OperationCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(
+        None, alias=idempotency.HEADER_NAME, max_length=idempotency.MAX_KEY_LENGTH
+    ),
+    async_mode: bool = Query(
+        False, alias="async", description="Принять операцию к асинхронному применению: 202 и номер квитанции"
+    ),
     db: Session = Depends(get_db)
 ):
     """
     Создать операцию с товаром.
     Используется другими сервисами (Catalog, Warehouse, Orders) для записи операций.
+    
+    С ключом идемпотентности (заголовок Idempotency-Key или поле idempotency_key) повтор запроса
+    возвращает ответ на первый запрос и не применяет операцию второй раз.
+    
+    С async=true (только receipt/write_off/transfer) операция сохраняется как квитанция и применяется
+    фоновым применителем пачками: ответ 202 с квитанцией, состояние - GET /inventory/intake/{ticket_id},
+    дождаться применения - POST /inventory/intake/flush.
     """
+    idempotency_key = idempotency_key or operation.idempotency_key
+    request_hash = None
+    if idempotency_key:
+        request_hash = idempotency.request_hash(operation.model_dump(exclude={"idempotency_key"}))
+    if async_mode:
+        return _accept_operation(db, operation, idempotency_key, request_hash)
+    if idempotency_key:
+        saved = _get_saved_response(db, idempotency_key, request_hash)
+        if saved is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return saved
+    
     try:
         # Для операции delete получаем текущее итоговое значение из остатков
         if operation.operation_type == 'delete':
@@ -62,7 +164,9 @@ async def create_operation(
                     weight_unit=operation.weight_unit,
                     delta_value=-sku_total.total_weight if sku_total.total_weight > 0 else 0,  # Отрицательное значение при удалении
                     source_location=operation.source_location,
-                    target_location=operation.target_location
+                    target_location=operation.target_location,
+                    idempotency_key=idempotency_key,
+                    request_hash=request_hash
                 )
             else:
                 # Если остатков нет, все равно создаем операцию для истории
@@ -77,7 +181,9 @@ async def create_operation(
                     weight_unit=operation.weight_unit or 'кг',
                     delta_value=0,
                     source_location=operation.source_location,
-                    target_location=operation.target_location
+                    target_location=operation.target_location,
+                    idempotency_key=idempotency_key,
+                    request_hash=request_hash
                 )
         else:
             # Для других операций создаем как обычно
@@ -90,7 +196,9 @@ async def create_operation(
                 weight_value=operation.weight_value,
                 weight_unit=operation.weight_unit,
                 source_location=operation.source_location,
-                target_location=operation.target_location
+                target_location=operation.target_location,
+                idempotency_key=idempotency_key,
+                request_hash=request_hash
             )
         
         # Публикуем событие в RabbitMQ
@@ -109,6 +217,15 @@ async def create_operation(
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError as e:
+        db.rollback()
+        # Параллельный запрос с тем же ключом закоммитился первым - операция откатилась, отдаем его ответ
+        saved = _get_saved_response(db, idempotency_key, request_hash) if idempotency_key else None
+        if saved is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return saved
+        logger.error(f"Error creating operation: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при создании операции")
     except Exception as e:
         logger.error(f"Error creating operation: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при создании операции")
@@ -121,32 +238,48 @@ async def get_operations(
     operation_type: Optional[str] = Query(None, description="Фильтр по типу операции"),
     sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
     location: Optional[str] = Query(None, description="Фильтр по локации"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Начало периода (включительно)"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Конец периода (не включительно)"),
     db: Session = Depends(get_db)
 ):
-    """Получить список операций"""
-    query = db.query(InventoryOperation)
-    
-    # Фильтры
-    if operation_type:
-        query = query.filter(InventoryOperation.operation_type == operation_type)
-    
-    if sku_id:
-        query = query.filter(InventoryOperation.sku_id == sku_id)
-    
-    if location:
-        query = query.filter(
-            or_(
-                InventoryOperation.source_location == location,
-                InventoryOperation.target_location == location
-            )
-        )
-    
-    # Сортировка по дате создания (новые сначала)
-    query = query.order_by(InventoryOperation.created_at.desc())
+    """Получить список операций (новые сначала)"""
+    _validate_period(date_from, date_to)
+    return InventoryService.query_operations(
+        db,
+        skip=skip,
+        limit=limit,
+        operation_type=operation_type,
+        sku_id=sku_id,
+        location=location,
+        date_from=date_from,
+        date_to=date_to
+    )
+
+
+@router.get("/intake/{ticket_id}", response_model=IntakeTicketResponse)
+async def get_intake_ticket(ticket_id: int, db: Session = Depends(get_db)):
+    """Состояние квитанции асинхронно принятой операции"""
+    ticket = db.get(InventoryOperationIntake, ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Квитанция не найдена")
+    return ticket
+
+
+@router.post("/intake/flush", response_model=IntakeFlushResponse)
+async def flush_intake(
+    through: Optional[int] = Query(None, ge=0, description="Номер квитанции (по умолчанию - последняя принятая)"),
+    timeout: Optional[float] = Query(None, gt=0, le=300, description="Предельное ожидание в секундах"),
+    db: Session = Depends(get_db)
+):
+    """
+    Дождаться применения квитанций с номером не больше through (чтение собственных записей).
     
-    # Пагинация
-    operations = query.offset(skip).limit(limit).all()
-    return operations
+    После ответа остатки и журнал отражают все эти операции; отклоненные квитанции - в поле failed.
+    """
+    try:
+        return await intake_applier.flush(db, through=through, timeout=timeout)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 
 @router.get("/sku/totals", response_model=List[SKUTotalResponse])
@@ -154,9 +287,18 @@ async def get_sku_totals(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
+    as_of: Optional[datetime] = Query(None, description="Остатки на момент времени (снимок + операции после него)"),
     db: Session = Depends(get_db)
 ):
-    """Получить абсолютные остатки по SKU (сумма со всех локаций)"""
+    """Получить абсолютные остатки по SKU (сумма со всех локаций; из индекса в памяти, если он включен)"""
+    if as_of:
+        totals = SnapshotService.sku_totals_as_of(db, as_of, sku_id=sku_id)
+        if totals is None:
+            raise HTTPException(status_code=404, detail="Нет снимка остатков на указанный момент")
+        return totals[skip:skip + limit]
+    if stock_index.ready:
+        return stock_index.sku_totals(sku_id=sku_id, skip=skip, limit=limit)
+    
     query = db.query(InventorySKUTotal)
     
     if sku_id:
@@ -174,9 +316,18 @@ async def get_location_totals(
     limit: int = Query(100, ge=1, le=1000),
     location_name: Optional[str] = Query(None, description="Фильтр по названию локации"),
     sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
+    as_of: Optional[datetime] = Query(None, description="Остатки на момент времени (снимок + операции после него)"),
     db: Session = Depends(get_db)
 ):
-    """Получить остатки по локациям"""
+    """Получить остатки по локациям (из индекса в памяти, если он включен)"""
+    if as_of:
+        totals = SnapshotService.location_totals_as_of(db, as_of, location_name=location_name, sku_id=sku_id)
+        if totals is None:
+            raise HTTPException(status_code=404, detail="Нет снимка остатков на указанный момент")
+        return totals[skip:skip + limit]
+    if stock_index.ready:
+        return stock_index.location_totals(location_name=location_name, sku_id=sku_id, skip=skip, limit=limit)
+    
     try:
         query = db.query(InventoryLocationTotal)
         
@@ -195,6 +346,82 @@ async def get_location_totals(
         raise HTTPException(status_code=500, detail=f"Ошибка при получении остатков: {str(e)}")
 
 
+@router.post("/totals/query", response_model=List[LocationTotalResponse])
+async def query_totals(query: TotalsQuery, db: Session = Depends(get_db)):
+    """
+    Остатки по локациям для наборов товаров и/или локаций одним запросом.
+    
+    Возвращаются только существующие ячейки (товар, локация) на пересечении наборов,
+    в порядке (локация, название товара). Нужен хотя бы один непустой набор.
+    """
+    if not query.sku_ids and not query.location_names:
+        raise HTTPException(status_code=400, detail="Укажите sku_ids и/или location_names")
+    if stock_index.ready:
+        return stock_index.cells(sku_ids=query.sku_ids or None, location_names=query.location_names or None)
+    
+    # IN по sku_id использует уникальный индекс (sku_id, location_name), по локации - индекс location_name
+    totals = db.query(InventoryLocationTotal)
+    if query.sku_ids:
+        totals = totals.filter(InventoryLocationTotal.sku_id.in_(set(query.sku_ids)))
+    if query.location_names:
+        totals = totals.filter(InventoryLocationTotal.location_name.in_(set(query.location_names)))
+    return totals.order_by(InventoryLocationTotal.location_name, InventoryLocationTotal.sku_name).all()
+
+
+@router.get("/locations/summary", response_model=List[LocationSummaryResponse])
+async def get_locations_summary(db: Session = Depends(get_db)):
+    """
+    Сводка по всем локациям: суммарный вес, количество SKU и время последнего изменения
+    
+    Объявлен до /locations/{location_name}, иначе "summary" будет принят за название локации.
+    """
+    return InventoryService.location_summary(db)
+
+
+@router.get("/valuation", response_model=ValuationResponse)
+async def get_valuation(
+    currency: str = Query("руб", max_length=20, description="Валюта (единица цены каталога)"),
+    location_name: Optional[str] = Query(None, description="Только одна локация"),
+    top: int = Query(20, ge=1, le=1000, description="Сколько товаров и локаций с наибольшей стоимостью вернуть"),
+    db: Session = Depends(get_db)
+):
+    """
+    Оценка запасов: стоимость остатков по ценам каталога - итог, товары и локации с наибольшей стоимостью
+
+    Цены - из проекции цен каталога (обновляется по sku.created/sku.updated и периодически целиком),
+    остатки - из индекса в памяти, если он включен, иначе из таблицы остатков.
+    Вес товаров без цены в валюте отчета возвращается отдельно (unpriced_weight).
+    """
+    return valuation.valuation(db, currency, location_name, top)
+
+
+@router.get("/stock-index", response_model=StockIndexStatsResponse)
+async def get_stock_index_stats():
+    """Состояние индекса остатков в памяти: размеры, объем памяти, время построения"""
+    return {"enabled": settings.STOCK_INDEX_ENABLED, **stock_index.stats()}
+
+
+@router.get("/locks/stats", response_model=SKULockStatsResponse)
+async def get_lock_stats():
+    """Метрики блокировок SKU: сколько раз операции ждали друг друга и как долго"""
+    return lock_metrics.snapshot()
+
+
+@router.get("/location-dictionary", response_model=List[LocationDictionaryEntry])
+async def get_location_dictionary(db: Session = Depends(get_db)):
+    """Словарь локаций журнала операций: id, название и id локации в Warehouse Service"""
+    return db.query(InventoryLocation).order_by(InventoryLocation.id).all()
+
+
+@router.post("/location-dictionary/sync", response_model=LocationSyncResponse)
+async def sync_location_dictionary(db: Session = Depends(get_db)):
+    """Синхронизировать словарь локаций с Warehouse Service вне расписания"""
+    warehouse_locations = await asyncio.to_thread(fetch_warehouse_locations)
+    if warehouse_locations is None:
+        raise HTTPException(status_code=503, detail="Warehouse Service недоступен")
+    return location_dictionary.sync(db, warehouse_locations)
+
+
 @router.get("/locations/{location_name}", response_model=List[LocationTotalResponse])
 async def get_location_totals_by_location(
     location_name: str,
@@ -227,17 +454,456 @@ async def get_location_totals_by_location(
         return []
 
 
+@router.get("/export/operations")
+async def export_operations(
+    export_format: str = Query("ndjson", alias="format", description="ndjson или csv"),
+    compress: bool = Query(False, alias="gzip", description="Сжать выгрузку gzip"),
+    operation_type: Optional[str] = Query(None, description="Фильтр по типу операции"),
+    sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
+    location: Optional[str] = Query(None, description="Фильтр по локации (начальной или конечной)"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Начало периода (включительно)"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Конец периода (не включительно)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Потоковая выгрузка журнала операций (старые сначала) в NDJSON или CSV.
+    
+    Строки читаются курсором на стороне сервера порциями, поэтому объем выгрузки не ограничен памятью.
+    """
+    _validate_export_format(export_format)
+    _validate_period(date_from, date_to)
+    chunks = exports.operation_chunks(
+        db, operation_type=operation_type, sku_id=sku_id, location=location, date_from=date_from, date_to=date_to
+    )
+    return _export_response(chunks, exports.OPERATION_COLUMNS, "operations", export_format, compress)
+
+
+@router.get("/export/locations")
+async def export_location_totals(
+    export_format: str = Query("ndjson", alias="format", description="ndjson или csv"),
+    compress: bool = Query(False, alias="gzip", description="Сжать выгрузку gzip"),
+    location_name: Optional[str] = Query(None, description="Только эта локация (по умолчанию - все)"),
+    db: Session = Depends(get_db)
+):
+    """Потоковая выгрузка остатков по локациям в NDJSON или CSV (в порядке локации и названия товара)"""
+    _validate_export_format(export_format)
+    chunks = exports.location_total_chunks(db, location_name=location_name)
+    return _export_response(chunks, exports.LOCATION_TOTAL_COLUMNS, "locations", export_format, compress)
+
+
+@router.post("/snapshots", response_model=SnapshotResponse, status_code=201)
+async def create_snapshot(db: Session = Depends(get_db)):
+    """Снять остатки вне расписания (снимки используются запросами с as_of)"""
+    return SnapshotService.take_snapshot(db)
+
+
+@router.get("/snapshots", response_model=List[SnapshotResponse])
+async def get_snapshots(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Получить список снимков остатков (новые сначала)"""
+    return db.query(InventorySnapshot).order_by(
+        InventorySnapshot.taken_at.desc()
+    ).offset(skip).limit(limit).all()
+
+
+@router.post("/reconciliation", response_model=ReconciliationResponse)
+async def reconcile_totals(
+    repair: bool = Query(False, description="Исправить остатки по журналу"),
+    sku_from: Optional[int] = Query(None, description="Начало диапазона SKU (включительно)"),
+    sku_to: Optional[int] = Query(None, description="Конец диапазона SKU (включительно)"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1000, le=500000, description="Размер порции строк журнала"),
+    db: Session = Depends(get_db)
+):
+    """
+    Сверить остатки по SKU и локациям с журналом операций.
+    Сверка читает весь журнал диапазона и выполняется в отдельном потоке, не блокируя event loop.
+    Для больших объемов запускайте по диапазонам SKU или через python -m app.reconciliation --workers N
+    """
+    if sku_from is not None and sku_to is not None and sku_from > sku_to:
+        raise HTTPException(status_code=400, detail="sku_from должен быть не больше sku_to")
+    
+    def reconcile():
+        repair_db = Session(bind=db.get_bind()) if repair else None
+        try:
+            return LedgerReconciler(db, repair_db, sku_from, sku_to, chunk_size).run()
+        finally:
+            if repair_db is not None:
+                repair_db.close()
+
+    try:
+        return await asyncio.to_thread(reconcile)
+    except LedgerBaselineError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/counts", response_model=StockCountResponse)
+async def upload_stock_count(
+    request: Request,
+    count_format: Optional[str] = Query(
+        None, alias="format", description="csv, ndjson или json (по умолчанию - по Content-Type)"
+    ),
+    missing_as_zero: bool = Query(True, description="Товары локации, которых нет в файле, считать отсутствующими"),
+    dry_run: bool = Query(False, description="Только отчет о расхождениях, без корректировки остатков"),
+    db: Session = Depends(get_db)
+):
+    """
+    Загрузить результаты инвентаризации (sku_id, location_name, counted_weight в кг) телом запроса.
+    
+    Каждая локация файла считается пересчитанной целиком. Расхождения с остатками применяются
+    одной транзакцией операциями receipt/write_off; ответ - отчет о расхождениях.
+    """
+    if count_format is None:
+        content_type = request.headers.get("content-type", "")
+        count_format = "csv" if "csv" in content_type else "ndjson" if "ndjson" in content_type else "json"
+    if count_format not in COUNT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из: {', '.join(COUNT_FORMATS)}")
+    
+    parser = CountParser(count_format)
+    async for chunk in request.stream():
+        parser.feed(chunk)
+    parser.close()
+    if parser.errors:
+        raise HTTPException(status_code=400, detail={
+            "message": "Файл пересчета содержит ошибки", "errors": parser.errors
+        })
+    if not parser.counts:
+        raise HTTPException(status_code=400, detail="Файл пересчета пуст")
+    
+    try:
+        report = await StockCount(db, parser.counts, missing_as_zero=missing_as_zero, dry_run=dry_run).run()
+    except StockCountError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+    report["lines"] = parser.lines
+    return report
+
+
+@router.get("/reports/movements", response_model=List[MovementReportRow])
+async def get_movement_report(
+    date_from: Optional[date] = Query(None, alias="from", description="Первый день периода (включительно)"),
+    date_to: Optional[date] = Query(None, alias="to", description="Конец периода (не включительно)"),
+    granularity: str = Query("day", description="Группировка: day, week или month"),
+    sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
+    location: Optional[str] = Query(None, description="Фильтр по локации"),
+    operation_type: Optional[str] = Query(None, description="Фильтр по типу операции"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """Отчет по движению товара: поступления и убытия по локациям за период (из дневного агрегата)"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity должен быть одним из: {', '.join(GRANULARITIES)}")
+    _validate_period(date_from, date_to)
+    return MovementService.report(
+        db,
+        date_from=date_from,
+        date_to=date_to,
+        granularity=granularity,
+        sku_id=sku_id,
+        location=location,
+        operation_type=operation_type,
+        skip=skip,
+        limit=limit
+    )
+
+
+@router.post("/reports/movements/backfill", response_model=MovementBackfillResponse)
+async def backfill_movements(
+    date_from: Optional[date] = Query(None, alias="from", description="Первый день (по умолчанию - с начала журнала)"),
+    date_to: Optional[date] = Query(None, alias="to", description="Конец периода (не включительно, по умолчанию - завтра)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Пересобрать отчеты по движению товара из журнала операций.
+    Для больших периодов запускайте через python -m app.movements --from ... --to ...
+    """
+    _validate_period(date_from, date_to)
+    return MovementService.backfill(db, date_from, date_to)
+
+
+@router.get("/analytics", response_model=AnalyticsSummaryResponse)
+async def get_analytics_summary(db: Session = Depends(get_db)):
+    """Окно последнего ABC/XYZ-анализа и матрица: количество товаров по парам классов"""
+    return AnalyticsService.summary(db)
+
+
+@router.get("/analytics/skus", response_model=List[SKUAnalyticsResponse])
+async def get_sku_analytics(
+    abc_class: Optional[str] = Query(None, description="Фильтр по классу ABC: A, B или C"),
+    xyz_class: Optional[str] = Query(None, description="Фильтр по классу XYZ: X, Y или Z"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """ABC/XYZ-классы, расход и оборачиваемость товаров в порядке вклада в расход"""
+    return AnalyticsService.skus(db, abc_class=abc_class, xyz_class=xyz_class, skip=skip, limit=limit)
+
+
+@router.get("/analytics/locations", response_model=List[LocationTurnoverResponse])
+async def get_location_turnover(db: Session = Depends(get_db)):
+    """Оборачиваемость и запас в днях по локациям"""
+    return AnalyticsService.locations(db)
+
+
+@router.post("/analytics/recompute", response_model=AnalyticsSummaryResponse)
+async def recompute_analytics(
+    force: bool = Query(True, description="Пересчитать, даже если окно анализа не сдвинулось"),
+    db: Session = Depends(get_db)
+):
+    """
+    Пересчитать ABC/XYZ-анализ и оборачиваемость вне расписания (из дневного агрегата движения).
+    После пересборки отчетов по движению пересчитывайте с force=true
+    """
+    return AnalyticsService.recompute(db, force)
+
+
+@router.post("/forecasts/query", response_model=ForecastQueryResponse)
+async def query_forecasts(query: ForecastQuery, db: Session = Depends(get_db)):
+    """
+    Прогноз спроса (убытия из локации) на horizon_days дней для наборов товаров и/или локаций.
+    Используется Warehouse Service для расчета объема пополнения. Нужен хотя бы один непустой набор
+    """
+    if not query.sku_ids and not query.location_names:
+        raise HTTPException(status_code=400, detail="Укажите sku_ids и/или location_names")
+    if query.method is not None and query.method not in FORECAST_METHODS:
+        raise HTTPException(status_code=400, detail=f"method должен быть одним из: {', '.join(FORECAST_METHODS)}")
+    return ForecastService.query(
+        db,
+        sku_ids=query.sku_ids,
+        location_names=query.location_names,
+        horizon_days=query.horizon_days,
+        method=query.method
+    )
+
+
+@router.post("/forecasts/refresh", response_model=ForecastRefreshResponse)
+async def refresh_forecasts(
+    force: bool = Query(True, description="Пересчитать, даже если новый день не закрылся"),
+    db: Session = Depends(get_db)
+):
+    """Пересчитать прогноз спроса вне расписания (из дневного агрегата движения)"""
+    return ForecastService.refresh(db, force)
+
+
+@router.get("/thresholds", response_model=List[StockThresholdResponse])
+async def get_thresholds(
+    sku_id: Optional[int] = Query(None, description="Фильтр по ID товара"),
+    location: Optional[str] = Query(None, description="Фильтр по локации"),
+    state: Optional[str] = Query(None, description="Фильтр по состоянию: ok, low или high"),
+    db: Session = Depends(get_db)
+):
+    """Получить пороги оповещений о низком остатке и переполнении"""
+    query = db.query(InventoryStockThreshold)
+    if sku_id is not None:
+        query = query.filter(InventoryStockThreshold.sku_id == sku_id)
+    if location:
+        query = query.filter(InventoryStockThreshold.location_name == location)
+    if state:
+        query = query.filter(InventoryStockThreshold.state == state)
+    return query.order_by(InventoryStockThreshold.id).all()
+
+
+@router.post("/thresholds", response_model=StockThresholdResponse)
+async def set_threshold(threshold_data: StockThresholdCreate, db: Session = Depends(get_db)):
+    """
+    Создать или изменить порог для товара в локации, товара или локации.
+    
+    Состояние порога сразу сверяется с текущим остатком: если остаток уже за порогом,
+    оповещение отправляется сейчас, дальше - только при пересечении порога.
+    """
+    if threshold_data.sku_id is None and threshold_data.location_name is None:
+        raise HTTPException(status_code=400, detail="Нужно указать sku_id и/или location_name")
+    if threshold_data.min_weight is None and threshold_data.max_weight is None:
+        raise HTTPException(status_code=400, detail="Нужно указать min_weight и/или max_weight")
+    if (
+        threshold_data.min_weight is not None and threshold_data.max_weight is not None
+        and threshold_data.min_weight > threshold_data.max_weight
+    ):
+        raise HTTPException(status_code=400, detail="min_weight должен быть не больше max_weight")
+    
+    threshold = db.query(InventoryStockThreshold).filter(
+        InventoryStockThreshold.sku_id.is_(None) if threshold_data.sku_id is None
+        else InventoryStockThreshold.sku_id == threshold_data.sku_id,
+        InventoryStockThreshold.location_name.is_(None) if threshold_data.location_name is None
+        else InventoryStockThreshold.location_name == threshold_data.location_name
+    ).first()
+    if threshold is None:
+        threshold = InventoryStockThreshold(
+            sku_id=threshold_data.sku_id,
+            location_name=threshold_data.location_name,
+            state=stock_alerts.LEVEL_OK
+        )
+        db.add(threshold)
+    threshold.min_weight = threshold_data.min_weight
+    threshold.max_weight = threshold_data.max_weight
+    db.flush()
+    stock_alerts.evaluate(db, threshold)
+    db.commit()
+    stock_alerts.threshold_cache.invalidate()
+    db.refresh(threshold)
+    return threshold
+
+
+@router.delete("/thresholds/{threshold_id}", status_code=204)
+async def delete_threshold(threshold_id: int, db: Session = Depends(get_db)):
+    """Удалить порог оповещений"""
+    deleted = db.query(InventoryStockThreshold).filter(InventoryStockThreshold.id == threshold_id).delete()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Порог не найден")
+    db.commit()
+    stock_alerts.threshold_cache.invalidate()
+    return Response(status_code=204)
+
+
 @router.get("/sku/{sku_id}/history", response_model=List[OperationResponse])
 async def get_sku_history(
     sku_id: int,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Начало периода (включительно)"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Конец периода (не включительно)"),
     db: Session = Depends(get_db)
 ):
     """Получить историю операций по конкретному товару"""
-    operations = db.query(InventoryOperation).filter(
-        InventoryOperation.sku_id == sku_id
-    ).order_by(InventoryOperation.created_at.desc()).offset(skip).limit(limit).all()
+    _validate_period(date_from, date_to)
+    return InventoryService.query_operations(
+        db,
+        skip=skip,
+        limit=limit,
+        sku_id=sku_id,
+        date_from=date_from,
+        date_to=date_to
+    )
+
+
+@router.get("/stream")
+async def stream_changes(
+    sku_id: Optional[int] = Query(None, description="Только изменения по товару"),
+    location: Optional[str] = Query(None, description="Только изменения в локации"),
+    last_event_id: Optional[int] = Query(None, ge=0, description="Продолжить после события с этим id"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Поток закоммиченных изменений (Server-Sent Events): события operation, location_total и sku_total.
+    
+    При переподключении браузер сам передает заголовок Last-Event-ID, и пропущенные события
+    досылаются из истории. Событие overflow (буфер клиента переполнен) или reset (история уже вытеснена)
+    означает, что часть изменений потеряна и списки нужно перечитать.
+    """
+    if last_event_id is None and last_event_id_header:
+        try:
+            last_event_id = int(last_event_id_header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный заголовок Last-Event-ID")
     
-    return operations
+    subscriber = change_stream.subscribe(sku_id=sku_id, location=location, last_event_id=last_event_id)
+    return StreamingResponse(
+        sse_events(change_stream, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/events/dead-letters", response_model=DeadLetterListResponse)
+async def get_dead_letters(limit: int = Query(100, ge=1, le=1000)):
+    """Просмотреть сообщения очереди недоставленных событий (без изъятия)"""
+    try:
+        return await dead_letter_queue.inspect(limit)
+    except Exception as e:
+        logger.error(f"Error reading dead letter queue: {e}")
+        raise HTTPException(status_code=503, detail="RabbitMQ недоступен")
+
+
+@router.post("/events/dead-letters/replay", response_model=DeadLetterReplayResponse)
+async def replay_dead_letters(
+    limit: Optional[int] = Query(None, ge=1, description="Сколько сообщений вернуть (по умолчанию все)"),
+    routing_key: Optional[str] = Query(None, description="Только события с этим routing key, например sku.updated")
+):
+    """Вернуть сообщения из очереди недоставленных событий в основную очередь"""
+    try:
+        return {"replayed": await dead_letter_queue.replay(limit, routing_key)}
+    except Exception as e:
+        logger.error(f"Error replaying dead letter queue: {e}")
+        raise HTTPException(status_code=503, detail="RabbitMQ недоступен")
+
+
+@router.delete("/events/dead-letters", response_model=DeadLetterPurgeResponse)
+async def purge_dead_letters():
+    """Удалить все сообщения очереди недоставленных событий"""
+    try:
+        return {"purged": await dead_letter_queue.purge()}
+    except Exception as e:
+        logger.error(f"Error purging dead letter queue: {e}")
+        raise HTTPException(status_code=503, detail="RabbitMQ недоступен")
+
+
+def _validate_period(date_from: Optional[datetime], date_to: Optional[datetime]):
+    """Проверить, что начало периода не позже конца"""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="Параметр from должен быть не позже to")
+
+
+def _validate_export_format(export_format: str):
+    if export_format not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из: {', '.join(exports.FORMATS)}")
+
+
+def _export_response(chunks, columns, name: str, export_format: str, compress: bool) -> StreamingResponse:
+    """
+    Ответ потоковой выгрузки. Генератор синхронный: Starlette выполняет его в пуле потоков,
+    и чтение курсора не блокирует event loop. Сессия БД закрывается после отправки ответа
+    """
+    return StreamingResponse(
+        exports.encode(chunks, columns, export_format, compress),
+        media_type=exports.media_type(export_format, compress),
+        headers={"Content-Disposition": f'attachment; filename="{exports.filename(name, export_format, compress)}"'}
+    )
+
+
+def _accept_operation(
+    db: Session,
+    operation: OperationCreate,
+    idempotency_key: Optional[str],
+    request_hash: Optional[str]
+) -> JSONResponse:
+    """Сохранить квитанцию асинхронной операции и ответить 202 Accepted"""
+    try:
+        ticket = intake.submit(
+            db,
+            operation_type=operation.operation_type,
+            sku_id=operation.sku_id,
+            quantity_value=operation.quantity_value,
+            quantity_unit=operation.quantity_unit,
+            weight_value=operation.weight_value,
+            weight_unit=operation.weight_unit,
+            source_location=operation.source_location,
+            target_location=operation.target_location,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash
+        )
+    except idempotency.IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.IdempotencyKeyInUseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(
+        status_code=202,
+        content=IntakeTicketResponse.model_validate(ticket).model_dump(mode="json"),
+        headers={"Location": f"/inventory/intake/{ticket.id}"}
+    )
+
 
+def _get_saved_response(db: Session, idempotency_key: str, request_hash: str) -> Optional[dict]:
+    """
+    Сохраненный ответ по ключу идемпотентности; 422, если ключ использован с другим телом запроса,
+    409, если ключ занят асинхронной квитанцией, которая еще не применена
+    """
+    try:
+        return idempotency.get_saved_response(db, idempotency_key, request_hash)
+    except idempotency.IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.IdempotencyKeyInUseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
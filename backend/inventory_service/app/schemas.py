@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime
+from typing import Optional, List, Dict, Any
+from datetime import date, datetime
 
 
 class OperationCreate(BaseModel):
@@ -13,6 +13,9 @@ class OperationCreate(BaseModel):
     weight_unit: str = Field(..., description="Единица веса (кг/г/т)")
     source_location: Optional[str] = Field(None, description="Начальная локация")
     target_location: Optional[str] = Field(None, description="Конечная локация")
+    idempotency_key: Optional[str] = Field(
+        None, max_length=255, description="Ключ идемпотентности (альтернатива заголовку Idempotency-Key)"
+    )
 
 
 class OperationResponse(BaseModel):
@@ -29,15 +32,38 @@ class OperationResponse(BaseModel):
     delta_unit: str
     source_location: Optional[str]
     target_location: Optional[str]
+    source_location_id: Optional[int] = None  # id в словаре локаций (inventory_locations)
+    target_location_id: Optional[int] = None
     created_at: datetime
     
     class Config:
         from_attributes = True
 
 
+class IntakeTicketResponse(BaseModel):
+    """Квитанция асинхронно принятой операции"""
+    id: int  # Номер квитанции
+    operation_type: str
+    sku_id: int
+    status: str  # pending/applied/failed
+    operation_id: Optional[int]  # ID операции журнала после применения
+    error: Optional[str]
+    created_at: datetime
+    processed_at: Optional[datetime]
+    
+    class Config:
+        from_attributes = True
+
+
+class IntakeFlushResponse(BaseModel):
+    """Результат ожидания применения квитанций"""
+    through: int  # Все квитанции с номером не больше through обработаны
+    failed: int  # Из них отклонено
+
+
 class SKUTotalResponse(BaseModel):
     """Схема ответа для абсолютных остатков по SKU"""
-    id: int
+    id: Optional[int]  # None для строк, появившихся после снимка (запросы с as_of)
     sku_id: int
     sku_name: str
     total_quantity: int
@@ -50,7 +76,7 @@ class SKUTotalResponse(BaseModel):
 
 class LocationTotalResponse(BaseModel):
     """Схема ответа для остатков по локации"""
-    id: int
+    id: Optional[int]  # None для строк, появившихся после снимка (запросы с as_of)
     sku_id: int
     sku_name: str
     location_name: str
@@ -62,3 +88,303 @@ class LocationTotalResponse(BaseModel):
         from_attributes = True
 
 
+class TotalsQuery(BaseModel):
+    """Запрос остатков по наборам товаров и локаций (POST /inventory/totals/query)"""
+    sku_ids: List[int] = Field(default_factory=list, max_length=10000, description="ID товаров (пусто - все товары)")
+    location_names: List[str] = Field(
+        default_factory=list, max_length=10000, description="Локации (пусто - все локации)"
+    )
+
+
+class LocationSummaryResponse(BaseModel):
+    """Схема ответа для сводки по локации"""
+    location_name: str
+    total_weight: int  # Суммарный вес в локации (в кг)
+    sku_count: int  # Количество SKU с ненулевым весом
+    updated_at: datetime  # Последнее изменение остатков в локации
+    
+    class Config:
+        from_attributes = True
+
+
+class StockIndexStatsResponse(BaseModel):
+    """Состояние индекса остатков в памяти"""
+    enabled: bool
+    ready: bool  # Индекс построен и обслуживает чтения
+    building: bool  # Идет перестроение
+    sku_count: Optional[int] = None
+    location_count: Optional[int] = None
+    cell_count: Optional[int] = None  # Строк остатков по локациям
+    capacity: Optional[List[int]] = None  # Размер матрицы [SKU, локации]
+    memory_bytes: Optional[int] = None  # Матрицы, векторы и словари индексов
+    built_at: Optional[datetime] = None
+    changes_applied: Optional[int] = None  # Строк остатков, примененных после commit
+
+
+class SKULockStatsResponse(BaseModel):
+    """Метрики блокировок SKU при записи остатков (с запуска процесса)"""
+    acquired: int  # Взято блокировок
+    contended: int  # Из них пришлось ждать другую транзакцию
+    wait_seconds_total: float
+    wait_seconds_max: float
+    avg_wait_ms: float  # Среднее ожидание занятого SKU
+    bulk_batches: int  # Пачек SKU, заблокированных одним запросом (в счетчики выше не входят)
+    bulk_skus: int  # SKU в этих пачках
+    bulk_wait_seconds_total: float  # Ожидание пачек целиком
+    bulk_wait_seconds_max: float
+
+
+class LocationDictionaryEntry(BaseModel):
+    """Локация в словаре журнала операций"""
+    id: int
+    name: str
+    warehouse_location_id: Optional[int]  # None - локации нет в Warehouse Service (или еще не синхронизирована)
+    synced_at: Optional[datetime]
+    
+    class Config:
+        from_attributes = True
+
+
+class LocationSyncResponse(BaseModel):
+    """Результат синхронизации словаря локаций с Warehouse Service"""
+    warehouse_locations: int
+    added: int
+
+
+class SnapshotResponse(BaseModel):
+    """Схема ответа для снимка остатков"""
+    id: int
+    taken_at: datetime
+    location_rows: int
+    sku_rows: int
+    operation_id_mark: int
+    
+    class Config:
+        from_attributes = True
+
+
+class ReconciliationMismatch(BaseModel):
+    """Расхождение остатков с журналом операций"""
+    sku_id: int
+    location_name: Optional[str]  # None - абсолютный остаток по SKU
+    ledger_weight: int  # Вес по журналу операций
+    totals_weight: Optional[int]  # Вес в таблице остатков (None - строки нет)
+
+
+class ReconciliationResponse(BaseModel):
+    """Отчет сверки остатков с журналом операций"""
+    sku_from: Optional[int]
+    sku_to: Optional[int]
+    baseline_snapshot_id: Optional[int] = None  # Снимок остатков, от которого воспроизведен журнал (None - с нуля)
+    operations_scanned: int
+    cells_checked: int
+    mismatch_count: int
+    repaired: int
+    mismatches: List[ReconciliationMismatch]  # Первые расхождения (не более 1000)
+
+
+class MovementReportRow(BaseModel):
+    """Строка отчета по движению товара за период"""
+    period_start: date  # Первый день периода (день, понедельник недели или первое число месяца)
+    sku_id: int
+    location_name: str
+    operation_type: str
+    inbound_weight: int  # Поступило в локацию (в кг)
+    outbound_weight: int  # Убыло из локации (в кг)
+    net_weight: int  # Изменение остатка за период (в кг)
+    inbound_count: int
+    outbound_count: int
+
+
+class MovementBackfillResponse(BaseModel):
+    """Результат пересборки отчетов по движению товара из журнала"""
+    date_from: date
+    date_to: date
+    months: int
+    rows: int
+
+
+class StockThresholdCreate(BaseModel):
+    """Схема для создания или изменения порога оповещений"""
+    sku_id: Optional[int] = Field(None, description="ID товара (без локации - абсолютный остаток товара)")
+    location_name: Optional[str] = Field(None, description="Локация (без товара - суммарный вес в локации)")
+    min_weight: Optional[int] = Field(None, ge=0, description="Ниже этого веса - оповещение low_stock (в кг)")
+    max_weight: Optional[int] = Field(None, ge=0, description="Выше этого веса - оповещение over_capacity (в кг)")
+
+
+class StockThresholdResponse(BaseModel):
+    """Схема ответа для порога оповещений"""
+    id: int
+    sku_id: Optional[int]
+    location_name: Optional[str]
+    min_weight: Optional[int]
+    max_weight: Optional[int]
+    state: str  # ok/low/high - последнее оповещенное состояние
+    state_changed_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class StockCountVariance(BaseModel):
+    """Расхождение пересчета с остатками в ячейке (товар, локация)"""
+    location_name: str
+    sku_id: int
+    sku_name: str
+    book_weight: int  # Числилось (кг)
+    counted_weight: int  # Найдено при пересчете (кг)
+    difference: int  # counted_weight - book_weight
+    operation_id: Optional[int]  # Корректирующая операция журнала (None при dry_run)
+
+
+class StockCountResponse(BaseModel):
+    """Отчет о расхождениях инвентаризации"""
+    lines: int  # Строк в файле
+    locations: List[str]  # Пересчитанные локации
+    cells_compared: int
+    matched: int  # Ячеек без расхождений
+    variance_count: int
+    weight_added: int  # Суммарные излишки (кг)
+    weight_removed: int  # Суммарные недостачи (кг)
+    dry_run: bool
+    variances: List[StockCountVariance]
+
+
+class ValuationSKU(BaseModel):
+    """Стоимость остатков товара"""
+    sku_id: int
+    sku_name: Optional[str] = None
+    weight: int  # Суммарный вес во всех оцениваемых локациях (кг)
+    price_per_kg: Optional[float] = None  # None - нет цены в валюте отчета
+    value: float
+
+
+class ValuationLocation(BaseModel):
+    """Стоимость остатков в локации"""
+    location_name: str
+    cells: int  # Ненулевых строк остатков
+    weight: int
+    value: float
+
+
+class ValuationResponse(BaseModel):
+    """Оценка запасов по ценам каталога"""
+    currency: str
+    location_name: Optional[str] = None
+    source: str  # index - индекс остатков в памяти, database - таблица остатков
+    cells: int
+    total_value: float
+    priced_weight: int  # Вес товаров с ценой в валюте отчета (кг)
+    unpriced_weight: int  # Вес товаров без цены (в стоимость не вошел)
+    unpriced_sku_count: int
+    top_skus: List[ValuationSKU]
+    top_locations: List[ValuationLocation]
+
+
+class SKUAnalyticsResponse(BaseModel):
+    """ABC/XYZ-класс и оборачиваемость товара"""
+    sku_id: int
+    abc_class: Optional[str]  # None - нет цены при оценке расхода по стоимости
+    xyz_class: Optional[str]  # None - расхода за окно не было
+    abc_rank: Optional[int]
+    demand_weight: int  # Расход за окно (кг)
+    demand_value: Optional[float]
+    value_share: Optional[float]
+    cumulative_share: Optional[float]
+    demand_cv: Optional[float]
+    average_stock: float
+    turnover: Optional[float]
+    window_from: date
+    window_to: date
+    computed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class LocationTurnoverResponse(BaseModel):
+    """Оборачиваемость локации"""
+    location_name: str
+    outbound_weight: int  # Убыло за окно: списания и перемещения (кг)
+    average_stock: float
+    turnover: Optional[float]
+    days_of_supply: Optional[float]
+    window_from: date
+    window_to: date
+    computed_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class AnalyticsSummaryResponse(BaseModel):
+    """Окно и матрица ABC/XYZ (количество товаров по парам классов, "-" - без класса)"""
+    window_from: Optional[date] = None  # None - анализ еще не выполнялся
+    window_to: Optional[date] = None
+    skus: int
+    locations: int
+    matrix: Dict[str, int]
+    recomputed: Optional[bool] = None  # Для POST /inventory/analytics/recompute: False - окно не сдвинулось
+
+
+class ForecastQuery(BaseModel):
+    """Запрос прогноза спроса по наборам товаров и локаций (POST /inventory/forecasts/query)"""
+    sku_ids: List[int] = Field(default_factory=list, max_length=10000, description="ID товаров (пусто - все товары)")
+    location_names: List[str] = Field(
+        default_factory=list, max_length=10000, description="Локации (пусто - все локации)"
+    )
+    horizon_days: int = Field(7, ge=1, le=365, description="На сколько дней вперед нужен спрос")
+    method: Optional[str] = Field(None, description="smoothing или moving_average (по умолчанию - из настроек)")
+
+
+class ForecastItem(BaseModel):
+    """Прогноз спроса по товару в локации"""
+    sku_id: int
+    location_name: str
+    moving_average: float  # кг в день
+    smoothed: float  # кг в день
+    daily_demand: float  # Расход в день по выбранному методу
+    forecast_weight: float  # Расход за горизонт (кг)
+
+
+class ForecastQueryResponse(BaseModel):
+    """Прогноз спроса; ячеек без расхода за историю нет (спрос 0)"""
+    method: str
+    horizon_days: int
+    history_from: Optional[date] = None
+    history_to: Optional[date] = None
+    computed_at: Optional[datetime] = None  # None - прогнозы еще не считались
+    items: List[ForecastItem]
+
+
+class ForecastRefreshResponse(BaseModel):
+    """Результат пересчета прогноза спроса"""
+    history_from: date
+    history_to: date
+    cells: int
+    refreshed: bool  # False - новый день не закрылся, кэш актуален
+
+
+class DeadLetterMessage(BaseModel):
+    """Сообщение в очереди недоставленных событий (DLQ)"""
+    routing_key: str
+    attempts: int  # Сколько попыток обработки не удалось
+    last_error: Optional[str]
+    dead_lettered_at: Optional[str]
+    body: Any
+
+
+class DeadLetterListResponse(BaseModel):
+    """Содержимое DLQ"""
+    total: int  # Всего сообщений в DLQ
+    messages: List[DeadLetterMessage]  # Первые limit сообщений
+
+
+class DeadLetterReplayResponse(BaseModel):
+    """Результат повтора сообщений из DLQ"""
+    replayed: int
+
+
+class DeadLetterPurgeResponse(BaseModel):
+    """Результат очистки DLQ"""
+    purged: int
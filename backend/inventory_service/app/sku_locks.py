@@ -0,0 +1,143 @@
+"""
+Блокировки SKU на время транзакции записи остатков (advisory-блокировки PostgreSQL)
+
+Остатки обновляются чтением и записью строк через ORM (InventoryService._update_totals,
+пересчет в event_consumer). Две параллельные транзакции по одному SKU иначе могли бы прочитать
+одно и то же значение и потерять приращение одной из них, а перемещение - перемежаться с другой
+операцией между уменьшением в начальной локации и увеличением в конечной.
+
+Перед изменением остатков транзакция берет pg_advisory_xact_lock по ключу (LOCK_NAMESPACE, sku_id):
+операции одного SKU выполняются по очереди, разных SKU - параллельно. Пачка из нескольких SKU берет
+блокировки заранее в порядке возрастания sku_id, поэтому взаимных блокировок между пачками не бывает.
+Блокировки снимаются сами при commit или rollback.
+
+Ожидание блокировок учитывается в метриках (GET /inventory/locks/stats): сначала делается
+pg_try_advisory_xact_lock, и только если SKU занят - блокирующий вызов с замером времени.
+Пачки от BULK_LOCK_THRESHOLD SKU блокируются одним запросом, где занятые SKU не отличить
+от свободных, поэтому они учитываются отдельно: число пачек и SKU и время ожидания пачки целиком.
+В SQLite (тесты) блокировки не нужны - пишущие транзакции там и так идут по одной.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "locked_skus"
+
+# Первая половина ключа advisory-блокировки: отделяет блокировки SKU от других advisory-блокировок в БД
+LOCK_NAMESPACE = 0x494E56  # "INV"
+
+# Ожидание дольше этого порога попадает в лог
+SLOW_WAIT_SECONDS = 1.0
+
+# С этого количества SKU блокировки берутся одним запросом (пересчет, загрузка инвентаризации)
+BULK_LOCK_THRESHOLD = 64
+
+
+class LockMetrics:
+    """Счетчики блокировок SKU в процессе сервиса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.acquired = 0  # Взято блокировок
+            self.contended = 0  # Из них SKU был занят другой транзакцией
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.bulk_batches = 0  # Пачек, заблокированных одним запросом
+            self.bulk_skus = 0  # SKU в этих пачках
+            self.bulk_wait_seconds_total = 0.0
+            self.bulk_wait_seconds_max = 0.0
+
+    def record_bulk(self, sku_count: int, wait_seconds: float):
+        with self._lock:
+            self.bulk_batches += 1
+            self.bulk_skus += sku_count
+            self.bulk_wait_seconds_total += wait_seconds
+            self.bulk_wait_seconds_max = max(self.bulk_wait_seconds_max, wait_seconds)
+
+    def record(self, contended: bool, wait_seconds: float = 0.0):
+        with self._lock:
+            self.acquired += 1
+            if contended:
+                self.contended += 1
+                self.wait_seconds_total += wait_seconds
+                self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "contended": self.contended,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "avg_wait_ms": round(self.wait_seconds_total / self.contended * 1000, 3) if self.contended else 0.0,
+                "bulk_batches": self.bulk_batches,
+                "bulk_skus": self.bulk_skus,
+                "bulk_wait_seconds_total": round(self.bulk_wait_seconds_total, 6),
+                "bulk_wait_seconds_max": round(self.bulk_wait_seconds_max, 6),
+            }
+
+
+lock_metrics = LockMetrics()
+
+
+def lock_skus(db: Session, sku_ids: Iterable[int]):
+    """
+    Заблокировать SKU до конца текущей транзакции (в порядке возрастания sku_id)
+
+    SKU, уже заблокированные этой транзакцией, пропускаются. Все SKU пачки нужно передавать
+    одним вызовом до первого изменения остатков - так порядок блокировок одинаков во всех транзакциях.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    locked: Set[int] = db.info.setdefault(SESSION_KEY, set())
+    to_lock = sorted(set(sku_ids) - locked)
+    if len(to_lock) >= BULK_LOCK_THRESHOLD:
+        _lock_bulk(db, to_lock)
+        locked.update(to_lock)
+        return
+    for sku_id in to_lock:
+        params = {"namespace": LOCK_NAMESPACE, "sku_id": sku_id}
+        if db.execute(text("SELECT pg_try_advisory_xact_lock(:namespace, :sku_id)"), params).scalar():
+            lock_metrics.record(contended=False)
+        else:
+            started = time.perf_counter()
+            db.execute(text("SELECT pg_advisory_xact_lock(:namespace, :sku_id)"), params)
+            waited = time.perf_counter() - started
+            lock_metrics.record(contended=True, wait_seconds=waited)
+            if waited >= SLOW_WAIT_SECONDS:
+                logger.warning(f"Waited {waited:.2f}s for SKU {sku_id} lock")
+        locked.add(sku_id)
+
+
+def _lock_bulk(db: Session, sku_ids: List[int]):
+    """
+    Заблокировать много SKU одним запросом (в порядке возрастания sku_id):
+    вместо запроса на каждый SKU - один проход по отсортированному массиву.
+    Ожидание замеряется для пачки целиком и в счетчики отдельных SKU не попадает
+    """
+    started = time.perf_counter()
+    db.execute(text(
+        "SELECT pg_advisory_xact_lock(:namespace, sku_id) "
+        "FROM (SELECT unnest(CAST(:sku_ids AS integer[])) AS sku_id ORDER BY 1) AS ordered"
+    ), {"namespace": LOCK_NAMESPACE, "sku_ids": sku_ids})
+    waited = time.perf_counter() - started
+    lock_metrics.record_bulk(len(sku_ids), waited)
+    if waited >= SLOW_WAIT_SECONDS:
+        logger.warning(f"Waited {waited:.2f}s for {len(sku_ids)} SKU locks")
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget_locks(session: Session):
+    # Транзакционные advisory-блокировки сняты вместе с транзакцией
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,223 @@
+"""
+Проекция цен каталога (inventory_sku_prices) для оценки запасов
+
+Цена товара в каталоге (SKU.price, единица price_unit - валюта) задана за единицу товара весом
+weight (единица weight_unit), а остатки ведутся в кг, поэтому проекция хранит цену килограмма:
+price_per_kg = price / (weight * коэффициент единицы веса). Товар без цены или с нулевым весом
+оценить нельзя (price_per_kg = None).
+
+Проекция обновляется:
+- при создании и изменении товара: товар из Catalog Service уже получен для операции create/update
+  (InventoryService.create_operation, потребитель событий sku.created/sku.updated), цена записывается
+  в той же транзакции без дополнительных запросов; sku.deleted удаляет строку;
+- периодически целиком (SKU_PRICE_REFRESH_INTERVAL_SECONDS): список товаров каталога постранично
+  и upsert пачками; строки товаров, которых в каталоге больше нет, удаляются. Удаление выполняется,
+  только если получено столько товаров, сколько их в каталоге (X-Total-Count): неполный список
+  (каталог изменился во время обхода) обновляет цены, но ничего не удаляет.
+
+Для расчета оценки цены держатся в памяти процесса векторами NumPy (PriceCache): отсортированные
+ID товаров, цена килограмма и код валюты. Кэш сбрасывается после commit транзакции, изменившей
+проекцию в этом процессе, и по истечении SKU_PRICE_CACHE_SECONDS (изменения других экземпляров).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, select, delete, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal, upsert
+from app.catalog_client import catalog_client
+from app.models import InventorySKUPrice
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "sku_prices_changed"
+CHUNK_SIZE = 10000  # Строк в одном upsert/delete при полном обновлении
+
+# Снимок кэша: (ID товаров по возрастанию, цена кг, код валюты, валюты по коду)
+PriceSnapshot = Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _unit_name(sku_data: Dict, field: str, unit_names: Optional[Dict[int, str]]) -> Optional[str]:
+    """Название единицы: вложенный объект (GET /catalog/skus/{id}) или ID из списка товаров"""
+    unit = sku_data.get(field)
+    if isinstance(unit, dict):
+        return unit.get("name")
+    if unit_names is not None:
+        return unit_names.get(sku_data.get(f"{field}_id"))
+    return None
+
+
+async def price_row(sku_data: Dict, unit_names: Optional[Dict[int, str]] = None) -> Dict:
+    """Строка проекции по товару каталога"""
+    price = _number(sku_data.get("price"))
+    weight = _number(sku_data.get("weight"))
+    weight_unit = _unit_name(sku_data, "weight_unit", unit_names) or "кг"
+    unit_weight = weight * await catalog_client.get_weight_unit_coefficient(weight_unit) if weight else None
+    return {
+        "sku_id": sku_data["id"],
+        "price": price,
+        "currency": _unit_name(sku_data, "price_unit", unit_names),
+        "unit_weight": unit_weight,
+        "price_per_kg": price / unit_weight if price is not None and unit_weight else None,
+    }
+
+
+def save(db: Session, rows: List[Dict]):
+    """Записать строки проекции в текущей транзакции (кэш сбросится после commit)"""
+    if not rows:
+        return
+    statement = upsert(db, InventorySKUPrice)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[InventorySKUPrice.sku_id],
+        set_={
+            "price": statement.excluded.price,
+            "currency": statement.excluded.currency,
+            "unit_weight": statement.excluded.unit_weight,
+            "price_per_kg": statement.excluded.price_per_kg,
+            "updated_at": func.now(),
+        }
+    ), rows)
+    db.info[SESSION_KEY] = True
+
+
+async def apply_catalog_sku(db: Session, sku_data: Dict):
+    """Обновить цену товара по данным Catalog Service в текущей транзакции"""
+    save(db, [await price_row(sku_data)])
+
+
+def remove(db: Session, sku_id: int):
+    """Удалить цену удаленного товара в текущей транзакции"""
+    db.execute(delete(InventorySKUPrice).where(InventorySKUPrice.sku_id == sku_id))
+    db.info[SESSION_KEY] = True
+
+
+async def fetch_catalog_prices() -> Optional[Tuple[List[Dict], Optional[int]]]:
+    """
+    Строки проекции по всем товарам каталога и количество товаров в каталоге
+    (None - каталог недоступен; количество None - каталог его не сообщил)
+    """
+    catalog_total = await catalog_client.count_skus()
+    records, unit_names = await asyncio.gather(catalog_client.list_sku_records(), catalog_client.get_units())
+    if records is None or unit_names is None:
+        return None
+    return [await price_row(record, unit_names) for record in records], catalog_total
+
+
+def replace_all(db: Session, rows: List[Dict], catalog_total: Optional[int]) -> Dict:
+    """
+    Записать список цен каталога и удалить цены товаров, которых в нем нет
+
+    Удаление выполняется, только если строк столько же, сколько товаров в каталоге (catalog_total):
+    иначе список мог оказаться неполным, и цены существующих товаров были бы удалены.
+    """
+    for start in range(0, len(rows), CHUNK_SIZE):
+        save(db, rows[start:start + CHUNK_SIZE])
+    stale = []
+    if catalog_total == len(rows):
+        stale = sorted(
+            set(db.execute(select(InventorySKUPrice.sku_id)).scalars()) - {row["sku_id"] for row in rows}
+        )
+    else:
+        logger.warning(
+            f"Цены товаров, которых нет в списке, не удалены: получено {len(rows)} товаров, в каталоге {catalog_total}"
+        )
+    for start in range(0, len(stale), CHUNK_SIZE):
+        db.execute(delete(InventorySKUPrice).where(InventorySKUPrice.sku_id.in_(stale[start:start + CHUNK_SIZE])))
+    db.info[SESSION_KEY] = True
+    db.commit()
+    return {"skus": len(rows), "removed": len(stale)}
+
+
+def _replace_in_session(rows: List[Dict], catalog_total: Optional[int]) -> Dict:
+    db = SessionLocal()
+    try:
+        return replace_all(db, rows, catalog_total)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_refresh():
+    """Периодически обновлять проекцию целиком (запросы в event loop, запись в БД - в потоке)"""
+    while True:
+        try:
+            fetched = await fetch_catalog_prices()
+            if fetched is None:
+                logger.warning("Цены каталога не обновлены: Catalog Service недоступен")
+            else:
+                report = await asyncio.to_thread(_replace_in_session, *fetched)
+                logger.info(f"Цены каталога обновлены: {report['skus']} товаров, удалено {report['removed']}")
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении цен каталога: {e}", exc_info=True)
+        await asyncio.sleep(settings.SKU_PRICE_REFRESH_INTERVAL_SECONDS)
+
+
+class PriceCache:
+    """Цены килограмма в памяти процесса векторами NumPy"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = settings.SKU_PRICE_CACHE_SECONDS if ttl_seconds is None else ttl_seconds
+        self._snapshot: Optional[PriceSnapshot] = None
+        self._loaded_at = 0.0
+
+    def snapshot(self, db: Session) -> PriceSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            rows = db.execute(
+                select(InventorySKUPrice.sku_id, InventorySKUPrice.price_per_kg, InventorySKUPrice.currency)
+                .where(InventorySKUPrice.price_per_kg.isnot(None))
+                .order_by(InventorySKUPrice.sku_id)
+            ).all()
+            currencies = sorted({row[2] or "" for row in rows})
+            codes = {currency: code for code, currency in enumerate(currencies)}
+            snapshot = (
+                np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+                np.fromiter((codes[row[2] or ""] for row in rows), dtype=np.int32, count=len(rows)),
+                currencies,
+            )
+            self._snapshot, self._loaded_at = snapshot, time.monotonic()
+        return snapshot
+
+    def lookup(self, db: Session, sku_ids: np.ndarray, currency: str) -> np.ndarray:
+        """Цена килограмма для каждого SKU в валюте currency (NaN - нет цены в этой валюте)"""
+        known_ids, prices, currency_codes, currencies = self.snapshot(db)
+        result = np.full(len(sku_ids), np.nan)
+        if currency not in currencies or not len(known_ids):
+            return result
+        positions = np.minimum(np.searchsorted(known_ids, sku_ids), len(known_ids) - 1)
+        found = (known_ids[positions] == sku_ids) & (currency_codes[positions] == currencies.index(currency))
+        result[found] = prices[positions[found]]
+        return result
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+# Глобальный кэш цен
+price_cache = PriceCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_prices(session: Session):
+    if session.info.pop(SESSION_KEY, None):
+        price_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_prices(session: Session):
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,346 @@
+"""
+Снимки остатков и запросы остатков на дату
+
+Периодически (по умолчанию раз в сутки) остатки inventory_location_totals и inventory_sku_totals
+копируются в таблицы снимков. Остатки на момент as_of считаются как ближайший снимок не позже as_of
+плюс операции журнала после снимка до as_of, то есть за O(операций после снимка), а не O(всей истории).
+Хранятся SNAPSHOT_RETENTION_COUNT последних снимков.
+
+Снимок служит и базой для сверки и пересборки остатков по журналу (ledger_baseline), когда старые
+партиции журнала архивированы и воспроизводить журнал с нуля уже нельзя.
+
+Пропорциональный пересчет остатков по локациям из event_consumer (sku.updated) пишется в журнал
+операциями update на каждую локацию и операцией update без локации для остатка по SKU,
+поэтому воспроизводится так же, как остальные операции.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import select, insert, delete, literal, func, or_, text, false
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.inventory_service import InventoryService
+from app.locations import location_dictionary
+from app.models import (
+    InventoryOperation, InventorySKUTotal, InventoryLocationTotal,
+    InventorySnapshot, InventoryLocationTotalSnapshot, InventorySKUTotalSnapshot, InventoryOperationArchive
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerBaselineError(ValueError):
+    """Журнал в БД неполон (партиции архивированы), а снимка, с которого его можно воспроизвести, нет"""
+
+
+class SnapshotService:
+    """Сервис снимков остатков"""
+
+    @staticmethod
+    def take_snapshot(db: Session) -> InventorySnapshot:
+        """
+        Снять остатки в таблицы снимков одной транзакцией (INSERT ... SELECT)
+
+        В PostgreSQL на время копирования журнал и остатки блокируются в режиме SHARE:
+        снимок дожидается завершения идущих операций и не пропускает новые.
+        Граница снимка - максимальный ID операции под блокировкой (operation_id_mark): все операции
+        с ID не больше него учтены в снимке, все последующие получат больший ID. По created_at
+        границу провести нельзя - это время начала транзакции операции, и операция, начатая
+        до снимка, может записаться уже после него.
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(text(
+                "LOCK TABLE inventory_operations, inventory_location_totals, inventory_sku_totals IN SHARE MODE"
+            ))
+            taken_at = db.execute(select(func.clock_timestamp())).scalar()
+        else:
+            taken_at = db.execute(select(func.now())).scalar()
+        operation_id_mark = db.execute(select(func.coalesce(func.max(InventoryOperation.id), 0))).scalar()
+
+        snapshot = InventorySnapshot(taken_at=taken_at, operation_id_mark=operation_id_mark)
+        db.add(snapshot)
+        db.flush()
+
+        location_result = db.execute(
+            insert(InventoryLocationTotalSnapshot).from_select(
+                ["snapshot_id", "total_id", "sku_id", "sku_name", "location_name", "quantity", "weight", "updated_at"],
+                select(
+                    literal(snapshot.id),
+                    InventoryLocationTotal.id,
+                    InventoryLocationTotal.sku_id,
+                    InventoryLocationTotal.sku_name,
+                    InventoryLocationTotal.location_name,
+                    InventoryLocationTotal.quantity,
+                    InventoryLocationTotal.weight,
+                    InventoryLocationTotal.updated_at
+                )
+            )
+        )
+        sku_result = db.execute(
+            insert(InventorySKUTotalSnapshot).from_select(
+                ["snapshot_id", "total_id", "sku_id", "sku_name", "total_quantity", "total_weight", "updated_at"],
+                select(
+                    literal(snapshot.id),
+                    InventorySKUTotal.id,
+                    InventorySKUTotal.sku_id,
+                    InventorySKUTotal.sku_name,
+                    InventorySKUTotal.total_quantity,
+                    InventorySKUTotal.total_weight,
+                    InventorySKUTotal.updated_at
+                )
+            )
+        )
+        snapshot.location_rows = location_result.rowcount
+        snapshot.sku_rows = sku_result.rowcount
+
+        db.commit()
+        db.refresh(snapshot)
+        logger.info(
+            f"Снимок остатков {snapshot.id} на {snapshot.taken_at}: "
+            f"{snapshot.location_rows} строк по локациям, {snapshot.sku_rows} строк по SKU"
+        )
+        return snapshot
+
+    @staticmethod
+    def prune_snapshots(db: Session, keep: Optional[int] = None) -> int:
+        """
+        Удалить снимки старше keep последних (по умолчанию SNAPSHOT_RETENTION_COUNT, 0 - хранить все)
+
+        Returns:
+            Количество удаленных снимков
+        """
+        if keep is None:
+            keep = settings.SNAPSHOT_RETENTION_COUNT
+        if keep <= 0:
+            return 0
+
+        expired = [
+            snapshot_id for (snapshot_id,) in db.query(InventorySnapshot.id).order_by(
+                InventorySnapshot.taken_at.desc()
+            ).offset(keep).all()
+        ]
+        if not expired:
+            return 0
+        # Строки снимков удаляются явно: каскад по внешнему ключу есть не во всех СУБД
+        for model in (InventoryLocationTotalSnapshot, InventorySKUTotalSnapshot):
+            db.execute(delete(model).where(model.snapshot_id.in_(expired)))
+        db.execute(delete(InventorySnapshot).where(InventorySnapshot.id.in_(expired)))
+        db.commit()
+        logger.info(f"Удалено устаревших снимков остатков: {len(expired)}")
+        return len(expired)
+
+    @staticmethod
+    def ledger_baseline(db: Session) -> Optional[InventorySnapshot]:
+        """
+        База для пересчета остатков по журналу
+
+        Пока ни одна партиция не архивирована, журнал полон и остатки считаются с нуля (None).
+        После архивации нужен снимок, в котором учтены все выгруженные операции: последний снимок
+        с operation_id_mark не меньше максимального ID архива; остатки = снимок + операции с ID больше границы.
+
+        Raises:
+            LedgerBaselineError: Партиции архивированы, а подходящего снимка нет
+        """
+        archived, archived_max_id = db.query(
+            func.count(InventoryOperationArchive.partition_name),
+            func.coalesce(func.max(InventoryOperationArchive.max_operation_id), 0)
+        ).one()
+        if not archived:
+            return None
+
+        snapshot = db.query(InventorySnapshot).filter(
+            InventorySnapshot.operation_id_mark >= archived_max_id
+        ).order_by(InventorySnapshot.operation_id_mark.desc(), InventorySnapshot.taken_at.desc()).first()
+        if snapshot is None:
+            raise LedgerBaselineError(
+                f"Архивировано партиций журнала: {archived}, а снимка остатков после архивации нет - "
+                f"снимите снимок (POST /inventory/snapshots) и повторите"
+            )
+        return snapshot
+
+    @staticmethod
+    def get_base_snapshot(db: Session, as_of: datetime) -> Optional[InventorySnapshot]:
+        """Ближайший снимок не позже as_of"""
+        return db.query(InventorySnapshot).filter(
+            InventorySnapshot.taken_at <= as_of
+        ).order_by(InventorySnapshot.taken_at.desc()).first()
+
+    @staticmethod
+    def _operations_since(
+        db: Session,
+        snapshot: InventorySnapshot,
+        as_of: datetime,
+        sku_id: Optional[int] = None,
+        location_name: Optional[str] = None
+    ) -> List[InventoryOperation]:
+        """Операции журнала, не учтенные в снимке, с created_at <= as_of в порядке применения"""
+        query = db.query(InventoryOperation).filter(
+            InventoryOperation.id > snapshot.operation_id_mark,
+            InventoryOperation.created_at <= as_of
+        )
+        if sku_id is not None:
+            query = query.filter(InventoryOperation.sku_id == sku_id)
+        if location_name:
+            location_id = location_dictionary.id_of(db, location_name, create=False)
+            query = query.filter(or_(
+                InventoryOperation.source_location_id == location_id,
+                InventoryOperation.target_location_id == location_id
+            ) if location_id is not None else false())
+        return query.order_by(InventoryOperation.created_at, InventoryOperation.id).all()
+
+    @staticmethod
+    def location_totals_as_of(
+        db: Session,
+        as_of: datetime,
+        location_name: Optional[str] = None,
+        sku_id: Optional[int] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Остатки по локациям на момент as_of
+
+        Returns:
+            Строки в формате LocationTotalResponse (сортировка по локации и названию товара)
+            или None, если нет снимка не позже as_of
+        """
+        snapshot = SnapshotService.get_base_snapshot(db, as_of)
+        if not snapshot:
+            return None
+
+        query = db.query(InventoryLocationTotalSnapshot).filter(
+            InventoryLocationTotalSnapshot.snapshot_id == snapshot.id
+        )
+        if location_name:
+            query = query.filter(InventoryLocationTotalSnapshot.location_name == location_name)
+        if sku_id is not None:
+            query = query.filter(InventoryLocationTotalSnapshot.sku_id == sku_id)
+
+        cells: Dict[Tuple[int, str], Dict] = {}
+        for row in query.all():
+            cells[(row.sku_id, row.location_name)] = {
+                "id": row.total_id,
+                "sku_id": row.sku_id,
+                "sku_name": row.sku_name,
+                "location_name": row.location_name,
+                "quantity": row.quantity,
+                "weight": row.weight,
+                "updated_at": row.updated_at
+            }
+
+        def apply(operation: InventoryOperation, location: Optional[str], weight: int, absolute: bool):
+            if not location or (location_name and location != location_name):
+                return
+            cell = cells.get((operation.sku_id, location))
+            if cell is None:
+                cell = cells[(operation.sku_id, location)] = {
+                    "id": None,
+                    "sku_id": operation.sku_id,
+                    "sku_name": operation.sku_name,
+                    "location_name": location,
+                    "quantity": 0,
+                    "weight": 0,
+                    "updated_at": operation.created_at
+                }
+            cell["weight"] = weight if absolute else cell["weight"] + weight
+            cell["sku_name"] = operation.sku_name
+            cell["updated_at"] = operation.created_at
+
+        # Повторяем логику InventoryService._update_totals для операций после снимка
+        for operation in SnapshotService._operations_since(db, snapshot, as_of, sku_id, location_name):
+            delta_value = InventoryService.applied_delta(operation)
+            if operation.operation_type == 'update':
+                apply(operation, operation.source_location, delta_value, absolute=True)
+                continue
+            for location, location_delta in InventoryService.location_deltas(
+                operation.operation_type, delta_value, operation.source_location, operation.target_location
+            ):
+                apply(operation, location, location_delta, absolute=False)
+
+        return sorted(cells.values(), key=lambda cell: (cell["location_name"], cell["sku_name"]))
+
+    @staticmethod
+    def sku_totals_as_of(
+        db: Session,
+        as_of: datetime,
+        sku_id: Optional[int] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Абсолютные остатки по SKU на момент as_of
+
+        Returns:
+            Строки в формате SKUTotalResponse (сортировка по названию товара)
+            или None, если нет снимка не позже as_of
+        """
+        snapshot = SnapshotService.get_base_snapshot(db, as_of)
+        if not snapshot:
+            return None
+
+        query = db.query(InventorySKUTotalSnapshot).filter(
+            InventorySKUTotalSnapshot.snapshot_id == snapshot.id
+        )
+        if sku_id is not None:
+            query = query.filter(InventorySKUTotalSnapshot.sku_id == sku_id)
+
+        totals: Dict[int, Dict] = {}
+        for row in query.all():
+            totals[row.sku_id] = {
+                "id": row.total_id,
+                "sku_id": row.sku_id,
+                "sku_name": row.sku_name,
+                "total_quantity": row.total_quantity,
+                "total_weight": row.total_weight,
+                "updated_at": row.updated_at
+            }
+
+        for operation in SnapshotService._operations_since(db, snapshot, as_of, sku_id):
+            delta_value = InventoryService.applied_delta(operation)
+            if operation.operation_type == 'update':
+                weight, absolute = delta_value, True
+            else:
+                weight, absolute = InventoryService.sku_delta(operation.operation_type, delta_value), False
+                if not weight:
+                    continue  # Перемещение не меняет абсолютные остатки
+
+            total = totals.get(operation.sku_id)
+            if total is None:
+                total = totals[operation.sku_id] = {
+                    "id": None,
+                    "sku_id": operation.sku_id,
+                    "sku_name": operation.sku_name,
+                    "total_quantity": 0,
+                    "total_weight": 0,
+                    "updated_at": operation.created_at
+                }
+            total["total_weight"] = weight if absolute else total["total_weight"] + weight
+            total["sku_name"] = operation.sku_name
+            total["updated_at"] = operation.created_at
+
+        return sorted(totals.values(), key=lambda total: total["sku_name"])
+
+
+def run_snapshot(force: bool = False) -> Optional[InventorySnapshot]:
+    """
+    Снять остатки, если с последнего снимка прошло SNAPSHOT_INTERVAL_SECONDS (периодическая задача)
+
+    Проверка по времени последнего снимка не дает перезапускам сервиса
+    ни сбивать расписание, ни плодить лишние снимки. После снимка удаляются
+    снимки сверх SNAPSHOT_RETENTION_COUNT.
+    """
+    db = SessionLocal()
+    try:
+        if not force:
+            latest = db.query(func.max(InventorySnapshot.taken_at)).scalar()
+            now = db.execute(select(func.now())).scalar()
+            if latest is not None and now - latest < timedelta(seconds=settings.SNAPSHOT_INTERVAL_SECONDS):
+                return None
+        snapshot = SnapshotService.take_snapshot(db)
+        SnapshotService.prune_snapshots(db)
+        return snapshot
+    except Exception as e:
+        logger.error(f"Ошибка при создании снимка остатков: {e}", exc_info=True)
+        db.rollback()
+        raise
+    finally:
+        db.close()
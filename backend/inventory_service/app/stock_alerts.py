@@ -0,0 +1,186 @@
+"""
+Оповещения о низком остатке и переполнении (события inventory.alert.*)
+
+Пороги (inventory_stock_thresholds) задаются для остатка товара в локации, для абсолютного
+остатка товара и для суммарного веса в локации. Проверка встроена в путь обновления остатков
+и использует только старое и новое значение: состояние (ok/low/high) пересчитывается,
+лишь когда изменение пересекает порог, поэтому остатки не перечитываются.
+
+Повторные оповещения подавляются: переход состояния фиксируется условным UPDATE
+(WHERE state <> новое состояние) в той же транзакции, что и остатки, и событие отправляется,
+только если строка порога действительно изменилась. Следующее low_stock придет лишь после
+recovered. События публикуются в RabbitMQ после commit; откаченные изменения оповещений не дают.
+
+Пороги кэшируются в процессе (STOCK_THRESHOLD_CACHE_SECONDS); изменения через API сбрасывают кэш сразу.
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, update, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import InventoryStockThreshold, InventoryLocationTotal, InventorySKUTotal, InventoryLocationRollup
+from app.rabbitmq_client import rabbitmq_client
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "stock_alerts"
+
+LEVEL_OK = "ok"
+LEVEL_LOW = "low"
+LEVEL_HIGH = "high"
+
+# Routing key события (inventory.<...>) для нового состояния
+ALERT_EVENTS = {
+    LEVEL_LOW: "alert.low_stock",
+    LEVEL_HIGH: "alert.over_capacity",
+    LEVEL_OK: "alert.recovered",
+}
+
+ThresholdKey = Tuple[Optional[int], Optional[str]]
+
+
+def level(value: int, min_weight: Optional[int], max_weight: Optional[int]) -> str:
+    """Состояние остатка относительно порогов"""
+    if min_weight is not None and value < min_weight:
+        return LEVEL_LOW
+    if max_weight is not None and value > max_weight:
+        return LEVEL_HIGH
+    return LEVEL_OK
+
+
+class ThresholdCache:
+    """Пороги в памяти процесса: {(sku_id, location_name): (id, min_weight, max_weight)}"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = settings.STOCK_THRESHOLD_CACHE_SECONDS if ttl_seconds is None else ttl_seconds
+        self._thresholds: Optional[Dict[ThresholdKey, Tuple[int, Optional[int], Optional[int]]]] = None
+        self._loaded_at = 0.0
+
+    def get(self, db: Session, sku_id: Optional[int], location_name: Optional[str]):
+        if self._thresholds is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            rows = db.query(
+                InventoryStockThreshold.id,
+                InventoryStockThreshold.sku_id,
+                InventoryStockThreshold.location_name,
+                InventoryStockThreshold.min_weight,
+                InventoryStockThreshold.max_weight
+            ).all()
+            self._thresholds = {
+                (row_sku_id, row_location): (threshold_id, min_weight, max_weight)
+                for threshold_id, row_sku_id, row_location, min_weight, max_weight in rows
+            }
+            self._loaded_at = time.monotonic()
+        return self._thresholds.get((sku_id, location_name))
+
+    def invalidate(self):
+        self._thresholds = None
+
+
+threshold_cache = ThresholdCache()
+
+
+def check(db: Session, sku_id: Optional[int], location_name: Optional[str], old_value: int, new_value: int):
+    """
+    Проверить порог остатка (sku_id, location_name) после изменения old_value -> new_value
+
+    Args:
+        sku_id: ID товара (None - суммарный вес в локации)
+        location_name: Локация (None - абсолютный остаток товара)
+    """
+    if old_value == new_value:
+        return
+    threshold = threshold_cache.get(db, sku_id, location_name)
+    if threshold is None:
+        return
+    threshold_id, min_weight, max_weight = threshold
+    new_level = level(new_value, min_weight, max_weight)
+    if level(old_value, min_weight, max_weight) == new_level:
+        return  # Порог не пересечен
+    _transition(db, threshold_id, sku_id, location_name, new_level, new_value, min_weight, max_weight)
+
+
+def check_location(db: Session, location_name: Optional[str], weight_delta: int):
+    """Проверить порог суммарного веса в локации (сводка уже обновлена в текущей транзакции)"""
+    if not location_name or not weight_delta or threshold_cache.get(db, None, location_name) is None:
+        return
+    total = db.query(InventoryLocationRollup.total_weight).filter(
+        InventoryLocationRollup.location_name == location_name
+    ).scalar() or 0
+    check(db, None, location_name, total - weight_delta, total)
+
+
+def current_value(db: Session, sku_id: Optional[int], location_name: Optional[str]) -> int:
+    """Текущее значение, с которым сравнивается порог"""
+    if sku_id is None:
+        query = db.query(InventoryLocationRollup.total_weight).filter(
+            InventoryLocationRollup.location_name == location_name
+        )
+    elif location_name is None:
+        query = db.query(InventorySKUTotal.total_weight).filter(InventorySKUTotal.sku_id == sku_id)
+    else:
+        query = db.query(InventoryLocationTotal.weight).filter(
+            InventoryLocationTotal.sku_id == sku_id,
+            InventoryLocationTotal.location_name == location_name
+        )
+    return query.scalar() or 0
+
+
+def evaluate(db: Session, threshold: InventoryStockThreshold):
+    """Привести состояние порога к текущему значению (после создания или изменения порога)"""
+    value = current_value(db, threshold.sku_id, threshold.location_name)
+    new_level = level(value, threshold.min_weight, threshold.max_weight)
+    if new_level != threshold.state:
+        _transition(
+            db, threshold.id, threshold.sku_id, threshold.location_name,
+            new_level, value, threshold.min_weight, threshold.max_weight
+        )
+
+
+def _transition(
+    db: Session,
+    threshold_id: int,
+    sku_id: Optional[int],
+    location_name: Optional[str],
+    new_level: str,
+    value: int,
+    min_weight: Optional[int],
+    max_weight: Optional[int]
+):
+    """Зафиксировать новое состояние порога и запланировать оповещение (если состояние изменилось)"""
+    result = db.execute(
+        update(InventoryStockThreshold).where(
+            InventoryStockThreshold.id == threshold_id,
+            InventoryStockThreshold.state != new_level
+        ).values(state=new_level, state_changed_at=func.now()).execution_options(synchronize_session="fetch")
+    )
+    if not result.rowcount:
+        return  # Оповещение об этом состоянии уже отправлено
+    session_alerts(db).append((ALERT_EVENTS[new_level], {
+        "threshold_id": threshold_id,
+        "sku_id": sku_id,
+        "location_name": location_name,
+        "level": new_level,
+        "value": value,
+        "min_weight": min_weight,
+        "max_weight": max_weight,
+    }))
+
+
+def session_alerts(db: Session) -> List[Tuple[str, Dict]]:
+    """Оповещения текущей транзакции (отправляются после commit)"""
+    return db.info.setdefault(SESSION_KEY, [])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_alerts(session: Session):
+    for event_type, data in session.info.pop(SESSION_KEY, []):
+        rabbitmq_client.publish_event(event_type, data)
+        logger.info(f"Stock alert {event_type}: SKU {data['sku_id']}, location {data['location_name']}, value {data['value']}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_alerts(session: Session):
+    session.info.pop(SESSION_KEY, None)
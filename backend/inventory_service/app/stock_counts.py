@@ -0,0 +1,392 @@
+"""
+Загрузка инвентаризации (POST /inventory/counts)
+
+Файл пересчета (sku_id, локация, фактический вес в кг) в CSV с заголовком, NDJSON или JSON-массиве
+разбирается по мере получения тела запроса: в памяти остается только итог {локация: {sku_id: вес}},
+повторные строки одной ячейки суммируются (ячейку пересчитывали частями).
+
+Сверка с inventory_location_totals идет одним проходом слиянием отсортированных последовательностей:
+для каждой локации файла строки остатков читаются одним запросом в порядке sku_id (индекс локации)
+и сливаются с отсортированными строками файла. Локация в файле считается пересчитанной целиком:
+товар, который числится в ней, но не найден при пересчете, получает фактический вес 0
+(missing_as_zero=false - такие строки не сверяются).
+
+Расхождения применяются одной транзакцией: на каждую ячейку - операция журнала (receipt при излишке,
+write_off при недостаче), остаток ячейки становится равным факту, сводка по локации и дневной
+агрегат движения обновляются одним запросом на локацию и одним upsert на всю пачку,
+абсолютные остатки - по SKU пачками. SKU пересчета блокируются заранее (app/sku_locks.py).
+С dry_run=true возвращается только отчет о расхождениях.
+"""
+import csv
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.inventory_service import InventoryService
+from app.models import InventoryOperation, InventoryLocationTotal, InventorySKUTotal
+from app.rabbitmq_client import rabbitmq_client
+from app import location_rollups, movements, sku_locks, stock_alerts
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson", "json")
+
+# Допустимые названия колонок CSV и полей JSON
+SKU_FIELDS = ("sku_id",)
+LOCATION_FIELDS = ("location_name", "location")
+WEIGHT_FIELDS = ("counted_weight", "weight")
+
+MAX_ERRORS = 100  # Сколько ошибок разбора возвращается в ответе
+SKU_CHUNK_SIZE = 1000  # Ключей в одном запросе IN
+
+
+class StockCountError(ValueError):
+    """Файл пересчета не принят (ошибки в строках или неизвестные товары)"""
+
+    def __init__(self, message: str, errors: List[str]):
+        super().__init__(message)
+        self.errors = errors
+
+
+def _field(record: Dict, names) -> Optional[object]:
+    for name in names:
+        if name in record:
+            return record[name]
+    return None
+
+
+class CountParser:
+    """Разбор файла пересчета по частям тела запроса в {локация: {sku_id: фактический вес}}"""
+
+    def __init__(self, count_format: str):
+        self.format = count_format
+        self.counts: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.lines = 0
+        self.errors: List[str] = []
+        self._columns: Optional[Dict[str, int]] = None
+        self._line_number = 0
+        self._tail = b""
+        self._started = False
+
+    def feed(self, data: bytes):
+        """Принять очередную часть тела (обрабатываются только полные строки)"""
+        if not self._started:
+            self._started = True
+            if data.startswith(b"\xef\xbb\xbf"):  # BOM из Excel
+                data = data[3:]
+        data = self._tail + data
+        if self.format == "json":
+            self._tail = data  # JSON-массив разбирается целиком
+            return
+        # Байт \n не встречается внутри многобайтовых символов UTF-8 - резать по нему безопасно
+        lines = data.split(b"\n")
+        self._tail = lines.pop()
+        self._parse_lines(lines)
+
+    def close(self):
+        """Разобрать остаток тела"""
+        if self.format == "json":
+            try:
+                records = json.loads(self._tail.decode("utf-8") or "[]")
+            except (UnicodeDecodeError, ValueError) as e:
+                self._error(f"Некорректный JSON: {e}")
+                return
+            if not isinstance(records, list):
+                self._error("Ожидается JSON-массив строк пересчета")
+                return
+            for number, record in enumerate(records, start=1):
+                self._record(number, record)
+        elif self._tail:
+            self._parse_lines([self._tail])
+        self._tail = b""
+
+    def _parse_lines(self, raw_lines: List[bytes]):
+        texts = []
+        for raw in raw_lines:
+            self._line_number += 1
+            try:
+                texts.append((self._line_number, raw.decode("utf-8").rstrip("\r")))
+            except UnicodeDecodeError:
+                self._error(f"Строка {self._line_number}: не в кодировке UTF-8")
+        texts = [(number, text) for number, text in texts if text.strip()]
+        if self.format == "ndjson":
+            for number, text in texts:
+                try:
+                    record = json.loads(text)
+                except ValueError as e:
+                    self._error(f"Строка {number}: некорректный JSON ({e})")
+                    continue
+                self._record(number, record)
+            return
+        for (number, _), values in zip(texts, csv.reader(text for _, text in texts)):
+            if self._columns is None:
+                self._columns = {name.strip().lower(): index for index, name in enumerate(values)}
+                if not all(any(name in self._columns for name in names)
+                           for names in (SKU_FIELDS, LOCATION_FIELDS, WEIGHT_FIELDS)):
+                    self._error(f"Строка {number}: заголовок должен содержать sku_id, location_name и counted_weight")
+                continue
+            self._record(number, {
+                name: values[index] for name, index in self._columns.items() if index < len(values)
+            })
+
+    def _record(self, number: int, record):
+        self.lines += 1
+        if not isinstance(record, dict):
+            self._error(f"Строка {number}: ожидается объект")
+            return
+        try:
+            sku_id = int(_field(record, SKU_FIELDS))
+            weight = float(_field(record, WEIGHT_FIELDS))
+        except (TypeError, ValueError):
+            self._error(f"Строка {number}: sku_id и counted_weight должны быть числами")
+            return
+        location = _field(record, LOCATION_FIELDS)
+        location = location.strip() if isinstance(location, str) else None
+        if not location:
+            self._error(f"Строка {number}: не указана локация")
+            return
+        if weight < 0 or weight != int(weight):
+            self._error(f"Строка {number}: counted_weight должен быть целым неотрицательным числом (кг)")
+            return
+        cells = self.counts[location]
+        cells[sku_id] = cells.get(sku_id, 0) + int(weight)
+
+    def _error(self, message: str):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+        elif len(self.errors) == MAX_ERRORS:
+            self.errors.append("... остальные ошибки не показаны")
+
+
+class StockCount:
+    """Сверка пересчета с остатками и применение расхождений одной транзакцией"""
+
+    def __init__(
+        self,
+        db: Session,
+        counts: Dict[str, Dict[int, int]],
+        missing_as_zero: bool = True,
+        dry_run: bool = False
+    ):
+        self.db = db
+        self.counts = counts
+        self.missing_as_zero = missing_as_zero
+        self.dry_run = dry_run
+        self.report = {
+            "locations": sorted(counts),
+            "cells_compared": 0,
+            "matched": 0,
+            "variance_count": 0,
+            "weight_added": 0,
+            "weight_removed": 0,
+            "dry_run": dry_run,
+            "variances": [],
+        }
+
+    async def run(self) -> Dict:
+        """
+        Сверить и (без dry_run) применить расхождения
+
+        Raises:
+            StockCountError: в файле есть товары, неизвестные каталогу и остаткам
+        """
+        if not self.dry_run:
+            self._lock()
+        variances = self._merge()
+        await self._resolve_names(variances)
+        if self.dry_run:
+            self.db.rollback()
+        else:
+            self._apply(variances)
+            self.db.commit()
+            rabbitmq_client.publish_event("stock_count.applied", {
+                key: self.report[key]
+                for key in ("locations", "cells_compared", "variance_count", "weight_added", "weight_removed")
+            })
+            logger.info(
+                f"Stock count applied: {self.report['variance_count']} variances in {len(self.counts)} locations"
+            )
+        self.report["variances"] = [
+            {key: value for key, value in variance.items() if key != "row_id"} for variance in variances
+        ]
+        return self.report
+
+    def _lock(self):
+        """Заблокировать SKU файла и SKU, числящиеся в пересчитанных локациях (до чтения остатков)"""
+        sku_ids = {sku_id for cells in self.counts.values() for sku_id in cells}
+        if self.missing_as_zero:
+            sku_ids.update(self.db.execute(
+                select(InventoryLocationTotal.sku_id).where(
+                    InventoryLocationTotal.location_name.in_(self.counts)
+                ).distinct()
+            ).scalars())
+        sku_locks.lock_skus(self.db, sku_ids)
+
+    def _merge(self) -> List[Dict]:
+        """Слияние отсортированных по sku_id строк файла и остатков каждой локации"""
+        variances = []
+        for location_name in self.report["locations"]:
+            counted = sorted(self.counts[location_name].items())
+            # Строки остатков - кортежи (id, sku_id, название, вес): ORM-объекты загружаются только для расхождений
+            book = self.db.execute(select(
+                InventoryLocationTotal.id,
+                InventoryLocationTotal.sku_id,
+                InventoryLocationTotal.sku_name,
+                InventoryLocationTotal.weight
+            ).where(
+                InventoryLocationTotal.location_name == location_name
+            ).order_by(InventoryLocationTotal.sku_id)).all()
+            book_index = count_index = 0
+            while book_index < len(book) or count_index < len(counted):
+                if count_index == len(counted) or (
+                    book_index < len(book) and book[book_index].sku_id < counted[count_index][0]
+                ):
+                    # Числится, но не найден при пересчете
+                    row = book[book_index]
+                    book_index += 1
+                    if self.missing_as_zero:
+                        self._compare(variances, location_name, row.sku_id, row, 0)
+                elif book_index == len(book) or counted[count_index][0] < book[book_index].sku_id:
+                    # Найден, но не числится
+                    sku_id, weight = counted[count_index]
+                    count_index += 1
+                    self._compare(variances, location_name, sku_id, None, weight)
+                else:
+                    self._compare(variances, location_name, counted[count_index][0], book[book_index],
+                                  counted[count_index][1])
+                    book_index += 1
+                    count_index += 1
+        return variances
+
+    def _compare(
+        self,
+        variances: List[Dict],
+        location_name: str,
+        sku_id: int,
+        row: Optional[Tuple[int, int, str, int]],
+        counted_weight: int
+    ):
+        self.report["cells_compared"] += 1
+        book_weight = row.weight if row is not None else 0
+        difference = counted_weight - book_weight
+        if not difference:
+            self.report["matched"] += 1
+            return
+        self.report["variance_count"] += 1
+        self.report["weight_added" if difference > 0 else "weight_removed"] += abs(difference)
+        variances.append({
+            "location_name": location_name,
+            "sku_id": sku_id,
+            "sku_name": row.sku_name if row is not None else None,
+            "book_weight": book_weight,
+            "counted_weight": counted_weight,
+            "difference": difference,
+            "operation_id": None,
+            "row_id": row.id if row is not None else None,
+        })
+
+    async def _resolve_names(self, variances: List[Dict]):
+        """Названия товаров для ячеек, которых нет в остатках: из абсолютных остатков, затем из каталога"""
+        missing = sorted({variance["sku_id"] for variance in variances if variance["sku_name"] is None})
+        if not missing:
+            return
+        names: Dict[int, str] = {}
+        for start in range(0, len(missing), SKU_CHUNK_SIZE):
+            names.update(self.db.query(InventorySKUTotal.sku_id, InventorySKUTotal.sku_name).filter(
+                InventorySKUTotal.sku_id.in_(missing[start:start + SKU_CHUNK_SIZE])
+            ).all())
+        unknown = [sku_id for sku_id in missing if sku_id not in names]
+        if unknown:
+            names.update(await InventoryService.sku_names(self.db, unknown))
+        unknown = [sku_id for sku_id in missing if sku_id not in names]
+        if unknown:
+            self.db.rollback()
+            raise StockCountError(
+                f"Товары не найдены в Catalog Service: {len(unknown)}",
+                [f"SKU {sku_id} не найден" for sku_id in unknown[:MAX_ERRORS]]
+            )
+        for variance in variances:
+            if variance["sku_name"] is None:
+                variance["sku_name"] = names[variance["sku_id"]]
+
+    def _apply(self, variances: List[Dict]):
+        """Записать операции и привести остатки к факту в текущей транзакции (без commit)"""
+        db = self.db
+        location_deltas: Dict[str, List[int]] = defaultdict(lambda: [0, 0])  # [вес, количество SKU]
+        sku_deltas: Dict[int, int] = defaultdict(int)
+        sku_names: Dict[int, str] = {}
+        movement_changes = []
+        operations = []
+        row_ids = sorted(variance["row_id"] for variance in variances if variance["row_id"] is not None)
+        rows: Dict[int, InventoryLocationTotal] = {}
+        for start in range(0, len(row_ids), SKU_CHUNK_SIZE):
+            rows.update((row.id, row) for row in db.query(InventoryLocationTotal).filter(
+                InventoryLocationTotal.id.in_(row_ids[start:start + SKU_CHUNK_SIZE])
+            ))
+        for variance in variances:
+            sku_id, location_name = variance["sku_id"], variance["location_name"]
+            book_weight, counted_weight = variance["book_weight"], variance["counted_weight"]
+            difference = variance["difference"]
+            stock_alerts.check(db, sku_id, location_name, book_weight, counted_weight)
+            if variance["row_id"] is not None:
+                rows[variance["row_id"]].weight = counted_weight
+            else:
+                db.add(InventoryLocationTotal(
+                    sku_id=sku_id,
+                    sku_name=variance["sku_name"],
+                    location_name=location_name,
+                    weight=counted_weight,
+                    quantity=0
+                ))
+            operation_type = "receipt" if difference > 0 else "write_off"
+            operations.append(InventoryOperation(
+                operation_type=operation_type,
+                sku_id=sku_id,
+                sku_name=variance["sku_name"],
+                quantity_value=1,
+                quantity_unit="шт",
+                weight_value=abs(difference),
+                weight_unit="кг",
+                delta_value=abs(difference),
+                delta_unit="кг",
+                source_location=location_name,
+                target_location=location_name
+            ))
+            movement_changes.append((sku_id, location_name, operation_type, difference))
+            location_delta = location_deltas[location_name]
+            location_delta[0] += difference
+            location_delta[1] += int(counted_weight != 0) - int(book_weight != 0)
+            sku_deltas[sku_id] += difference
+            sku_names[sku_id] = variance["sku_name"]
+        db.add_all(operations)
+        db.flush()
+        for variance, operation in zip(variances, operations):
+            variance["operation_id"] = operation.id
+
+        for location_name, (weight_delta, sku_count_delta) in sorted(location_deltas.items()):
+            location_rollups.apply_delta(db, location_name, weight_delta, sku_count_delta)
+            stock_alerts.check_location(db, location_name, weight_delta)
+        movements.add_movements(db, movement_changes)
+
+        changed_skus = sorted(sku_id for sku_id, delta in sku_deltas.items() if delta)
+        for start in range(0, len(changed_skus), SKU_CHUNK_SIZE):
+            chunk = changed_skus[start:start + SKU_CHUNK_SIZE]
+            totals = {
+                total.sku_id: total
+                for total in db.query(InventorySKUTotal).filter(InventorySKUTotal.sku_id.in_(chunk)).all()
+            }
+            for sku_id in chunk:
+                total = totals.get(sku_id)
+                old_weight = total.total_weight if total is not None else 0
+                stock_alerts.check(db, sku_id, None, old_weight, old_weight + sku_deltas[sku_id])
+                if total is not None:
+                    total.total_weight += sku_deltas[sku_id]
+                else:
+                    db.add(InventorySKUTotal(
+                        sku_id=sku_id, sku_name=sku_names[sku_id], total_weight=sku_deltas[sku_id], total_quantity=0
+                    ))
+        db.flush()
@@ -0,0 +1,420 @@
+"""
+Индекс остатков в памяти процесса для горячих чтений (GET /inventory/locations и /inventory/sku/totals)
+
+Остатки по локациям хранятся плотными матрицами NumPy [индекс SKU, индекс локации]: вес, количество,
+id строки (0 - строки нет) и время изменения. Словари переводят ID товара и название локации в индексы.
+Абсолютные остатки по SKU - векторы по индексу SKU. Чтение "товар во всех локациях" - строка матрицы,
+"все товары в локации" - столбец, без обращения к БД и без построения ORM-объектов.
+
+Индекс строится при запуске из inventory_location_totals и inventory_sku_totals и обновляется
+хуками сессии: after_flush запоминает записанные строки остатков, after_commit применяет их,
+after_rollback отбрасывает. Изменения, закоммиченные во время перестроения, применяются поверх нового
+снимка. Прямые UPDATE через Core (исправления сверки) и изменения других экземпляров сервиса индекс
+увидит после периодического перестроения (STOCK_INDEX_REBUILD_INTERVAL_SECONDS).
+
+Время изменения в индексе - время применения commit в процессе (onupdate выполняется на стороне БД).
+Название товара хранится одно на SKU - последнее записанное.
+
+Матрица плотная: память ~ (SKU x локации) x 16 байт, фактический объем - в GET /inventory/stock-index.
+Индекс выключен по умолчанию (STOCK_INDEX_ENABLED).
+"""
+import logging
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import InventoryLocationTotal, InventorySKUTotal
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "stock_index_changes"
+
+# (id, sku_id, sku_name, location_name, weight, quantity)
+LocationRow = Tuple[int, int, str, str, int, int]
+# (id, sku_id, sku_name, total_weight, total_quantity)
+SKURow = Tuple[int, int, str, int, int]
+
+
+def _now_seconds() -> int:
+    return int(datetime.now(timezone.utc).timestamp())
+
+
+def _timestamp(seconds: int) -> datetime:
+    return datetime.fromtimestamp(int(seconds), timezone.utc)
+
+
+def _ranks(names: List[str]) -> np.ndarray:
+    """Позиция каждого названия в отсортированном порядке (для сортировки как ORDER BY name)"""
+    ranks = np.empty(len(names), dtype=np.int32)
+    ranks[sorted(range(len(names)), key=names.__getitem__)] = np.arange(len(names), dtype=np.int32)
+    return ranks
+
+
+class _StockMatrix:
+    """Данные индекса (без синхронизации - ее обеспечивает StockIndex)"""
+
+    def __init__(self, sku_capacity: int = 64, location_capacity: int = 16):
+        self.sku_index: Dict[int, int] = {}
+        self.sku_ids: List[int] = []
+        self.sku_names: List[str] = []
+        self.location_index: Dict[str, int] = {}
+        self.location_names: List[str] = []
+
+        shape = (sku_capacity, location_capacity)
+        self.weight = np.zeros(shape, dtype=np.int32)
+        self.quantity = np.zeros(shape, dtype=np.int32)
+        self.row_id = np.zeros(shape, dtype=np.int32)
+        self.updated_at = np.zeros(shape, dtype=np.uint32)  # Секунды Unix
+
+        self.total_id = np.zeros(sku_capacity, dtype=np.int32)
+        self.total_weight = np.zeros(sku_capacity, dtype=np.int32)
+        self.total_quantity = np.zeros(sku_capacity, dtype=np.int32)
+        self.total_updated_at = np.zeros(sku_capacity, dtype=np.uint32)
+
+        self._sku_ranks: Optional[np.ndarray] = None
+        self._location_ranks: Optional[np.ndarray] = None
+
+    def _grow(self, sku_capacity: int, location_capacity: int):
+        old_skus, old_locations = self.weight.shape
+        for name in ("weight", "quantity", "row_id", "updated_at"):
+            old = getattr(self, name)
+            grown = np.zeros((sku_capacity, location_capacity), dtype=old.dtype)
+            grown[:old_skus, :old_locations] = old
+            setattr(self, name, grown)
+        for name in ("total_id", "total_weight", "total_quantity", "total_updated_at"):
+            old = getattr(self, name)
+            grown = np.zeros(sku_capacity, dtype=old.dtype)
+            grown[:old_skus] = old
+            setattr(self, name, grown)
+
+    def sku(self, sku_id: int, sku_name: str) -> int:
+        """Индекс SKU (новый SKU добавляется, емкость удваивается при нехватке)"""
+        index = self.sku_index.get(sku_id)
+        if index is None:
+            index = self.sku_index[sku_id] = len(self.sku_ids)
+            self.sku_ids.append(sku_id)
+            self.sku_names.append(sku_name)
+            if index >= self.weight.shape[0]:
+                self._grow(self.weight.shape[0] * 2, self.weight.shape[1])
+            self._sku_ranks = None
+        elif self.sku_names[index] != sku_name:
+            self.sku_names[index] = sku_name
+            self._sku_ranks = None
+        return index
+
+    def location(self, location_name: str) -> int:
+        index = self.location_index.get(location_name)
+        if index is None:
+            index = self.location_index[location_name] = len(self.location_names)
+            self.location_names.append(location_name)
+            if index >= self.weight.shape[1]:
+                self._grow(self.weight.shape[0], self.weight.shape[1] * 2)
+            self._location_ranks = None
+        return index
+
+    def set_location_row(self, row: LocationRow, updated_at: int):
+        row_id, sku_id, sku_name, location_name, weight, quantity = row
+        sku, location = self.sku(sku_id, sku_name), self.location(location_name)
+        self.row_id[sku, location] = row_id
+        self.weight[sku, location] = weight
+        self.quantity[sku, location] = quantity
+        self.updated_at[sku, location] = updated_at
+
+    def set_sku_row(self, row: SKURow, updated_at: int):
+        row_id, sku_id, sku_name, total_weight, total_quantity = row
+        sku = self.sku(sku_id, sku_name)
+        self.total_id[sku] = row_id
+        self.total_weight[sku] = total_weight
+        self.total_quantity[sku] = total_quantity
+        self.total_updated_at[sku] = updated_at
+
+    @property
+    def sku_ranks(self) -> np.ndarray:
+        if self._sku_ranks is None:
+            self._sku_ranks = _ranks(self.sku_names)
+        return self._sku_ranks
+
+    @property
+    def location_ranks(self) -> np.ndarray:
+        if self._location_ranks is None:
+            self._location_ranks = _ranks(self.location_names)
+        return self._location_ranks
+
+    @property
+    def memory_bytes(self) -> int:
+        arrays = (
+            self.weight, self.quantity, self.row_id, self.updated_at,
+            self.total_id, self.total_weight, self.total_quantity, self.total_updated_at
+        )
+        dictionaries = (
+            sys.getsizeof(self.sku_index) + sys.getsizeof(self.sku_ids)
+            + sum(sys.getsizeof(name) for name in self.sku_names)
+            + sys.getsizeof(self.location_index) + sys.getsizeof(self.location_names)
+            + sum(sys.getsizeof(name) for name in self.location_names)
+        )
+        return sum(array.nbytes for array in arrays) + dictionaries
+
+
+class StockIndex:
+    """Индекс остатков: построение, применение закоммиченных изменений и чтение"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrix: Optional[_StockMatrix] = None
+        self._pending: Optional[List[Tuple[List[LocationRow], List[SKURow], int]]] = None
+        self.built_at: Optional[datetime] = None
+        self.changes_applied = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._matrix is not None
+
+    @property
+    def active(self) -> bool:
+        """Нужно ли собирать изменения (индекс построен или строится)"""
+        return self._matrix is not None or self._pending is not None
+
+    def rebuild(self, db: Session):
+        """Построить индекс заново из таблиц остатков"""
+        with self._lock:
+            self._pending = []
+        try:
+            location_rows = db.execute(select(
+                InventoryLocationTotal.id, InventoryLocationTotal.sku_id, InventoryLocationTotal.sku_name,
+                InventoryLocationTotal.location_name, InventoryLocationTotal.weight, InventoryLocationTotal.quantity,
+                InventoryLocationTotal.updated_at
+            )).all()
+            sku_rows = db.execute(select(
+                InventorySKUTotal.id, InventorySKUTotal.sku_id, InventorySKUTotal.sku_name,
+                InventorySKUTotal.total_weight, InventorySKUTotal.total_quantity, InventorySKUTotal.updated_at
+            )).all()
+            db.rollback()
+
+            sku_ids = {row[1] for row in location_rows} | {row[1] for row in sku_rows}
+            location_names = {row[3] for row in location_rows}
+            matrix = _StockMatrix(max(len(sku_ids), 64), max(len(location_names), 16))
+            for row in location_rows:
+                matrix.set_location_row(tuple(row[:6]), int(row[6].timestamp()))
+            for row in sku_rows:
+                matrix.set_sku_row(tuple(row[:5]), int(row[5].timestamp()))
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            # Изменения, закоммиченные во время чтения, применяются поверх снимка (значения абсолютные)
+            for location_changes, sku_changes, updated_at in self._pending:
+                self._apply(matrix, location_changes, sku_changes, updated_at)
+            self._pending = None
+            self._matrix = matrix
+            self.built_at = datetime.now(timezone.utc)
+        logger.info(
+            f"Stock index built: {len(matrix.sku_ids)} SKU x {len(matrix.location_names)} locations, "
+            f"{matrix.memory_bytes} bytes"
+        )
+
+    def disable(self):
+        with self._lock:
+            self._matrix = None
+            self._pending = None
+            self.built_at = None
+
+    @staticmethod
+    def _apply(matrix: _StockMatrix, location_changes: List[LocationRow], sku_changes: List[SKURow], updated_at: int):
+        for row in location_changes:
+            matrix.set_location_row(row, updated_at)
+        for row in sku_changes:
+            matrix.set_sku_row(row, updated_at)
+
+    def apply(self, location_changes: List[LocationRow], sku_changes: List[SKURow]):
+        """Применить закоммиченные значения строк остатков"""
+        updated_at = _now_seconds()
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((location_changes, sku_changes, updated_at))
+            if self._matrix is not None:
+                self._apply(self._matrix, location_changes, sku_changes, updated_at)
+                self.changes_applied += len(location_changes) + len(sku_changes)
+
+    def location_totals(
+        self,
+        location_name: Optional[str] = None,
+        sku_id: Optional[int] = None,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[Dict]:
+        """Остатки по локациям в порядке (локация, название товара), как GET /inventory/locations"""
+        return self.cells(
+            sku_ids=[sku_id] if sku_id else None,
+            location_names=[location_name] if location_name else None,
+            skip=skip,
+            limit=limit
+        )
+
+    def cells(
+        self,
+        sku_ids: Optional[List[int]] = None,
+        location_names: Optional[List[str]] = None,
+        skip: int = 0,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Остатки по локациям для наборов SKU и локаций (None - без ограничения)
+        в порядке (локация, название товара); неизвестные SKU и локации пропускаются
+        """
+        with self._lock:
+            matrix = self._matrix
+            if sku_ids is None:
+                skus = np.arange(len(matrix.sku_ids))
+            else:
+                skus = np.array(
+                    sorted({matrix.sku_index[sku_id] for sku_id in sku_ids if sku_id in matrix.sku_index}),
+                    dtype=np.intp
+                )
+            if location_names is None:
+                locations = np.arange(len(matrix.location_names))
+            else:
+                locations = np.array(
+                    sorted({matrix.location_index[name] for name in location_names if name in matrix.location_index}),
+                    dtype=np.intp
+                )
+            if not len(skus) or not len(locations):
+                return []
+
+            present_skus, present_locations = np.nonzero(matrix.row_id[np.ix_(skus, locations)])
+            cell_skus, cell_locations = skus[present_skus], locations[present_locations]
+            order = np.lexsort((matrix.sku_ranks[cell_skus], matrix.location_ranks[cell_locations]))
+            page = order[skip:None if limit is None else skip + limit]
+            cell_skus, cell_locations = cell_skus[page], cell_locations[page]
+            return [
+                {
+                    "id": int(matrix.row_id[sku, location]),
+                    "sku_id": matrix.sku_ids[sku],
+                    "sku_name": matrix.sku_names[sku],
+                    "location_name": matrix.location_names[location],
+                    "quantity": int(matrix.quantity[sku, location]),
+                    "weight": int(matrix.weight[sku, location]),
+                    "updated_at": _timestamp(matrix.updated_at[sku, location]),
+                }
+                for sku, location in zip(cell_skus.tolist(), cell_locations.tolist())
+            ]
+
+    def weights(self, location_name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+        """
+        Ненулевые остатки по локациям векторами (для расчетов по всем ячейкам, например оценки запасов)
+
+        Returns:
+            (ID товара ячейки, код локации ячейки, названия локаций по коду, вес ячейки)
+        """
+        with self._lock:
+            matrix = self._matrix
+            location_names = list(matrix.location_names)
+            weight = matrix.weight[:len(matrix.sku_ids), :len(location_names)]
+            if location_name is not None:
+                if location_name not in matrix.location_index:
+                    return np.empty(0, np.int64), np.empty(0, np.intp), location_names, np.empty(0, np.int64)
+                column = matrix.location_index[location_name]
+                skus = np.nonzero(weight[:, column])[0]
+                locations = np.full(len(skus), column, dtype=np.intp)
+            else:
+                skus, locations = np.nonzero(weight)
+            sku_ids = np.asarray(matrix.sku_ids, dtype=np.int64)[skus]
+            return sku_ids, locations, location_names, weight[skus, locations].astype(np.int64)
+
+    def sku_totals(self, sku_id: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[Dict]:
+        """Абсолютные остатки по SKU в порядке названия товара, как GET /inventory/sku/totals"""
+        with self._lock:
+            matrix = self._matrix
+            if sku_id:
+                if sku_id not in matrix.sku_index:
+                    return []
+                skus = np.array([matrix.sku_index[sku_id]])
+            else:
+                skus = np.arange(len(matrix.sku_ids))
+            skus = skus[matrix.total_id[skus] != 0]
+            skus = skus[np.argsort(matrix.sku_ranks[skus], kind="stable")][skip:skip + limit]
+            return [
+                {
+                    "id": int(matrix.total_id[sku]),
+                    "sku_id": matrix.sku_ids[sku],
+                    "sku_name": matrix.sku_names[sku],
+                    "total_quantity": int(matrix.total_quantity[sku]),
+                    "total_weight": int(matrix.total_weight[sku]),
+                    "updated_at": _timestamp(matrix.total_updated_at[sku]),
+                }
+                for sku in skus.tolist()
+            ]
+
+    def stats(self) -> Dict:
+        """Размеры и объем памяти индекса"""
+        with self._lock:
+            matrix = self._matrix
+            if matrix is None:
+                return {"ready": False, "building": self._pending is not None}
+            return {
+                "ready": True,
+                "building": self._pending is not None,
+                "sku_count": len(matrix.sku_ids),
+                "location_count": len(matrix.location_names),
+                "cell_count": int(np.count_nonzero(matrix.row_id)),
+                "capacity": list(matrix.weight.shape),
+                "memory_bytes": matrix.memory_bytes,
+                "built_at": self.built_at,
+                "changes_applied": self.changes_applied,
+            }
+
+
+# Глобальный индекс остатков
+stock_index = StockIndex()
+
+
+def run_rebuild():
+    """Перестроить индекс остатков (при запуске и периодически)"""
+    db = SessionLocal()
+    try:
+        stock_index.rebuild(db)
+    finally:
+        db.close()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session: Session, flush_context):
+    """Запомнить записанные значения строк остатков до commit"""
+    if not stock_index.active:
+        return
+    pending = session.info.setdefault(SESSION_KEY, ({}, {}))
+    for obj in list(session.new) + list(session.dirty):
+        if obj not in session.new and not session.is_modified(obj):
+            continue
+        # Несколько изменений одной строки за транзакцию - итоговое значение
+        if isinstance(obj, InventoryLocationTotal):
+            pending[0][(obj.sku_id, obj.location_name)] = (
+                obj.id, obj.sku_id, obj.sku_name, obj.location_name, obj.weight, obj.quantity or 0
+            )
+        elif isinstance(obj, InventorySKUTotal):
+            pending[1][obj.sku_id] = (
+                obj.id, obj.sku_id, obj.sku_name, obj.total_weight, obj.total_quantity or 0
+            )
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session: Session):
+    pending = session.info.pop(SESSION_KEY, None)
+    if not pending:
+        return
+    try:
+        stock_index.apply(list(pending[0].values()), list(pending[1].values()))
+    except Exception as e:
+        logger.error(f"Failed to apply inventory changes to stock index: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(SESSION_KEY, None)
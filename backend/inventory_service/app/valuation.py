@@ -0,0 +1,125 @@
+"""
+Оценка запасов (GET /inventory/valuation): стоимость остатков по ценам каталога
+
+Остатки по локациям берутся векторами: из индекса остатков в памяти, если он построен
+(StockIndex.weights), иначе одним запросом ненулевых строк inventory_location_totals.
+Цены килограмма - из кэша проекции цен (app/sku_prices.py) поиском searchsorted по ID товара.
+Стоимость ячейки = вес * цена кг; суммы по SKU и по локациям - np.bincount, лучшие N -
+np.argpartition, поэтому расчет по миллиону ячеек не строит объектов на ячейку.
+
+Оцениваются только товары с ценой в запрошенной валюте; вес остальных возвращается
+как неоцененный, чтобы отчет не занижал стоимость молча.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import InventoryLocationTotal, InventorySKUTotal
+from app import sku_prices
+from app.stock_index import stock_index
+
+SOURCE_INDEX = "index"
+SOURCE_DATABASE = "database"
+
+
+def _cells_from_database(
+    db: Session,
+    location_name: Optional[str]
+) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+    statement = select(
+        InventoryLocationTotal.sku_id, InventoryLocationTotal.location_name, InventoryLocationTotal.weight
+    ).where(InventoryLocationTotal.weight != 0)
+    if location_name is not None:
+        statement = statement.where(InventoryLocationTotal.location_name == location_name)
+    rows = db.execute(statement).all()
+    codes: Dict[str, int] = {}
+    sku_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    locations = np.fromiter((codes.setdefault(row[1], len(codes)) for row in rows), dtype=np.intp, count=len(rows))
+    weights = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+    return sku_ids, locations, list(codes), weights
+
+
+def _top(values: np.ndarray, keys: np.ndarray, count: int) -> np.ndarray:
+    """Позиции count наибольших значений (при равенстве - по ключу)"""
+    if len(values) > count:
+        candidates = np.argpartition(-values, count - 1)[:count]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((keys[candidates], -values[candidates]))]
+
+
+def valuation(db: Session, currency: str, location_name: Optional[str] = None, top: int = 20) -> Dict:
+    """
+    Стоимость остатков в валюте currency: итог, лучшие top товаров и локаций
+
+    Args:
+        currency: Валюта (единица цены каталога, например руб)
+        location_name: Только одна локация
+        top: Сколько товаров и локаций вернуть (по убыванию стоимости)
+
+    Returns:
+        Отчет в формате ValuationResponse
+    """
+    if stock_index.ready:
+        source = SOURCE_INDEX
+        sku_ids, locations, location_names, weights = stock_index.weights(location_name)
+    else:
+        source = SOURCE_DATABASE
+        sku_ids, locations, location_names, weights = _cells_from_database(db, location_name)
+
+    prices = sku_prices.price_cache.lookup(db, sku_ids, currency)
+    priced = ~np.isnan(prices)
+    values = np.where(priced, weights * np.nan_to_num(prices), 0.0)
+
+    skus, sku_positions = np.unique(sku_ids, return_inverse=True)
+    sku_values = np.bincount(sku_positions, weights=values, minlength=len(skus))
+    sku_weights = np.bincount(sku_positions, weights=weights, minlength=len(skus))
+    sku_price = np.full(len(skus), np.nan)
+    sku_price[sku_positions] = prices
+    location_values = np.bincount(locations, weights=values, minlength=len(location_names))
+    location_weights = np.bincount(locations, weights=weights, minlength=len(location_names))
+    location_cells = np.bincount(locations, minlength=len(location_names))
+
+    top_skus = _top(sku_values, skus, top)
+    names = dict(db.execute(
+        select(InventorySKUTotal.sku_id, InventorySKUTotal.sku_name)
+        .where(InventorySKUTotal.sku_id.in_(skus[top_skus].tolist()))
+    ).all()) if len(top_skus) else {}
+    name_order = np.argsort(np.array(location_names, dtype=object)) if location_names else np.empty(0, np.intp)
+    location_ranks = np.empty(len(location_names), dtype=np.intp)
+    location_ranks[name_order] = np.arange(len(location_names))
+    present = np.nonzero(location_cells)[0]
+    top_locations = present[_top(location_values[present], location_ranks[present], top)]
+
+    unpriced = np.isnan(sku_price)
+    return {
+        "currency": currency,
+        "location_name": location_name,
+        "source": source,
+        "cells": int(len(sku_ids)),
+        "total_value": round(float(values.sum()), 2),
+        "priced_weight": int(weights[priced].sum()),
+        "unpriced_weight": int(weights[~priced].sum()),
+        "unpriced_sku_count": int(np.count_nonzero(unpriced & (sku_weights != 0))),
+        "top_skus": [
+            {
+                "sku_id": int(skus[position]),
+                "sku_name": names.get(int(skus[position])),
+                "weight": int(sku_weights[position]),
+                "price_per_kg": None if np.isnan(sku_price[position]) else round(float(sku_price[position]), 4),
+                "value": round(float(sku_values[position]), 2),
+            }
+            for position in top_skus.tolist()
+        ],
+        "top_locations": [
+            {
+                "location_name": location_names[position],
+                "cells": int(location_cells[position]),
+                "weight": int(location_weights[position]),
+                "value": round(float(location_values[position]), 2),
+            }
+            for position in top_locations.tolist()
+        ],
+    }
@@ -0,0 +1,97 @@
+"""
+Замер пропускной способности потребителя событий на синтетическом всплеске sku.updated
+
+Запуск из каталога сервиса:
+    python tests/benchmark_event_consumer.py --messages 20000 --skus 200
+
+Сравнивает обработку по одному сообщению (пачка из 1) и пачками с окном EVENT_BATCH_WINDOW_MS.
+Catalog Service заменен заглушкой с задержкой ответа, БД - SQLite в памяти.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.event_consumer as event_consumer_module
+from app.database import Base
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.models import InventorySKUTotal
+from app.event_consumer import EventConsumer
+from inprocess_broker import InProcessBroker
+
+
+def _prepare_db(skus: int):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    db.add_all(InventorySKUTotal(sku_id=sku_id, sku_name=f"SKU {sku_id}", total_quantity=1, total_weight=10)
+               for sku_id in range(1, skus + 1))
+    db.commit()
+    db.close()
+    return factory
+
+
+async def _run(messages: int, skus: int, batch_max_size: int, batch_window_ms: int, catalog_latency: float):
+    event_consumer_module.SessionLocal = _prepare_db(skus)
+
+    async def fake_get_sku(sku_id):
+        await asyncio.sleep(catalog_latency)
+        return {"id": sku_id, "name": f"SKU {sku_id}", "quantity": "2", "weight": "10"}
+
+    event_consumer_module.catalog_client.get_sku = fake_get_sku
+
+    broker = InProcessBroker()
+    consumer = EventConsumer(
+        connect=broker.connect,
+        prefetch_count=max(batch_max_size * 2, 1),
+        batch_max_size=batch_max_size,
+        batch_window_ms=batch_window_ms
+    )
+    for number in range(messages):
+        broker.publish("sku.updated", {"sku_id": number % skus + 1})
+
+    started = time.perf_counter()
+    task = asyncio.create_task(consumer.run())
+    while len(broker.acked) + len(broker.rejected) < messages:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    await consumer.stop()
+    await task
+    return elapsed, consumer.stats, broker.ack_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер пропускной способности потребителя событий")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--window-ms", type=int, default=200)
+    parser.add_argument("--catalog-latency-ms", type=float, default=2.0)
+    parser.add_argument("--skip-single", action="store_true", help="Не замерять обработку по одному сообщению")
+    args = parser.parse_args()
+
+    modes = [("пачками", args.batch_size, args.window_ms)]
+    if not args.skip_single:
+        modes.insert(0, ("по одному", 1, 0))
+
+    for title, batch_size, window_ms in modes:
+        elapsed, stats, ack_calls = asyncio.run(
+            _run(args.messages, args.skus, batch_size, window_ms, args.catalog_latency_ms / 1000)
+        )
+        print(
+            f"{title:>10}: {args.messages} сообщений за {elapsed:.2f} с "
+            f"({args.messages / elapsed:,.0f} сообщ/с), пачек {stats['batches']}, "
+            f"применено событий {stats['events_applied']}, ack-вызовов {ack_calls}"
+        )
+
+
+if __name__ == "__main__":
+    main()
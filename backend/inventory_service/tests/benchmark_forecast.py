@@ -0,0 +1,91 @@
+"""
+Бэктест прогноза спроса: точность и скорость методов app/forecasting.py
+
+Запуск из каталога сервиса:
+    python tests/benchmark_forecast.py --cells 100000 --history-days 56 --holdout-days 14
+    python tests/benchmark_forecast.py --database-url postgresql://... --holdout-days 14
+
+Без --database-url расход генерируется: базовый уровень ячейки, недельная сезонность, тренд,
+прерывистый спрос (дни без расхода). С --database-url берется история расхода из
+inventory_daily_movements (load_history) за history-days + holdout-days закрытых дней.
+
+Прогноз каждого метода строится по первым history-days дням и сравнивается с фактом
+следующих holdout-days дней: WAPE = сумма |прогноз - факт| / сумма факта, смещение =
+сумма (прогноз - факт) / сумма факта. Базовая линия - расход последнего дня истории.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.forecasting import moving_average, exponential_smoothing, load_history
+
+
+def synthetic_history(cells: int, days: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    base = rng.gamma(2.0, 20.0, size=(cells, 1))
+    weekly = 1 + rng.uniform(0, 0.5, size=(cells, 1)) * np.sin(2 * np.pi * np.arange(days) / 7 + rng.uniform(0, 7, (cells, 1)))
+    trend = 1 + rng.normal(0, 0.005, size=(cells, 1)) * np.arange(days)
+    active = rng.random((cells, days)) < rng.uniform(0.3, 1.0, size=(cells, 1))
+    return np.round(rng.poisson(np.maximum(base * weekly * trend, 0)) * active).astype(np.float64)
+
+
+def database_history(database_url: str, days: int) -> np.ndarray:
+    from sqlalchemy import create_engine, select, func
+    from sqlalchemy.orm import sessionmaker
+
+    db = sessionmaker(bind=create_engine(database_url))()
+    try:
+        today = db.execute(select(func.current_date())).scalar()
+        return load_history(db, today - timedelta(days=days), today)[3]
+    finally:
+        db.close()
+
+
+def evaluate(name: str, forecast, history: np.ndarray, actual: np.ndarray, holdout_days: int):
+    started = time.perf_counter()
+    daily = forecast(history)
+    seconds = time.perf_counter() - started
+    error = daily * holdout_days - actual
+    total = actual.sum()
+    print(f"{name:<24} WAPE {np.abs(error).sum() / total:6.1%}  смещение {error.sum() / total:+6.1%}  "
+          f"{seconds * 1000:7.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест прогноза спроса")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--cells", type=int, default=100_000)
+    parser.add_argument("--history-days", type=int, default=56)
+    parser.add_argument("--holdout-days", type=int, default=14)
+    parser.add_argument("--moving-average-days", type=int, nargs="+", default=[7, 14, 28])
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.1, 0.2, 0.3, 0.5])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    days = args.history_days + args.holdout_days
+    if args.database_url:
+        series = database_history(args.database_url, days)
+    else:
+        series = synthetic_history(args.cells, days, args.seed)
+    history, actual = series[:, :args.history_days], series[:, args.history_days:].sum(axis=1)
+    print(f"ячеек: {len(series)}, история: {args.history_days} дн., проверка: {args.holdout_days} дн., "
+          f"факт: {actual.sum():,.0f} кг")
+    if not actual.sum():
+        print("нет расхода в проверочном периоде")
+        return
+
+    evaluate("последний день", lambda h: h[:, -1], history, actual, args.holdout_days)
+    for window in args.moving_average_days:
+        evaluate(f"скользящее среднее {window}", lambda h: moving_average(h, window), history, actual, args.holdout_days)
+    for alpha in args.alpha:
+        evaluate(f"сглаживание {alpha}", lambda h: exponential_smoothing(h, alpha), history, actual, args.holdout_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Замер загрузки инвентаризации: разбор файла, сверка слиянием и применение расхождений
+
+Запуск из каталога сервиса (по умолчанию - временная SQLite, для PostgreSQL - DATABASE_URL):
+    python tests/benchmark_stock_counts.py --lines 100000 --locations 20 --variance 0.1
+
+Остатки заполняются --lines ячейками (товар, локация), файл пересчета в CSV содержит все ячейки,
+у доли --variance из них фактический вес отличается. Печатает время разбора, сверки без
+применения (dry_run) и с применением, затем проверяет, что повторная сверка расхождений не находит.
+Данные замера пишутся под SKU начиная с --sku-base и удаляются после замера.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.models import (
+    InventoryOperation, InventorySKUTotal, InventoryLocationTotal, InventoryLocationRollup, InventoryDailyMovement
+)
+from app.rabbitmq_client import rabbitmq_client
+from app.stock_counts import CountParser, StockCount
+
+CHUNK_BYTES = 64 * 1024  # Части тела запроса, как их отдает сервер
+
+
+def _cleanup(factory, sku_ids, locations):
+    db = factory()
+    for model in (InventoryOperation, InventorySKUTotal, InventoryLocationTotal, InventoryDailyMovement):
+        db.execute(delete(model).where(model.sku_id.in_(sku_ids)))
+    db.execute(delete(InventoryLocationRollup).where(InventoryLocationRollup.location_name.in_(locations)))
+    db.commit()
+    db.close()
+
+
+def _prepare(factory, cells):
+    db = factory()
+    db.execute(insert(InventoryLocationTotal), [
+        {"sku_id": sku_id, "sku_name": f"Bench {sku_id}", "location_name": location, "weight": weight, "quantity": 0}
+        for (location, sku_id), weight in cells.items()
+    ])
+    sku_totals = {}
+    for (_, sku_id), weight in cells.items():
+        sku_totals[sku_id] = sku_totals.get(sku_id, 0) + weight
+    db.execute(insert(InventorySKUTotal), [
+        {"sku_id": sku_id, "sku_name": f"Bench {sku_id}", "total_weight": weight, "total_quantity": 0}
+        for sku_id, weight in sku_totals.items()
+    ])
+    db.commit()
+    db.close()
+
+
+def _parse(body: bytes) -> CountParser:
+    parser = CountParser("csv")
+    for start in range(0, len(body), CHUNK_BYTES):
+        parser.feed(body[start:start + CHUNK_BYTES])
+    parser.close()
+    return parser
+
+
+def _count(factory, counts, dry_run):
+    db = factory()
+    try:
+        return asyncio.run(StockCount(db, counts, dry_run=dry_run).run())
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер загрузки инвентаризации")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--lines", type=int, default=100_000, help="Строк в файле пересчета")
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--variance", type=float, default=0.1, help="Доля ячеек с расхождением")
+    parser.add_argument("--sku-base", type=int, default=900_000_000)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    rabbitmq_client.publish_event = lambda event_type, data: None  # Замер без брокера
+
+    random.seed(1)
+    locations = [f"bench-{number}" for number in range(args.locations)]
+    skus_per_location = args.lines // args.locations
+    cells = {
+        (location, args.sku_base + number): random.randint(1, 1000)
+        for location in locations for number in range(skus_per_location)
+    }
+    sku_ids = sorted({sku_id for _, sku_id in cells})
+    _cleanup(factory, sku_ids, locations)
+    _prepare(factory, cells)
+
+    lines = ["sku_id,location_name,counted_weight"]
+    for (location, sku_id), weight in cells.items():
+        counted = weight + random.randint(-weight, 50) if random.random() < args.variance else weight
+        lines.append(f"{sku_id},{location},{counted}")
+    body = ("\n".join(lines) + "\n").encode("utf-8")
+
+    started = time.perf_counter()
+    parsed = _parse(body)
+    parse_seconds = time.perf_counter() - started
+    assert not parsed.errors, parsed.errors[:5]
+
+    started = time.perf_counter()
+    dry = _count(factory, parsed.counts, dry_run=True)
+    dry_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    applied = _count(factory, parsed.counts, dry_run=False)
+    apply_seconds = time.perf_counter() - started
+
+    again = _count(factory, parsed.counts, dry_run=True)
+    _cleanup(factory, sku_ids, locations)
+
+    print(f"строк: {parsed.lines}, размер файла: {len(body) / 1024 / 1024:.1f} МБ")
+    print(f"разбор: {parse_seconds:.2f} с ({parsed.lines / parse_seconds:,.0f} строк/с)")
+    print(f"сверка (dry_run): {dry_seconds:.2f} с, расхождений {dry['variance_count']}")
+    print(f"сверка с применением: {apply_seconds:.2f} с, операций {applied['variance_count']}")
+    remaining = again["variance_count"]
+    print(f"повторная сверка: {'расхождений нет' if not remaining else f'РАСХОЖДЕНИЙ {remaining}'}")
+
+
+if __name__ == "__main__":
+    main()
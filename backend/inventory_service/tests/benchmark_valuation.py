@@ -0,0 +1,128 @@
+"""
+Замер оценки запасов на миллионе ячеек (товар, локация)
+
+Запуск из каталога сервиса (по умолчанию - временная SQLite, для PostgreSQL - DATABASE_URL):
+    python tests/benchmark_valuation.py --skus 100000 --locations 10 --repeat 5
+
+Остатки заполняются --skus x --locations ячейками, цены - для 90% товаров (часть в другой валюте).
+Печатает время расчета из таблицы остатков и из индекса остатков в памяти (медиана и максимум
+по --repeat запускам, кэш цен прогрет) и проверяет, что оба источника дают один и тот же отчет.
+Данные замера пишутся под SKU начиная с --sku-base и удаляются после замера.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.models import InventoryLocationTotal, InventorySKUTotal, InventorySKUPrice
+from app import valuation
+from app.stock_index import StockIndex
+
+INSERT_CHUNK = 50000
+
+
+def _cleanup(factory, sku_from, sku_to):
+    db = factory()
+    for model in (InventoryLocationTotal, InventorySKUTotal, InventorySKUPrice):
+        db.execute(delete(model).where(model.sku_id >= sku_from, model.sku_id < sku_to))
+    db.commit()
+    db.close()
+
+
+def _insert(db, model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db.execute(insert(model), rows[start:start + INSERT_CHUNK])
+
+
+def _prepare(factory, sku_ids, locations):
+    db = factory()
+    cells = [
+        {"sku_id": sku_id, "sku_name": f"B{sku_id}", "location_name": location,
+         "weight": random.randint(1, 1000), "quantity": 0}
+        for sku_id in sku_ids for location in locations
+    ]
+    _insert(db, InventoryLocationTotal, cells)
+    _insert(db, InventorySKUTotal, [
+        {"sku_id": sku_id, "sku_name": f"B{sku_id}", "total_weight": 0, "total_quantity": 0} for sku_id in sku_ids
+    ])
+    prices = []
+    for sku_id in sku_ids:
+        if random.random() < 0.9:
+            price = round(random.uniform(1, 500), 2)
+            prices.append({
+                "sku_id": sku_id, "price": price, "currency": "руб" if random.random() < 0.95 else "USD",
+                "unit_weight": 1.0, "price_per_kg": price
+            })
+    _insert(db, InventorySKUPrice, prices)
+    db.commit()
+    db.close()
+    return len(cells)
+
+
+def _measure(factory, repeat):
+    timings, report = [], None
+    for _ in range(repeat):
+        db = factory()
+        started = time.perf_counter()
+        report = valuation.valuation(db, "руб", top=20)
+        timings.append(time.perf_counter() - started)
+        db.close()
+    return timings, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер оценки запасов")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--skus", type=int, default=100_000)
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sku-base", type=int, default=900_000_000)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    random.seed(1)
+    sku_ids = list(range(args.sku_base, args.sku_base + args.skus))
+    locations = [f"bench-{number}" for number in range(args.locations)]
+    _cleanup(factory, sku_ids[0], sku_ids[-1] + 1)
+    cells = _prepare(factory, sku_ids, locations)
+
+    try:
+        valuation.stock_index = StockIndex()  # Сначала без индекса: расчет по таблице остатков
+        _measure(factory, 1)  # Прогрев кэша цен
+        database_timings, database_report = _measure(factory, args.repeat)
+
+        index = StockIndex()
+        db = factory()
+        started = time.perf_counter()
+        index.rebuild(db)
+        build_seconds = time.perf_counter() - started
+        db.close()
+        valuation.stock_index = index
+        index_timings, index_report = _measure(factory, args.repeat)
+    finally:
+        _cleanup(factory, sku_ids[0], sku_ids[-1] + 1)
+
+    assert {**index_report, "source": database_report["source"]} == database_report, "источники расходятся"
+    print(f"ячеек: {cells}, товаров: {args.skus}, локаций: {args.locations}")
+    print(f"стоимость: {database_report['total_value']:,.2f} руб, без цены: {database_report['unpriced_weight']} кг")
+    for name, timings in (("таблица остатков", database_timings), ("индекс в памяти", index_timings)):
+        print(f"{name}: медиана {statistics.median(timings) * 1000:.0f} мс, максимум {max(timings) * 1000:.0f} мс")
+    print(f"построение индекса: {build_seconds:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Брокер RabbitMQ в памяти для тестов и замеров потребителя событий
+
+Реализует ту часть интерфейса aio-pika, которой пользуются EventConsumer и DeadLetterQueue:
+именованные очереди, публикация в exchange по умолчанию, prefetch, ack/nack (в том числе multiple),
+basic.get, purge, TTL с dead-letter в другую очередь и обрыв соединения.
+"""
+import asyncio
+import json
+from collections import deque
+from types import SimpleNamespace
+
+MAIN_QUEUE = "inventory_service_queue"
+
+
+class InProcessBroker:
+    """Брокер в памяти: очереди, подтверждения, TTL и обрыв соединения"""
+
+    def __init__(self, fail_connects=0, ttl_scale=0.001):
+        self.queues = {MAIN_QUEUE: deque()}
+        self.queue_arguments = {}
+        self.unacked = {}
+        self.acked = []
+        self.rejected = []
+        self.ack_calls = 0
+        self.fail_connects = fail_connects
+        self.connect_attempts = 0
+        self.connections = []
+        self.consumer = None  # (queue_name, connection, callback, prefetch)
+        self.ttl_scale = ttl_scale  # Масштаб x-message-ttl, чтобы тесты не ждали секунды
+        self._next_tag = 0
+
+    @property
+    def ready(self):
+        """Сообщения основной очереди, ожидающие доставки"""
+        return self.queues[MAIN_QUEUE]
+
+    async def connect(self):
+        self.connect_attempts += 1
+        if self.fail_connects:
+            self.fail_connects -= 1
+            raise ConnectionError("broker unavailable")
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def publish(self, routing_key, data, headers=None):
+        """Событие из erp_events, маршрутизированное в основную очередь"""
+        self.enqueue(MAIN_QUEUE, routing_key, json.dumps(data).encode(), headers)
+
+    def enqueue(self, queue_name, routing_key, body, headers=None):
+        self.queues.setdefault(queue_name, deque()).append((routing_key, body, dict(headers or {})))
+        ttl = self.queue_arguments.get(queue_name, {}).get("x-message-ttl")
+        if ttl is not None:
+            asyncio.get_running_loop().call_later(ttl / 1000 * self.ttl_scale, self._expire, queue_name)
+        self._dispatch()
+
+    def _expire(self, queue_name):
+        """Истек TTL первого сообщения: dead-letter по x-dead-letter-routing-key"""
+        if not self.queues.get(queue_name):
+            return
+        arguments = self.queue_arguments[queue_name]
+        routing_key, body, headers = self.queues[queue_name].popleft()
+        target = arguments.get("x-dead-letter-routing-key", routing_key)
+        self.enqueue(target, target, body, headers)
+
+    def messages(self, queue_name):
+        """Тела сообщений очереди (без изъятия)"""
+        return [json.loads(body) for _, body, _ in self.queues.get(queue_name, ())]
+
+    def _deliver(self, queue_name, connection):
+        routing_key, body, headers = self.queues[queue_name].popleft()
+        self._next_tag += 1
+        message = FakeMessage(self, self._next_tag, routing_key, body, headers, queue_name, connection)
+        self.unacked[message.delivery_tag] = message
+        return message
+
+    def _dispatch(self):
+        if self.consumer is None:
+            return
+        queue_name, connection, callback, prefetch = self.consumer
+        in_flight = sum(1 for message in self.unacked.values() if message.queue_name == queue_name)
+        while self.queues[queue_name] and in_flight < prefetch:
+            message = self._deliver(queue_name, connection)
+            in_flight += 1
+            asyncio.get_running_loop().create_task(callback(message))
+
+    def settle(self, message, acked, multiple=False, requeue=False):
+        if acked:
+            self.ack_calls += 1
+        if multiple:
+            tags = [
+                tag for tag, pending in sorted(self.unacked.items())
+                if tag <= message.delivery_tag and pending.connection is message.connection
+            ]
+        else:
+            tags = [message.delivery_tag]
+        for tag in tags:
+            settled = self.unacked.pop(tag)
+            settled.stale = True
+            if requeue:
+                self.queues[settled.queue_name].appendleft((settled.routing_key, settled.body, settled.headers))
+            else:
+                (self.acked if acked else self.rejected).append(json.loads(settled.body))
+        self._dispatch()
+
+    def close_connection(self, connection, error=None):
+        if connection.is_closed:
+            return
+        connection.is_closed = True
+        if self.consumer and self.consumer[1] is connection:
+            self.consumer = None
+        # Неподтвержденные сообщения возвращаются в начало своих очередей
+        owned = [message for message in self.unacked.values() if message.connection is connection]
+        for message in sorted(owned, key=lambda m: m.delivery_tag, reverse=True):
+            message.stale = True
+            del self.unacked[message.delivery_tag]
+            self.queues[message.queue_name].appendleft((message.routing_key, message.body, message.headers))
+        for callback in list(connection.close_callbacks):
+            callback(connection, error)
+        self._dispatch()
+
+    def drop(self):
+        """Оборвать текущее соединение со стороны брокера"""
+        self.close_connection(self.connections[-1], ConnectionError("connection reset"))
+
+
+class FakeMessage:
+    def __init__(self, broker, delivery_tag, routing_key, body, headers, queue_name, connection):
+        self.broker = broker
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.body = body
+        self.headers = headers
+        self.queue_name = queue_name
+        self.connection = connection
+        self.stale = False
+
+    async def ack(self, multiple=False):
+        if not self.stale:
+            self.broker.settle(self, acked=True, multiple=multiple)
+
+    async def nack(self, multiple=False, requeue=True):
+        if not self.stale:
+            self.broker.settle(self, acked=False, multiple=multiple, requeue=requeue)
+
+    async def reject(self, requeue=False):
+        await self.nack(requeue=requeue)
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+        self.close_callbacks = set()
+
+    async def channel(self):
+        return FakeChannel(self)
+
+    async def close(self):
+        self.broker.close_connection(self)
+
+
+class FakeExchange:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def publish(self, message, routing_key):
+        self.broker.enqueue(routing_key, routing_key, message.body, message.headers)
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.prefetch_count = None
+        self.default_exchange = FakeExchange(connection.broker)
+
+    async def set_qos(self, prefetch_count):
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(self, name, exchange_type, durable):
+        return name
+
+    async def declare_queue(self, name, durable, arguments=None):
+        broker = self.connection.broker
+        broker.queues.setdefault(name, deque())
+        if arguments:
+            broker.queue_arguments[name] = dict(arguments)
+        return FakeQueue(self, name)
+
+    async def close(self):
+        pass
+
+
+class FakeQueue:
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+        self.bindings = []
+        self.declaration_result = SimpleNamespace(message_count=len(channel.connection.broker.queues[name]))
+
+    async def bind(self, exchange, routing_key):
+        self.bindings.append(routing_key)
+
+    async def consume(self, callback):
+        broker = self.channel.connection.broker
+        broker.consumer = (self.name, self.channel.connection, callback, self.channel.prefetch_count)
+        broker._dispatch()
+        return "ctag"
+
+    async def cancel(self, consumer_tag):
+        self.channel.connection.broker.consumer = None
+
+    async def get(self, no_ack=False, fail=True):
+        broker = self.channel.connection.broker
+        if not broker.queues[self.name]:
+            return None
+        return broker._deliver(self.name, self.channel.connection)
+
+    async def purge(self):
+        broker = self.channel.connection.broker
+        count = len(broker.queues[self.name])
+        broker.queues[self.name].clear()
+        return SimpleNamespace(message_count=count)
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.change_stream import ChangeStream, sse_events
+from app.inventory_service import InventoryService
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    stream = ChangeStream(history_size=5, buffer_size=3)
+    monkeypatch.setattr("app.change_stream.change_stream", stream)
+    return stream
+
+
+async def _add_operation(db, sku_id, weight, location, operation_type="receipt", target=None):
+    await InventoryService.add_operation(
+        db, operation_type=operation_type, sku_id=sku_id, sku_name=f"SKU {sku_id}",
+        quantity_value=1, quantity_unit="шт", weight_value=weight, weight_unit="кг", delta_value=weight,
+        source_location=location, target_location=target
+    )
+
+
+def test_committed_changes_are_published_with_filters(session_factory, monkeypatch):
+    stream = ChangeStream(history_size=100, buffer_size=100)
+    monkeypatch.setattr("app.change_stream.change_stream", stream)
+    everything = stream.subscribe()
+    beta = stream.subscribe(location="Бета")
+    sku_2 = stream.subscribe(sku_id=2)
+
+    async def scenario():
+        db = session_factory()
+        await _add_operation(db, 1, 10, "Альфа")
+        await _add_operation(db, 1, 5, "Альфа")  # Та же строка остатков - одно событие с итогом
+        assert not everything.buffer  # До commit подписчики ничего не видят
+        db.commit()
+
+        await _add_operation(db, 2, 7, "Альфа")
+        db.rollback()  # Откаченные изменения не публикуются
+
+        await _add_operation(db, 1, 4, "Альфа", operation_type="transfer", target="Бета")
+        db.commit()
+        db.close()
+
+    asyncio.run(scenario())
+
+    kinds = [(kind, data.get("location_name")) for _, kind, data in everything.drain()[0]]
+    assert kinds[:5] == [
+        ("operation", None), ("operation", None), ("location_total", "Альфа"), ("sku_total", None),
+        ("operation", None),
+    ]
+    assert sorted(kinds[5:]) == [("location_total", "Альфа"), ("location_total", "Бета")]
+    beta_events = beta.drain()[0]
+    assert [kind for _, kind, _ in beta_events] == ["operation", "location_total"]
+    assert beta_events[1][2]["weight"] == 4
+    assert not sku_2.buffer
+    assert stream.last_id == 7
+
+
+def test_slow_client_drops_oldest_and_resume_from_history(stream):
+    slow = stream.subscribe()
+    stream.publish([("operation", {"sku_id": sku_id}) for sku_id in range(1, 6)])
+
+    items, dropped = slow.drain()
+    assert [item[0] for item in items] == [3, 4, 5]  # Буфер на 3 события - старые вытеснены
+    assert dropped == 2
+
+    resumed = stream.subscribe(last_event_id=3)
+    assert [item[0] for item in resumed.drain()[0]] == [4, 5]
+
+    stream.publish([("operation", {"sku_id": 6})])  # История на 5 событий - событие 1 вытеснено
+    too_old = stream.subscribe(last_event_id=0)
+    assert [kind for _, kind, _ in too_old.drain()[0]] == ["reset"]
+
+    stream.unsubscribe(slow)
+    stream.unsubscribe(resumed)
+    stream.unsubscribe(too_old)
+    assert stream.subscriber_count == 0
+
+
+def test_sse_generator_formats_events_and_heartbeat(stream):
+    async def scenario():
+        subscriber = stream.subscribe(sku_id=1)
+        events = sse_events(stream, subscriber, heartbeat_seconds=0.01)
+        chunks = [await events.__anext__(), await events.__anext__()]
+        stream.publish([("sku_total", {"sku_id": 1, "total_weight": 5}) for _ in range(4)])
+        chunks.append(await events.__anext__())
+        await events.aclose()
+        return chunks
+
+    retry, keepalive, batch = asyncio.run(scenario())
+    assert retry == "retry: 3000\n\n"
+    assert keepalive == ": keepalive\n\n"
+    assert batch.startswith('event: overflow\ndata: {"dropped": 1}\n\nid: 2\nevent: sku_total\n')
+    assert batch.count("event: sku_total") == 3
+    assert stream.subscriber_count == 0
@@ -0,0 +1,238 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.models import InventoryOperation, InventorySKUTotal
+from app.event_consumer import EventConsumer, DEAD_LETTER_QUEUE
+from app.dead_letters import DeadLetterQueue
+from inprocess_broker import InProcessBroker
+
+
+async def _wait_for(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+def _consumer(broker, **kwargs):
+    params = {
+        "prefetch_count": 50, "max_concurrency": 3, "reconnect_delay": 0.01, "max_reconnect_delay": 0.05,
+        "batch_window_ms": 20, "batch_max_size": 50,
+    }
+    params.update(kwargs)
+    return EventConsumer(connect=broker.connect, **params)
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr("app.event_consumer.SessionLocal", factory)
+    yield factory
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    """Catalog Service: считает запросы и их параллельность"""
+    calls = {"count": 0, "active": 0, "max_active": 0, "missing": set()}
+
+    async def fake_get_sku(sku_id):
+        calls["count"] += 1
+        calls["active"] += 1
+        calls["max_active"] = max(calls["max_active"], calls["active"])
+        await asyncio.sleep(0.001)
+        calls["active"] -= 1
+        if sku_id in calls["missing"]:
+            return None
+        return {"id": sku_id, "name": f"SKU {sku_id}", "quantity": "1", "weight": "10"}
+
+    monkeypatch.setattr("app.event_consumer.catalog_client.get_sku", fake_get_sku)
+    return calls
+
+
+def test_consumer_compacts_batch_per_sku(session_factory, catalog):
+    async def scenario():
+        broker = InProcessBroker()
+        consumer = _consumer(broker)
+        applied = []
+
+        async def record(db, event):
+            applied.append((event["sku_id"], event["data"]["version"], len(event["messages"])))
+
+        consumer.appliers["sku.updated"] = record
+        task = asyncio.create_task(consumer.run())
+        for version in range(10):
+            for sku_id in range(1, 5):
+                broker.publish("sku.updated", {"sku_id": sku_id, "version": version})
+        broker.publish("sku.updated", {"version": "нет sku_id"})
+
+        await _wait_for(lambda: len(broker.acked) == 41)
+        await consumer.stop()
+        await task
+        return broker, consumer, applied
+
+    broker, consumer, applied = asyncio.run(scenario())
+    # 40 событий по 4 товарам - одно применение на товар с последней версией
+    assert sorted(applied) == [(sku_id, 9, 10) for sku_id in range(1, 5)]
+    assert catalog["count"] == 4
+    assert catalog["max_active"] <= 3
+    assert broker.ack_calls == 1
+    # Некорректное событие повторять бессмысленно - сразу в DLQ
+    assert broker.messages(DEAD_LETTER_QUEUE) == [{"version": "нет sku_id"}]
+    assert consumer.stats == {"messages": 41, "batches": 1, "events_applied": 4, "retried": 0, "dead_lettered": 1}
+    assert broker.connections[0].is_closed
+
+
+def test_failed_events_retry_with_backoff_then_dead_letter(session_factory, catalog):
+    catalog["missing"].add(2)  # Catalog Service не отдает товар 2
+    broken = {3}  # Применение события по товару 3 падает
+
+    async def scenario():
+        broker = InProcessBroker()
+        consumer = _consumer(broker)
+        dead_letters = DeadLetterQueue(connect=broker.connect)
+
+        async def apply(db, event):
+            if event["sku_id"] in broken:
+                raise RuntimeError("apply failed")
+            db.add(InventorySKUTotal(sku_id=event["sku_id"], sku_name="x", total_quantity=0, total_weight=0))
+            db.flush()
+
+        consumer.appliers["sku.created"] = apply
+        task = asyncio.create_task(consumer.run())
+        for sku_id in range(1, 5):
+            broker.publish("sku.created", {"sku_id": sku_id})
+
+        # Основная очередь разбирается, неудачные события ходят через очереди повтора и оседают в DLQ
+        await _wait_for(lambda: len(broker.messages(DEAD_LETTER_QUEUE)) == 2)
+        report = await dead_letters.inspect(limit=10)
+        assert report["total"] == 2
+        assert broker.messages(DEAD_LETTER_QUEUE) == [{"sku_id": 2}, {"sku_id": 3}]  # Просмотр не изымает
+
+        # Причина устранена - возвращаем сообщения из DLQ в работу
+        catalog["missing"].clear()
+        broken.clear()
+        assert await dead_letters.replay(routing_key="sku.created") == 2
+        await _wait_for(lambda: not broker.queues[DEAD_LETTER_QUEUE] and not broker.unacked and not broker.ready)
+        await consumer.stop()
+        await task
+        return broker, consumer, report
+
+    broker, consumer, report = asyncio.run(scenario())
+    by_sku = {item["body"]["sku_id"]: item for item in report["messages"]}
+    assert by_sku[2]["attempts"] == 5 and "Failed to fetch SKU 2" in by_sku[2]["last_error"]
+    assert by_sku[3]["attempts"] == 5 and "apply failed" in by_sku[3]["last_error"]
+    assert by_sku[3]["routing_key"] == "sku.created"
+    assert consumer.stats["retried"] == 8  # По 4 повтора с задержками 1, 2, 4, 8 с (масштаб брокера)
+    assert consumer.stats["dead_lettered"] == 2
+    assert not broker.rejected
+    db = session_factory()
+    assert sorted(total.sku_id for total in db.query(InventorySKUTotal)) == [1, 2, 3, 4]
+    db.close()
+
+
+def test_dead_letter_purge(session_factory):
+    async def scenario():
+        broker = InProcessBroker()
+        for sku_id in range(3):
+            broker.enqueue(DEAD_LETTER_QUEUE, DEAD_LETTER_QUEUE, json.dumps({"sku_id": sku_id}).encode())
+        dead_letters = DeadLetterQueue(connect=broker.connect)
+        purged = await dead_letters.purge()
+        return broker, purged
+
+    broker, purged = asyncio.run(scenario())
+    assert purged == 3
+    assert not broker.queues[DEAD_LETTER_QUEUE]
+
+
+def test_consumer_reconnects_with_backoff(session_factory, catalog):
+    async def scenario():
+        broker = InProcessBroker(fail_connects=2)
+        consumer = _consumer(broker)
+        handled = []
+
+        async def handler(db, event):
+            handled.append(event["sku_id"])
+
+        consumer.appliers["sku.created"] = handler
+        task = asyncio.create_task(consumer.run())
+
+        broker.publish("sku.created", {"sku_id": 1})
+        await _wait_for(lambda: broker.acked == [{"sku_id": 1}])
+        assert broker.connect_attempts == 3
+
+        broker.drop()
+        broker.publish("sku.created", {"sku_id": 2})
+        await _wait_for(lambda: len(broker.acked) == 2)
+        await consumer.stop()
+        await task
+        return broker, handled
+
+    broker, handled = asyncio.run(scenario())
+    assert handled == [1, 2]
+    assert len(broker.connections) == 2
+
+
+def test_consumer_stop_finishes_received_messages(session_factory, catalog):
+    async def scenario():
+        broker = InProcessBroker()
+        consumer = _consumer(broker, batch_window_ms=0)
+        release = asyncio.Event()
+        started = []
+
+        async def blocking_handler(db, event):
+            started.append(event["sku_id"])
+            await release.wait()
+
+        consumer.appliers["sku.updated"] = blocking_handler
+        task = asyncio.create_task(consumer.run())
+        broker.publish("sku.updated", {"sku_id": 1})
+        await _wait_for(lambda: started == [1])
+        broker.publish("sku.updated", {"sku_id": 2})  # Получено во время применения первой пачки
+
+        stop = asyncio.create_task(consumer.stop())
+        await asyncio.sleep(0.02)
+        assert not stop.done()  # Остановка ждет применения начатой пачки
+        release.set()
+        await stop
+        await task
+        return broker, started
+
+    broker, started = asyncio.run(scenario())
+    assert started == [1, 2]
+    assert broker.acked == [{"sku_id": 1}, {"sku_id": 2}]
+    assert not broker.ready
+
+
+def test_sku_deleted_event_writes_off_totals(session_factory):
+    db = session_factory()
+    db.add(InventorySKUTotal(sku_id=5, sku_name="SKU 5", total_quantity=2, total_weight=40))
+    db.commit()
+    db.close()
+
+    async def scenario():
+        broker = InProcessBroker()
+        consumer = _consumer(broker)
+        task = asyncio.create_task(consumer.run())
+        broker.publish("sku.deleted", {"sku_id": 5})
+        await _wait_for(lambda: broker.acked)
+        await consumer.stop()
+        await task
+
+    asyncio.run(scenario())
+
+    db = session_factory()
+    assert db.query(InventorySKUTotal).filter_by(sku_id=5).one().total_weight == 0
+    operation = db.query(InventoryOperation).one()
+    assert (operation.operation_type, operation.delta_value) == ("delete", -40)
+    db.close()
@@ -0,0 +1,1062 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.main import app as fastapi_app
+from app.database import Base, get_db
+import app.models  # noqa: F401 - регистрирует модели в metadata
+from app.models import InventoryOperation, InventoryLocationTotal, InventoryLocation
+from app.inventory_service import InventoryService
+from app import location_rollups, sku_locks
+from app.stock_alerts import ThresholdCache
+from app.sku_prices import PriceCache
+from app.stock_index import StockIndex
+from app.locations import location_dictionary
+from app.intake import intake_applier
+from app.snapshots import SnapshotService
+
+
+@pytest.fixture
+def session_factory():
+    # In-memory SQLite for isolated tests
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,  # один in-memory инстанс на все соединения
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def client(monkeypatch, session_factory):
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    fastapi_app.dependency_overrides[get_db] = override_get_db
+
+    # Stub external integrations
+    async def fake_get_sku(sku_id):
+        return {"id": sku_id, "name": f"SKU {sku_id}"}
+
+    def fake_publish_event(event_type, data):
+        return None
+
+    monkeypatch.setattr("app.inventory_service.catalog_client.get_sku", fake_get_sku)
+    monkeypatch.setattr("app.routers.inventory.rabbitmq_client.publish_event", fake_publish_event)
+    monkeypatch.setattr("app.stock_alerts.threshold_cache", ThresholdCache())
+    monkeypatch.setattr("app.sku_prices.price_cache", PriceCache())
+
+    with TestClient(fastapi_app) as test_client:
+        yield test_client
+
+    fastapi_app.dependency_overrides.clear()
+
+
+def _operation(**kwargs):
+    data = {
+        "operation_type": "receipt",
+        "sku_id": 1,
+        "quantity_value": 1,
+        "quantity_unit": "шт",
+        "weight_value": 10,
+        "weight_unit": "кг",
+        "source_location": "Альфа",
+        "target_location": None,
+    }
+    data.update(kwargs)
+    return data
+
+
+def _add_ledger_row(db, created_at, **kwargs):
+    values = {
+        "operation_type": "receipt",
+        "sku_id": 1,
+        "sku_name": "SKU 1",
+        "quantity_value": 1,
+        "quantity_unit": "шт",
+        "weight_value": 10,
+        "weight_unit": "кг",
+        "delta_value": 10,
+        "delta_unit": "кг",
+        "source_location": "Альфа",
+        "target_location": "Альфа",
+        "created_at": created_at,
+    }
+    values.update(kwargs)
+    db.add(InventoryOperation(**values))
+
+
+def test_create_operation_updates_totals(client):
+    resp = client.post("/inventory/operations", json=_operation(weight_value=25))
+    assert resp.status_code == 201
+    assert resp.json()["delta_value"] == 25
+
+    resp = client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", weight_value=5, source_location="Альфа", target_location="Бета"
+    ))
+    assert resp.status_code == 201
+
+    totals = {item["location_name"]: item["weight"] for item in client.get("/inventory/locations").json()}
+    assert totals == {"Альфа": 20, "Бета": 5}
+    sku_totals = client.get("/inventory/sku/totals", params={"sku_id": 1}).json()
+    assert sku_totals[0]["total_weight"] == 25
+
+
+def test_locations_summary_aggregates_per_location(client):
+    for sku_id in range(1, 151):  # Больше лимита по умолчанию у /inventory/locations
+        client.post("/inventory/operations", json=_operation(sku_id=sku_id, weight_value=2))
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=7, source_location="Бета"))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=2, weight_value=2, source_location="Альфа", target_location="Бета"
+    ))
+
+    resp = client.get("/inventory/locations/summary")
+    assert resp.status_code == 200
+    summary = {item["location_name"]: item for item in resp.json()}
+    assert (summary["Альфа"]["total_weight"], summary["Альфа"]["sku_count"]) == (298, 149)
+    assert (summary["Бета"]["total_weight"], summary["Бета"]["sku_count"]) == (9, 2)
+    assert summary["Бета"]["updated_at"]
+
+
+def test_location_rollups_follow_totals_and_verifier_repairs_drift(client, session_factory):
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=10))
+    client.post("/inventory/operations", json=_operation(sku_id=2, weight_value=4))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=2, weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+    client.post("/inventory/operations", json=_operation(operation_type="update", sku_id=1, weight_value=15))
+
+    db = session_factory()
+    assert location_rollups.verify_rollups(db)["mismatch_count"] == 0
+    summary = {item["location_name"]: item for item in client.get("/inventory/locations/summary").json()}
+    assert (summary["Альфа"]["total_weight"], summary["Альфа"]["sku_count"]) == (15, 1)
+    assert (summary["Бета"]["total_weight"], summary["Бета"]["sku_count"]) == (4, 1)
+
+    # Правка остатков в обход сервиса - сводку исправит сверка
+    db.query(InventoryLocationTotal).filter_by(sku_id=2, location_name="Бета").update({"weight": 9})
+    db.add(InventoryLocationTotal(sku_id=3, sku_name="SKU 3", location_name="Гамма", weight=5, quantity=0))
+    db.commit()
+    report = location_rollups.verify_rollups(db)
+    assert report["repaired"] == 2
+    assert [item["location_name"] for item in report["mismatches"]] == ["Бета", "Гамма"]
+    assert location_rollups.verify_rollups(db)["mismatch_count"] == 0
+    db.close()
+
+    summary = {item["location_name"]: item for item in client.get("/inventory/locations/summary").json()}
+    assert summary["Бета"]["total_weight"] == 9
+    assert (summary["Гамма"]["total_weight"], summary["Гамма"]["sku_count"]) == (5, 1)
+
+
+def test_stock_alerts_fire_once_per_threshold_crossing(client, session_factory, monkeypatch):
+    alerts = []
+    monkeypatch.setattr(
+        "app.routers.inventory.rabbitmq_client.publish_event",
+        lambda event_type, data: alerts.append((event_type, data["sku_id"], data["location_name"], data["value"]))
+    )
+    client.post("/inventory/operations", json=_operation(weight_value=10))
+    resp = client.post("/inventory/thresholds", json={"sku_id": 1, "location_name": "Альфа", "min_weight": 5, "max_weight": 20})
+    assert resp.status_code == 200
+    assert resp.json()["state"] == "ok"
+    client.post("/inventory/thresholds", json={"location_name": "Бета", "max_weight": 8})
+    assert client.post("/inventory/thresholds", json={"sku_id": 1}).status_code == 400
+    assert not alerts
+
+    client.post("/inventory/operations", json=_operation(operation_type="write_off", weight_value=6))
+    client.post("/inventory/operations", json=_operation(operation_type="write_off", weight_value=1))  # Уже low
+    client.post("/inventory/operations", json=_operation(weight_value=10))
+    client.post("/inventory/operations", json=_operation(weight_value=10))
+    assert [alert[0] for alert in alerts] == ["alert.low_stock", "alert.recovered", "alert.over_capacity"]
+    assert alerts[0][1:] == (1, "Альфа", 4)
+
+    # Заполненность локации: сумма по всем SKU
+    alerts.clear()
+    client.post("/inventory/operations", json=_operation(sku_id=2, weight_value=5, source_location="Бета"))
+    client.post("/inventory/operations", json=_operation(sku_id=3, weight_value=5, source_location="Бета"))
+    assert alerts == [("alert.over_capacity", None, "Бета", 10)]
+
+    # Откаченные изменения оповещений не дают, состояние порога не меняется
+    db = session_factory()
+    InventoryService.location_weight_changed(db, 2, "Бета", 5, 0)
+    db.rollback()
+    db.close()
+    thresholds = {item["location_name"]: item["state"] for item in client.get("/inventory/thresholds").json()}
+    assert thresholds == {"Альфа": "high", "Бета": "high"}
+    assert len(alerts) == 1
+
+
+def test_stock_index_serves_same_reads_as_database(client, session_factory, monkeypatch):
+    client.post("/inventory/operations", json=_operation(sku_id=2, weight_value=7))
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=10, source_location="Бета"))
+
+    index = StockIndex()
+    monkeypatch.setattr("app.stock_index.stock_index", index)
+    monkeypatch.setattr("app.routers.inventory.stock_index", index)
+    db = session_factory()
+    index.rebuild(db)
+
+    # Изменения после построения применяются после commit; новые SKU и локации расширяют матрицу
+    for sku_id in range(3, 80):
+        client.post("/inventory/operations", json=_operation(sku_id=sku_id, weight_value=sku_id))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=2, weight_value=3, source_location="Альфа", target_location="Гамма"
+    ))
+    client.post("/inventory/operations", json=_operation(operation_type="update", sku_id=1, weight_value=4, source_location="Бета"))
+    db.add(InventoryLocationTotal(sku_id=1, sku_name="SKU 1", location_name="Дельта", weight=5, quantity=0))
+    db.flush()
+    db.rollback()
+    db.close()
+
+    queries = [
+        ("/inventory/locations", {"limit": 1000}),
+        ("/inventory/locations", {"location_name": "Альфа", "skip": 5, "limit": 10}),
+        ("/inventory/locations", {"sku_id": 2}),
+        ("/inventory/locations", {"location_name": "Нет такой"}),
+        ("/inventory/sku/totals", {"limit": 1000}),
+        ("/inventory/sku/totals", {"sku_id": 1}),
+    ]
+    def drop_time(rows):  # Время изменения в индексе - время commit в процессе
+        return [{key: value for key, value in row.items() if key != "updated_at"} for row in rows]
+    cell_queries = [
+        {"sku_ids": [2, 1, 79, 1000], "location_names": ["Альфа", "Гамма", "Нет такой"]},
+        {"sku_ids": [1, 2]},
+        {"location_names": ["Бета", "Гамма"]},
+    ]
+    def read_all():
+        return [drop_time(client.get(path, params=params).json()) for path, params in queries] + [
+            drop_time(client.post("/inventory/totals/query", json=body).json()) for body in cell_queries
+        ]
+    from_index = read_all()
+    stats = client.get("/inventory/stock-index").json()
+    index.disable()
+    from_db = read_all()
+
+    assert from_index == from_db
+    assert [(row["sku_id"], row["location_name"]) for row in from_db[6]] == [(2, "Альфа"), (79, "Альфа"), (2, "Гамма")]
+    assert client.post("/inventory/totals/query", json={}).status_code == 400
+    assert {row["location_name"]: row["weight"] for row in from_index[2]} == {"Альфа": 4, "Гамма": 3}
+    assert (stats["ready"], stats["sku_count"], stats["location_count"], stats["cell_count"]) == (True, 79, 3, 80)
+    assert stats["capacity"][0] >= 79 and stats["memory_bytes"] > 0
+
+
+class _FakePostgresSession:
+    """Сессия, записывающая вызовы advisory-блокировок (SKU 3 занят другой транзакцией)"""
+
+    def __init__(self):
+        self.info = {}
+        self.calls = []
+
+    def get_bind(self):
+        return type("Bind", (), {"dialect": type("Dialect", (), {"name": "postgresql"})()})()
+
+    def execute(self, statement, params):
+        function = str(statement).split("(")[0].split()[-1]
+        self.calls.append((function, params.get("sku_id", "bulk")))
+        result = not (function == "pg_try_advisory_xact_lock" and params.get("sku_id") == 3)
+        return type("Result", (), {"scalar": lambda _: result})()
+
+
+def test_sku_locks_taken_once_in_sorted_order(monkeypatch):
+    metrics = sku_locks.LockMetrics()
+    monkeypatch.setattr(sku_locks, "lock_metrics", metrics)
+    db = _FakePostgresSession()
+
+    sku_locks.lock_skus(db, [5, 3, 5, 1])
+    sku_locks.lock_skus(db, [3, 7])  # SKU 3 уже заблокирован этой транзакцией
+    assert db.calls == [
+        ("pg_try_advisory_xact_lock", 1),
+        ("pg_try_advisory_xact_lock", 3), ("pg_advisory_xact_lock", 3),
+        ("pg_try_advisory_xact_lock", 5),
+        ("pg_try_advisory_xact_lock", 7),
+    ]
+    stats = metrics.snapshot()
+    assert (stats["acquired"], stats["contended"]) == (4, 1)
+
+    sku_locks._forget_locks(db)  # После commit блокировки берутся заново
+    sku_locks.lock_skus(db, [1])
+    assert db.calls[-1] == ("pg_try_advisory_xact_lock", 1)
+
+    # Пачка блокируется одним запросом и учитывается отдельно от SKU
+    sku_locks.lock_skus(db, range(100, 100 + sku_locks.BULK_LOCK_THRESHOLD))
+    assert db.calls[-1] == ("pg_advisory_xact_lock", "bulk")
+    stats = metrics.snapshot()
+    assert (stats["acquired"], stats["bulk_batches"], stats["bulk_skus"]) == (5, 1, sku_locks.BULK_LOCK_THRESHOLD)
+
+
+def test_async_intake_applies_batch_on_flush(client, session_factory, monkeypatch):
+    async def fake_get_sku(sku_id):
+        return None if sku_id == 99 else {"id": sku_id, "name": f"SKU {sku_id}"}
+
+    monkeypatch.setattr("app.inventory_service.catalog_client.get_sku", fake_get_sku)
+    # Фоновый применитель не будится: квитанции применяет flush
+    monkeypatch.setattr(intake_applier, "wake", lambda: None)
+
+    tickets = []
+    for number in range(3):
+        resp = client.post(
+            "/inventory/operations", params={"async": "true"}, json=_operation(weight_value=10),
+            headers={"Idempotency-Key": f"intake-{number}"}
+        )
+        assert resp.status_code == 202
+        assert resp.headers["Location"] == f"/inventory/intake/{resp.json()['id']}"
+        tickets.append(resp.json())
+    assert {ticket["status"] for ticket in tickets} == {"pending"}
+    replay = client.post(
+        "/inventory/operations", params={"async": "true"}, json=_operation(weight_value=10),
+        headers={"Idempotency-Key": "intake-0"}
+    )
+    assert replay.json()["id"] == tickets[0]["id"]
+    client.post("/inventory/operations", params={"async": "true"}, json=_operation(
+        operation_type="transfer", weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+    failing = client.post("/inventory/operations", params={"async": "true"}, json=_operation(sku_id=99)).json()
+    assert client.post(
+        "/inventory/operations", params={"async": "true"}, json=_operation(operation_type="update")
+    ).status_code == 400
+    assert client.get("/inventory/locations").json() == []
+
+    resp = client.post("/inventory/intake/flush")
+    assert resp.json() == {"through": failing["id"], "failed": 1}
+
+    totals = {item["location_name"]: item["weight"] for item in client.get("/inventory/locations").json()}
+    assert totals == {"Альфа": 26, "Бета": 4}
+    assert client.get("/inventory/sku/totals", params={"sku_id": 1}).json()[0]["total_weight"] == 30
+    summary = {item["location_name"]: item["total_weight"] for item in client.get("/inventory/locations/summary").json()}
+    assert summary == {"Альфа": 26, "Бета": 4}
+    ledger = client.get("/inventory/operations").json()
+    assert sorted(item["operation_type"] for item in ledger) == ["receipt"] * 3 + ["transfer"]
+
+    applied = client.get(f"/inventory/intake/{tickets[0]['id']}").json()
+    assert applied["status"] == "applied" and applied["operation_id"] in {item["id"] for item in ledger}
+    rejected = client.get(f"/inventory/intake/{failing['id']}").json()
+    assert rejected["status"] == "failed" and "SKU 99" in rejected["error"]
+    assert client.get("/inventory/intake/100000").status_code == 404
+
+    # Обработанные квитанции удаляются по истечении срока хранения, ожидающие - остаются
+    from app.intake import purge_processed_tickets
+    pending = client.post("/inventory/operations", params={"async": "true"}, json=_operation()).json()
+    db = session_factory()
+    assert purge_processed_tickets(db, ttl_seconds=3600) == 0
+    assert purge_processed_tickets(db, ttl_seconds=-60) == 5
+    db.close()
+    assert client.get(f"/inventory/intake/{tickets[0]['id']}").status_code == 404
+    assert client.get(f"/inventory/intake/{pending['id']}").json()["status"] == "pending"
+
+
+def test_valuation_uses_price_projection_and_matches_index(client, session_factory, monkeypatch):
+    catalog = {
+        1: {"weight": "2", "weight_unit": {"name": "кг"}, "price": "10", "price_unit": {"name": "руб"}},
+        2: {"weight": "500", "weight_unit": {"name": "г"}, "price": "3", "price_unit": {"name": "руб"}},
+        3: {"weight": "1", "weight_unit": {"name": "кг"}, "price": "7", "price_unit": {"name": "USD"}},
+        4: {"weight": "1", "weight_unit": {"name": "кг"}, "price": None, "price_unit": None},
+    }
+
+    async def fake_get_sku(sku_id):
+        return {"id": sku_id, "name": f"SKU {sku_id}", **catalog[sku_id]}
+
+    monkeypatch.setattr("app.inventory_service.catalog_client.get_sku", fake_get_sku)
+    # Цена обновляется операциями create/update - так Catalog Service сообщает об изменении товара
+    for sku_id in catalog:
+        client.post("/inventory/operations", json=_operation(operation_type="create", sku_id=sku_id, weight_value=10))
+    client.post("/inventory/operations", json=_operation(sku_id=2, weight_value=30, source_location="Бета"))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=1, weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+
+    # Цена кг: SKU 1 - 10 руб / 2 кг = 5, SKU 2 - 3 руб / 0.5 кг = 6
+    report = client.get("/inventory/valuation", params={"top": 2}).json()
+    assert (report["source"], report["cells"], report["total_value"]) == ("database", 6, 5 * 10 + 6 * 40)
+    assert (report["priced_weight"], report["unpriced_weight"], report["unpriced_sku_count"]) == (50, 20, 2)
+    assert [(item["sku_id"], item["weight"], item["price_per_kg"], item["value"]) for item in report["top_skus"]] == [
+        (2, 40, 6.0, 240.0), (1, 10, 5.0, 50.0)
+    ]
+    assert [(item["location_name"], item["cells"], item["value"]) for item in report["top_locations"]] == [
+        ("Бета", 2, 200.0), ("Альфа", 4, 90.0)
+    ]
+    usd = client.get("/inventory/valuation", params={"currency": "USD", "location_name": "Альфа"}).json()
+    assert (usd["total_value"], usd["top_skus"][0]["sku_id"]) == (70.0, 3)
+
+    index = StockIndex()
+    db = session_factory()
+    index.rebuild(db)
+    monkeypatch.setattr("app.valuation.stock_index", index)
+    from_index = client.get("/inventory/valuation", params={"top": 2}).json()
+    assert from_index["source"] == "index"
+    assert {**from_index, "source": "database"} == report
+
+    # Полное обновление проекции: неполный список (в каталоге 4 товара) ничего не удаляет
+    from app import sku_prices
+    rows = [{"sku_id": 1, "price": 20.0, "currency": "руб", "unit_weight": 2.0, "price_per_kg": 10.0}]
+    assert sku_prices.replace_all(db, rows, catalog_total=4) == {"skus": 1, "removed": 0}
+    assert sku_prices.replace_all(db, rows, catalog_total=None) == {"skus": 1, "removed": 0}
+    # Полный список: товара 2 в каталоге больше нет
+    assert sku_prices.replace_all(db, rows, catalog_total=1) == {"skus": 1, "removed": 3}
+    db.close()
+    report = client.get("/inventory/valuation").json()
+    assert (report["total_value"], report["unpriced_sku_count"]) == (100.0, 3)
+
+
+def test_location_filter_matches_source_or_target(client):
+    client.post("/inventory/operations", json=_operation(source_location="Альфа"))
+    client.post("/inventory/operations", json=_operation(source_location="Бета"))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", source_location="Бета", target_location="Альфа"
+    ))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", source_location="Альфа", target_location="Бета"
+    ))
+
+    alpha = client.get("/inventory/operations", params={"location": "Альфа"}).json()
+    assert len(alpha) == 3
+    assert len({item["id"] for item in alpha}) == 3
+
+    page = client.get("/inventory/operations", params={"location": "Альфа", "skip": 1, "limit": 1}).json()
+    assert [item["id"] for item in page] == [alpha[1]["id"]]
+
+
+def test_ledger_stores_location_ids_from_dictionary(client, session_factory):
+    client.post("/inventory/operations", json=_operation(weight_value=10))
+    resp = client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+    operation = resp.json()
+    assert (operation["source_location"], operation["target_location"]) == ("Альфа", "Бета")
+
+    db = session_factory()
+    ids = {location.name: location.id for location in db.query(InventoryLocation).all()}
+    assert (operation["source_location_id"], operation["target_location_id"]) == (ids["Альфа"], ids["Бета"])
+
+    # Новая локация в откаченной транзакции не остается ни в словаре, ни в кэше процесса
+    db.add(InventoryOperation(
+        operation_type="receipt", sku_id=1, sku_name="SKU 1", quantity_value=1, quantity_unit="шт",
+        weight_value=1, weight_unit="кг", delta_value=1, source_location="Гамма", target_location="Гамма"
+    ))
+    db.flush()
+    db.rollback()
+    assert location_dictionary.id_of(db, "Гамма", create=False) is None
+
+    # Синхронизация со складом добавляет его локации и сохраняет их id
+    report = location_dictionary.sync(db, [{"id": 7, "name": "Бета"}, {"id": 8, "name": "Дельта"}])
+    assert report == {"warehouse_locations": 2, "added": 1}
+    db.close()
+    dictionary = {item["name"]: item for item in client.get("/inventory/location-dictionary").json()}
+    assert dictionary["Бета"]["id"] == ids["Бета"]
+    assert (dictionary["Бета"]["warehouse_location_id"], dictionary["Дельта"]["warehouse_location_id"]) == (7, 8)
+    assert dictionary["Альфа"]["warehouse_location_id"] is None
+
+    beta = client.get("/inventory/operations", params={"location": "Бета"}).json()
+    assert [item["id"] for item in beta] == [operation["id"]]
+    assert client.get("/inventory/operations", params={"location": "Дельта"}).json() == []
+
+
+def test_streaming_export_matches_api_reads(client, monkeypatch):
+    monkeypatch.setattr("app.exports.settings.EXPORT_CHUNK_ROWS", 2)  # Несколько порций курсора
+    for sku_id in (1, 2, 3):
+        client.post("/inventory/operations", json=_operation(sku_id=sku_id, weight_value=sku_id * 10))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=2, weight_value=5, source_location="Альфа", target_location="Бета"
+    ))
+    client.post("/inventory/operations", json=_operation(sku_id=4, weight_value=1, source_location="Гамма"))
+
+    resp = client.get("/inventory/export/operations", params={"location": "Альфа"})
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in resp.text.splitlines()]
+    expected = list(reversed(client.get("/inventory/operations", params={"location": "Альфа"}).json()))
+    assert [(row["id"], row["source_location"], row["target_location"]) for row in exported] == [
+        (row["id"], row["source_location"], row["target_location"]) for row in expected
+    ]
+    assert len(exported) == 4
+
+    resp = client.get("/inventory/export/locations", params={"format": "csv", "gzip": "true"})
+    assert resp.headers["content-disposition"] == 'attachment; filename="locations.csv.gz"'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(resp.content).decode("utf-8"))))
+    totals = client.get("/inventory/locations").json()
+    assert [(row["location_name"], int(row["sku_id"]), int(row["weight"])) for row in rows] == [
+        (row["location_name"], row["sku_id"], row["weight"]) for row in totals
+    ]
+    assert client.get("/inventory/export/operations", params={"format": "xml"}).status_code == 400
+
+
+def test_operations_date_range_filters(client, session_factory):
+    db = session_factory()
+    _add_ledger_row(db, datetime(2024, 1, 15))
+    _add_ledger_row(db, datetime(2024, 2, 15))
+    _add_ledger_row(db, datetime(2024, 3, 15), sku_id=2, sku_name="SKU 2")
+    db.commit()
+    db.close()
+
+    resp = client.get("/inventory/operations", params={"from": "2024-02-01T00:00:00", "to": "2024-04-01T00:00:00"})
+    assert resp.status_code == 200
+    assert [item["sku_id"] for item in resp.json()] == [2, 1]
+
+    resp = client.get("/inventory/sku/1/history", params={"to": "2024-02-01T00:00:00"})
+    assert [item["created_at"][:10] for item in resp.json()] == ["2024-01-15"]
+
+    resp = client.get("/inventory/operations", params={"from": "2024-03-01T00:00:00", "to": "2024-02-01T00:00:00"})
+    assert resp.status_code == 400
+
+
+def test_movement_rollup_matches_backfill_from_ledger(client, session_factory):
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=10))
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=5))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=1, weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+    client.post("/inventory/operations", json=_operation(operation_type="write_off", sku_id=1, weight_value=3))
+    client.post("/inventory/operations", json=_operation(operation_type="update", sku_id=1, weight_value=50))
+
+    incremental = client.get("/inventory/reports/movements").json()
+    rows = {(item["location_name"], item["operation_type"]): item for item in incremental}
+    assert set(rows) == {("Альфа", "receipt"), ("Альфа", "transfer"), ("Бета", "transfer"), ("Альфа", "write_off")}
+    assert (rows[("Альфа", "receipt")]["inbound_weight"], rows[("Альфа", "receipt")]["inbound_count"]) == (15, 2)
+    assert rows[("Альфа", "transfer")]["outbound_weight"] == 4
+    assert rows[("Бета", "transfer")]["net_weight"] == 4
+
+    resp = client.post("/inventory/reports/movements/backfill")
+    assert resp.status_code == 200
+    assert resp.json()["rows"] == 4
+    assert client.get("/inventory/reports/movements").json() == incremental
+
+
+def test_movement_report_weekly_and_monthly(client, session_factory):
+    db = session_factory()
+    _add_ledger_row(db, datetime(2024, 1, 29, 10), delta_value=10)  # понедельник
+    _add_ledger_row(db, datetime(2024, 2, 4, 10), delta_value=20)  # воскресенье той же недели
+    _add_ledger_row(db, datetime(2024, 2, 5, 10), delta_value=5)
+    _add_ledger_row(db, datetime(2024, 2, 6, 10), operation_type="write_off", delta_value=7)
+    db.commit()
+    db.close()
+
+    resp = client.post("/inventory/reports/movements/backfill", params={"from": "2024-01-01", "to": "2024-03-01"})
+    assert resp.json()["months"] == 2
+
+    weekly = client.get("/inventory/reports/movements", params={"granularity": "week", "operation_type": "receipt"}).json()
+    assert [(item["period_start"], item["inbound_weight"]) for item in weekly] == [("2024-01-29", 30), ("2024-02-05", 5)]
+
+    monthly = client.get("/inventory/reports/movements", params={"granularity": "month", "from": "2024-02-01"}).json()
+    assert [(item["period_start"], item["operation_type"], item["net_weight"]) for item in monthly] == [
+        ("2024-02-01", "receipt", 25), ("2024-02-01", "write_off", -7)
+    ]
+    assert client.get("/inventory/reports/movements", params={"granularity": "year"}).status_code == 400
+
+
+def test_analytics_classifies_skus_and_turnover_from_daily_movements(client, session_factory, monkeypatch):
+    from sqlalchemy import func, select
+    from app.config import settings
+    from app.models import InventoryDailyMovement, InventorySKUTotal, InventoryLocationRollup, InventorySKUPrice
+
+    # Окно из двух периодов по два дня: [сегодня - 4, сегодня)
+    monkeypatch.setattr(settings, "ANALYTICS_PERIODS", 2)
+    monkeypatch.setattr(settings, "ANALYTICS_PERIOD_DAYS", 2)
+    monkeypatch.setattr(settings, "ANALYTICS_ABC_BASIS", "weight")
+    db = session_factory()
+    today = db.execute(select(func.current_date())).scalar()
+    window_from = today - timedelta(days=4)
+
+    def movement(day, sku_id, operation_type, inbound=0, outbound=0, location="Альфа"):
+        db.add(InventoryDailyMovement(
+            day=window_from + timedelta(days=day), sku_id=sku_id, location_name=location,
+            operation_type=operation_type, inbound_weight=inbound, outbound_weight=outbound,
+            inbound_count=int(inbound > 0), outbound_count=int(outbound > 0)
+        ))
+
+    for day in range(4):
+        movement(day, 1, "write_off", outbound=10)  # Ровный расход: X
+    movement(4, 1, "receipt", inbound=20)  # Сегодня - вне окна, но нужен для остатка в окне
+    movement(1, 1, "transfer", outbound=6)
+    movement(1, 1, "transfer", inbound=6, location="Бета")
+    movement(3, 2, "write_off", outbound=8)  # Расход только во втором периоде: Z
+    movement(0, 3, "write_off", outbound=2)
+    movement(2, 3, "write_off", outbound=2)
+    movement(-6, 3, "write_off", outbound=100)  # До окна - не учитывается
+    for sku_id, weight in ((1, 60), (2, 5), (3, 1), (4, 9)):
+        db.add(InventorySKUTotal(sku_id=sku_id, sku_name=f"SKU {sku_id}", total_weight=weight, total_quantity=0))
+    db.add_all([
+        InventoryLocationRollup(location_name="Альфа", total_weight=100, sku_count=4),
+        InventoryLocationRollup(location_name="Бета", total_weight=6, sku_count=1),
+    ])
+    db.commit()
+
+    resp = client.post("/inventory/analytics/recompute")
+    assert resp.status_code == 200
+    summary = resp.json()
+    assert (summary["window_from"], summary["window_to"]) == (window_from.isoformat(), today.isoformat())
+    assert summary["matrix"] == {"AX": 1, "AZ": 1, "BX": 1, "C-": 1}
+    assert client.post("/inventory/analytics/recompute", params={"force": False}).json()["recomputed"] is False
+
+    skus = {item["sku_id"]: item for item in client.get("/inventory/analytics/skus").json()}
+    assert [skus[sku_id]["abc_rank"] for sku_id in (1, 2, 3, 4)] == [1, 2, 3, 4]
+    assert (skus[1]["demand_weight"], skus[1]["demand_cv"], skus[2]["demand_cv"]) == (40, 0.0, 1.0)
+    # Остатки SKU 1 на конец дней окна: 70, 60, 50, 40 (сегодняшнее поступление вычтено)
+    assert (skus[1]["average_stock"], skus[1]["turnover"]) == (55.0, pytest.approx(40 / 55))
+    assert skus[4]["xyz_class"] is None and skus[4]["turnover"] == 0.0
+    assert [item["sku_id"] for item in client.get("/inventory/analytics/skus", params={"abc_class": "A"}).json()] == [1, 2]
+
+    locations = {item["location_name"]: item for item in client.get("/inventory/analytics/locations").json()}
+    assert (locations["Альфа"]["outbound_weight"], locations["Альфа"]["average_stock"]) == (58, 103.5)
+    assert locations["Альфа"]["days_of_supply"] == pytest.approx(103.5 / (58 / 4))
+    assert (locations["Бета"]["average_stock"], locations["Бета"]["turnover"], locations["Бета"]["days_of_supply"]) == (
+        4.5, 0.0, None
+    )
+
+    # По стоимости: класс получают только товары с ценой
+    monkeypatch.setattr(settings, "ANALYTICS_ABC_BASIS", "value")
+    db.add(InventorySKUPrice(sku_id=2, price=3.0, currency="руб", unit_weight=1.0, price_per_kg=3.0))
+    db.commit()
+    db.close()
+    summary = client.post("/inventory/analytics/recompute").json()
+    assert summary["matrix"] == {"-X": 2, "--": 1, "AZ": 1}
+    assert client.get("/inventory/analytics/skus").json()[0]["demand_value"] == 24.0
+
+
+def test_forecast_smooths_outbound_history_per_cell(client, session_factory, monkeypatch):
+    from sqlalchemy import func, select
+    from app.config import settings
+    from app.models import InventoryDailyMovement
+
+    monkeypatch.setattr(settings, "FORECAST_HISTORY_DAYS", 4)
+    monkeypatch.setattr(settings, "FORECAST_MOVING_AVERAGE_DAYS", 2)
+    monkeypatch.setattr(settings, "FORECAST_SMOOTHING_ALPHA", 0.5)
+    query = {"location_names": ["Альфа"], "horizon_days": 10}
+    assert client.post("/inventory/forecasts/query", json=query).json()["computed_at"] is None
+    # Пересчет без расхода: строк прогноза нет, но прогноз посчитан (спрос 0)
+    assert client.post("/inventory/forecasts/refresh").json()["cells"] == 0
+    empty = client.post("/inventory/forecasts/query", json=query).json()
+    assert empty["computed_at"] is not None and empty["items"] == []
+    assert client.post("/inventory/forecasts/refresh", params={"force": False}).json()["refreshed"] is False
+
+    db = session_factory()
+    today = db.execute(select(func.current_date())).scalar()
+    rows = [(-4, "Альфа", "write_off", 4), (-2, "Альфа", "write_off", 8), (-1, "Альфа", "write_off", 4),
+            (-1, "Бета", "transfer", 2), (-3, "Альфа", "receipt", 0), (0, "Альфа", "write_off", 50)]
+    for day, location, operation_type, outbound in rows:
+        db.add(InventoryDailyMovement(
+            day=today + timedelta(days=day), sku_id=1, location_name=location, operation_type=operation_type,
+            inbound_weight=0 if outbound else 30, outbound_weight=outbound,
+            inbound_count=0, outbound_count=int(outbound > 0)
+        ))
+    db.commit()
+    db.close()
+
+    resp = client.post("/inventory/forecasts/refresh")
+    assert (resp.json()["cells"], resp.json()["refreshed"]) == (2, True)
+    assert client.post("/inventory/forecasts/refresh", params={"force": False}).json()["refreshed"] is False
+
+    # Расход Альфы по дням истории: 4, 0, 8, 4 (сегодняшний день не закрыт и не учитывается)
+    forecast = client.post("/inventory/forecasts/query", json=query).json()
+    assert (forecast["method"], forecast["history_to"]) == ("smoothing", today.isoformat())
+    assert [(item["moving_average"], item["smoothed"], item["forecast_weight"]) for item in forecast["items"]] == [
+        (6.0, 4.5, 45.0)
+    ]
+    by_average = client.post("/inventory/forecasts/query", json={"sku_ids": [1], "method": "moving_average"}).json()
+    assert [(item["location_name"], item["daily_demand"]) for item in by_average["items"]] == [("Альфа", 6.0), ("Бета", 1.0)]
+    assert client.post("/inventory/forecasts/query", json={"sku_ids": [1], "method": "median"}).status_code == 400
+    assert client.post("/inventory/forecasts/query", json={}).status_code == 400
+
+
+def test_parquet_export_appends_ledger_by_watermark(client, session_factory, monkeypatch, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from app.config import settings
+    from app.parquet_export import ParquetExporter
+
+    monkeypatch.setattr(settings, "PARQUET_LEDGER_LAG_SECONDS", -60)
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=10))
+    client.post("/inventory/operations", json=_operation(
+        operation_type="transfer", sku_id=1, weight_value=4, source_location="Альфа", target_location="Бета"
+    ))
+    db = session_factory()
+    skus = [{"id": 1, "name": "SKU 1", "price": "10"}]
+    report = ParquetExporter(db, str(tmp_path), batch_rows=1).run(skus)
+    assert (report["operations"]["rows"], report["location_totals"], report["sku_totals"], report["skus"]) == (2, 2, 1, 1)
+
+    # Повторный запуск: новых операций нет, остатки не менялись
+    report = ParquetExporter(db, str(tmp_path)).run()
+    assert (report["operations"]["rows"], report["location_totals"], report["skus"]) == (0, None, None)
+
+    _add_ledger_row(db, datetime(2024, 1, 5, 12), sku_id=2, delta_value=7)
+    db.commit()
+    report = ParquetExporter(db, str(tmp_path)).run()
+    assert report["operations"]["files"] == [f"operations/month=2024-01/part-{report['operations']['last_id']:012d}.parquet"]
+
+    # Операция моложе задержки останавливает выгрузку: следующая по id, но более старая, ждет вместе с ней
+    monkeypatch.setattr(settings, "PARQUET_LEDGER_LAG_SECONDS", 3600)
+    watermark = report["operations"]["last_id"]
+    _add_ledger_row(db, datetime.utcnow(), sku_id=3, delta_value=5)
+    _add_ledger_row(db, datetime(2024, 1, 6, 12), sku_id=4, delta_value=5)
+    db.commit()
+    report = ParquetExporter(db, str(tmp_path)).run()
+    assert (report["operations"]["rows"], report["operations"]["last_id"]) == (0, watermark)
+    monkeypatch.setattr(settings, "PARQUET_LEDGER_LAG_SECONDS", -60)
+    report = ParquetExporter(db, str(tmp_path)).run()
+    assert report["operations"]["rows"] == 2
+    db.close()
+
+    ledger = pq.read_table(tmp_path / "operations").to_pandas().sort_values("id")
+    assert ledger["sku_id"].tolist() == [1, 1, 2, 3, 4]
+    assert ledger.iloc[1][["source_location", "target_location", "delta_value"]].tolist() == ["Альфа", "Бета", 4]
+    totals = pq.read_table(tmp_path / "location_totals").to_pandas()
+    assert sorted(zip(totals["location_name"], totals["weight"])) == [("Альфа", 6), ("Бета", 4)]
+    assert pq.read_table(tmp_path / "skus").to_pandas()["name"].tolist() == ["SKU 1"]
+
+
+def test_partition_months_and_retention_cutoff(session_factory, monkeypatch):
+    from datetime import date, timezone
+    from app import partitioning
+    from app.partitioning import OperationsPartitionManager, _add_months, _month_start, partition_name
+
+    assert _month_start(date(2024, 12, 31)) == date(2024, 12, 1)
+    assert _add_months(date(2024, 11, 1), 2) == date(2025, 1, 1)
+    assert _add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert _add_months(date(2024, 3, 1), -27) == date(2021, 12, 1)
+    assert partition_name(date(2024, 2, 1)) == "inventory_operations_y2024m02"
+
+    # Текущий месяц и 2 полных месяца до него остаются, более старые архивируются
+    current = _month_start(datetime.now(timezone.utc).date())
+    partitions = [
+        {"name": partition_name(_add_months(current, offset)), "month": _add_months(current, offset), "rows_estimate": 0}
+        for offset in (-4, -3, -2, -1, 0, 1)
+    ]
+    archived = []
+    monkeypatch.setattr(OperationsPartitionManager, "list_partitions", staticmethod(lambda db: partitions))
+    monkeypatch.setattr(
+        OperationsPartitionManager, "archive_partition",
+        staticmethod(lambda db, name, archive_dir=None: archived.append(name) or f"{name}.csv.gz")
+    )
+    assert OperationsPartitionManager.apply_retention(None, retention_months=0) == []
+    assert archived == []
+    result = OperationsPartitionManager.apply_retention(None, retention_months=2)
+    assert archived == [partition_name(_add_months(current, -4)), partition_name(_add_months(current, -3))]
+    assert result == [f"{name}.csv.gz" for name in archived]
+
+    # На SQLite журнал не партиционирован: обслуживание ничего не делает
+    monkeypatch.setattr(partitioning, "SessionLocal", session_factory)
+    assert partitioning.run_maintenance() == {"created": [], "archived": []}
+    assert len(archived) == 2
+
+
+def test_totals_as_of_replays_ledger_after_snapshot(client, session_factory):
+    client.post("/inventory/operations", json=_operation(weight_value=100))
+    resp = client.post("/inventory/snapshots")
+    assert resp.status_code == 201
+    assert resp.json()["location_rows"] == 1
+
+    # Операции после снимка: перемещение и списание
+    db = session_factory()
+    snapshot_time = db.query(app.models.InventorySnapshot).one().taken_at
+    _add_ledger_row(
+        db, snapshot_time + timedelta(hours=1), operation_type="transfer", delta_value=30,
+        source_location="Альфа", target_location="Бета"
+    )
+    _add_ledger_row(db, snapshot_time + timedelta(hours=2), operation_type="write_off", delta_value=20)
+    # Транзакция началась до снимка, а записалась после: created_at раньше taken_at, но ID больше границы снимка
+    _add_ledger_row(db, snapshot_time - timedelta(minutes=1), delta_value=5)
+    db.commit()
+    db.close()
+
+    as_of = (snapshot_time + timedelta(hours=1, minutes=30)).isoformat()
+    locations = client.get("/inventory/locations", params={"as_of": as_of}).json()
+    assert {item["location_name"]: item["weight"] for item in locations} == {"Альфа": 75, "Бета": 30}
+
+    beta = client.get("/inventory/locations", params={"as_of": as_of, "location_name": "Бета"}).json()
+    assert [(item["location_name"], item["weight"], item["id"]) for item in beta] == [("Бета", 30, None)]
+
+    as_of = (snapshot_time + timedelta(hours=3)).isoformat()
+    sku_totals = client.get("/inventory/sku/totals", params={"as_of": as_of}).json()
+    assert sku_totals[0]["total_weight"] == 85
+
+    resp = client.get("/inventory/locations", params={"as_of": "2000-01-01T00:00:00"})
+    assert resp.status_code == 404
+
+    # Хранение: остается keep последних снимков вместе с их строками
+    db = session_factory()
+    db.add(app.models.InventorySnapshot(taken_at=snapshot_time + timedelta(hours=4), operation_id_mark=4))
+    db.commit()
+    assert SnapshotService.prune_snapshots(db, keep=1) == 1
+    assert [snapshot.operation_id_mark for snapshot in db.query(app.models.InventorySnapshot)] == [4]
+    assert db.query(app.models.InventoryLocationTotalSnapshot).count() == 0
+    assert SnapshotService.prune_snapshots(db, keep=0) == 0
+    db.close()
+
+
+def test_stock_count_applies_variances_in_one_pass(client):
+    for sku_id, weight, location in ((1, 10, "Альфа"), (2, 20, "Альфа"), (5, 3, "Альфа"), (3, 5, "Бета")):
+        client.post("/inventory/operations", json=_operation(sku_id=sku_id, weight_value=weight, source_location=location))
+    operations_before = len(client.get("/inventory/operations").json())
+
+    # SKU 2 пересчитан частями, SKU 4 найден, но не числится, SKU 5 не найден
+    body = "sku_id,location_name,counted_weight\r\n1,Альфа,12\r\n2,Альфа,15\r\n4,Альфа,7\r\n2,Альфа,5\r\n"
+    dry = client.post("/inventory/counts", params={"dry_run": True}, content=body.encode(),
+                      headers={"Content-Type": "text/csv"}).json()
+    assert (dry["lines"], dry["cells_compared"], dry["matched"], dry["variance_count"]) == (4, 4, 1, 3)
+    assert [(item["sku_id"], item["book_weight"], item["counted_weight"]) for item in dry["variances"]] == [
+        (1, 10, 12), (4, 0, 7), (5, 3, 0)
+    ]
+    assert len(client.get("/inventory/operations").json()) == operations_before
+
+    report = client.post("/inventory/counts", content=json.dumps([
+        {"sku_id": 1, "location": "Альфа", "weight": 12}, {"sku_id": 2, "location": "Альфа", "weight": 20},
+        {"sku_id": 4, "location": "Альфа", "weight": 7}
+    ]), headers={"Content-Type": "application/json"}).json()
+    assert (report["weight_added"], report["weight_removed"], report["dry_run"]) == (9, 3, False)
+    assert all(item["operation_id"] for item in report["variances"])
+
+    alpha = {item["sku_id"]: item["weight"] for item in client.get("/inventory/locations", params={"location_name": "Альфа"}).json()}
+    assert alpha == {1: 12, 2: 20, 4: 7, 5: 0}
+    summary = {item["location_name"]: (item["total_weight"], item["sku_count"])
+               for item in client.get("/inventory/locations/summary").json()}
+    assert summary == {"Альфа": (39, 3), "Бета": (5, 1)}
+    sku_totals = {item["sku_id"]: item["total_weight"] for item in client.get("/inventory/sku/totals").json()}
+    assert (sku_totals[1], sku_totals[4], sku_totals[5]) == (12, 7, 0)
+    assert len(client.get("/inventory/operations").json()) == operations_before + 3
+    assert client.post("/inventory/reconciliation").json()["mismatch_count"] == 0
+
+    resp = client.post("/inventory/counts", params={"format": "ndjson"}, content='{"sku_id": "x", "location": "Альфа", "weight": 1}\n')
+    assert resp.status_code == 400 and resp.json()["detail"]["errors"] == ["Строка 1: sku_id и counted_weight должны быть числами"]
+
+
+def test_reconciliation_reports_and_repairs_drift(client, session_factory):
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=50))
+    client.post("/inventory/operations", json=_operation(
+        sku_id=1, operation_type="transfer", weight_value=20, source_location="Альфа", target_location="Бета"
+    ))
+    client.post("/inventory/operations", json=_operation(sku_id=2, weight_value=7))
+
+    resp = client.post("/inventory/reconciliation")
+    assert resp.status_code == 200
+    assert resp.json()["mismatch_count"] == 0
+    assert resp.json()["operations_scanned"] == 3
+
+    # Расхождение: остаток изменен в обход журнала
+    db = session_factory()
+    db.query(app.models.InventoryLocationTotal).filter_by(sku_id=1, location_name="Бета").update({"weight": 5})
+    db.query(app.models.InventorySKUTotal).filter_by(sku_id=2).delete()
+    db.commit()
+    db.close()
+
+    report = client.post("/inventory/reconciliation", params={"chunk_size": 1000}).json()
+    assert report["mismatch_count"] == 2
+    assert {(item["sku_id"], item["location_name"], item["ledger_weight"], item["totals_weight"])
+            for item in report["mismatches"]} == {(1, "Бета", 20, 5), (2, None, 7, None)}
+
+    report = client.post("/inventory/reconciliation", params={"repair": True, "sku_from": 2}).json()
+    assert report["mismatch_count"] == 1
+    assert report["repaired"] == 1
+
+    report = client.post("/inventory/reconciliation", params={"repair": True}).json()
+    assert report["repaired"] == 1
+    assert client.post("/inventory/reconciliation").json()["mismatch_count"] == 0
+    beta = client.get("/inventory/locations", params={"location_name": "Бета"}).json()
+    assert beta[0]["weight"] == 20
+
+    # Партиция с первой операцией архивирована: с нуля журнал воспроизводить нельзя
+    db = session_factory()
+    db.query(InventoryOperation).filter(InventoryOperation.id == 1).delete()
+    db.add(app.models.InventoryOperationArchive(
+        partition_name="inventory_operations_y2024m01", month=datetime(2024, 1, 1).date(),
+        archive_path="/tmp/inventory_operations_y2024m01.csv.gz", rows=1, max_operation_id=1
+    ))
+    db.commit()
+    db.close()
+    resp = client.post("/inventory/reconciliation", params={"repair": True})
+    assert resp.status_code == 409
+
+    # Со снимком журнал воспроизводится от него: операции после снимка и расхождения после них
+    snapshot_id = client.post("/inventory/snapshots").json()["id"]
+    client.post("/inventory/operations", json=_operation(sku_id=1, operation_type="write_off", weight_value=5))
+    db = session_factory()
+    db.query(app.models.InventoryLocationTotal).filter_by(sku_id=1, location_name="Альфа").update({"weight": 99})
+    db.commit()
+    db.close()
+    report = client.post("/inventory/reconciliation", params={"repair": True, "chunk_size": 1000}).json()
+    assert (report["baseline_snapshot_id"], report["operations_scanned"]) == (snapshot_id, 1)
+    assert [(item["sku_id"], item["location_name"], item["ledger_weight"]) for item in report["mismatches"]] == [(1, "Альфа", 25)]
+    assert client.post("/inventory/reconciliation").json()["mismatch_count"] == 0
+    sku_totals = {item["sku_id"]: item["total_weight"] for item in client.get("/inventory/sku/totals").json()}
+    assert sku_totals == {1: 45, 2: 7}
+
+
+def test_ledger_replays_proportional_rescale_from_catalog_update(client, session_factory):
+    import asyncio
+    from app.event_consumer import EventConsumer
+    from app.ledger_import import rebuild_totals
+
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=30))
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=10, source_location="хранилище"))
+    client.post("/inventory/snapshots")
+
+    # Catalog Service изменил вес товара: остатки локаций пересчитываются пропорционально
+    db = session_factory()
+    event = {"sku_id": 1, "sku_data": {"id": 1, "name": "SKU 1", "quantity": "1", "weight": "20"}}
+    asyncio.run(EventConsumer()._apply_sku_updated(db, event))
+    db.commit()
+    db.close()
+    cells = {item["location_name"]: item["weight"] for item in client.get("/inventory/locations").json()}
+    assert cells == {"Альфа": 15, "хранилище": 5}
+
+    report = client.post("/inventory/reconciliation", params={"repair": True}).json()
+    assert (report["mismatch_count"], report["repaired"]) == (0, 0)
+    as_of = {item["location_name"]: item["weight"] for item in client.get(
+        "/inventory/locations", params={"as_of": (datetime.now() + timedelta(days=1)).isoformat()}
+    ).json()}
+    assert as_of == cells
+    db = session_factory()
+    rebuild_totals(db, {1: "SKU 1"})
+    db.close()
+    assert {item["location_name"]: item["weight"] for item in client.get("/inventory/locations").json()} == cells
+    assert client.get("/inventory/sku/totals").json()[0]["total_weight"] == 20
+
+
+def test_ledger_import_loads_history_and_rebuilds_totals(client, session_factory):
+    from app.ledger_import import LedgerImporter
+
+    client.post("/inventory/operations", json=_operation(sku_id=1, weight_value=5))
+    header = "id,operation_type,sku_id,sku_name,quantity_value,quantity_unit,weight_value,weight_unit," \
+             "delta_value,delta_unit,source_location,target_location,created_at\n"
+    rows = [
+        ",receipt,1,,1,шт,40,кг,40,кг,Альфа,,2023-01-10T08:00:00",
+        ",transfer,1,,1,шт,15,кг,15,кг,Альфа,Гамма,2023-02-01T08:00:00+00:00",
+        ",update,2,,1,шт,30,кг,30,кг,Гамма,,2023-02-02T08:00:00",
+        ",receipt,2,,1,шт,12,кг,12,кг,Гамма,,2023-02-03T08:00:00",
+        ",delete,2,,1,шт,2,кг,-2,кг,Гамма,,2023-02-04T08:00:00",
+        ",receipt,9,,1,шт,1,кг,1,кг,Альфа,,2023-02-05T08:00:00",
+        ",move,1,,1,шт,1,кг,1,кг,Альфа,,2023-02-05T08:00:00",
+    ]
+
+    db = session_factory()
+    importer = LedgerImporter(db, {1: "SKU 1", 2: "SKU 2"}, chunk_rows=2)
+    report = importer.run(io.StringIO(header + "\n".join(rows) + "\n"))
+    assert (report["rows_read"], report["rows_imported"], report["rows_rejected"]) == (7, 5, 2)
+    assert report["errors"] == ["Строка 7: товара 9 нет в каталоге", "Строка 8: неизвестный тип операции 'move'"]
+    assert db.query(InventoryOperation).filter_by(operation_type="transfer").one().target_location == "Гамма"
+
+    rebuild = importer.rebuild()
+    db.close()
+    assert (rebuild["skus"], rebuild["location_totals"], rebuild["sku_totals"]) == (2, 3, 2)
+
+    cells = {(item["sku_id"], item["location_name"]): item["weight"] for item in client.get("/inventory/locations").json()}
+    assert cells == {(1, "Альфа"): 30, (1, "Гамма"): 15, (2, "Гамма"): 40}
+    sku_totals = {item["sku_id"]: item["total_weight"] for item in client.get("/inventory/sku/totals").json()}
+    assert sku_totals == {1: 45, 2: 40}
+    summary = {item["location_name"]: item["total_weight"] for item in client.get("/inventory/locations/summary").json()}
+    assert summary == {"Альфа": 30, "Гамма": 55}
+    assert client.post("/inventory/reconciliation").json()["mismatch_count"] == 0
+
+    # Партиция с первой операцией архивирована: без снимка пересборка отказывается работать
+    from app.ledger_import import rebuild_totals
+    from app.snapshots import LedgerBaselineError
+    db = session_factory()
+    db.query(InventoryOperation).filter(InventoryOperation.id == 1).delete()
+    db.add(app.models.InventoryOperationArchive(
+        partition_name="inventory_operations_y2022m12", month=datetime(2022, 12, 1).date(),
+        archive_path="/tmp/inventory_operations_y2022m12.csv.gz", rows=1, max_operation_id=1
+    ))
+    db.commit()
+    with pytest.raises(LedgerBaselineError):
+        rebuild_totals(db, {1: "SKU 1"})
+
+    # Со снимком, снятым до загрузки, архивированный остаток сохраняется
+    snapshot_id = client.post("/inventory/snapshots").json()["id"]
+    importer = LedgerImporter(db, {1: "SKU 1"})
+    importer.run(io.StringIO(header + ",receipt,1,,1,шт,10,кг,10,кг,Альфа,,2023-03-01T08:00:00\n"))
+    rebuild = importer.rebuild()
+    db.close()
+    assert (rebuild["baseline_snapshot_id"], rebuild["location_totals"], rebuild["sku_totals"]) == (snapshot_id, 2, 1)
+    cells = {(item["sku_id"], item["location_name"]): item["weight"] for item in client.get("/inventory/locations").json()}
+    assert cells == {(1, "Альфа"): 40, (1, "Гамма"): 15, (2, "Гамма"): 40}
+    assert client.post("/inventory/reconciliation").json()["mismatch_count"] == 0
+
+
+def test_idempotency_key_returns_original_result(client, session_factory):
+    headers = {"Idempotency-Key": "warehouse-42-1"}
+    first = client.post("/inventory/operations", json=_operation(weight_value=30), headers=headers)
+    assert first.status_code == 201
+
+    repeat = client.post("/inventory/operations", json=_operation(weight_value=30), headers=headers)
+    assert repeat.status_code == 201
+    assert repeat.json() == first.json()
+    assert repeat.headers["Idempotent-Replayed"] == "true"
+
+    # Ключ в теле запроса равнозначен заголовку
+    body = client.post("/inventory/operations", json=_operation(weight_value=30, idempotency_key="warehouse-42-1"))
+    assert body.json()["id"] == first.json()["id"]
+
+    conflict = client.post("/inventory/operations", json=_operation(weight_value=31), headers=headers)
+    assert conflict.status_code == 422
+
+    assert len(client.get("/inventory/operations").json()) == 1
+    assert client.get("/inventory/locations").json()[0]["weight"] == 30
+
+    from app.idempotency import cleanup_expired_keys
+    db = session_factory()
+    assert cleanup_expired_keys(db, ttl_seconds=3600) == 0
+    assert cleanup_expired_keys(db, ttl_seconds=-60) == 1
+    db.close()
+
+
+def test_idempotency_key_is_shared_between_sync_and_async(client, session_factory, monkeypatch):
+    async def fake_get_sku(sku_id):
+        return {"id": sku_id, "name": f"SKU {sku_id}"}
+
+    monkeypatch.setattr("app.inventory_service.catalog_client.get_sku", fake_get_sku)
+    monkeypatch.setattr(intake_applier, "wake", lambda: None)
+
+    # Синхронный ключ не принимается асинхронным повтором
+    sync_headers = {"Idempotency-Key": "sync-then-async"}
+    first = client.post("/inventory/operations", json=_operation(weight_value=30), headers=sync_headers)
+    assert first.status_code == 201
+    retry = client.post(
+        "/inventory/operations", params={"async": "true"}, json=_operation(weight_value=30), headers=sync_headers
+    )
+    assert retry.status_code == 409
+
+    # Синхронный повтор ключа квитанции: 409, пока квитанция не применена, затем ответ ее операции
+    async_headers = {"Idempotency-Key": "async-then-sync"}
+    ticket = client.post(
+        "/inventory/operations", params={"async": "true"}, json=_operation(weight_value=5), headers=async_headers
+    ).json()
+    assert client.post("/inventory/operations", json=_operation(weight_value=5), headers=async_headers).status_code == 409
+    client.post("/inventory/intake/flush")
+    replay = client.post("/inventory/operations", json=_operation(weight_value=5), headers=async_headers)
+    applied = client.get(f"/inventory/intake/{ticket['id']}").json()
+    assert replay.status_code == 201 and replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json()["id"] == applied["operation_id"]
+    assert client.post(
+        "/inventory/operations", json=_operation(weight_value=6), headers=async_headers
+    ).status_code == 422
+
+    assert len(client.get("/inventory/operations").json()) == 2
+    assert client.get("/inventory/locations").json()[0]["weight"] == 35
+
+
+def test_reconciliation_chunks_match_single_pass():
+    from app.reconciliation import _chunk_effects, _aggregate_chunk, OP_ADD, OP_UPDATE, OP_TRANSFER, SKU_LEVEL
+    import numpy as np
+
+    sku = np.array([1, 1, 1, 1, 2])
+    op_code = np.array([OP_ADD, OP_TRANSFER, OP_UPDATE, OP_ADD, OP_ADD], dtype=np.int8)
+    delta = np.array([10, 4, 100, 5, 3])
+    source = np.array([0, 0, 0, 0, 0])
+    target = np.array([0, 1, 0, 0, 0])
+
+    whole = {}
+    _aggregate_chunk(whole, *_chunk_effects(sku, op_code, delta, source, target))
+    chunked = {}
+    for part in (slice(0, 2), slice(2, 3), slice(3, 5)):
+        _aggregate_chunk(chunked, *_chunk_effects(sku[part], op_code[part], delta[part], source[part], target[part]))
+
+    assert whole == chunked
+    assert whole[1] == {0: 105, 1: 4, SKU_LEVEL: 105}
+    assert whole[2] == {0: 3, SKU_LEVEL: 3}
@@ -15,6 +15,16 @@ class Settings(BaseSettings):
     CATALOG_SERVICE_URL: str = "http://catalog_service:8000"
     INVENTORY_SERVICE_URL: str = "http://inventory_service:8000"
     
+    # Ключи идемпотентности операций (Idempotency-Key)
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 86400  # Сколько хранить ключ запроса на создание операции
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: int = 3600  # Период удаления ключей с истекшим сроком
+    INVENTORY_REQUEST_ATTEMPTS: int = 3  # Попыток создать операцию в Inventory Service при таймауте
+    
+    # Пополнение запасов (replenishment_all/replenishment_sku)
+    # stock - перемещать все, что есть в других локациях; forecast - только недостающее до прогноза спроса
+    REPLENISHMENT_SIZING: str = "stock"
+    REPLENISHMENT_COVER_DAYS: int = 14  # На сколько дней спроса пополнять склад при REPLENISHMENT_SIZING=forecast
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
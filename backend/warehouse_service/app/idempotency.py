@@ -0,0 +1,85 @@
+"""
+Ключи идемпотентности для создания складских операций (заголовок Idempotency-Key)
+
+Ключ сохраняется в той же транзакции, что и операция. Повтор запроса с тем же ключом
+возвращает уже созданную операцию (в ее текущем статусе) и не ставит обработку второй раз.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import WarehouseOperation, WarehouseIdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER_NAME = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflictError(ValueError):
+    """Ключ уже использован для запроса с другими параметрами"""
+
+
+def request_hash(payload: Dict) -> str:
+    """SHA-256 канонического JSON тела запроса (без самого ключа)"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_saved_operation(db: Session, key: str, payload_hash: str) -> Optional[WarehouseOperation]:
+    """
+    Найти операцию, созданную первым запросом с этим ключом (один запрос: ключ JOIN операция)
+
+    Raises:
+        IdempotencyConflictError: ключ использован с другим телом запроса
+    """
+    row = db.query(WarehouseOperation, WarehouseIdempotencyKey.request_hash).join(
+        WarehouseIdempotencyKey, WarehouseIdempotencyKey.operation_id == WarehouseOperation.id
+    ).filter(WarehouseIdempotencyKey.key == key).first()
+    if row is None:
+        return None
+    operation, saved_hash = row
+    if saved_hash != payload_hash:
+        raise IdempotencyConflictError(
+            f"{HEADER_NAME} '{key}' уже использован для запроса с другими параметрами"
+        )
+    return operation
+
+
+def remember(db: Session, key: str, payload_hash: str, operation: WarehouseOperation) -> None:
+    """Сохранить ключ в текущей транзакции (до commit операции)"""
+    db.flush()  # Получаем ID операции
+    db.add(WarehouseIdempotencyKey(key=key, request_hash=payload_hash, operation_id=operation.id))
+
+
+def cleanup_expired_keys(db: Session, ttl_seconds: Optional[int] = None) -> int:
+    """Удалить ключи старше TTL. Возвращает количество удаленных ключей"""
+    ttl_seconds = settings.IDEMPOTENCY_KEY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    expired_before = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    result = db.execute(
+        delete(WarehouseIdempotencyKey).where(WarehouseIdempotencyKey.created_at < expired_before)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def run_cleanup() -> int:
+    """Удаление ключей с истекшим сроком хранения (периодическая задача)"""
+    db = SessionLocal()
+    try:
+        removed = cleanup_expired_keys(db)
+        if removed:
+            logger.info(f"Удалено ключей идемпотентности с истекшим сроком: {removed}")
+        return removed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -3,7 +3,8 @@
 """
 import httpx
 import logging
-from typing import Optional, Dict, List
+import uuid
+from typing import Optional, Dict, List, Iterable, Tuple
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -34,6 +35,82 @@ class InventoryClient:
             logger.error(f"Error fetching location totals from Inventory Service: {e}")
             return []
     
+    async def get_totals(
+        self,
+        sku_ids: Optional[Iterable[int]] = None,
+        location_names: Optional[Iterable[str]] = None
+    ) -> Dict[Tuple[int, str], Dict]:
+        """
+        Получить остатки для наборов товаров и/или локаций одним запросом
+        
+        Returns:
+            Словарь {(sku_id, название локации): остаток}; ячеек без остатков в нем нет.
+            Пустой словарь, если Inventory Service недоступен
+        """
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/inventory/totals/query",
+                json={"sku_ids": list(sku_ids or []), "location_names": list(location_names or [])}
+            )
+            if response.status_code == 200:
+                return {(item["sku_id"], item["location_name"]): item for item in response.json()}
+            logger.error(f"Failed to query totals: {response.status_code} - {response.text}")
+            return {}
+        except Exception as e:
+            logger.error(f"Error querying totals from Inventory Service: {e}")
+            return {}
+    
+    async def get_forecasts(
+        self,
+        sku_ids: Optional[Iterable[int]] = None,
+        location_names: Optional[Iterable[str]] = None,
+        horizon_days: int = 7
+    ) -> Optional[Dict[Tuple[int, str], Dict]]:
+        """
+        Получить прогноз спроса на horizon_days дней для наборов товаров и/или локаций
+        
+        Returns:
+            Словарь {(sku_id, название локации): прогноз}; ячеек без спроса в нем нет
+            (пустой словарь - прогноз посчитан, спроса нет).
+            None, если Inventory Service недоступен или прогнозы еще не посчитаны
+        """
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/inventory/forecasts/query",
+                json={
+                    "sku_ids": list(sku_ids or []),
+                    "location_names": list(location_names or []),
+                    "horizon_days": horizon_days
+                }
+            )
+            if response.status_code != 200:
+                logger.error(f"Failed to query forecasts: {response.status_code} - {response.text}")
+                return None
+            forecast = response.json()
+            if forecast["computed_at"] is None:
+                return None
+            return {(item["sku_id"], item["location_name"]): item for item in forecast["items"]}
+        except Exception as e:
+            logger.error(f"Error querying forecasts from Inventory Service: {e}")
+            return None
+    
+    async def get_location_summary(self) -> Optional[Dict[str, Dict]]:
+        """
+        Получить сводку остатков по всем локациям одним запросом
+        
+        Returns:
+            Словарь {название локации: сводка} или None, если Inventory Service недоступен
+        """
+        try:
+            response = await self.client.get(f"{self.base_url}/inventory/locations/summary")
+            if response.status_code == 200:
+                return {item["location_name"]: item for item in response.json()}
+            logger.error(f"Failed to fetch location summary: {response.status_code} - {response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching location summary from Inventory Service: {e}")
+            return None
+    
     async def create_operation(
         self,
         operation_type: str,
@@ -43,32 +120,49 @@ class InventoryClient:
         weight_value: int,
         weight_unit: str,
         source_location: Optional[str] = None,
-        target_location: Optional[str] = None
+        target_location: Optional[str] = None,
+        idempotency_key: Optional[str] = None
     ) -> bool:
-        """Создать операцию в Inventory Service"""
-        try:
-            response = await self.client.post(
-                f"{self.base_url}/inventory/operations",
-                json={
-                    "operation_type": operation_type,
-                    "sku_id": sku_id,
-                    "quantity_value": quantity_value,
-                    "quantity_unit": quantity_unit,
-                    "weight_value": weight_value,
-                    "weight_unit": weight_unit,
-                    "source_location": source_location,
-                    "target_location": target_location
-                }
-            )
-            if response.status_code in [200, 201]:
-                logger.info(f"Successfully created inventory operation: {operation_type} for SKU {sku_id}")
-                return True
-            else:
-                logger.error(f"Failed to create inventory operation: {response.status_code} - {response.text}")
+        """
+        Создать операцию в Inventory Service
+        
+        При таймауте или обрыве соединения запрос повторяется с тем же ключом идемпотентности:
+        если первая попытка успела закоммититься, Inventory Service вернет ее результат
+        и не применит изменение остатков второй раз.
+        """
+        idempotency_key = idempotency_key or str(uuid.uuid4())
+        attempts = max(settings.INVENTORY_REQUEST_ATTEMPTS, 1)
+        for attempt in range(1, attempts + 1):
+            try:
+                response = await self.client.post(
+                    f"{self.base_url}/inventory/operations",
+                    json={
+                        "operation_type": operation_type,
+                        "sku_id": sku_id,
+                        "quantity_value": quantity_value,
+                        "quantity_unit": quantity_unit,
+                        "weight_value": weight_value,
+                        "weight_unit": weight_unit,
+                        "source_location": source_location,
+                        "target_location": target_location
+                    },
+                    headers={"Idempotency-Key": idempotency_key}
+                )
+                if response.status_code in [200, 201]:
+                    logger.info(f"Successfully created inventory operation: {operation_type} for SKU {sku_id}")
+                    return True
+                else:
+                    logger.error(f"Failed to create inventory operation: {response.status_code} - {response.text}")
+                    return False
+            except httpx.TransportError as e:
+                logger.warning(
+                    f"Inventory Service request failed (attempt {attempt}/{attempts}, key {idempotency_key}): {e}"
+                )
+            except Exception as e:
+                logger.error(f"Error calling Inventory Service: {e}")
                 return False
-        except Exception as e:
-            logger.error(f"Error calling Inventory Service: {e}")
-            return False
+        logger.error(f"Inventory Service unavailable, operation {operation_type} for SKU {sku_id} not created")
+        return False
     
     async def close(self):
         """Закрыть клиент"""
@@ -7,6 +7,7 @@ from contextlib import asynccontextmanager
 from app.routers import warehouse
 from app.warehouse_service import WarehouseService
 from app.database import SessionLocal
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,17 @@ async def process_temp_storage_periodically():
             logger.error(f"Ошибка при обработке временного хранилища: {e}")
 
 
+async def cleanup_idempotency_keys_periodically():
+    """Периодическое удаление ключей идемпотентности с истекшим сроком хранения"""
+    from app.idempotency import run_cleanup
+    while True:
+        try:
+            await asyncio.to_thread(run_cleanup)
+        except Exception as e:
+            logger.error(f"Ошибка при удалении ключей идемпотентности: {e}")
+        await asyncio.sleep(settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -34,16 +46,20 @@ async def lifespan(app: FastAPI):
     init_locations()
     
     # Запускаем фоновую задачу для обработки временного хранилища
-    task = asyncio.create_task(process_temp_storage_periodically())
+    tasks = [
+        asyncio.create_task(process_temp_storage_periodically()),
+        asyncio.create_task(cleanup_idempotency_keys_periodically()),
+    ]
     
     yield
     
     # Shutdown
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
     logger.info("Shutting down Warehouse Service...")
 
 
@@ -79,3 +79,12 @@ class TempStorageItem(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     moved_to_storage_at = Column(DateTime(timezone=True), nullable=True)  # Когда перемещен в хранилище
 
+
+class WarehouseIdempotencyKey(Base):
+    """Ключ идемпотентности запроса на создание операции (Idempotency-Key)"""
+    __tablename__ = "warehouse_idempotency_keys"
+    
+    key = Column(String(255), primary_key=True)  # Значение заголовка Idempotency-Key
+    request_hash = Column(String(64), nullable=False)  # SHA-256 тела запроса
+    operation_id = Column(Integer, ForeignKey("warehouse_operations.id", ondelete="CASCADE"), nullable=False)  # Созданная операция
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
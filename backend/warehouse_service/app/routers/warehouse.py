@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 import logging
 
@@ -11,6 +12,7 @@ from app.schemas import (
     WarehouseOperationResponse, TempStorageItemResponse
 )
 from app.warehouse_service import WarehouseService
+from app import idempotency
 
 logger = logging.getLogger(__name__)
 
@@ -49,9 +51,27 @@ async def get_location(location_id: int, db: Session = Depends(get_db)):
 async def create_operation(
     operation: WarehouseOperationCreate,
     background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(
+        None, alias=idempotency.HEADER_NAME, max_length=idempotency.MAX_KEY_LENGTH
+    ),
     db: Session = Depends(get_db)
 ):
-    """Создать операцию перемещения товаров"""
+    """
+    Создать операцию перемещения товаров
+    
+    С ключом идемпотентности (заголовок Idempotency-Key или поле idempotency_key) повтор запроса
+    возвращает уже созданную операцию и не запускает ее обработку второй раз.
+    """
+    idempotency_key = idempotency_key or operation.idempotency_key
+    request_hash = None
+    if idempotency_key:
+        request_hash = idempotency.request_hash(operation.model_dump(mode="json", exclude={"idempotency_key"}))
+        saved = _get_saved_operation(db, idempotency_key, request_hash)
+        if saved is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return saved
+    
     # Создаем запись операции
     db_operation = WarehouseOperation(
         operation_type=operation.operation_type,
@@ -74,7 +94,18 @@ async def create_operation(
             db_operation.sku_name = f"SKU_{operation.sku_id}"
     
     db.add(db_operation)
-    db.commit()
+    if idempotency_key:
+        idempotency.remember(db, idempotency_key, request_hash, db_operation)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Параллельный запрос с тем же ключом успел создать операцию первым
+        saved = _get_saved_operation(db, idempotency_key, request_hash) if idempotency_key else None
+        if saved is None:
+            raise
+        response.headers["Idempotent-Replayed"] = "true"
+        return saved
     db.refresh(db_operation)
     
     # Обрабатываем операцию в фоне
@@ -83,6 +114,14 @@ async def create_operation(
     return db_operation
 
 
+def _get_saved_operation(db: Session, idempotency_key: str, request_hash: str) -> Optional[WarehouseOperation]:
+    """Операция по ключу идемпотентности; 422, если ключ использован с другим телом запроса"""
+    try:
+        return idempotency.get_saved_operation(db, idempotency_key, request_hash)
+    except idempotency.IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 async def process_operation_background(operation_id: int):
     """Фоновая обработка операции"""
     from app.database import SessionLocal
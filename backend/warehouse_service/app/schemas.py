@@ -47,7 +47,9 @@ class WarehouseOperationBase(BaseModel):
 
 
 class WarehouseOperationCreate(WarehouseOperationBase):
-    pass
+    idempotency_key: Optional[str] = Field(
+        None, max_length=255, description="Ключ идемпотентности (альтернатива заголовку Idempotency-Key)"
+    )
 
 
 class WarehouseOperationResponse(WarehouseOperationBase):
@@ -2,11 +2,13 @@
 Сервисная логика для работы со складами и операциями
 """
 import logging
+import math
 from sqlalchemy.orm import Session
 from typing import List, Dict, Optional, Tuple
 from app.models import Location, WarehouseOperation, TempStorageItem, LocationType, OperationType
 from app.inventory_client import inventory_client
 from app.catalog_client import catalog_client
+from app.config import settings
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -22,15 +24,18 @@ class WarehouseService:
             locations = db.query(Location).all()
             stats = []
             
+            # Реальные остатки всех локаций из Inventory Service одним запросом
+            summary = await inventory_client.get_location_summary()
+            if summary is None:
+                # Если не удалось получить данные из Inventory Service, используем значения из БД
+                logger.warning("Не удалось получить сводку остатков по локациям, используются значения из БД")
+            
             for location in locations:
-                # Получаем реальные остатки из Inventory Service
-                try:
-                    location_totals = await inventory_client.get_location_totals(location.name)
-                    current_weight = sum(item.get('weight', 0) for item in location_totals if isinstance(item, dict))
-                except Exception as e:
-                    # Если не удалось получить данные из Inventory Service, используем значение из БД
-                    logger.warning(f"Не удалось получить остатки для локации {location.name}: {e}")
+                if summary is None:
                     current_weight = location.current_capacity_kg or 0
+                else:
+                    # Локации без остатков в сводке нет
+                    current_weight = summary.get(location.name, {}).get('total_weight', 0)
                 
                 # Обновляем current_capacity_kg в БД только если значение изменилось
                 if location.current_capacity_kg != current_weight:
@@ -170,8 +175,8 @@ class WarehouseService:
             return False, "Целевая локация не найдена"
         
         # Получаем остатки из Inventory Service
-        location_totals = await inventory_client.get_location_totals(source_location.name)
-        sku_total = next((item for item in location_totals if item['sku_id'] == operation.sku_id), None)
+        totals = await inventory_client.get_totals(sku_ids=[operation.sku_id], location_names=[source_location.name])
+        sku_total = totals.get((operation.sku_id, source_location.name))
         
         if not sku_total or sku_total['weight'] <= 0:
             return False, f"Товар {operation.sku_name} отсутствует в {source_location.name}"
@@ -333,8 +338,8 @@ class WarehouseService:
         if not main_storage:
             return False, "Основное хранилище не найдено"
         
-        location_totals = await inventory_client.get_location_totals(main_storage.name)
-        sku_total = next((item for item in location_totals if item['sku_id'] == operation.sku_id), None)
+        totals = await inventory_client.get_totals(sku_ids=[operation.sku_id], location_names=[main_storage.name])
+        sku_total = totals.get((operation.sku_id, main_storage.name))
         
         if not sku_total or sku_total['weight'] <= 0:
             return False, f"Товар {operation.sku_name} отсутствует в хранилище"
@@ -388,6 +393,35 @@ class WarehouseService:
             return True, "; ".join(errors)
         return True, None
     
+    @staticmethod
+    async def _replenishment_needs(
+        target_location: Location,
+        sku_ids: Optional[List[int]] = None
+    ) -> Optional[Dict[int, int]]:
+        """
+        Сколько кг товаров довезти на склад, чтобы покрыть прогноз спроса на REPLENISHMENT_COVER_DAYS дней
+        
+        Returns:
+            {ID товара: кг} (товаров, которым хватает остатка, нет) или None - пополнять всем,
+            что есть в других локациях (REPLENISHMENT_SIZING=stock, прогноза нет или Inventory Service недоступен)
+        """
+        if settings.REPLENISHMENT_SIZING != "forecast":
+            return None
+        forecasts = await inventory_client.get_forecasts(
+            sku_ids=sku_ids, location_names=[target_location.name], horizon_days=settings.REPLENISHMENT_COVER_DAYS
+        )
+        if forecasts is None:
+            logger.warning(f"Прогноз спроса для {target_location.name} недоступен, пополнение по остаткам")
+            return None
+        stock = await inventory_client.get_totals(sku_ids=sku_ids, location_names=[target_location.name])
+        needs = {}
+        for (sku_id, location_name), forecast in forecasts.items():
+            on_hand = stock.get((sku_id, location_name), {}).get('weight', 0)
+            need = math.ceil(forecast['forecast_weight']) - on_hand
+            if need > 0:
+                needs[sku_id] = need
+        return needs
+    
     @staticmethod
     async def _process_replenishment_all(db: Session, operation: WarehouseOperation) -> Tuple[bool, Optional[str]]:
         """Пополнение запасов (все товары) - в выбранный склад со всех складов"""
@@ -402,13 +436,19 @@ class WarehouseService:
         warehouses = await WarehouseService.get_warehouse_locations(db)
         source_warehouses = [w for w in warehouses if w.id != operation.target_location_id]
         
+        # С прогнозом перемещается только недостающее до спроса на период пополнения
+        needs = await WarehouseService._replenishment_needs(target_location)
+        if needs is not None and not needs:
+            return True, f"Пополнение не требуется: остатков {target_location.name} хватает на прогноз спроса"
+        
         errors = []
         for warehouse in source_warehouses:
             location_totals = await inventory_client.get_location_totals(warehouse.name)
             
             for item in location_totals:
-                if item['weight'] > 0:
-                    has_space, available_space = await WarehouseService.check_capacity(db, operation.target_location_id, item['weight'])
+                weight = item['weight'] if needs is None else min(item['weight'], needs.get(item['sku_id'], 0))
+                if weight > 0:
+                    has_space, available_space = await WarehouseService.check_capacity(db, operation.target_location_id, weight)
                     
                     if has_space:
                         success = await inventory_client.create_operation(
@@ -416,17 +456,20 @@ class WarehouseService:
                             sku_id=item['sku_id'],
                             quantity_value=1,
                             quantity_unit="шт",
-                            weight_value=item['weight'],
+                            weight_value=weight,
                             weight_unit="кг",
                             source_location=warehouse.name,
                             target_location=target_location.name
                         )
                         
                         if success:
-                            await WarehouseService.update_location_capacity(db, warehouse.id, -item['weight'])
-                            await WarehouseService.update_location_capacity(db, operation.target_location_id, item['weight'])
+                            await WarehouseService.update_location_capacity(db, warehouse.id, -weight)
+                            await WarehouseService.update_location_capacity(db, operation.target_location_id, weight)
+                            # Потребность закрывается только перемещенным весом - остальное доберут другие склады
+                            if needs is not None:
+                                needs[item['sku_id']] -= weight
                     else:
-                        excess = item['weight'] - available_space
+                        excess = weight - available_space
                         if available_space > 0:
                             success = await inventory_client.create_operation(
                                 operation_type="transfer",
@@ -441,6 +484,8 @@ class WarehouseService:
                             if success:
                                 await WarehouseService.update_location_capacity(db, warehouse.id, -available_space)
                                 await WarehouseService.update_location_capacity(db, operation.target_location_id, available_space)
+                                if needs is not None:
+                                    needs[item['sku_id']] -= available_space
                         
                         await WarehouseService._move_to_temp_storage(db, item['sku_id'], item['sku_name'], excess, operation.id)
                         errors.append(f"Недостаточно места в {target_location.name} для товара {item['sku_name']}")
@@ -462,16 +507,22 @@ class WarehouseService:
         # Получаем все локации кроме целевой
         all_locations = db.query(Location).filter(Location.id != operation.target_location_id).all()
         
-        total_weight = 0
-        for location in all_locations:
-            location_totals = await inventory_client.get_location_totals(location.name)
-            sku_total = next((item for item in location_totals if item['sku_id'] == operation.sku_id), None)
-            if sku_total:
-                total_weight += sku_total['weight']
+        # Остатки товара во всех локациях одним запросом
+        totals = await inventory_client.get_totals(
+            sku_ids=[operation.sku_id], location_names=[location.name for location in all_locations]
+        )
+        total_weight = sum(item['weight'] for item in totals.values())
         
         if total_weight == 0:
             return False, f"Товар {operation.sku_name} отсутствует в других локациях"
         
+        # С прогнозом перемещается только недостающее до спроса на период пополнения
+        needs = await WarehouseService._replenishment_needs(target_location, [operation.sku_id])
+        if needs is not None:
+            if operation.sku_id not in needs:
+                return True, f"Пополнение не требуется: остатка в {target_location.name} хватает на прогноз спроса"
+            total_weight = min(total_weight, needs[operation.sku_id])
+        
         has_space, available_space = await WarehouseService.check_capacity(db, operation.target_location_id, total_weight)
         
         errors = []
@@ -483,8 +534,7 @@ class WarehouseService:
             if moved_weight >= transfer_weight:
                 break
             
-            location_totals = await inventory_client.get_location_totals(location.name)
-            sku_total = next((item for item in location_totals if item['sku_id'] == operation.sku_id), None)
+            sku_total = totals.get((operation.sku_id, location.name))
             
             if sku_total and sku_total['weight'] > 0:
                 move_weight = min(sku_total['weight'], transfer_weight - moved_weight)
@@ -600,8 +650,8 @@ class WarehouseService:
         if len(target_warehouses) != 3:
             return False, "Должно быть ровно 3 целевых склада"
         
-        location_totals = await inventory_client.get_location_totals(source_location.name)
-        sku_total = next((item for item in location_totals if item['sku_id'] == operation.sku_id), None)
+        totals = await inventory_client.get_totals(sku_ids=[operation.sku_id], location_names=[source_location.name])
+        sku_total = totals.get((operation.sku_id, source_location.name))
         
         if not sku_total or sku_total['weight'] <= 0:
             return False, f"Товар {operation.sku_name} отсутствует в {source_location.name}"